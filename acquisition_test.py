@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Test dell'acquisizione in un processo separato (modules/acquisition.py, modules/shared_state.py)
+
+Il processo figlio riproduce una sessione registrata: si verificano i valori letti
+dal blocco condiviso, gli eventi con l'istante di arrivo originale, il riavvio dopo
+SIGKILL e dopo un blocco (SIGSTOP) con numeri di sequenza sempre crescenti, e la
+coerenza dei record con uno scrittore in un altro processo e con uno scrittore
+morto tenendo il lock o a metà copia.
+
+Uso:
+    python acquisition_test.py
+"""
+
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+import time
+from functools import reduce
+from modules import logger
+from modules.acquisition import AcquisitionProcess
+from modules.sensor_events import SensorEvents
+from modules.session_recorder import SessionRecorder, SOURCE_ARDUINO, SOURCE_GPS
+from modules.shared_state import SharedState, EMPTY, SEQUENCE, LOCK_TIMEOUT
+
+FRAMES = 50
+
+
+def nmea(body):
+    checksum = reduce(lambda a, c: a ^ ord(c), body, 0)
+    return f"${body}*{checksum:02X}\r\n".encode()
+
+
+def make_session(path):
+    """50 pacchetti Arduino v1 ogni 20 ms e una frase RMC ogni 200 ms"""
+    recorder = SessionRecorder(path)
+    start = time.time()
+    for i in range(FRAMES):
+        t = start + i * 0.02
+        recorder.write(SOURCE_ARDUINO, bytes([0xFF, i, 2 * i, 3 * i, 100]), t)
+        if i % 10 == 0:
+            recorder.write(SOURCE_GPS, nmea(f"GPRMC,120000,A,4530.000,N,00910.000,E,{i / 10:.1f},0.0,150625,,"), t)
+    recorder.close()
+
+
+def check(name, condition):
+    print(f"  {'OK ' if condition else 'ERR'} {name}")
+    return condition
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+class Watcher(threading.Thread):
+    """Consuma gli eventi come ControlLoop e annota le sequenze viste"""
+
+    def __init__(self, acquisition, events):
+        super().__init__(daemon=True)
+        self.acquisition = acquisition
+        self.events = events
+        self.seqs = []
+        self.stamps_ok = True
+        self.running = True
+
+    def run(self):
+        seq = 0
+        while self.running:
+            pending = self.events.wait(0.1)
+            snapshot = self.acquisition.arduino.get_values_if_newer(seq)
+            if snapshot is not None:
+                seq = snapshot.seq
+                self.seqs.append(seq)
+                if 'arduino' in pending and pending['arduino'] > snapshot.timestamp:
+                    self.stamps_ok = False
+
+
+def replaced(acquisition, old_pid):
+    """Un figlio diverso da old_pid è in esecuzione"""
+    pid = acquisition.current_pid()
+    if pid is None or pid == old_pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def run_process_test(path):
+    ok = True
+    print("\n--- Sessione riprodotta nel processo figlio ---")
+    events = SensorEvents()
+    acquisition = AcquisitionProcess(events, protocol='v1', replay=path, replay_speed=1.0,
+                                     log_level='ERROR', heartbeat_timeout=1.0)
+    watcher = Watcher(acquisition, events)
+    acquisition.start()
+    watcher.start()
+    try:
+        ok &= check("Arduino pronto", acquisition.arduino.wait_ready(15.0))
+        ok &= check("tutti i pacchetti", wait_for(lambda: acquisition.read().pots_seq >= FRAMES, 5.0))
+        snapshot = acquisition.arduino.get_snapshot()
+        last = FRAMES - 1
+        ok &= check(f"ultimo pacchetto ({snapshot})", tuple(snapshot.raw) == (last, 2 * last, 3 * last, 100))
+        gps = acquisition.gps.get_data()
+        ok &= check(f"dati GPS (velocità {gps['speed']:.2f} km/h)",
+                    acquisition.gps.ready.is_set() and abs(gps['speed'] - 4 * 1.852) < 1e-6
+                    and abs(gps['lat'] - 45.5) < 1e-9 and gps['valid'])
+        ok &= check("istante di arrivo dal figlio sugli eventi", watcher.stamps_ok and bool(watcher.seqs))
+
+        print("\n--- Riavvio dopo SIGKILL ---")
+        first_pid = acquisition.current_pid()
+        os.kill(first_pid, signal.SIGKILL)
+        ok &= check("nuovo processo", wait_for(lambda: replaced(acquisition, first_pid) and acquisition.restarts == 1, 5.0))
+        ok &= check("la sessione riparte e la sequenza prosegue",
+                    wait_for(lambda: acquisition.read().pots_seq >= 2 * FRAMES, 15.0))
+        record = acquisition.read()
+        ok &= check(f"contatori cumulativi ({record.frames} pacchetti)", record.frames >= 2 * FRAMES)
+
+        print("\n--- Riavvio dopo un blocco (SIGSTOP) ---")
+        stopped_pid = acquisition.current_pid()
+        started = time.monotonic()
+        os.kill(stopped_pid, signal.SIGSTOP)
+        ok &= check("heartbeat fermo: processo sostituito",
+                    wait_for(lambda: replaced(acquisition, stopped_pid) and acquisition.restarts == 2, 10.0))
+        elapsed = time.monotonic() - started
+        ok &= check(f"rilevato in {elapsed:.1f} s", elapsed < 5.0)
+        ok &= check("sequenza ripresa", wait_for(lambda: acquisition.read().pots_seq >= 3 * FRAMES, 15.0))
+        watcher.running = False
+        watcher.join(timeout=1.0)
+        ok &= check(f"sequenze viste sempre crescenti ({len(watcher.seqs)} letture)",
+                    all(a < b for a, b in zip(watcher.seqs, watcher.seqs[1:])))
+    finally:
+        watcher.running = False
+        name = acquisition.state.name
+        acquisition.stop()
+    try:
+        SharedState(name).close()
+        ok &= check("blocco condiviso rimosso all'arresto", False)
+    except FileNotFoundError:
+        ok &= check("blocco condiviso rimosso all'arresto", True)
+    ok &= check("ultimi valori leggibili dopo l'arresto", acquisition.arduino.get_snapshot().seq >= 3 * FRAMES)
+    return ok
+
+
+def _writer(name, lock, count):
+    """Scrittore in un altro processo: ogni record ha tutti i campi pari a i"""
+    state = SharedState(name, lock=lock)
+    for i in range(1, count + 1):
+        state.write(EMPTY._replace(pots_seq=i, pots_time=float(i), raw1=i & 0xFFFF, gps_seq=i,
+                                   frames=i, heartbeat=float(i)))
+    state.close()
+
+
+def test_shared_lock():
+    ok = True
+    print("\n--- Record condiviso con lo scrittore in un altro processo ---")
+    state = SharedState(create=True)
+    count = 300000
+    writer = multiprocessing.get_context('spawn').Process(target=_writer, args=(state.name, state.lock, count))
+    writer.start()
+    reads = torn = 0
+    last = 0
+    start = time.perf_counter()
+    while writer.is_alive() or last < count:
+        r = state.read()
+        reads += 1
+        if r.pots_seq and not (r.pots_seq == r.gps_seq == r.frames == int(r.pots_time) == int(r.heartbeat)
+                               and r.raw1 == r.pots_seq & 0xFFFF):
+            torn += 1
+        if r.pots_seq < last:
+            torn += 1
+        last = r.pots_seq
+        if not writer.is_alive() and last < count:
+            break
+    elapsed = time.perf_counter() - start
+    writer.join()
+    ok &= check(f"nessun record misto ({reads} letture, {state.stale} non aggiornate)", torn == 0 and last == count)
+
+    start = time.perf_counter()
+    for _ in range(100000):
+        state.read()
+    cost = (time.perf_counter() - start) / 100000
+    print(f"  lettura: {cost * 1e6:.2f} µs (scrittore {count / max(elapsed, 1e-9) / 1e3:.0f}k record/s)")
+    state.close()
+    return ok
+
+
+def _hold_lock(lock):
+    """Scrittore che termina senza rilasciare il lock"""
+    lock.acquire()
+
+
+def test_dead_writer():
+    ok = True
+    print("\n--- Scrittore morto a metà scrittura ---")
+    state = SharedState(create=True)
+    state.write(EMPTY._replace(pots_seq=7))
+    good = state.read()
+
+    writer = multiprocessing.get_context('spawn').Process(target=_hold_lock, args=(state.lock,))
+    writer.start()
+    writer.join()
+    start = time.perf_counter()
+    record = state.read()
+    elapsed = time.perf_counter() - start
+    ok &= check(f"lock rimasto preso: ultima copia dopo {elapsed * 1e3:.0f} ms",
+                record == good and state.stale == 1 and elapsed < LOCK_TIMEOUT * 5)
+    state.new_lock()
+    state.write(EMPTY._replace(pots_seq=8))
+    ok &= check("lock nuovo: letture e scritture riprendono", state.read().pots_seq == 8)
+
+    # Contatore dispari: lo scrittore è stato ucciso tra l'inizio e la fine della copia
+    SEQUENCE.pack_into(state.buf, 0, SEQUENCE.unpack_from(state.buf, 0)[0] + 1)
+    state.buf[16:24] = b'\xff' * 8
+    ok &= check("copia a metà ignorata", state.read().pots_seq == 8 and state.stale == 2)
+    state.write(EMPTY._replace(pots_seq=9))
+    ok &= check("lo scrittore successivo la sovrascrive", state.read().pots_seq == 9)
+    state.close()
+    return ok
+
+
+def main():
+    print("=== TEST ACQUISIZIONE IN PROCESSO SEPARATO ===")
+    logger.configure('ERROR')
+    fd, path = tempfile.mkstemp(suffix='.carsess')
+    os.close(fd)
+    os.unlink(path)
+    try:
+        make_session(path)
+        ok = run_process_test(path)
+        ok &= test_shared_lock()
+        ok &= test_dead_writer()
+    finally:
+        os.unlink(path)
+    print(f"\n{'TUTTI I TEST SUPERATI' if ok else 'ALCUNI TEST FALLITI'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
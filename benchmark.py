@@ -0,0 +1,714 @@
+#!/usr/bin/env python3
+"""
+Benchmark del percorso sensori -> OSC
+
+Bench disponibili:
+    serial   pacchetti sintetici o registrati dentro ArduinoReader tramite una seriale finta
+    control  logica del loop di controllo (ControlLoop + MusicEngine) senza thread
+    e2e      ArduinoReader -> ControlLoop -> MusicEngine -> sink OSC UDP locale
+             (al posto di SuperCollider), con latenza sensore -> datagramma
+    gps      parser NMEA su un log sintetico (o --nmea FILE) a blocchi come dalla seriale
+    fanout   costo di un aggiornamento di MusicEngine verso 1..16 sink UDP locali
+             (sendmmsg e sendto), con metà dei sink che non leggono mai (nodi lenti)
+    sequencer  sequencer a lookahead verso un sink OSC locale al posto di scsynth:
+             jitter dei timetag (l'istante in cui scsynth suona) e dell'arrivo dei
+             datagrammi (quando suonerebbe una nota eseguita all'arrivo)
+    geofence zone GeoJSON sintetiche (default 10000 poligoni): costruzione della
+             griglia e costo per fix GPS, con confronto con la ricerca lineare
+
+Uso:
+    python benchmark.py                              # tutti i bench
+    python benchmark.py serial e2e --frames 20000
+    python benchmark.py --session sessione.bin       # pacchetti Arduino registrati
+    python benchmark.py --json risultati.json --compare vecchi.json
+    python benchmark.py gps --nmea traccia.nmea
+    python benchmark.py fanout --targets 1,4,16
+    python benchmark.py sequencer --seconds 10
+    python benchmark.py geofence --zones 10000
+"""
+
+import argparse
+import bisect
+import json
+import math
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from pythonosc.osc_packet import OscPacket
+
+from modules import logger
+from modules.arduino_reader import ArduinoReader
+from modules.controller import ControlLoop
+from modules.geofence import Geofence
+from modules.gps_reader import NmeaParser, nmea_checksum
+from modules.music_engine import MusicEngine
+from modules.osc_fanout import OscFanout
+from modules.sequencer import Sequencer
+from modules.sensor_events import SensorEvents
+from modules.signal_filter import SignalFilter, DEFAULT_CONFIG
+from modules.session_recorder import SessionReplay, SOURCE_ARDUINO
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def sweep_frames(count):
+    """Pacchetti sintetici: pot1 sale e scende a passi di 3, gli altri si muovono più lentamente"""
+    frames = []
+    for i in range(count):
+        pot1 = (i * 3) % 508
+        if pot1 > 254:
+            pot1 = 508 - pot1
+        frames.append(bytes((0xFF, pot1, (i // 7) % 255, (i // 50) % 255, (i // 200) % 255)))
+    return frames
+
+
+def recorded_frames(path):
+    """Blocchi Arduino di una sessione registrata (come letti dalla seriale)"""
+    replay = SessionReplay(path, speed=0)
+    return [data for timestamp, source, data in replay.records if source == SOURCE_ARDUINO]
+
+
+def nmea_sentence(body):
+    """Frase NMEA completa con checksum a partire dal corpo (senza $ e *hh)"""
+    data = body.encode()
+    return b'$%s*%02X\r\n' % (data, nmea_checksum(data, 0, len(data)))
+
+
+def synthetic_nmea(seconds):
+    """Log NMEA sintetico: un ciclo al secondo come un modulo a 1 Hz (RMC, VTG, GGA, GSA, GSV)"""
+    lines = []
+    for i in range(seconds):
+        hhmmss = f"{(i // 3600) % 24:02d}{(i // 60) % 60:02d}{i % 60:02d}.00"
+        knots = (i % 40) * 0.5
+        lat = f"{4107 + (i % 60) / 100.0:.4f}"
+        lines.append(nmea_sentence(f"GPRMC,{hhmmss},A,{lat},N,01452.1234,E,{knots:.2f},87.5,150625,,,A"))
+        lines.append(nmea_sentence(f"GPVTG,87.5,T,,M,{knots:.2f},N,{knots * 1.852:.2f},K,A"))
+        lines.append(nmea_sentence(f"GPGGA,{hhmmss},{lat},N,01452.1234,E,1,{8 + i % 4:02d},0.9,42.0,M,47.0,M,,"))
+        lines.append(nmea_sentence("GPGSA,A,3,04,05,09,12,24,25,29,31,,,,,1.8,0.9,1.5"))
+        for part in range(1, 4):
+            lines.append(nmea_sentence(f"GPGSV,3,{part},11,04,45,120,38,05,30,045,40,09,12,300,35,12,70,200,42"))
+    return b''.join(lines)
+
+
+class FakeSerial:
+    def __init__(self, chunks, rate=None, group=1):
+        """
+        Seriale finta che restituisce blocchi preparati
+
+        Args:
+            chunks: Lista di blocchi di byte (tipicamente un pacchetto ciascuno)
+            rate: Blocchi al secondo (None = il più veloce possibile)
+            group: Blocchi restituiti per ogni read() in modalità veloce
+        """
+        self.chunks = chunks
+        self.rate = rate
+        self.group = group
+        self.index = 0
+        self.start = None
+        self.sent_at = {}     # valore grezzo di pot1 -> istanti di consegna (crescenti)
+        self.done = threading.Event()
+        self.is_open = True
+
+    @property
+    def in_waiting(self):
+        return 0
+
+    def read(self, size=1):
+        if self.index >= len(self.chunks):
+            self.done.set()
+            time.sleep(0.01)
+            return b''
+        if self.rate:
+            if self.start is None:
+                self.start = time.perf_counter()
+            wait = self.start + self.index / self.rate - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            end = self.index + 1
+        else:
+            end = self.index + self.group
+        data = b''.join(self.chunks[self.index:end])
+        self.index = min(end, len(self.chunks))
+        now = time.perf_counter()
+        if len(data) >= 5 and data[-5] == 0xFF:
+            self.sent_at.setdefault(data[-4], []).append(now)
+        return data
+
+    def close(self):
+        self.is_open = False
+
+
+class OscSink:
+    def __init__(self):
+        """Server UDP locale al posto di SuperCollider: conta e decodifica i datagrammi"""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(0.2)
+        self.port = self.sock.getsockname()[1]
+        self.datagrams = 0
+        self.messages = 0
+        self.received = []    # (istante di ricezione, volume di /carretto/state)
+        self.running = True
+        self.thread = threading.Thread(target=self._recv_thread, daemon=True)
+        self.thread.start()
+
+    def _recv_thread(self):
+        while self.running:
+            try:
+                data, _ = self.sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+            now = time.perf_counter()
+            self.datagrams += 1
+            for timed in OscPacket(data).messages:
+                self.messages += 1
+                if timed.message.address == '/carretto/state':
+                    self.received.append((now, timed.message.params[0]))
+
+    def close(self):
+        self.running = False
+        self.thread.join(timeout=1.0)
+        self.sock.close()
+
+
+class StaticGPS:
+    def get_data(self):
+        return {'speed': None}
+
+
+def count_movements(chunks):
+    """Numero di pacchetti in cui almeno un potenziometro cambia"""
+    moves = 0
+    last = None
+    for chunk in chunks:
+        values = chunk[-4:]
+        if values != last:
+            moves += 1
+            last = values
+    return moves
+
+
+def bench_serial(chunks):
+    """Pacchetti dentro ArduinoReader il più velocemente possibile"""
+    fake = FakeSerial(chunks, group=64)
+    reader = ArduinoReader(serial_port=fake)
+    cpu = time.process_time()
+    start = time.perf_counter()
+    reader.start()
+    fake.done.wait()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    reader.stop()
+    frames = reader.get_stats()['frames']
+    return {
+        'frames': frames,
+        'frames_per_s': frames / elapsed,
+        'cpu_ms_per_1000_frames': cpu * 1000.0 / max(frames, 1) * 1000.0,
+        'resyncs': reader.get_stats()['resyncs']
+    }
+
+
+class _SnapshotFeeder:
+    """Lettore finto per il bench control: pubblica un'istantanea per pacchetto"""
+
+    def __init__(self):
+        self.reader = ArduinoReader(serial_port=FakeSerial([]))
+
+    def get_values(self):
+        return self.reader.get_values()
+
+    def get_values_if_newer(self, seq):
+        return self.reader.get_values_if_newer(seq)
+
+
+def bench_control(chunks):
+    """Logica di ControlLoop.step + MusicEngine.update, invio sincrono al sink"""
+    sink = OscSink()
+    feeder = _SnapshotFeeder()
+    music = MusicEngine(port=sink.port)
+    control = ControlLoop(feeder, StaticGPS(), music, SensorEvents())
+
+    cpu = time.process_time()
+    start = time.perf_counter()
+    for chunk in chunks:
+        now = time.perf_counter()
+        feeder.reader._update_values(chunk[-4:], now)
+        control.step({'arduino': now})
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+
+    time.sleep(0.3)
+    sink.close()
+    frames = len(chunks)
+    return {
+        'frames': frames,
+        'frames_per_s': frames / elapsed,
+        'cpu_ms_per_1000_frames': cpu * 1000.0 / frames * 1000.0,
+        'datagrams': sink.datagrams,
+        'datagrams_per_knob_movement': sink.datagrams / max(count_movements(chunks), 1)
+    }
+
+
+def bench_e2e(chunks, rate):
+    """Percorso completo a thread: seriale finta -> lettore -> loop -> invio asincrono -> sink"""
+    sink = OscSink()
+    fake = FakeSerial(chunks, rate=rate)
+    events = SensorEvents()
+    reader = ArduinoReader(serial_port=fake, events=events)
+    music = MusicEngine(port=sink.port, async_send=True)
+    # Latenza misurata abbinando il volume ricevuto al pacchetto con lo stesso valore:
+    # su pot1 solo il gate finale, che restituisce sempre un valore realmente ricevuto
+    config = dict(DEFAULT_CONFIG, pot1={'source': 'pot1', 'chain': DEFAULT_CONFIG['pot1']['chain'][1:]})
+    control = ControlLoop(reader, StaticGPS(), music, events, filters=SignalFilter(config))
+    control_thread = threading.Thread(target=control.run, daemon=True)
+
+    music.start()
+    time.sleep(0.1)
+    sink.received.clear()
+    datagrams_before = sink.datagrams
+
+    cpu = time.process_time()
+    start = time.perf_counter()
+    control_thread.start()
+    reader.start()
+    fake.done.wait()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    time.sleep(0.3)
+
+    control.stop()
+    reader.stop()
+    music.stop()
+    sink.close()
+
+    # Latenza: dal pacchetto con quel valore di pot1 alla ricezione del datagramma
+    latencies = []
+    for received_at, volume in sink.received:
+        # Ultima consegna di quel valore prima della ricezione
+        times = fake.sent_at.get(round(volume * 255), [])
+        index = bisect.bisect_right(times, received_at)
+        if index:
+            latencies.append(received_at - times[index - 1])
+
+    frames = reader.get_stats()['frames']
+    datagrams = sink.datagrams - datagrams_before
+    p50 = percentile(latencies, 0.5)
+    p99 = percentile(latencies, 0.99)
+    return {
+        'frames': frames,
+        'frame_rate': rate,
+        'frames_per_s': frames / elapsed,
+        'cpu_ms_per_1000_frames': cpu * 1000.0 / max(frames, 1) * 1000.0,
+        'datagrams': datagrams,
+        'datagrams_per_knob_movement': datagrams / max(count_movements(chunks), 1),
+        'latency_samples': len(latencies),
+        'latency_p50_ms': p50 * 1000.0 if p50 is not None else None,
+        'latency_p99_ms': p99 * 1000.0 if p99 is not None else None
+    }
+
+
+def bench_gps(data, chunk_size=64):
+    """Parser NMEA su blocchi di chunk_size byte (come letti dalla seriale)"""
+    chunks = [data[pos:pos + chunk_size] for pos in range(0, len(data), chunk_size)]
+    parser = NmeaParser()
+    cpu = time.process_time()
+    start = time.perf_counter()
+    for chunk in chunks:
+        parser.feed(chunk)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    stats = parser.get_stats()
+    return {
+        'bytes': len(data),
+        'sentences': stats['sentences'],
+        'decoded': stats['decoded'],
+        'checksum_errors': stats['checksum_errors'],
+        'sentences_per_s': stats['sentences'] / elapsed,
+        'mb_per_s': len(data) / elapsed / 1e6,
+        'cpu_us_per_sentence': cpu * 1e6 / max(stats['sentences'], 1)
+    }
+
+
+class _DrainSink:
+    def __init__(self, reading=True):
+        """Sink UDP senza thread: i datagrammi vengono contati svuotando il socket tra un giro e l'altro"""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.setblocking(False)
+        self.port = self.sock.getsockname()[1]
+        self.reading = reading
+        self.datagrams = 0
+
+    def drain(self):
+        if not self.reading:
+            return      # Nodo lento: il buffer si riempie e il kernel scarta
+        while True:
+            try:
+                self.sock.recv(4096)
+            except BlockingIOError:
+                return
+            self.datagrams += 1
+
+    def close(self):
+        self.sock.close()
+
+
+def bench_fanout(counts, rounds=20, per_round=200):
+    """
+    Costo di un aggiornamento al crescere delle destinazioni:
+        update_us    MusicEngine.update() in modalità asincrona (il costo visto dal loop di controllo)
+        transmit_us  codifica del bundle + invio a tutte le destinazioni (thread di invio)
+        send_us      solo l'invio di un datagramma già codificato, con sendmmsg e con sendto
+    """
+    result = {}
+    changes = {"/carretto/volume": 0.5, "/carretto/bpm": 120.0, "/carretto/speed": 12.5}
+    for n in counts:
+        # Metà dei nodi (a partire dal secondo) non legge mai: non deve rallentare gli altri
+        sinks = [_DrainSink(reading=(i == 0 or i % 2 == 0)) for i in range(n)]
+        targets = [('127.0.0.1', sink.port) for sink in sinks]
+        updates = rounds * per_round
+
+        music = MusicEngine(targets=targets, async_send=True)
+        music.bpm_min_beats = 0
+        music.start()
+        elapsed = 0.0
+        for r in range(rounds):
+            start = time.perf_counter()
+            for i in range(per_round):
+                music.update({'pot1': (i % 100) / 100.0}, {})
+            elapsed += time.perf_counter() - start
+            time.sleep(0.02)
+            for sink in sinks:
+                sink.drain()
+        music.stop()
+        result[f'update_us_{n}'] = elapsed / updates * 1e6
+
+        for mode in ('sendmmsg', 'sendto'):
+            for sink in sinks:
+                sink.drain()
+                sink.datagrams = 0
+            music = MusicEngine(targets=targets)
+            music.client.close()
+            music.client = OscFanout(targets, use_sendmmsg=(mode == 'sendmmsg'))
+            dgram = music._build_bundle(changes).dgram
+            transmit = 0.0
+            send = 0.0
+            for r in range(rounds):
+                start = time.perf_counter()
+                for i in range(per_round):
+                    changes["/carretto/volume"] = i / per_round
+                    music._transmit(changes, start)
+                transmit += time.perf_counter() - start
+                for sink in sinks:
+                    sink.drain()
+                start = time.perf_counter()
+                for i in range(per_round):
+                    music.client.send(dgram)
+                send += time.perf_counter() - start
+                for sink in sinks:
+                    sink.drain()
+            if mode == 'sendmmsg':
+                result[f'transmit_us_{n}'] = transmit / updates * 1e6
+            result[f'{mode}_send_us_{n}'] = send / updates * 1e6
+            readers = [sink for sink in sinks if sink.reading]
+            result[f'{mode}_delivered_{n}'] = min(sink.datagrams for sink in readers) / (2 * updates)
+            music.client.close()
+        for sink in sinks:
+            sink.close()
+    first, last = counts[0], counts[-1]
+    result[f'update_cost_{last}_vs_{first}'] = result[f'update_us_{last}'] / result[f'update_us_{first}']
+    return result
+
+
+class _TimetagSink:
+    def __init__(self):
+        """Sink UDP al posto di scsynth: registra arrivo (tempo di sistema) e timetag di ogni bundle"""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(0.2)
+        self.port = self.sock.getsockname()[1]
+        self.bundles = []     # (arrivo, timetag, note)
+        self.running = True
+        self.thread = threading.Thread(target=self._recv_thread, daemon=True)
+        self.thread.start()
+
+    def _recv_thread(self):
+        while self.running:
+            try:
+                data, _ = self.sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+            arrival = time.time()
+            messages = OscPacket(data).messages
+            self.bundles.append((arrival, messages[0].time, len(messages)))
+
+    def close(self):
+        self.running = False
+        self.thread.join(timeout=1.0)
+        self.sock.close()
+
+
+def grid_error(times, step):
+    """Scarto massimo in secondi dalla griglia di passo step che parte dal primo istante"""
+    first = times[0]
+    return max(abs(t - first - round((t - first) / step) * step) for t in times)
+
+
+def bench_sequencer(seconds, lookahead=0.1):
+    """
+    Drum and bass a 172 BPM per metà del tempo (griglia regolare di 1/8 di battito),
+    poi cambio di tempo e di pattern; il sink sostituisce scsynth.
+        timetag_jitter_us  scarto dei timetag dalla griglia: è il jitter udibile con scsynth
+        arrival_jitter_ms  scarto degli arrivi dalla griglia: il jitter di note eseguite all'arrivo
+        margin_min_ms      anticipo minimo dell'arrivo sul timetag (negativo = nota in ritardo)
+    """
+    sink = _TimetagSink()
+    sequencer = Sequencer(port=sink.port, lookahead=lookahead)
+    sequencer.set_state(0.8, 172, "drumandbass", 0)
+
+    cpu = time.process_time()
+    sequencer.start()
+    time.sleep(seconds / 2)
+    change_at = time.time()
+    sequencer.set_state(0.8, 120, "house", 2)
+    time.sleep(seconds / 2)
+    sequencer.stop()
+    cpu = time.process_time() - cpu
+    time.sleep(0.1)
+    sink.close()
+
+    bundles = sink.bundles
+    # Note della prima metà già in volo al cambio escluse: restano sulla griglia vecchia
+    steady = [(arrival, timetag) for arrival, timetag, _ in bundles if timetag < change_at]
+    step = 0.125 * 60.0 / 172
+    margins = sorted(timetag - arrival for arrival, timetag, _ in bundles)
+    stats = sequencer.get_stats()
+    return {
+        'seconds': seconds,
+        'lookahead_ms': lookahead * 1000.0,
+        'bundles': len(bundles),
+        'notes': sum(notes for _, _, notes in bundles),
+        'late': sum(1 for margin in margins if margin < 0),
+        'stalls': stats['stalls'],
+        'timetag_jitter_us': grid_error([timetag for _, timetag in steady], step) * 1e6,
+        'arrival_jitter_ms': grid_error([arrival for arrival, _ in steady], step) * 1000.0,
+        'margin_min_ms': margins[0] * 1000.0,
+        'margin_p50_ms': percentile(margins, 0.5) * 1000.0,
+        'cpu_ms_per_s': cpu * 1000.0 / seconds
+    }
+
+
+def synthetic_zones(count, seed=1, lat0=41.9028, lon0=12.4964, extent=8000.0):
+    """
+    FeatureCollection sintetica: count poligoni stellati (8-24 vertici, raggio 15-120 m)
+    sparsi su un quadrato di extent metri, con un buco ogni dieci, più un quartiere
+    grande ogni mille zone (priorità più bassa, nell'elenco delle zone grandi)
+    """
+    rng = random.Random(seed)
+    m_lat = 1.0 / 111195.0
+    m_lon = m_lat / math.cos(math.radians(lat0))
+
+    def ring(cx, cy, radius, vertices, jitter=0.4):
+        points = []
+        for k in range(vertices):
+            angle = 2 * math.pi * k / vertices
+            r = radius * (1 - jitter * rng.random())
+            points.append([lon0 + (cx + r * math.cos(angle)) * m_lon, lat0 + (cy + r * math.sin(angle)) * m_lat])
+        return points + [points[0]]
+
+    features = []
+    genres = ["dub", "techno", "reggae", "house", "drumandbass", "ambient"]
+    for i in range(count):
+        cx, cy = rng.uniform(-extent / 2, extent / 2), rng.uniform(-extent / 2, extent / 2)
+        radius = rng.uniform(15.0, 120.0)
+        rings = [ring(cx, cy, radius, rng.randint(8, 24))]
+        if i % 10 == 0:
+            rings.append(ring(cx, cy, radius * 0.2, 6, jitter=0.0)[::-1])
+        low = rng.randint(70, 140)
+        features.append({'type': 'Feature',
+                         'properties': {'name': f"zona {i}", 'genre': rng.choice(genres),
+                                        'bpm': [low, low + 20], 'priority': 1},
+                         'geometry': {'type': 'Polygon', 'coordinates': rings}})
+    for i in range(max(1, count // 1000)):
+        cx, cy = rng.uniform(-extent / 3, extent / 3), rng.uniform(-extent / 3, extent / 3)
+        features.append({'type': 'Feature',
+                         'properties': {'name': f"quartiere {i}", 'volume_max': 0.7},
+                         'geometry': {'type': 'Polygon', 'coordinates': [ring(cx, cy, 2000.0, 64, 0.2)]}})
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def bench_geofence(count, fixes=20000, seed=1):
+    """
+    Indice a griglia su count zone sintetiche: costruzione, ricerca per fix (senza e con
+    isteresi) lungo un percorso casuale a passi di 3 m, confronto con la ricerca lineare
+        locate_*_us   zona che contiene il punto (griglia + rettangoli + ray casting)
+        update_*_us   come locate, con l'isteresi ai confini (quella usata dal MusicEngine)
+        mismatches    punti in cui griglia e ricerca lineare danno zone diverse
+    """
+    geojson = synthetic_zones(count, seed)
+    start = time.perf_counter()
+    fence = Geofence(geojson)
+    build = time.perf_counter() - start
+
+    rng = random.Random(seed)
+    lat, lon = fence.lat0, fence.lon0
+    track = []
+    heading = 0.0
+    for _ in range(fixes):
+        heading += rng.gauss(0.0, 0.3)
+        lat += 3.0 * math.sin(heading) / fence.ky
+        lon += 3.0 * math.cos(heading) / fence.kx
+        track.append((lat, lon))
+
+    clock = time.perf_counter
+    timings = []
+    inside = 0
+    for lat, lon in track:
+        t0 = clock()
+        zone = fence.locate(lat, lon)
+        timings.append(clock() - t0)
+        inside += zone is not None
+    update_timings = []
+    for lat, lon in track:
+        t0 = clock()
+        fence.update(lat, lon)
+        update_timings.append(clock() - t0)
+
+    # Ricerca lineare su un campione: stesso risultato, costo di riferimento
+    sample = track[::max(1, len(track) // 200)]
+    mismatches = 0
+    t0 = clock()
+    for lat, lon in sample:
+        x, y = fence.project(lat, lon)
+        best = None
+        for zone in fence.zones:
+            if zone.contains(x, y) and (best is None or zone.rank > best.rank):
+                best = zone
+        mismatches += best is not fence.locate(lat, lon)
+    linear = (clock() - t0) / len(sample)
+
+    stats = fence.get_stats()
+    candidates = sum(len(cell) for cell in fence.cells.values()) / max(len(fence.cells), 1)
+    return {
+        'zones': len(fence.zones),
+        'vertices': sum(len(r) for z in fence.zones for p in z.polygons for r in p),
+        'build_ms': build * 1000.0,
+        'cell_m': fence.cell_size,
+        'cells': len(fence.cells),
+        'large_zones': len(fence.large),
+        'zones_per_cell': candidates,
+        'fixes': len(track),
+        'fixes_in_zone': inside,
+        'locate_mean_us': sum(timings) / len(timings) * 1e6,
+        'locate_p50_us': percentile(timings, 0.5) * 1e6,
+        'locate_p99_us': percentile(timings, 0.99) * 1e6,
+        'update_p50_us': percentile(update_timings, 0.5) * 1e6,
+        'update_p99_us': percentile(update_timings, 0.99) * 1e6,
+        'zone_changes': stats['changes'],
+        'held_at_border': stats['held'],
+        'linear_us': linear * 1e6,
+        'mismatches': mismatches
+    }
+
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, path):
+    """Stampa le variazioni rispetto a un file di risultati precedente"""
+    with open(path) as f:
+        old = json.load(f)
+    print(f"\n=== CONFRONTO CON {path} ({old.get('version')}) ===")
+    for bench, values in results['benches'].items():
+        previous = old.get('benches', {}).get(bench, {})
+        for key, value in values.items():
+            before = previous.get(key)
+            if isinstance(value, (int, float)) and isinstance(before, (int, float)) and before:
+                print(f"  {bench:8s} {key:30s} {before:12.3f} -> {value:12.3f} ({(value - before) / before * 100:+.1f}%)")
+
+
+BENCHES = ('serial', 'control', 'e2e', 'gps', 'fanout', 'sequencer', 'geofence')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del carretto musicale")
+    parser.add_argument('benches', nargs='*', metavar='BENCH',
+                        help=f"Bench da eseguire ({', '.join(BENCHES)}); default tutti")
+    parser.add_argument('--frames', type=int, default=10000, help="Pacchetti sintetici")
+    parser.add_argument('--rate', type=float, default=500.0, help="Pacchetti/s del bench e2e")
+    parser.add_argument('--session', help="Usa i pacchetti Arduino di una sessione registrata")
+    parser.add_argument('--nmea', help="Log NMEA per il bench gps (default sintetico)")
+    parser.add_argument('--nmea-seconds', type=int, default=20000, help="Secondi di log NMEA sintetico")
+    parser.add_argument('--targets', default='1,2,4,8,16', help="Destinazioni del bench fanout")
+    parser.add_argument('--seconds', type=float, default=4.0, help="Durata del bench sequencer")
+    parser.add_argument('--zones', type=int, default=10000, help="Zone sintetiche del bench geofence")
+    parser.add_argument('--json', help="Salva i risultati in formato JSON")
+    parser.add_argument('--compare', help="Confronta con un file JSON precedente")
+    args = parser.parse_args()
+    for name in args.benches:
+        if name not in BENCHES:
+            parser.error(f"bench sconosciuto: {name}")
+
+    logger.configure('WARNING')
+    chunks = recorded_frames(args.session) if args.session else sweep_frames(args.frames)
+
+    print("=== BENCHMARK CARRETTO ===")
+    print(f"Pacchetti: {len(chunks)} ({'sessione ' + args.session if args.session else 'sintetici'})")
+
+    results = {
+        'version': git_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'machine': platform.machine(),
+        'benches': {}
+    }
+    for name in args.benches or BENCHES:
+        print(f"\n=== BENCH {name.upper()} ===")
+        if name == 'serial':
+            result = bench_serial(chunks)
+        elif name == 'control':
+            result = bench_control(chunks)
+        elif name == 'gps':
+            if args.nmea:
+                with open(args.nmea, 'rb') as f:
+                    nmea = f.read()
+            else:
+                nmea = synthetic_nmea(args.nmea_seconds)
+            result = bench_gps(nmea)
+        elif name == 'fanout':
+            result = bench_fanout([int(n) for n in args.targets.split(',')])
+        elif name == 'sequencer':
+            result = bench_sequencer(args.seconds)
+        elif name == 'geofence':
+            result = bench_geofence(args.zones)
+        else:
+            result = bench_e2e(chunks, args.rate)
+        results['benches'][name] = result
+        for key, value in result.items():
+            print(f"  {key:30s} {value:.3f}" if isinstance(value, float) else f"  {key:30s} {value}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nRisultati salvati in {args.json}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Fuzz dei decoder dei pacchetti Arduino (v1, v2 e riconoscimento automatico)
+
+Flussi casuali e corrotti passati a blocchi di dimensione casuale. Per ogni
+caso si verificano gli invarianti:
+- nessuna eccezione, buffer interno limitato
+- valori pubblicati sempre nell'intervallo del formato
+- v2: ogni pacchetto accettato è uno di quelli realmente inviati (con un solo
+  bit errato per pacchetto il CRC deve scartarlo sempre)
+- v2: risultato indipendente da come il flusso è spezzato in blocchi
+- riconoscimento: un flusso v1 non viene mai preso per v2 e viceversa
+
+Uso:
+    python decoder_fuzz.py                 # 300 casi per famiglia
+    python decoder_fuzz.py 5000            # più casi
+"""
+
+import random
+import sys
+import time
+from modules.packet_decoder import PacketDecoder, PacketDecoderV2, AutoDecoder, encode_frame_v2
+
+
+def feed_random_chunks(decoder, stream, rnd, max_chunk=64):
+    """Alimenta il decoder a blocchi casuali; restituisce il massimo di byte in attesa"""
+    pos = 0
+    max_pending = 0
+    while pos < len(stream):
+        size = rnd.randint(1, max_chunk)
+        decoder.feed(stream[pos:pos + size])
+        max_pending = max(max_pending, decoder.get_stats()['pending'])
+        pos += size
+    return max_pending
+
+
+def v2_stream(rnd, count):
+    """Pacchetti v2 con sequenza a partire da un valore casuale; pot1 = indice del pacchetto"""
+    frames = []
+    sent = set()
+    seq = rnd.randrange(256)
+    for index in range(count):
+        values = (index,) + tuple(rnd.choice((0, 1023, rnd.randrange(1024))) for _ in range(3))
+        frames.append(bytearray(encode_frame_v2(seq, values)))
+        sent.add(values)
+        seq = (seq + 1) & 0xFF
+    return frames, sent
+
+
+def check(name, condition):
+    print(f"  {'OK ' if condition else 'ERR'} {name}")
+    return condition
+
+
+def fuzz_random_bytes(cases, rnd):
+    """Rumore puro: nessuna eccezione, buffer limitati, valori nell'intervallo"""
+    ok = True
+    for _ in range(cases):
+        noise = bytes(rnd.randrange(256) for _ in range(rnd.randint(0, 2000)))
+        for decoder in (PacketDecoder(), PacketDecoderV2(), AutoDecoder()):
+            if feed_random_chunks(decoder, noise, rnd) > 128:
+                ok = False
+            latest = decoder.latest
+            if latest is not None and (len(latest) != 4 or max(latest) > decoder.full_scale):
+                ok = False
+    return check(f"rumore casuale ({cases} casi): nessun errore, buffer e valori nei limiti", ok)
+
+
+def feed_v2(stream, sent, rnd, max_chunk):
+    """
+    Alimenta un PacketDecoderV2 controllando ogni valore pubblicato
+
+    Returns:
+        (decoder, valori accettati ma mai inviati, indice del primo pacchetto accettato)
+    """
+    decoder = PacketDecoderV2()
+    false_accepts = 0
+    first_index = None
+    pos = 0
+    while pos < len(stream):
+        size = rnd.randint(1, max_chunk)
+        found = decoder.feed(stream[pos:pos + size])
+        if found:
+            if decoder.latest not in sent:
+                false_accepts += 1
+            elif first_index is None:
+                # Primo blocco con pacchetti validi: risale al primo tramite i contatori
+                first_index = decoder.latest[0] - (found - 1) - decoder.dropped
+        pos += size
+    return decoder, false_accepts, first_index
+
+
+def fuzz_bit_flips(cases, rnd):
+    """Un bit errato in alcuni pacchetti v2: il CRC deve scartarli tutti"""
+    false_accepts = 0
+    damaged = 0
+    for _ in range(cases):
+        frames, sent = v2_stream(rnd, rnd.randint(5, 60))
+        for frame in frames:
+            if rnd.random() < 0.3:
+                frame[rnd.randrange(len(frame))] ^= 1 << rnd.randrange(8)
+                damaged += 1
+        decoder, bad, _ = feed_v2(b''.join(frames), sent, rnd, 32)
+        false_accepts += bad
+    return check(f"un bit errato ({damaged} pacchetti danneggiati): nessuno accettato", false_accepts == 0)
+
+
+def fuzz_byte_damage(cases, rnd):
+    """Byte persi o inseriti e pacchetti mancanti: perdite contate dai salti di sequenza"""
+    ok = True
+    false_accepts = 0
+    miscounted = 0
+    for _ in range(cases):
+        frames, sent = v2_stream(rnd, rnd.randint(20, 200))
+        out = bytearray()
+        for frame in frames:
+            r = rnd.random()
+            if r < 0.05:
+                del frame[rnd.randrange(len(frame))]
+            elif r < 0.10:
+                frame.insert(rnd.randrange(len(frame)), rnd.randrange(256))
+            elif r < 0.12:
+                continue    # pacchetto intero perso
+            out += frame
+        decoder, bad, first_index = feed_v2(bytes(out), sent, rnd, 64)
+        false_accepts += bad
+        if bad or first_index is None:
+            continue
+        # Tra il primo e l'ultimo pacchetto accettato: validi + persi = pacchetti inviati
+        span = decoder.latest[0] - first_index + 1
+        if decoder.frames + decoder.dropped != span:
+            miscounted += 1
+    # Con byte arbitrari il CRC-8 lascia passare in media un pacchetto errato su 256
+    ok &= check(f"byte persi/inseriti: {false_accepts} valori mai inviati accettati (CRC-8, atteso ~0)",
+                false_accepts <= max(1, cases // 50))
+    ok &= check(f"perdite contate dai salti di sequenza ({miscounted} flussi errati)", miscounted == 0)
+    return ok
+
+
+def fuzz_chunking(cases, rnd):
+    """Stesso flusso corrotto, blocchi diversi: stessi contatori e stesso ultimo valore"""
+    ok = True
+    for _ in range(cases):
+        frames, _ = v2_stream(rnd, rnd.randint(5, 80))
+        stream = bytearray(b''.join(frames))
+        for _ in range(rnd.randint(0, 10)):
+            stream[rnd.randrange(len(stream))] = rnd.randrange(256)
+        results = []
+        for max_chunk in (1, 7, 4096):
+            decoder = PacketDecoderV2()
+            feed_random_chunks(decoder, bytes(stream), rnd, max_chunk)
+            results.append((decoder.frames, decoder.corrupt, decoder.dropped, decoder.latest))
+        if results[0] != results[1] or results[1] != results[2]:
+            ok = False
+    return check(f"indipendenza dai blocchi ({cases} flussi corrotti)", ok)
+
+
+def fuzz_detection(cases, rnd):
+    """Riconoscimento su flussi con inizio a caso e un po' di rumore in testa"""
+    wrong = 0
+    for _ in range(cases):
+        head = bytes(rnd.randrange(256) for _ in range(rnd.randint(0, 12)))
+        if rnd.random() < 0.5:
+            expected = 'v1'
+            stream = bytearray()
+            for _ in range(40):
+                stream.append(0xFF)
+                stream += bytes(rnd.choice((0, 254, rnd.randrange(255))) for _ in range(4))
+        else:
+            expected = 'v2'
+            frames, _ = v2_stream(rnd, 40)
+            stream = b''.join(frames)
+        decoder = AutoDecoder()
+        feed_random_chunks(decoder, head + bytes(stream[rnd.randrange(9):]), rnd, 24)
+        if decoder.protocol != expected:
+            wrong += 1
+    return check(f"riconoscimento v1/v2 ({cases} flussi): {wrong} errori", wrong == 0)
+
+
+def fuzz_spurious_v2(cases, rnd):
+    """Flusso v1 con un pacchetto v2 valido in mezzo (CRC giusto per caso): resta v1"""
+    wrong = 0
+    for _ in range(cases):
+        packets = [tuple(rnd.choice((0, 254, rnd.randrange(255))) for _ in range(4)) for _ in range(40)]
+        stream = bytearray()
+        position = rnd.randint(1, 6)
+        for index, values in enumerate(packets):
+            if index == position:
+                stream += b'\x00' + encode_frame_v2(rnd.randrange(256), tuple(rnd.randrange(1024) for _ in range(4)))
+            stream.append(0xFF)
+            stream += bytes(values)
+        decoder = AutoDecoder()
+        spurious = PacketDecoderV2()
+        spurious.feed(bytes(stream))
+        feed_random_chunks(decoder, bytes(stream), rnd, 24)
+        if spurious.frames == 0 or decoder.protocol != 'v1' or tuple(decoder.latest) != packets[-1]:
+            wrong += 1
+    return check(f"pacchetto v2 spurio in un flusso v1 ({cases} flussi): {wrong} errori", wrong == 0)
+
+
+def main():
+    cases = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 12345
+    rnd = random.Random(seed)
+    print(f"=== FUZZ DECODER PACCHETTI ({cases} casi, seme {seed}) ===")
+    start = time.perf_counter()
+    ok = fuzz_random_bytes(cases, rnd)
+    ok &= fuzz_bit_flips(cases, rnd)
+    ok &= fuzz_byte_damage(cases, rnd)
+    ok &= fuzz_chunking(cases, rnd)
+    ok &= fuzz_detection(cases, rnd)
+    ok &= fuzz_spurious_v2(cases, rnd)
+    print(f"\n  durata {time.perf_counter() - start:.1f} s")
+    print(f"\n{'TUTTI I TEST SUPERATI' if ok else 'ALCUNI TEST FALLITI'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
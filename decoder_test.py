@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Test del decoder dei pacchetti Arduino su flussi di byte registrati
+
+Uso:
+    python decoder_test.py                 # flussi sintetici (puliti, corrotti, parziali)
+    python decoder_test.py cattura.bin     # anche una cattura grezza dalla seriale
+"""
+
+import random
+import sys
+import time
+from modules.packet_decoder import PacketDecoder, PacketDecoderV2, AutoDecoder, encode_frame_v2
+
+BAUD_115200_BYTES = 115200 // 10  # 8N1: 10 bit per byte
+
+
+def make_frames(count, seed=1):
+    """Genera un flusso registrato di pacchetti validi [0xFF, v1..v4] (valori 0-254)"""
+    rnd = random.Random(seed)
+    stream = bytearray()
+    last = None
+    for _ in range(count):
+        last = bytes(rnd.randrange(255) for _ in range(4))
+        stream.append(0xFF)
+        stream += last
+    return bytes(stream), last
+
+
+def make_frames_v2(count, seed=1, full_scale=False):
+    """Flusso di pacchetti v2 (valori 0-1023, o tutti a fondo scala)"""
+    rnd = random.Random(seed)
+    stream = bytearray()
+    last = None
+    for seq in range(count):
+        last = (1023,) * 4 if full_scale else tuple(rnd.randrange(1024) for _ in range(4))
+        stream += encode_frame_v2(seq, last)
+    return bytes(stream), last
+
+
+def corrupt(stream, rate, seed=2):
+    """Inserisce byte spuri e ne elimina altri con la probabilità indicata"""
+    rnd = random.Random(seed)
+    out = bytearray()
+    for b in stream:
+        r = rnd.random()
+        if r < rate / 2:
+            continue  # byte perso
+        out.append(b)
+        if r > 1 - rate / 2:
+            out.append(rnd.randrange(256))  # byte spurio
+    return bytes(out)
+
+
+def feed_chunks(decoder, stream, max_chunk, seed=3):
+    """Alimenta il decoder a blocchi di dimensione casuale, come farebbe la seriale"""
+    rnd = random.Random(seed)
+    pos = 0
+    while pos < len(stream):
+        size = rnd.randint(1, max_chunk)
+        decoder.feed(stream[pos:pos + size])
+        pos += size
+
+
+def check(name, condition):
+    print(f"  {'OK ' if condition else 'ERR'} {name}")
+    return condition
+
+
+def run_synthetic():
+    ok = True
+
+    print("\n=== TEST 1: FLUSSO PULITO IN UN UNICO BLOCCO ===")
+    stream, last = make_frames(1000)
+    decoder = PacketDecoder()
+    decoder.feed(stream)
+    ok &= check("1000 pacchetti decodificati", decoder.frames == 1000)
+    ok &= check("nessuna risincronizzazione", decoder.resyncs == 0)
+    ok &= check("ultimo pacchetto corretto", decoder.latest == last)
+
+    print("\n=== TEST 2: FLUSSO PULITO A BLOCCHI PARZIALI ===")
+    for max_chunk in (1, 3, 7, 64):
+        decoder = PacketDecoder()
+        feed_chunks(decoder, stream, max_chunk)
+        ok &= check(f"blocchi fino a {max_chunk} byte: {decoder.frames} pacchetti",
+                    decoder.frames == 1000 and decoder.latest == last)
+
+    print("\n=== TEST 3: INIZIO A META' PACCHETTO E CODA TRONCATA ===")
+    decoder = PacketDecoder()
+    decoder.feed(stream[3:] + b'\xff\x01\x02')
+    ok &= check("pacchetto iniziale scartato", decoder.frames == 999)
+    ok &= check("una risincronizzazione", decoder.resyncs == 1)
+    ok &= check("coda parziale in attesa", decoder.get_stats()['pending'] == 3)
+    decoder.feed(b'\x03\x04')
+    ok &= check("coda completata dal blocco successivo", decoder.latest == b'\x01\x02\x03\x04')
+
+    print("\n=== TEST 4: FLUSSO CORROTTO ===")
+    noisy = corrupt(stream, 0.02)
+    decoder = PacketDecoder()
+    feed_chunks(decoder, noisy, 32)
+    ok &= check(f"pacchetti {decoder.frames}, risincronizzazioni {decoder.resyncs}",
+                900 <= decoder.frames <= 1000 and decoder.resyncs > 0)
+    ok &= check("ultimo pacchetto ha 4 valori", decoder.latest is not None and len(decoder.latest) == 4)
+
+    print("\n=== TEST 5: SOLO RUMORE ===")
+    decoder = PacketDecoder()
+    decoder.feed(bytes(range(255)))
+    ok &= check("nessun pacchetto", decoder.frames == 0 and decoder.latest is None)
+    ok &= check("buffer svuotato", decoder.get_stats()['pending'] == 0)
+
+    return ok
+
+
+def run_v2():
+    ok = True
+
+    print("\n=== TEST 6: V2 A BLOCCHI PARZIALI ===")
+    stream, last = make_frames_v2(1000)
+    for max_chunk in (1, 5, 9, 64):
+        decoder = PacketDecoderV2()
+        feed_chunks(decoder, stream, max_chunk)
+        ok &= check(f"blocchi fino a {max_chunk} byte: {decoder.frames} pacchetti",
+                    decoder.frames == 1000 and decoder.latest == last
+                    and decoder.dropped == 0 and decoder.corrupt == 0)
+
+    print("\n=== TEST 7: V2 A FONDO SCALA ===")
+    full, _ = make_frames_v2(100, full_scale=True)
+    decoder = PacketDecoderV2()
+    decoder.feed(full)
+    ok &= check("nessun pacchetto perso con tutti i valori a 1023",
+                decoder.frames == 100 and decoder.latest == (1023,) * 4)
+    decoder = PacketDecoder()
+    decoder.feed(b''.join(bytes((0xFF, 255, 255, 255, 255)) for _ in range(100)))
+    ok &= check(f"v1 a fondo scala perde i pacchetti ({decoder.frames} su 100)", decoder.frames < 100)
+
+    print("\n=== TEST 8: V2 PACCHETTI PERSI E CORROTTI ===")
+    frames = [encode_frame_v2(seq, (seq, 0, 0, 0)) for seq in range(600)]
+    damaged = bytearray(frames[100])
+    damaged[3] ^= 0x10
+    stream = b''.join(frames[:50] + frames[53:100]) + bytes(damaged) + b''.join(frames[101:])
+    decoder = PacketDecoderV2()
+    feed_chunks(decoder, stream, 32)
+    ok &= check(f"persi {decoder.dropped} (attesi 4: 3 mancanti + 1 corrotto)", decoder.dropped == 4)
+    ok &= check(f"corrotti {decoder.corrupt} (atteso 1)", decoder.corrupt == 1)
+    ok &= check("sequenza oltre 255 senza falsi salti", decoder.latest == (599, 0, 0, 0))
+
+    print("\n=== TEST 9: RICONOSCIMENTO DEL FORMATO ===")
+    v1_stream, v1_last = make_frames(100)
+    v2_stream, v2_last = make_frames_v2(100)
+    for name, stream, last, protocol in (("v1", v1_stream, v1_last, 'v1'), ("v2", v2_stream, v2_last, 'v2'),
+                                          ("v2 a fondo scala", full, (1023,) * 4, 'v2')):
+        decoder = AutoDecoder()
+        feed_chunks(decoder, stream[4:], 16)
+        ok &= check(f"{name}: riconosciuto come {decoder.protocol}",
+                    decoder.protocol == protocol and decoder.latest == last)
+    decoder = AutoDecoder()
+    decoder.feed(v2_stream[:9 * 2])
+    ok &= check("nessun valore pubblicato prima del riconoscimento", decoder.latest is None and decoder.frames == 0)
+    return ok
+
+
+def run_file(path):
+    with open(path, 'rb') as f:
+        stream = f.read()
+    print(f"\n=== CATTURA: {path} ({len(stream)} byte) ===")
+    decoder = PacketDecoder()
+    feed_chunks(decoder, stream, 64)
+    print(f"  Statistiche: {decoder.get_stats()}")
+    print(f"  Ultimo pacchetto: {list(decoder.latest) if decoder.latest else None}")
+    return stream
+
+
+def throughput(stream, chunk_size, decoder_class=PacketDecoder):
+    decoder = decoder_class()
+    start = time.perf_counter()
+    for pos in range(0, len(stream), chunk_size):
+        decoder.feed(stream[pos:pos + chunk_size])
+    elapsed = time.perf_counter() - start
+    rate = len(stream) / elapsed
+    print(f"  blocchi da {chunk_size:5d} byte: {rate / 1e6:7.2f} MB/s, "
+          f"{decoder.frames / elapsed:10.0f} pacchetti/s, "
+          f"{rate / BAUD_115200_BYTES:8.1f}x il flusso a 115200 baud")
+
+
+def main():
+    print("=== TEST DECODER PACCHETTI ARDUINO ===")
+    ok = run_synthetic()
+    ok &= run_v2()
+
+    streams = [make_frames(200000)[0]]
+    for path in sys.argv[1:]:
+        streams.append(run_file(path))
+
+    print("\n=== THROUGHPUT ===")
+    for stream in streams:
+        for chunk_size in (16, 256, 4096):
+            throughput(stream, chunk_size)
+
+    print("\n=== THROUGHPUT V2 ===")
+    stream = make_frames_v2(200000)[0]
+    for chunk_size in (16, 256, 4096):
+        throughput(stream, chunk_size, PacketDecoderV2)
+
+    print("\nTest completato!" if ok else "\nTest FALLITO!")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Test dell'invio a più destinazioni (OscFanout) con sink UDP locali
+
+Una destinazione che rifiuta i datagrammi (indirizzo broadcast senza
+SO_BROADCAST: sendto fallisce con EACCES) simula un nodo irraggiungibile:
+gli altri devono ricevere tutto, l'errore resta nello stato di quel nodo e
+al ritorno il nodo riceve lo stato completo.
+
+Uso:
+    python fanout_test.py
+"""
+
+import socket
+import sys
+import threading
+import time
+from pythonosc.osc_packet import OscPacket
+from modules import logger
+from modules.music_engine import MusicEngine
+from modules.osc_fanout import OscFanout, _sendmmsg
+from heartbeat_test import FakeSclang, wait_for
+
+UNREACHABLE = ('255.255.255.255', 9)
+
+
+class Sink:
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(0.2)
+        self.port = self.sock.getsockname()[1]
+
+    def receive_all(self):
+        """Indirizzi OSC di tutti i datagrammi in attesa"""
+        addresses = []
+        while True:
+            try:
+                data = self.sock.recv(4096)
+            except socket.timeout:
+                return addresses
+            addresses.append([m.message.address for m in OscPacket(data).messages])
+
+    def close(self):
+        self.sock.close()
+
+
+def check(name, condition):
+    print(f"  {'OK ' if condition else 'ERR'} {name}")
+    return condition
+
+
+def run_isolation_test(use_sendmmsg):
+    ok = True
+    label = "sendmmsg" if use_sendmmsg else "sendto"
+    print(f"\n--- Nodo irraggiungibile in mezzo agli altri ({label}) ---")
+    sinks = [Sink() for _ in range(4)]
+    targets = [('127.0.0.1', sinks[0].port), UNREACHABLE] + [('127.0.0.1', s.port) for s in sinks[1:]]
+    fanout = OscFanout(targets, use_sendmmsg=use_sendmmsg)
+    delivered = [fanout.send(b'/x\x00\x00,\x00\x00\x00') for _ in range(10)]
+    received = [len(sink.receive_all()) for sink in sinks]
+    ok &= check(f"consegnato agli altri 4 nodi ({received})", received == [10] * 4 and delivered == [4] * 10)
+    stats = fanout.get_stats()
+    bad = stats['255.255.255.255:9']
+    ok &= check(f"errore solo nello stato del nodo ({bad['last_error']}, {bad['failed']} falliti)",
+                bad['failed'] == 10 and all(s['failed'] == 0 for name, s in stats.items() if name != '255.255.255.255:9'))
+    fanout.close()
+    for sink in sinks:
+        sink.close()
+    return ok
+
+
+def test_recovery():
+    ok = True
+    print("\n--- Nodo che torna raggiungibile ---")
+    sinks = [Sink(), Sink()]
+    music = MusicEngine(targets=[('127.0.0.1', sinks[0].port), UNREACHABLE])
+    target = music.client.targets[1]
+    music.update({'pot1': 0.3, 'pot2': 0.5, 'pot3': 0.2, 'pot4': 0.9}, {'speed': 10.0})
+    ok &= check("invio riuscito con un nodo irraggiungibile", music.stats['sent'] == 1 and music.stats['errors'] == 0)
+    ok &= check("nodo segnato in errore", target in music.client.failing)
+
+    # Il nodo torna: al primo invio riuscito riceve anche lo stato completo
+    target.addr = ('127.0.0.1', sinks[1].port)
+    music.update({'pot1': 0.9}, {})
+    received = sinks[1].receive_all()
+    ok &= check("stato completo reinviato al nodo tornato",
+                any('/carretto/state' in bundle and '/carretto/speed' in bundle for bundle in received))
+    ok &= check("nodo non più in errore", not music.client.failing and target.consecutive_errors == 0)
+    music.client.close()
+    for sink in sinks:
+        sink.close()
+    return ok
+
+
+def test_threads():
+    ok = True
+    print("\n--- Invii da più thread con un nodo che va e viene ---")
+    sink = Sink()
+    recovered = []
+
+    def resend(target):
+        # Come MusicEngine.send_full_state: un invio dentro on_recover non deve bloccarsi
+        recovered.append(target)
+        fanout.send(b'/s\x00\x00,\x00\x00\x00', [target])
+
+    fanout = OscFanout([('127.0.0.1', sink.port), UNREACHABLE, UNREACHABLE], use_sendmmsg=False,
+                       on_recover=resend)
+    good, bad, flapping = fanout.targets
+    errors = []
+    running = True
+    sends = 3000
+
+    def sender():
+        try:
+            for _ in range(sends):
+                fanout.send(b'/x\x00\x00,\x00\x00\x00')
+        except Exception as e:
+            errors.append(e)
+
+    def flapper():
+        while running:
+            flapping.addr = good.addr if flapping.addr == UNREACHABLE else UNREACHABLE
+            time.sleep(0)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)     # Cambi di thread il più spesso possibile
+    try:
+        toggle = threading.Thread(target=flapper)
+        toggle.start()
+        senders = [threading.Thread(target=sender) for _ in range(4)]
+        for thread in senders:
+            thread.start()
+        for thread in senders:
+            thread.join()
+        running = False
+        toggle.join()
+    finally:
+        sys.setswitchinterval(interval)
+    ok &= check(f"nessuna eccezione nei thread ({errors[:1]})", not errors)
+    ok &= check(f"nessun errore perso sul nodo spento ({bad.failed} su {4 * sends})", bad.failed == 4 * sends)
+    flapping.addr = good.addr
+    fanout.send(b'/x\x00\x00,\x00\x00\x00')
+    ok &= check(f"nodo che va e viene: {len(recovered)} ritorni, alla fine non in errore",
+                recovered and fanout.failing == {bad} and flapping.consecutive_errors == 0)
+    fanout.close()
+    sink.close()
+    return ok
+
+
+def test_heartbeat_per_target():
+    ok = True
+    print("\n--- Heartbeat per destinazione ---")
+    alive = FakeSclang()
+    silent = FakeSclang()
+    silent.replying = False
+    music = MusicEngine(targets=[('127.0.0.1', alive.port), ('127.0.0.1', silent.port)], heartbeat_interval=0.05)
+    first, second = music.client.targets
+    music.start()
+    try:
+        ok &= check("nodo che risponde: raggiungibile", wait_for(lambda: first.alive))
+        time.sleep(0.3)
+        ok &= check("nodo muto: assente", not second.alive and second.rtt.summary() is None)
+        states = silent.states
+        silent.replying = True
+        ok &= check("nodo muto che risponde: raggiungibile", wait_for(lambda: second.alive))
+        ok &= check("solo il nodo tornato risincronizzato",
+                    wait_for(lambda: silent.states > states) and music.heartbeat.stats['resyncs'] == 2)
+    finally:
+        music.stop()
+        alive.close()
+        silent.close()
+    return ok
+
+
+def main():
+    print("=== TEST FANOUT OSC ===")
+    logger.configure('ERROR')
+    ok = run_isolation_test(False)
+    if _sendmmsg:
+        ok &= run_isolation_test(True)
+    else:
+        print("\n  sendmmsg non disponibile su questo sistema")
+    ok &= test_recovery()
+    ok &= test_threads()
+    ok &= test_heartbeat_per_target()
+    print(f"\n{'TUTTI I TEST SUPERATI' if ok else 'ALCUNI TEST FALLITI'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
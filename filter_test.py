@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Test dello stadio di filtro dei segnali (SignalFilter)
+
+Il caso principale è il rumore del potenziometro sul bordo tra due generi o
+pattern: con la mappatura storica l'indice salta avanti e indietro (e ogni
+salto riavvia il pattern in SuperCollider), con l'isteresi non deve cambiare mai.
+
+Uso:
+    python filter_test.py                  # flussi sintetici registrati con rumore
+    python filter_test.py sessione.bin     # anche una sessione registrata (--record)
+"""
+
+import random
+import sys
+from modules import logger
+from modules.arduino_reader import ArduinoReader
+from modules.controller import ControlLoop
+from modules.gps_reader import GPSReader, nmea_checksum
+from modules.mapping import Mapping
+from modules.music_engine import MusicEngine
+from modules.packet_decoder import PacketDecoder
+from modules.sensor_events import SensorEvents
+from modules.session_recorder import read_session, SOURCE_ARDUINO
+from modules.signal_filter import SignalFilter, Deadband, Gate, Slew, OneEuro, Ema
+from modules.snapshot import NORM
+
+FRAME_PERIOD = 0.01     # 100 pacchetti al secondo
+
+
+def legacy_genre(value):
+    return min(int(value * 6.99), 6)
+
+
+def legacy_pattern(value):
+    return min(int(value * 3.99), 3)
+
+
+def count_flaps(indices, times, window=1.0):
+    """Cambi di indice annullati (A -> B -> A) entro window secondi"""
+    flaps = 0
+    changes = []    # (istante, da, a)
+    last = indices[0]
+    for index, t in zip(indices, times):
+        if index != last:
+            if changes and changes[-1][1] == index and t - changes[-1][0] <= window:
+                flaps += 1
+            changes.append((t, last, index))
+            last = index
+    return flaps
+
+
+def count_changes(indices):
+    return sum(1 for a, b in zip(indices, indices[1:]) if a != b)
+
+
+def noisy_boundary(boundary_raw, frames, seed, amplitude=2):
+    """Potenziometro fermo su un bordo: valore grezzo con rumore di ±amplitude passi"""
+    rnd = random.Random(seed)
+    return [max(0, min(255, boundary_raw + rnd.randint(-amplitude, amplitude))) for _ in range(frames)]
+
+
+def noisy_sweep(frames, seed, amplitude=2):
+    """Rotazione lenta da 0 a 255 con rumore: ogni bordo viene attraversato una sola volta"""
+    rnd = random.Random(seed)
+    return [max(0, min(255, round(i * 255 / (frames - 1)) + rnd.randint(-amplitude, amplitude)))
+            for i in range(frames)]
+
+
+def run_filter(raw3, raw4=None):
+    """Passa i valori grezzi di pot3 (e pot4) nel filtro, un pacchetto alla volta"""
+    raw4 = raw4 or raw3
+    filters = SignalFilter()
+    genres, patterns, times = [], [], []
+    for i, (a, b) in enumerate(zip(raw3, raw4)):
+        t = i * FRAME_PERIOD
+        filters.process({'pot1': 0.5, 'pot2': 0.5, 'pot3': NORM[a], 'pot4': NORM[b]}, t)
+        genres.append(filters.outputs['genre_idx'])
+        patterns.append(filters.outputs['pattern_idx'])
+        times.append(t)
+    return genres, patterns, times
+
+
+def check(name, condition):
+    print(f"  {'OK ' if condition else 'ERR'} {name}")
+    return condition
+
+
+def test_boundaries():
+    ok = True
+    print("\n--- Rumore sul bordo tra due intervalli ---")
+    # Valori grezzi sul bordo di ogni genere (int(v * 6.99)) e pattern (int(v * 3.99))
+    genre_edges = [round(k / 6.99 * 255) for k in range(1, 7)]
+    pattern_edges = [round(k / 3.99 * 255) for k in range(1, 4)]
+    for name, edges, legacy, key in (("genere", genre_edges, legacy_genre, 0),
+                                     ("pattern", pattern_edges, legacy_pattern, 1)):
+        legacy_flaps = 0
+        filtered_flaps = 0
+        filtered_changes = 0
+        for n, edge in enumerate(edges):
+            raw = noisy_boundary(edge, 3000, seed=100 + n)
+            times = [i * FRAME_PERIOD for i in range(len(raw))]
+            legacy_flaps += count_flaps([legacy(NORM[v]) for v in raw], times)
+            filtered = run_filter(raw)[key]
+            filtered_flaps += count_flaps(filtered, times)
+            filtered_changes += count_changes(filtered)
+        print(f"      {name}: salti avanti-indietro {legacy_flaps} (mappatura storica) -> {filtered_flaps}")
+        ok &= check(f"Il rumore fa saltare il {name} con la mappatura storica", legacy_flaps > 100)
+        ok &= check(f"Nessun salto del {name} con l'isteresi", filtered_flaps == 0 and filtered_changes == 0)
+    return ok
+
+
+def test_sweep():
+    ok = True
+    print("\n--- Rotazione lenta con rumore ---")
+    raw = noisy_sweep(6000, seed=7)
+    genres, patterns, times = run_filter(raw)
+    legacy = [legacy_genre(NORM[v]) for v in raw]
+    print(f"      cambi di genere: {count_changes(legacy)} (storica) -> {count_changes(genres)} (minimo 6)")
+    ok &= check("Genere: un solo cambio per bordo attraversato", count_changes(genres) == 6)
+    ok &= check("Pattern: un solo cambio per bordo attraversato", count_changes(patterns) == 3)
+    ok &= check("Tutti gli intervalli raggiunti", genres[-1] == 6 and patterns[-1] == 3 and genres[0] == 0)
+    return ok
+
+
+def test_step_response():
+    ok = True
+    print("\n--- Risposta a un movimento deciso ---")
+    raw = [10] * 50 + [200] * 50
+    genres, patterns, times = run_filter(raw)
+    delay = next(i for i in range(50, 100) if genres[i] == legacy_genre(NORM[200])) - 50
+    ok &= check(f"Nuovo genere al primo pacchetto (ritardo {delay})", delay == 0)
+    ok &= check("Nessun genere intermedio (un solo riavvio)", count_changes(genres) == 1)
+    return ok
+
+
+def test_stages():
+    ok = True
+    print("\n--- Filtri elementari ---")
+    band = Deadband(0.05)
+    outputs = [band(x, 0) for x in (0.50, 0.52, 0.48, 0.54, 0.56, 0.52)]
+    ok &= check("Deadband: fermo dentro la banda, segue fuori", outputs == [0.50, 0.50, 0.50, 0.50, 0.56, 0.56])
+
+    slew = Slew(rate=1.0)
+    slew(0.0, 0.0)
+    ok &= check("Slew: massimo 0.1 in 100 ms", abs(slew(1.0, 0.1) - 0.1) < 1e-9)
+    ok &= check("Slew: raggiunge il valore", abs(slew(1.0, 2.0) - 1.0) < 1e-9)
+
+    rnd = random.Random(3)
+    noise = [0.5 + rnd.uniform(-0.02, 0.02) for _ in range(500)]
+    euro = OneEuro(min_cutoff=0.5, beta=1.0)
+    smoothed = [euro(x, i * FRAME_PERIOD) for i, x in enumerate(noise)]
+    spread = max(smoothed[100:]) - min(smoothed[100:])
+    ok &= check(f"One-euro: rumore da fermo ridotto (±0.02 -> {spread:.4f})", spread < 0.01)
+    euro_fast = [euro(1.0, (500 + i) * FRAME_PERIOD) for i in range(10)]
+    ok &= check("One-euro: segue un movimento veloce in 10 pacchetti", euro_fast[-1] > 0.95)
+
+    gate = Gate(0.05)
+    outputs = [(gate(x, 0), gate.opened) for x in (0.50, 0.52, 0.54, 0.56)]
+    ok &= check("Gate: valore sempre aggiornato, segnalato solo oltre la soglia",
+                outputs == [(0.50, True), (0.52, False), (0.54, False), (0.56, True)])
+
+    ema = Ema(0.5)
+    ok &= check("EMA: primo campione invariato", ema(0.3, 0) == 0.3 and ema(0.5, 0) == 0.4)
+
+    filters = SignalFilter()
+    filters.process({'speed': 10.0})
+    changed = filters.process({'speed': 10.4})
+    ok &= check("Velocità: variazioni < 0.5 km/h ignorate", not changed and filters.outputs['speed'] == 10.0)
+    return ok
+
+
+def test_slow_adjustment():
+    ok = True
+    print("\n--- Regolazione lenta del BPM fino al MusicEngine ---")
+    logger.configure('ERROR')
+    arduino = ArduinoReader(protocol='v1')
+    music = MusicEngine(port=9)
+    control = ControlLoop(arduino, GPSReader(), music, SensorEvents())
+    t = 0.0
+    music.clock = lambda: t
+    sent = []
+    # pot2 da 128 a 134 (+2.8 BPM) in 3 secondi, poi fermo: sotto la vecchia banda morta del 5%
+    for raw in [128] * 100 + [128 + i * 6 // 300 for i in range(300)] + [134] * 300:
+        arduino._on_data(bytes((0xFF, 128, raw, 0, 0)), t)
+        control.step({})
+        music.flush_pending_bpm()
+        bpm = music.sent_values.get('/carretto/bpm')
+        if bpm is not None and bpm != (sent[-1] if sent else None):
+            sent.append(bpm)
+        t += FRAME_PERIOD
+    target = round(60 + 134 / 255 * 120)
+    print(f"      BPM inviati: {sent}")
+    ok &= check(f"Il BPM arriva a {target} a passi di 1", sent[-1] == target
+                and all(b - a == 1.0 for a, b in zip(sent, sent[1:])))
+    sent_before = music.stats["sent"]
+    control.step({}, force=True)
+    ok &= check("Aggiornamento forzato: posizione vera della manopola",
+                abs(music.current_values['bpm'] - (60 + 134 / 255 * 120)) < 0.05)
+    ok &= check("Aggiornamento forzato: stato reinviato anche a valori fermi",
+                music.stats["sent"] == sent_before + 1)
+    music.client.close()
+    return ok
+
+
+def rmc(knots, status='A'):
+    body = f"GPRMC,123519.00,{status},4154.1680,N,01229.7840,E,{knots:.2f},87.5,150625,,,A".encode()
+    return b'$%s*%02X\r\n' % (body, nmea_checksum(body, 0, len(body)))
+
+
+def test_fix_lost():
+    ok = True
+    print("\n--- Perdita del fix GPS fino al MusicEngine ---")
+    logger.configure('ERROR')
+    arduino = ArduinoReader(protocol='v1')
+    gps = GPSReader()
+    coupled = Mapping({'bpm': {'sum': [{'source': 'pot2', 'curve': 'linear', 'points': [[0, 60], [1, 120]]},
+                                       {'source': 'speed', 'curve': 'linear', 'points': [[0, 0], [20, 60]]}],
+                               'clip': [60, 180]}})
+    music = MusicEngine(port=9, mapping=coupled)
+    control = ControlLoop(arduino, gps, music, SensorEvents())
+    t = 0.0
+
+    def run(raw, frames, sentence=None):
+        nonlocal t
+        if sentence:
+            gps._on_data(sentence, t)
+        for _ in range(frames):
+            arduino._on_data(bytes((0xFF, 128, raw, 0, 0)), t)
+            control.step({})
+            t += FRAME_PERIOD
+        return music.current_values['bpm']
+
+    moving = run(128, 100, rmc(10.0))
+    ok &= check(f"Con il fix: pot2 + velocità ({moving:.1f} BPM)", moving > 140)
+    held = run(128, 10, rmc(10.0, status='V'))
+    ok &= check(f"Fix perso: solo pot2 ({held:.1f} BPM)", abs(held - (60 + 128 / 255 * 60)) < 0.5)
+    moved = run(5, 200)
+    ok &= check(f"Pot spostato senza fix: nessuna velocità rimasta ({moved:.1f} BPM)",
+                abs(moved - (60 + 5 / 255 * 60)) < 0.5)
+    music.client.close()
+    return ok
+
+
+def check_session(path):
+    """Sessione registrata: nessun salto avanti-indietro con il filtro"""
+    print(f"\n--- Sessione {path} ---")
+    decoder = PacketDecoder()
+    raw3, raw4, times = [], [], []
+    for timestamp, source, data in read_session(path):
+        if source != SOURCE_ARDUINO:
+            continue
+        if decoder.feed(data):
+            raw3.append(decoder.latest[2])
+            raw4.append(decoder.latest[3])
+            times.append(timestamp)
+    if not raw3:
+        print("      nessun pacchetto Arduino nella sessione")
+        return True
+    filters = SignalFilter()
+    genres, patterns = [], []
+    for a, b, t in zip(raw3, raw4, times):
+        filters.process({'pot3': NORM[a], 'pot4': NORM[b]}, t)
+        genres.append(filters.outputs['genre_idx'])
+        patterns.append(filters.outputs['pattern_idx'])
+    legacy = count_flaps([legacy_genre(NORM[v]) for v in raw3], times) + \
+        count_flaps([legacy_pattern(NORM[v]) for v in raw4], times)
+    filtered = count_flaps(genres, times) + count_flaps(patterns, times)
+    print(f"      {len(raw3)} pacchetti, salti avanti-indietro: {legacy} (storica) -> {filtered}")
+    return check("Nessun salto di genere/pattern nella sessione", filtered == 0)
+
+
+def main():
+    print("=== TEST SIGNAL FILTER ===")
+    ok = test_boundaries()
+    ok &= test_sweep()
+    ok &= test_step_response()
+    ok &= test_stages()
+    ok &= test_slow_adjustment()
+    ok &= test_fix_lost()
+    for path in sys.argv[1:]:
+        ok &= check_session(path)
+    print(f"\n{'TUTTI I TEST SUPERATI' if ok else 'ALCUNI TEST FALLITI'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
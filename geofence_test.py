@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Test delle zone geografiche (modules/geofence.py)
+
+Zone GeoJSON costruite a mano attorno a un punto di Roma: appartenenza con buchi e
+MultiPolygon, priorità tra zone annidate, isteresi ai confini, confronto della
+griglia con la ricerca lineare su zone casuali, limiti applicati dal MusicEngine
+e tolti alla perdita del fix.
+
+Uso:
+    python geofence_test.py
+"""
+
+import json
+import math
+import os
+import random
+import tempfile
+from modules import logger
+from modules.geofence import Geofence, load_zones
+from modules.music_engine import MusicEngine
+
+LAT0, LON0 = 41.9028, 12.4964
+M_LAT = 1.0 / 111195.0
+M_LON = M_LAT / math.cos(math.radians(LAT0))
+
+
+def at(x, y):
+    """(lat, lon) a x metri verso est e y verso nord dal centro"""
+    return LAT0 + y * M_LAT, LON0 + x * M_LON
+
+
+def square(x0, y0, x1, y1):
+    """Anello GeoJSON chiuso [lon, lat] di un rettangolo in metri"""
+    corners = [(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)]
+    return [[LON0 + x * M_LON, LAT0 + y * M_LAT] for x, y in corners]
+
+
+def feature(properties, *rings, multi=None):
+    if multi:
+        geometry = {'type': 'MultiPolygon', 'coordinates': multi}
+    else:
+        geometry = {'type': 'Polygon', 'coordinates': list(rings)}
+    return {'type': 'Feature', 'properties': properties, 'geometry': geometry}
+
+
+# Piazza 200x200 m con un cortile escluso, un locale annidato con priorità più alta,
+# una via adiacente alla piazza e una zona in due pezzi separati
+ZONES = {'type': 'FeatureCollection', 'features': [
+    feature({'name': 'piazza', 'genre': 'reggae', 'bpm': [80, 100], 'volume_max': 0.6},
+            square(0, 0, 200, 200), square(150, 150, 190, 190)),
+    feature({'name': 'locale', 'genre': 'house', 'priority': 1}, square(20, 20, 60, 60)),
+    feature({'name': 'via', 'genre': 'techno', 'bpm': [125, 135]}, square(200, 0, 400, 40)),
+    feature({'name': 'mercati', 'genre': 'dub'},
+            multi=[[square(-500, -500, -400, -400)], [square(500, 500, 600, 600)]]),
+    {'type': 'Feature', 'properties': {}, 'geometry': {'type': 'Point', 'coordinates': [LON0, LAT0]}}
+]}
+
+
+def check(name, condition):
+    print(f"  {'OK ' if condition else 'ERR'} {name}")
+    return condition
+
+
+def name(zone):
+    return zone.name if zone else None
+
+
+def test_locate():
+    ok = True
+    print("\n--- Appartenenza e priorità ---")
+    fence = Geofence(ZONES)
+    ok &= check("feature non poligonali ignorate", len(fence.zones) == 4)
+    cases = [((100, 100), 'piazza'), ((170, 170), None), ((40, 40), 'locale'), ((300, 20), 'via'),
+             ((-450, -450), 'mercati'), ((550, 550), 'mercati'), ((0, 300), None)]
+    for (x, y), expected in cases:
+        ok &= check(f"({x}, {y}) m -> {expected}", name(fence.locate(*at(x, y))) == expected)
+    for bad in ({'name': 'x', 'genre': 'polka'}, {'name': 'x', 'bpm': [120, 90]}):
+        try:
+            Geofence([feature(bad, square(0, 0, 10, 10))])
+            ok &= check(f"proprietà non valide rifiutate {bad}", False)
+        except ValueError:
+            ok &= check(f"proprietà non valide rifiutate {bad}", True)
+    return ok
+
+
+def test_hysteresis():
+    ok = True
+    print("\n--- Isteresi ai confini ---")
+    fence = Geofence(ZONES, margin=15.0)
+
+    def walk(points):
+        return [name(fence.update(*at(x, y))) for x, y in points]
+
+    # Jitter di +/- 8 m sul bordo est della piazza (verso la via, a nord della via)
+    ok &= check("ingresso immediato", walk([(190, 100)]) == ['piazza'])
+    ok &= check("jitter sul bordo: nessun cambio", walk([(208, 100), (195, 100), (207, 100)] * 3)
+                == ['piazza'] * 9)
+    ok &= check("oltre il margine: fuori", walk([(216, 100)]) == [None])
+    ok &= check("rientro immediato", walk([(199, 100)]) == ['piazza'])
+
+    # Piazza -> via (adiacenti, stessa priorità): la via vince solo oltre il margine
+    ok &= check("via entro il margine: resta la piazza", walk([(210, 20)]) == ['piazza'])
+    ok &= check("via oltre il margine", walk([(220, 20)]) == ['via'])
+    ok &= check("ritorno verso la piazza: resta la via", walk([(190, 20)]) == ['via'])
+    ok &= check("piazza oltre il margine", walk([(180, 20)]) == ['piazza'])
+
+    # Locale annidato con priorità più alta: ingresso al bordo, uscita oltre il margine
+    ok &= check("locale: ingresso immediato", walk([(59, 40)]) == ['locale'])
+    ok &= check("locale: resta entro il margine", walk([(70, 40)]) == ['locale'])
+    ok &= check("locale: uscita verso la piazza", walk([(80, 40)]) == ['piazza'])
+    stats = fence.get_stats()
+    ok &= check(f"statistiche ({stats['changes']} cambi, {stats['held']} trattenuti)",
+                stats['changes'] == 7 and stats['held'] == 9)
+    return ok
+
+
+def test_grid():
+    ok = True
+    print("\n--- Griglia contro ricerca lineare ---")
+    rng = random.Random(7)
+    features = []
+    for i in range(500):
+        cx, cy = rng.uniform(-2000, 2000), rng.uniform(-2000, 2000)
+        radius = rng.uniform(20, 200)
+        vertices = rng.randint(5, 16)
+        ring = []
+        for k in range(vertices):
+            angle = 2 * math.pi * k / vertices
+            r = radius * rng.uniform(0.5, 1.0)
+            ring.append([LON0 + (cx + r * math.cos(angle)) * M_LON, LAT0 + (cy + r * math.sin(angle)) * M_LAT])
+        features.append(feature({'name': f"z{i}", 'priority': rng.randint(0, 2)}, ring + [ring[0]]))
+    features.append(feature({'name': 'citta'}, square(-3000, -3000, 3000, 3000)))
+    for cell_size in (None, 25.0):
+        fence = Geofence(features, cell_size=cell_size)
+        mismatches = 0
+        for _ in range(3000):
+            x, y = fence.project(*at(rng.uniform(-2500, 2500), rng.uniform(-2500, 2500)))
+            best = None
+            for zone in fence.zones:
+                if zone.contains(x, y) and (best is None or zone.rank > best.rank):
+                    best = zone
+            lat = fence.lat0 + y / fence.ky
+            lon = fence.lon0 + x / fence.kx
+            mismatches += best is not fence.locate(lat, lon)
+        ok &= check(f"celle da {fence.cell_size:.0f} m ({len(fence.cells)} celle, "
+                    f"{len(fence.large)} zone grandi): {mismatches} differenze", mismatches == 0)
+    return ok
+
+
+def test_engine():
+    ok = True
+    print("\n--- Limiti della zona nel MusicEngine ---")
+    path = os.path.join(tempfile.mkdtemp(), "zone.geojson")
+    with open(path, 'w') as f:
+        json.dump(ZONES, f)
+    music = MusicEngine(port=9, zones=Geofence(load_zones(path)))
+    pots = {'pot1': 0.9, 'pot2': 1.0, 'pot3': 0.0, 'pot4': 0.0}
+    values = music.current_values
+
+    music.update(pots, {'speed': 5.0})
+    ok &= check("senza posizione: solo potenziometri",
+                values['pattern'] == 'dub' and values['bpm'] == 180.0 and abs(values['volume'] - 0.9) < 0.01)
+    music.update(pots, {'speed': 5.0, 'lat': at(100, 100)[0], 'lon': at(100, 100)[1]})
+    ok &= check(f"piazza: genere, BPM e volume limitati ({values['pattern']}, {values['bpm']}, {values['volume']})",
+                values['pattern'] == 'reggae' and values['bpm'] == 100.0 and values['volume'] == 0.6)
+    music.update({'pot1': 0.3}, {'lat': at(100, 110)[0], 'lon': at(100, 110)[1]})
+    ok &= check("pot sotto il limite: valore del pot", abs(values['volume'] - 0.3) < 0.01 and values['bpm'] == 100.0)
+    lat, lon = at(300, 20)
+    music.update({}, {'lat': lat, 'lon': lon})
+    ok &= check(f"via: limiti nuovi anche a pot fermi ({values['pattern']}, {values['bpm']}, {values['volume']:.2f})",
+                values['pattern'] == 'techno' and values['bpm'] == 135.0 and abs(values['volume'] - 0.3) < 0.01)
+    lat, lon = at(0, 1000)
+    music.update({}, {'lat': lat, 'lon': lon})
+    ok &= check("fuori dalle zone: tornano i valori dei pot",
+                values['pattern'] == 'dub' and values['bpm'] == 180.0)
+    ok &= check("statistiche nel motore", music.get_metrics()['zones']['changes'] == 3)
+    lat, lon = at(100, 100)
+    music.update({}, {'speed': 5.0, 'lat': lat, 'lon': lon})
+    music.update({}, {'speed': None, 'lat': None, 'lon': None})
+    ok &= check(f"fix perso: nessuna zona, valori dei pot ({values['pattern']}, {values['bpm']})",
+                music.zone is None and values['pattern'] == 'dub' and values['bpm'] == 180.0)
+    music.update({}, {'speed': 5.0, 'lat': lat, 'lon': lon})
+    ok &= check("fix di nuovo valido: zona ripristinata", values['pattern'] == 'reggae' and values['bpm'] == 100.0)
+    music.client.close()
+    os.unlink(path)
+    return ok
+
+
+def main():
+    print("=== TEST ZONE GEOGRAFICHE ===")
+    logger.configure('ERROR')
+    ok = test_locate()
+    ok &= test_hysteresis()
+    ok &= test_grid()
+    ok &= test_engine()
+    print(f"\n{'TUTTI I TEST SUPERATI' if ok else 'ALCUNI TEST FALLITI'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Test del parser NMEA a flusso (modules/gps_reader.py)
+
+Frasi costruite con checksum corretto: risincronizzazione dopo una frase
+troncata (apertura della porta, riconnessione, '\\n' perso), frasi spezzate tra
+blocchi, perdita e ritorno del fix con RMC, VTG e GGA.
+
+Uso:
+    python gps_test.py
+"""
+
+from modules.gps_reader import NmeaParser, nmea_checksum, KNOTS_TO_KMH
+
+
+def nmea(body):
+    data = body.encode()
+    return b'$%s*%02X\r\n' % (data, nmea_checksum(data, 0, len(data)))
+
+
+def rmc(knots, status='A'):
+    return nmea(f"GPRMC,123519.00,{status},4154.1680,N,01229.7840,E,{knots:.2f},87.5,150625,,,A")
+
+
+def vtg(kmh, mode='A'):
+    return nmea(f"GPVTG,87.5,T,,M,{kmh / KNOTS_TO_KMH:.2f},N,{kmh:.2f},K,{mode}")
+
+
+def gga(quality):
+    return nmea(f"GPGGA,123519.00,4154.1680,N,01229.7840,E,{quality},08,0.9,42.0,M,47.0,M,,")
+
+
+def check(name, condition):
+    print(f"  {'OK ' if condition else 'ERR'} {name}")
+    return condition
+
+
+def test_truncated():
+    ok = True
+    print("\n--- Frasi troncate ---")
+    parser = NmeaParser()
+    decoded = parser.feed(b'$GPRMC,1235' + rmc(10.0))
+    ok &= check("troncata + valida nello stesso blocco", decoded == 1 and abs(parser.speed - 18.52) < 1e-6)
+    ok &= check("nessun errore di checksum, una troncata",
+                parser.checksum_errors == 0 and parser.get_stats()['truncated'] == 1)
+
+    parser = NmeaParser()
+    parser.feed(b'$GPVTG,87.5,T,,M,5.')
+    decoded = parser.feed(rmc(20.0)[:30])
+    decoded += parser.feed(rmc(20.0)[30:])
+    ok &= check("troncata e valida spezzate tra blocchi", decoded == 1 and abs(parser.speed - 20.0 * KNOTS_TO_KMH) < 1e-6)
+
+    parser = NmeaParser()
+    stream = rmc(1.0) + rmc(2.0).replace(b'\r\n', b'') + rmc(3.0) + vtg(9.0)
+    decoded = parser.feed(stream)
+    ok &= check("'\\n' perso: solo la frase senza terminatore va persa",
+                decoded == 3 and abs(parser.speed - 9.0) < 1e-6 and parser.checksum_errors == 0)
+    return ok
+
+
+def test_fix_lost():
+    ok = True
+    print("\n--- Perdita del fix ---")
+    parser = NmeaParser()
+    parser.feed(rmc(10.0) + gga(1))
+    ok &= check("fix valido: velocità e posizione", parser.valid and parser.speed is not None
+                and abs(parser.lat - 41.9028) < 1e-6 and abs(parser.lon - 12.4964) < 1e-6)
+    parser.feed(rmc(10.0, status='V'))
+    ok &= check("RMC 'V': velocità e posizione azzerate",
+                not parser.valid and parser.speed is None and parser.lat is None and parser.lon is None)
+    parser.feed(rmc(10.0))
+    ok &= check("RMC 'A': valori di nuovo presenti", parser.speed is not None and parser.lat is not None)
+
+    parser.feed(vtg(12.0, mode='N'))
+    ok &= check("VTG modo 'N': velocità azzerata", parser.speed is None)
+    parser.feed(vtg(12.0))
+    ok &= check("VTG valida: velocità", abs(parser.speed - 12.0) < 1e-6)
+    parser.feed(nmea("GPVTG,87.5,T,,M,6.00,N,11.11,K"))
+    ok &= check("VTG senza modo (NMEA < 2.3): velocità", abs(parser.speed - 11.11) < 1e-6)
+
+    parser.feed(gga(0))
+    ok &= check("GGA qualità 0: posizione azzerata",
+                parser.fix_quality == 0 and parser.lat is None and parser.lon is None)
+    return ok
+
+
+def main():
+    print("=== TEST PARSER NMEA ===")
+    ok = test_truncated()
+    ok &= test_fix_lost()
+    print(f"\n{'TUTTI I TEST SUPERATI' if ok else 'ALCUNI TEST FALLITI'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Test del heartbeat verso sclang con un sclang finto
+
+Il finto sclang è un socket UDP che risponde a /carretto/hb come l'OSCdef di
+carretto_music.scd e registra tutto ciò che riceve. Si verificano: RTT misurato,
+nessun /test o /carretto/ping inviato, rilevamento di sclang assente e riavviato,
+reinvio automatico dello stato completo.
+
+Uso:
+    python heartbeat_test.py
+"""
+
+import socket
+import threading
+import time
+from pythonosc import osc_message_builder
+from pythonosc.osc_packet import OscPacket
+from modules import logger
+from modules.music_engine import MusicEngine
+
+
+class FakeSclang:
+    def __init__(self):
+        """Sclang finto su una porta locale libera"""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.05)
+        self.port = self.sock.getsockname()[1]
+        self.session = 1
+        self.replying = True
+        self.received = []      # indirizzi OSC ricevuti
+        self.states = 0         # messaggi /carretto/state ricevuti
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            for timed in OscPacket(data).messages:
+                message = timed.message
+                self.received.append(message.address)
+                if message.address == "/carretto/state":
+                    self.states += 1
+                elif message.address == "/carretto/hb" and self.replying:
+                    reply = osc_message_builder.OscMessageBuilder(address="/carretto/hb/reply")
+                    reply.add_arg(message.params[0])
+                    reply.add_arg(self.session)
+                    self.sock.sendto(reply.build().dgram, addr)
+
+    def close(self):
+        self.running = False
+        self.thread.join(timeout=1.0)
+        self.sock.close()
+
+
+def wait_for(condition, timeout=2.0):
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def check(name, condition):
+    print(f"  {'OK ' if condition else 'ERR'} {name}")
+    return condition
+
+
+def main():
+    print("=== TEST HEARTBEAT ===")
+    logger.configure('ERROR')
+    ok = True
+    sclang = FakeSclang()
+    music = MusicEngine(port=sclang.port, heartbeat_interval=0.05)
+    heartbeat = music.heartbeat
+    target = music.client.targets[0]
+    music.start()
+    try:
+        print("\n--- Sclang presente ---")
+        ok &= check("Prima risposta ricevuta", wait_for(lambda: heartbeat.alive))
+        wait_for(lambda: heartbeat.stats["replies"] >= 10)
+        rtt = target.rtt.summary()
+        print(f"      RTT p50 {rtt['p50_ms']:.3f} ms, max {rtt['max_ms']:.3f} ms su {rtt['count']} risposte")
+        ok &= check("RTT misurato", rtt['count'] >= 10 and rtt['p50_ms'] < 50)
+        ok &= check("Stato completo inviato al primo contatto", heartbeat.stats["resyncs"] == 1
+                    and sclang.states >= 2)
+        ok &= check("Nessun /test né /carretto/ping",
+                    "/test" not in sclang.received and "/carretto/ping" not in sclang.received)
+
+        print("\n--- Sclang assente ---")
+        sclang.replying = False
+        ok &= check("Assenza rilevata entro il timeout", wait_for(lambda: not heartbeat.alive, timeout=1.0))
+
+        print("\n--- Sclang ritorna (stessa sessione) ---")
+        states = sclang.states
+        sclang.replying = True
+        ok &= check("Ritorno rilevato", wait_for(lambda: heartbeat.alive))
+        ok &= check("Stato reinviato al ritorno", wait_for(lambda: sclang.states > states))
+
+        print("\n--- Sclang riavviato senza pause (nuova sessione) ---")
+        states = sclang.states
+        sclang.session = 2
+        ok &= check("Riavvio rilevato", wait_for(lambda: heartbeat.stats["restarts"] == 1))
+        ok &= check("Stato reinviato dopo il riavvio", wait_for(lambda: sclang.states > states))
+        ok &= check("Sessione aggiornata", target.session == 2 and target.alive)
+
+        print("\n--- Invii normali non toccati dal heartbeat ---")
+        resyncs = heartbeat.stats["resyncs"]
+        time.sleep(0.3)
+        ok &= check("Nessuna risincronizzazione a regime", heartbeat.stats["resyncs"] == resyncs)
+    finally:
+        music.stop()
+        sclang.close()
+
+    print(f"\n{'TUTTI I TEST SUPERATI' if ok else 'ALCUNI TEST FALLITI'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
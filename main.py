@@ -1,4 +1,3 @@
-cat main.py 
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
@@ -11,79 +10,263 @@ Sistema completo di controllo per il carretto musicale.
 Ottimizzato per inviare comandi solo quando i valori cambiano significativamente.
 """
 
-import threading
+import argparse
 import time
 import os
 import sys
-import glob
-from modules.arduino_reader import ArduinoReader
-from modules.gps_reader import GPSReader
-from modules.music_engine import MusicEngine
+import signal
+import getpass
+from modules import logger
+from modules.startup import Startup
+from modules.sensor_events import SensorEvents
+from modules.controller import ControlLoop
+from modules.signal_filter import SignalFilter, load_config
+from modules.session_recorder import SessionRecorder, SessionReplay, SOURCE_ARDUINO, SOURCE_GPS
+from modules.device_registry import DeviceRegistry, DEFAULT_PORTS
+from modules.serial_reactor import SerialReactor
+# Lettori seriali e motore OSC (pyserial, python-osc) vengono importati nei
+# thread di avvio, in parallelo all'apertura dei dispositivi
 
-# Cerca automaticamente le porte seriali disponibili
-def find_serial_ports():
-    # Trova tutte le porte seriali disponibili
-    ports = glob.glob('/dev/tty[A-Za-z]*')
+# Porte di Arduino e GPS riconosciute per VID/PID/seriale USB (con cache su disco)
+def find_serial_ports(registry, refresh=False):
+    ports = registry.resolve(refresh=refresh)
     
-    arduino_port = None
-    gps_port = None
-    
-    print(f"Porte seriali disponibili: {ports}")
-    
-    # Cerca porta Arduino (Nano) che tipicamente usa 9600 baud
-    for p in ports:
-        if 'ACM' in p or 'USB0' in p:
-            arduino_port = p
-            print(f"Porta Arduino rilevata: {arduino_port}")
-            break
-    
-    # Cerca porta GPS (tipicamente la seconda USB a 9600 baud)
-    for p in ports:
-        if p != arduino_port and ('USB' in p or 'ACM' in p):
-            gps_port = p
-            print(f"Porta GPS rilevata: {gps_port}")
-            break
+    arduino_port = ports.get('arduino')
+    gps_port = ports.get('gps')
     
     # Fallback a valori di default
-    if not arduino_port:
-        arduino_port = '/dev/ttyUSB0'
+    if arduino_port:
+        print(f"Porta Arduino rilevata: {arduino_port}")
+    else:
+        arduino_port = DEFAULT_PORTS['arduino']
         print(f"Nessuna porta Arduino rilevata, usando default: {arduino_port}")
     
-    if not gps_port:
-        gps_port = '/dev/ttyUSB1'
+    if gps_port:
+        print(f"Porta GPS rilevata: {gps_port}")
+    else:
+        gps_port = DEFAULT_PORTS['gps']
         print(f"Nessuna porta GPS rilevata, usando default: {gps_port}")
     
     return arduino_port, gps_port
 
-# Rendi disponibili tutte le informazioni nel log
-print(f"Current Date and Time (UTC): {time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())}")
-print(f"Current User's Login: {os.getlogin()}")
-print(f"Python version: {sys.version}")
-print(f"Working directory: {os.getcwd()}")
+# Porte indicate a mano sulla riga di comando (None = dal registro)
+def port_overrides(args):
+    return {'arduino': args.arduino_port, 'gps': args.gps_port}
 
-def main():
-    print("\n===== CARRETTO MUSICALE v3.1 =====")
-    print("Autore: Michele Pietravalle")
-    print(f"Data: 2025-06-15, Utente: {os.getlogin()}")
-    
-    # Rileva automaticamente le porte seriali
-    arduino_port, gps_port = find_serial_ports()
-    
-    # Inizializzazione dei moduli
-    print("\nInizializzazione moduli...")
+def current_user():
+    # os.getlogin() fallisce senza terminale di controllo (es. servizio systemd)
+    try:
+        return getpass.getuser()
+    except Exception:
+        return 'sconosciuto'
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Carretto musicale - controller principale")
+    parser.add_argument('--latency', action='store_true',
+                        help="Misura la latenza arrivo pacchetto -> invio UDP e stampa p50/p99")
+    parser.add_argument('--keyframe', type=float, default=0,
+                        help="Secondi tra due reinvii completi dello stato OSC (0 = disattivato)")
+    parser.add_argument('--target', action='append', default=[], metavar='HOST:PORTA',
+                        help="Destinazione OSC (ripetibile per più nodi; default 127.0.0.1:57120)")
+    parser.add_argument('--heartbeat', type=float, default=1.0, metavar='SECONDI',
+                        help="Intervallo del heartbeat verso sclang (0 = disattivato)")
+    parser.add_argument('--sequencer', nargs='?', const='127.0.0.1:57110', metavar='HOST:PORTA',
+                        help="Suona i pattern da Python con bundle a timetag diretti a scsynth "
+                             "(default 127.0.0.1:57110) invece dei player di sclang")
+    parser.add_argument('--scsynth-monitor', nargs='?', const='127.0.0.1:57110', metavar='HOST:PORTA',
+                        help="Interroga scsynth con /status (default 127.0.0.1:57110) e riduce il carico "
+                             "quando la CPU resta alta")
+    parser.add_argument('--shedding', metavar='FILE',
+                        help="Politica JSON di riduzione del carico (default: modules/scsynth_monitor.py)")
+    parser.add_argument('--zones', metavar='FILE',
+                        help="Zone geografiche GeoJSON: genere, intervallo di BPM e volume massimo per zona")
+    parser.add_argument('--zone-margin', type=float, default=15.0, metavar='METRI',
+                        help="Isteresi ai confini delle zone in metri (default 15)")
+    parser.add_argument('--record', metavar='FILE',
+                        help="Registra i byte grezzi dei sensori in un file di sessione")
+    parser.add_argument('--replay', metavar='FILE',
+                        help="Riproduce una sessione registrata al posto di Arduino e GPS")
+    parser.add_argument('--replay-speed', type=float, default=1.0, metavar='X',
+                        help="Velocità di riproduzione: 1 = tempo reale, N = N volte, 0 = massima")
+    parser.add_argument('--render', metavar='FILE',
+                        help="Con --replay: rende la sessione offline in un file NRT per scsynth -N "
+                             "(FILE.osc), con lo script sclang FILE.scd che scrive le SynthDef e lo avvia")
+    parser.add_argument('--acquisition-process', action='store_true',
+                        help="Legge Arduino e GPS in un processo separato (stato in memoria condivisa, "
+                             "riavviato se termina o si blocca)")
+    parser.add_argument('--protocol', choices=('auto', 'v1', 'v2'), default='auto',
+                        help="Formato dei pacchetti Arduino (default: riconosciuto automaticamente)")
+    parser.add_argument('--filters', metavar='FILE',
+                        help="Configurazione JSON dei filtri per canale (default: modules/signal_filter.py)")
+    parser.add_argument('--mapping', metavar='FILE',
+                        help="Mappatura JSON ingressi -> parametri musicali (default: modules/mapping.py)")
+    parser.add_argument('--metrics', metavar='INDIRIZZO',
+                        help="Espone le metriche Prometheus su host:porta (es. 127.0.0.1:9108) o unix:/percorso")
+    parser.add_argument('--rescan-devices', action='store_true',
+                        help="Ignora la cache dei dispositivi USB e ripete la scansione")
+    parser.add_argument('--arduino-port', metavar='PORTA',
+                        help="Porta dell'Arduino (es. /dev/ttyUSB1): fissata nella cache dei dispositivi, "
+                             "la segue anche se cambia nome")
+    parser.add_argument('--gps-port', metavar='PORTA',
+                        help="Porta del GPS, fissata come --arduino-port")
+    parser.add_argument('--log-level', default='INFO',
+                        help="Livello di log predefinito (DEBUG, INFO, WARNING, ERROR)")
+    parser.add_argument('--log', action='append', default=[], metavar='MODULO=LIVELLO',
+                        help="Livello per un singolo modulo, es. --log arduino=DEBUG (ripetibile)")
+    parser.add_argument('--log-ring', type=int, default=0, metavar='N',
+                        help="Conserva gli ultimi N eventi in un ring buffer binario (SIGUSR1 per scaricarlo)")
+    return parser.parse_args()
+
+def setup_logging(args):
+    module_levels = dict(item.split('=', 1) for item in args.log)
+    ring = logger.configure(args.log_level, module_levels, ring_size=args.log_ring)
     
-    arduino = ArduinoReader(arduino_port, baudrate=9600)
+    # Scarica il ring buffer su stderr a richiesta: kill -USR1 <pid>
+    if ring and hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: ring.dump(sys.stderr))
+
+def open_arduino(args, events, recorder, replay, ports, registry, reactor):
+    from modules.arduino_reader import ArduinoReader
+    if replay:
+        arduino = ArduinoReader(events=events, serial_port=replay.serial_for(SOURCE_ARDUINO),
+                                recorder=recorder, protocol=args.protocol)
+    else:
+        arduino = ArduinoReader(ports[0], baudrate=9600, events=events, recorder=recorder,
+                                registry=registry, reactor=reactor, protocol=args.protocol)
     arduino.start()
     print("✓ Arduino Reader avviato")
+    return arduino
 
-    gps = GPSReader(gps_port)
+def open_gps(args, events, recorder, replay, ports, registry, reactor):
+    from modules.gps_reader import GPSReader
+    if replay:
+        gps = GPSReader(events=events, serial_port=replay.serial_for(SOURCE_GPS), recorder=recorder)
+    else:
+        gps = GPSReader(ports[1], baudrate=9600, events=events, recorder=recorder, registry=registry,
+                        reactor=reactor)
     gps.start()
     print("✓ GPS Reader avviato")
+    return gps
 
+def open_music(args):
+    from modules.music_engine import MusicEngine
+    from modules.osc_fanout import parse_target
+    from modules.mapping import Mapping, load_mapping
+    mapping = Mapping(load_mapping(args.mapping)) if args.mapping else None
+    sequencer = None
+    if args.sequencer:
+        from modules.sequencer import Sequencer, SCSYNTH_PORT
+        sequencer = Sequencer(*parse_target(args.sequencer, default_port=SCSYNTH_PORT))
+    monitor = None
+    if args.scsynth_monitor:
+        from modules.scsynth_monitor import ServerMonitor, SCSYNTH_PORT, load_policy
+        monitor = ServerMonitor(*parse_target(args.scsynth_monitor, default_port=SCSYNTH_PORT),
+                                policy=load_policy(args.shedding) if args.shedding else None)
+    zones = None
+    if args.zones:
+        from modules.geofence import Geofence, load_zones
+        zones = Geofence(load_zones(args.zones), margin=args.zone_margin)
+        print(f"✓ {len(zones.zones)} zone geografiche caricate")
     # Usa direttamente la porta 57120 per SuperCollider
-    music = MusicEngine(host="127.0.0.1", port=57120)
+    # Invio asincrono: update() accoda e ritorna subito, un thread dedicato spedisce
+    music = MusicEngine(host="127.0.0.1", port=57120, keyframe_interval=args.keyframe or None,
+                        async_send=True, heartbeat_interval=args.heartbeat or None,
+                        targets=[parse_target(target) for target in args.target] or None,
+                        sequencer=sequencer, mapping=mapping, monitor=monitor, zones=zones)
     music.start()
     print("✓ Music Engine avviato")
+    return music
+
+def render_offline(args):
+    """Sessione registrata -> score NRT, su orologio virtuale e senza hardware né audio"""
+    from modules.offline_render import OfflineRender
+    from modules.mapping import Mapping, load_mapping
+    if not args.replay:
+        print("--render richiede --replay SESSIONE")
+        return 1
+    base = os.path.splitext(args.render)[0]
+    zones = None
+    if args.zones:
+        from modules.geofence import Geofence, load_zones
+        zones = Geofence(load_zones(args.zones), margin=args.zone_margin)
+    render = OfflineRender(args.replay, protocol=args.protocol,
+                           filters=SignalFilter(load_config(args.filters)) if args.filters else None,
+                           mapping=Mapping(load_mapping(args.mapping)) if args.mapping else None,
+                           zones=zones)
+    stats = render.run()
+    render.write_score(args.render, base + "_synthdefs")
+    render.write_script(base + ".scd", args.render, base + ".wav", base + "_synthdefs")
+    print(f"\n✓ {stats['session_seconds']:.0f} s di sessione in {stats['render_seconds']:.2f} s "
+          f"({stats['speedup']:.0f}x): {stats['notes']} note, {stats['control_messages']} messaggi di controllo")
+    print(f"Score: {args.render}")
+    print(f"Audio: sclang {base}.scd   (poi anche: {render.command_line(args.render, base + '.wav')})")
+    return 0
+
+def main():
+    boot = Startup()
+    args = parse_args()
+    setup_logging(args)
+    
+    if args.render:
+        return render_offline(args)
+    
+    print("\n===== CARRETTO MUSICALE v3.1 =====")
+    print("Autore: Michele Pietravalle")
+    print(f"Data: {time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())} UTC, Utente: {current_user()}")
+    print(f"Python: {sys.version.split()[0]}, directory: {os.getcwd()}")
+    
+    metrics_server = None
+    if args.metrics:
+        from modules.metrics import MetricsServer
+        metrics_server = MetricsServer(args.metrics)
+        metrics_server.start()
+    
+    # Canale eventi condiviso: i lettori pubblicano, il loop di controllo consuma
+    events = SensorEvents()
+    recorder = SessionRecorder(args.record) if args.record and not args.acquisition_process else None
+    
+    # Inizializzazione dei moduli: motore OSC, Arduino e GPS si aprono in parallelo
+    print("\nInizializzazione moduli...")
+    boot.launch('music', open_music, args)
+    
+    replay = registry = ports = reactor = acquisition = None
+    if args.acquisition_process:
+        # Porte, registrazione e riproduzione nel processo di acquisizione
+        from modules.acquisition import AcquisitionProcess
+        acquisition = AcquisitionProcess(events, protocol=args.protocol, record=args.record,
+                                         replay=args.replay, replay_speed=args.replay_speed,
+                                         rescan=args.rescan_devices, port_overrides=port_overrides(args),
+                                         log_level=args.log_level,
+                                         log_levels=dict(item.split('=', 1) for item in args.log))
+        boot.run('acquisition', acquisition.start)
+    elif args.replay:
+        # Sessione registrata al posto dell'hardware
+        replay = SessionReplay(args.replay, speed=args.replay_speed)
+    else:
+        # Porte seriali dal registro dei dispositivi USB
+        registry = DeviceRegistry(overrides=port_overrides(args))
+        ports = boot.run('devices', find_serial_ports, registry, refresh=args.rescan_devices)
+        # Un solo thread di I/O per tutte le porte, con riconnessione non bloccante
+        reactor = SerialReactor()
+        reactor.start()
+    
+    if acquisition:
+        arduino, gps = acquisition.arduino, acquisition.gps
+    else:
+        boot.launch('arduino', open_arduino, args, events, recorder, replay, ports, registry, reactor)
+        boot.launch('gps', open_gps, args, events, recorder, replay, ports, registry, reactor)
+        arduino = boot.result('arduino')
+        gps = boot.result('gps')
+    music = boot.result('music')
+    
+    # Prontezza hardware osservata in sottofondo: il loop parte subito con i valori iniziali
+    boot.watch('arduino_pronto', arduino.ready, timeout=5.0)
+    boot.watch('gps_dati', gps.ready, timeout=30.0)
+    
+    filters = SignalFilter(load_config(args.filters)) if args.filters else None
+    control = ControlLoop(arduino, gps, music, events, measure_latency=args.latency, filters=filters)
+    boot.mark('controllo')
+    boot.report()
 
     print("\nCarretto musicale avviato e pronto!")
     print("Utilizzare i potenziometri per controllare la musica:")
@@ -91,82 +274,27 @@ def main():
     print("- POT2: BPM (60-180)")
     print("- POT3: Genere musicale")
     print("- POT4: Pattern (0-3)")
+    if args.latency:
+        print("\nModalità misura latenza attiva")
     print("\nCtrl+C per uscire.")
     
-    # Valori precedenti per confronto
-    prev_pots = {}
-    prev_gps = {}
-    
-    # Contatore per aggiornamenti forzati periodici
-    force_update_counter = 0
-    
-    # Soglia di cambiamento significativo
-    change_threshold = 0.05  # 5% di cambiamento
-    
-    # Soglia di cambiamento minimo per il genere e il pattern
-    # (questi richiedono una precisione maggiore)
-    genre_pattern_threshold = 0.015  # 1.5% di cambiamento
-    
     try:
-        debug_counter = 0
-        while True:
-            # Leggi i valori attuali
-            pots = arduino.get_values()
-            gps_data = gps.get_data()
-            
-            # Verifica se i valori sono cambiati significativamente
-            values_changed = False
-            
-            # Controlla i potenziometri
-            if pots:
-                for key, value in pots.items():
-                    # Usa una soglia più bassa per pot3 (genere) e pot4 (pattern)
-                    threshold = genre_pattern_threshold if key in ('pot3', 'pot4') else change_threshold
-                    
-                    if (key not in prev_pots or 
-                        abs(value - prev_pots.get(key, 0)) > threshold):
-                        values_changed = True
-                        break
-            
-            # Controlla il GPS
-            if gps_data and 'speed' in gps_data and gps_data['speed'] is not None:
-                if ('speed' not in prev_gps or 
-                    abs(gps_data['speed'] - prev_gps.get('speed', 0)) > 0.5):  # 0.5 km/h di differenza
-                    values_changed = True
-            
-            # Forza un aggiornamento ogni ~10 secondi anche se i valori non cambiano
-            force_update_counter += 1
-            if force_update_counter >= 200:  # 200 * 0.05s = 10s
-                values_changed = True
-                force_update_counter = 0
-                print("[INFO] Aggiornamento forzato periodico")
-            
-            # Aggiorna i moduli solo se i valori sono cambiati
-            if values_changed:
-                music.update(pots, gps_data)
-                
-                # Aggiorna i valori precedenti
-                if pots:
-                    prev_pots = pots.copy()
-                if gps_data:
-                    prev_gps = gps_data.copy()
-                
-                # Debug quando i valori cambiano
-                print(f"[AGGIORNAMENTO] Potenziometri: {pots} | GPS: {gps_data}")
-            
-            # Debug ogni ~30 secondi indipendentemente dai cambiamenti
-            debug_counter += 1
-            if debug_counter >= 600:  # 600 * 0.05s = 30s
-                print(f"[DEBUG] Potenziometri: {pots} | GPS: {gps_data}")
-                debug_counter = 0
-
-            time.sleep(0.05)  # 50ms di attesa
+        control.run()
     except KeyboardInterrupt:
         print("\nArresto in corso...")
+        control.stop()
         arduino.stop()
         gps.stop()
+        if reactor:
+            reactor.stop()
+        if acquisition:
+            acquisition.stop()
         music.stop()
+        if recorder:
+            recorder.close()
+        if metrics_server:
+            metrics_server.stop()
         print("Sistema arrestato correttamente.")
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Test della mappatura ingressi -> parametri musicali (modules/mapping.py)
+
+La mappatura predefinita compilata viene confrontata con le formule storiche
+del MusicEngine su tutti i valori grezzi a 8 e 10 bit e su valori filtrati; poi
+isteresi, curve, accoppiamento velocità -> BPM, configurazione JSON e costo per
+pacchetto.
+
+Uso:
+    python mapping_test.py
+"""
+
+import json
+import os
+import random
+import tempfile
+import time
+from modules import logger
+from modules.mapping import Mapping, GENRES, load_mapping
+from modules.music_engine import MusicEngine
+from modules.signal_filter import Hysteresis
+from modules.snapshot import NORM, NORM10
+
+
+def legacy(pots, speed):
+    """Mappatura inline del MusicEngine prima della mappatura dichiarativa"""
+    result = {}
+    if 'pot1' in pots:
+        result['volume'] = float(pots['pot1'])
+    if 'pot2' in pots:
+        result['bpm'] = 60.0 + (float(pots['pot2']) * 120.0)
+    if 'pot3' in pots:
+        genre_idx = pots['genre_idx'] if 'genre_idx' in pots else min(int(float(pots['pot3']) * 6.99), 6)
+        result['pattern'] = GENRES[genre_idx]
+        result['tune'] = float(pots['pot3'])
+    if 'pot4' in pots:
+        result['patternIdx'] = pots['pattern_idx'] if 'pattern_idx' in pots else min(int(float(pots['pot4']) * 3.99), 3)
+    if speed is not None:
+        result['speed'] = float(speed)
+    return result
+
+
+def close(a, b, tolerance=1e-9):
+    return a.keys() == b.keys() and all(abs(a[k] - b[k]) <= tolerance for k in a)
+
+
+def check(name, condition):
+    print(f"  {'OK ' if condition else 'ERR'} {name}")
+    return condition
+
+
+def test_default_tables():
+    ok = True
+    print("\n--- Mappatura predefinita = formule storiche (valori grezzi a 8 e 10 bit) ---")
+    mapping = Mapping()
+    mismatches = []
+    for value in NORM + NORM10:
+        pots = {'pot1': value, 'pot2': value, 'pot3': value, 'pot4': value}
+        if mapping.apply(pots) != legacy(pots, None):
+            mismatches.append(value)
+    ok &= check(f"volume, BPM, genere, tune, pattern identici ({len(mismatches)} differenze)", not mismatches)
+
+    # Pacchetti v2: valori grezzi vicini danno BPM diversi (una tabella a 256 voci li fondeva)
+    bpms = [mapping.apply({'pot2': NORM10[raw]})['bpm'] for raw in range(500, 504)]
+    ok &= check(f"10 bit: pot2 500-503 -> {len(set(bpms))} BPM distinti", len(set(bpms)) == 4)
+
+    indexed = mapping.apply({'pot3': 0.0, 'genre_idx': 5, 'pot4': 0.0, 'pattern_idx': 3})
+    ok &= check("indici con isteresi dallo stadio di filtro", indexed['pattern'] == 'ambient' and indexed['patternIdx'] == 3)
+
+    speeds = [i * 0.1 for i in range(1000)]
+    worst = max(abs(mapping.apply({'speed': s})['speed'] - s) for s in speeds)
+    ok &= check(f"velocità inoltrata (scarto massimo {worst:.2g} km/h)", worst < 1e-9)
+
+    filtered = [random.random() for _ in range(1000)]
+    worst = max(abs(mapping.apply({'pot2': v})['bpm'] - (60 + v * 120)) for v in filtered)
+    ok &= check(f"valori filtrati: BPM esatto (scarto {worst:.2g})", worst < 1e-9)
+    return ok
+
+
+def test_hysteresis():
+    ok = True
+    print("\n--- Intervalli con isteresi = filtro Hysteresis ---")
+    rnd = random.Random(3)
+    raw = [max(0, min(255, round(i * 255 / 1999) + rnd.randint(-3, 3))) for i in range(2000)]
+    raw += [max(0, min(255, 109 + rnd.randint(-3, 3))) for _ in range(2000)]     # Bordo 3/4 di 7 generi
+    mapping = Mapping({'genre': {'source': 'pot3', 'curve': 'bins', 'bins': 7, 'margin': 0.3}})
+    reference = Hysteresis(7, margin=0.3)
+    ours = [mapping.apply({'pot3': NORM[r]})['genre'] for r in raw]
+    theirs = [reference(NORM[r], 0.0) for r in raw]
+    ok &= check(f"stessa sequenza di indici ({mapping.get_stats()['genre']} cambi)", ours == theirs)
+    plain = Mapping({'genre': {'source': 'pot3', 'curve': 'bins', 'bins': 7}})
+    flaps = sum(1 for a, b in zip(raw[2000:], raw[2001:])
+                if plain.apply({'pot3': NORM[a]}) != plain.apply({'pot3': NORM[b]}))
+    ok &= check(f"senza margine il bordo oscilla ({flaps} salti)", flaps > 0)
+    return ok
+
+
+def test_curves():
+    ok = True
+    print("\n--- Curve e accoppiamento velocità -> BPM ---")
+    mapping = Mapping({'bpm': {'source': 'pot2', 'curve': 'exp', 'min': 60, 'max': 180}})
+    values = [mapping.apply({'pot2': NORM[raw]})['bpm'] for raw in range(256)]
+    ok &= check("exp: estremi 60 e 180", abs(values[0] - 60) < 1e-9 and abs(values[-1] - 180) < 1e-9)
+    ok &= check("exp: crescente, metà corsa alla media geometrica",
+                all(a < b for a, b in zip(values, values[1:])) and abs(values[128] - (60 * 180) ** 0.5) < 0.5)
+    values = [mapping.apply({'pot2': value})['bpm'] for value in NORM10]
+    worst = max(abs(bpm - 60 * 3 ** value) for bpm, value in zip(values, NORM10))
+    ok &= check(f"exp a 10 bit: crescente, scarto dalla curva {worst:.2g}",
+                all(a < b for a, b in zip(values, values[1:])) and worst < 1e-3)
+
+    points = Mapping({'volume': {'source': 'pot1', 'curve': 'linear', 'points': [[0, 0], [0.5, 0.8], [1, 1]]}})
+    ok &= check("spezzata per punti", close(points.apply({'pot1': 0.5}), {'volume': 0.8}, 0.005)
+                and close(points.apply({'pot1': 0.75}), {'volume': 0.9}, 0.005))
+
+    coupled = Mapping({'bpm': {'sum': [{'source': 'pot2', 'curve': 'linear', 'points': [[0, 60], [1, 120]]},
+                                       {'source': 'speed', 'curve': 'linear', 'points': [[0, 0], [20, 60]]}],
+                               'clip': [60, 180]}})
+    ok &= check("solo pot2", close(coupled.apply({'pot2': NORM[51]}), {'bpm': 72.0}))
+    ok &= check("la velocità si somma all'ultimo pot2", close(coupled.apply({'speed': 10.0}), {'bpm': 102.0}))
+    ok &= check("limite superiore", close(coupled.apply({'pot2': 1.0, 'speed': 50.0}), {'bpm': 180}))
+    ok &= check("nessuna sorgente presente: nessuna uscita", coupled.apply({'pot1': 0.3}) == {})
+    return ok
+
+
+def test_config():
+    ok = True
+    print("\n--- Configurazione JSON e MusicEngine ---")
+    config = {'bpm': {'source': 'pot2', 'curve': 'linear', 'points': [[0, 90], [1, 100]]}}
+    fd, path = tempfile.mkstemp(suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(config, f)
+    try:
+        music = MusicEngine(port=9, mapping=Mapping(load_mapping(path)))
+        music.update({'pot1': 0.2, 'pot2': 1.0}, {})
+        ok &= check("BPM dalla mappatura del file", music.current_values['bpm'] == 100)
+        ok &= check("parametri non mappati invariati", music.current_values['volume'] == 0.8)
+        music.client.close()
+    finally:
+        os.unlink(path)
+    try:
+        MusicEngine(port=9, mapping=Mapping({'reverb': {'source': 'pot1'}}))
+        ok &= check("parametro sconosciuto rifiutato", False)
+    except ValueError:
+        ok &= check("parametro sconosciuto rifiutato", True)
+    return ok
+
+
+def test_cost():
+    ok = True
+    print("\n--- Costo per pacchetto ---")
+    mapping = Mapping()
+    frames = [{'pot1': NORM[i % 256], 'pot2': NORM[(i * 7) % 256], 'pot3': NORM[(i * 3) % 256],
+               'pot4': NORM[(i * 5) % 256], 'genre_idx': (i // 40) % 7, 'pattern_idx': (i // 70) % 4}
+              for i in range(20000)]
+    for name, func in (("mappatura", mapping.apply), ("formule", lambda pots: legacy(pots, None))):
+        start = time.perf_counter()
+        for pots in frames:
+            func(pots)
+        elapsed = time.perf_counter() - start
+        print(f"  {name:14s} {elapsed / len(frames) * 1e6:.2f} µs/pacchetto")
+
+    # Curva non lineare sommata alla velocità: stesso costo di qualsiasi altra curva
+    coupled = Mapping({'bpm': {'sum': [{'source': 'pot2', 'curve': 'exp', 'min': 60, 'max': 180},
+                                       {'source': 'speed', 'curve': 'linear', 'points': [[0, 0], [20, 30]]}],
+                               'clip': [60, 180]}})
+    for name, func in (("exp + velocità", coupled.apply),):
+        start = time.perf_counter()
+        for pots in frames:
+            func(pots)
+        elapsed = time.perf_counter() - start
+        print(f"  {name:14s} {elapsed / len(frames) * 1e6:.2f} µs/pacchetto")
+    return ok
+
+
+def main():
+    print("=== TEST MAPPATURA ===")
+    logger.configure('ERROR')
+    ok = test_default_tables()
+    ok &= test_hysteresis()
+    ok &= test_curves()
+    ok &= test_config()
+    ok &= test_cost()
+    print(f"\n{'TUTTI I TEST SUPERATI' if ok else 'ALCUNI TEST FALLITI'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Test delle metriche Prometheus del carretto
+
+Verifica il formato del testo esposto, lo scrape via HTTP e via socket Unix e
+il costo di registrazione (deve restare trascurabile alla frequenza dei pacchetti).
+
+Uso:
+    python metrics_test.py
+"""
+
+import os
+import socket
+import tempfile
+import time
+import urllib.request
+from modules import logger
+from modules.metrics import Counter, Gauge, Histogram, Registry, MetricsServer
+
+FRAME_RATE = 100        # pacchetti al secondo dell'Arduino
+
+
+def check(name, condition):
+    print(f"  {'OK ' if condition else 'ERR'} {name}")
+    return condition
+
+
+def sample_registry():
+    registry = Registry()
+    frames = Counter("test_frames_total", "Pacchetti", registry=registry)
+    messages = Counter("test_messages_total", "Messaggi", label="address", registry=registry)
+    genre = Gauge("test_genre", "Genere", label="genre", registry=registry)
+    latency = Histogram("test_latency_seconds", "Latenza", buckets=(0.001, 0.01), registry=registry)
+    frames.inc(3)
+    messages.inc(label_value="/carretto/bpm")
+    messages.inc(2, label_value="/carretto/volume")
+    genre.set("dub")
+    for value in (0.0005, 0.005, 0.5):
+        latency.observe(value)
+    return registry, latency
+
+
+def test_format():
+    ok = True
+    print("\n--- Formato testo ---")
+    registry, latency = sample_registry()
+    text = registry.render()
+    lines = text.splitlines()
+    ok &= check("Contatore semplice", "test_frames_total 3" in lines)
+    ok &= check("Contatore con etichetta", 'test_messages_total{address="/carretto/volume"} 2' in lines)
+    ok &= check("Gauge informativa", 'test_genre{genre="dub"} 1' in lines)
+    ok &= check("Bucket cumulativi", 'test_latency_seconds_bucket{le="0.001"} 1' in lines
+                and 'test_latency_seconds_bucket{le="0.01"} 2' in lines
+                and 'test_latency_seconds_bucket{le="+Inf"} 3' in lines)
+    ok &= check("Conteggio istogramma", "test_latency_seconds_count 3" in lines and latency.count == 3)
+    ok &= check("TYPE prima dei valori", lines.index("# TYPE test_frames_total counter") <
+                lines.index("test_frames_total 3"))
+    ok &= check("Terminato da a capo", text.endswith("\n"))
+
+    broken = Gauge("test_broken", "Funzione che fallisce", registry=registry)
+    broken.set_function(lambda: 1 / 0)
+    ok &= check("Una metrica in errore non blocca le altre", "test_frames_total 3" in registry.render())
+    return ok
+
+
+def test_http():
+    ok = True
+    print("\n--- Scrape HTTP ---")
+    registry, _ = sample_registry()
+    server = MetricsServer("127.0.0.1:0", registry)
+    server.start()
+    try:
+        port = server.server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=2) as response:
+            body = response.read().decode()
+            content_type = response.headers["Content-Type"]
+        ok &= check("Risposta HTTP con le metriche", "test_frames_total 3" in body)
+        ok &= check("Content-Type Prometheus", content_type.startswith("text/plain; version=0.0.4"))
+    finally:
+        server.stop()
+    return ok
+
+
+def test_unix():
+    ok = True
+    print("\n--- Scrape su socket Unix ---")
+    registry, _ = sample_registry()
+    path = os.path.join(tempfile.mkdtemp(prefix="carretto-metrics-"), "metrics.sock")
+    server = MetricsServer(f"unix:{path}", registry)
+    server.start()
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.settimeout(2)
+        client.connect(path)
+        client.sendall(b"GET /metrics HTTP/1.0\r\n\r\n")
+        response = b""
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+        client.close()
+        ok &= check("Risposta 200", response.startswith(b"HTTP/1.0 200"))
+        ok &= check("Metriche nel corpo", b"test_frames_total 3" in response)
+    finally:
+        server.stop()
+    ok &= check("Socket rimosso all'arresto", not os.path.exists(path))
+    os.rmdir(os.path.dirname(path))
+    return ok
+
+
+def test_overhead():
+    ok = True
+    print("\n--- Costo di registrazione ---")
+    registry = Registry()
+    counter = Counter("bench_total", "Contatore", label="address", registry=registry)
+    histogram = Histogram("bench_seconds", "Istogramma", registry=registry)
+    n = 200000
+    start = time.perf_counter()
+    for i in range(n):
+        histogram.observe(0.0004)
+        counter.inc(label_value="/carretto/volume")
+    per_frame = (time.perf_counter() - start) / n
+    # Un observe + un inc per pacchetto, 100 pacchetti/s
+    load = per_frame * FRAME_RATE
+    print(f"      observe + inc: {per_frame * 1e6:.2f} µs -> {load * 100:.4f}% di una CPU a {FRAME_RATE} Hz")
+    ok &= check("Sotto i 5 µs per pacchetto", per_frame < 5e-6)
+    return ok
+
+
+def main():
+    print("=== TEST METRICHE ===")
+    logger.configure('ERROR')
+    ok = test_format()
+    ok &= test_http()
+    ok &= test_unix()
+    ok &= test_overhead()
+    print(f"\n{'TUTTI I TEST SUPERATI' if ok else 'ALCUNI TEST FALLITI'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - ACQUISITION PROCESS
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Acquisizione dei sensori in un processo separato (--acquisition-process).
+- Il processo figlio apre Arduino e GPS (registro dei dispositivi, reactor o sessione
+  registrata) e scrive ogni nuovo dato nel blocco condiviso (modules/shared_state.py),
+  con un heartbeat almeno ogni HEARTBEAT_PERIOD secondi
+- Per ogni nuovo dato scrive un byte su una pipe: un thread del processo di controllo
+  si sveglia e pubblica su SensorEvents con l'istante di arrivo originale
+- Il processo di controllo legge il blocco con un lock condiviso tenuto solo per la
+  copia: nessun pickle, nessuna contesa del GIL con la lettura delle seriali
+- Un supervisore riavvia il figlio se termina o se l'heartbeat si ferma; i numeri di
+  sequenza e i contatori riprendono da quelli già nel blocco, quindi restano crescenti
+- ArduinoReader e GPSReader vengono sostituiti da facciate con la stessa interfaccia
+  usata da ControlLoop e dall'avvio (get_values_if_newer, get_data, ready, ...)
+"""
+
+import math
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from modules.shared_state import SharedState
+from modules.snapshot import PotSnapshot, GPSSnapshot
+from modules.logger import get_logger
+from modules import metrics
+
+log = get_logger("acquisition")
+
+# Intervallo massimo tra due scritture del figlio (heartbeat senza dati nuovi)
+HEARTBEAT_PERIOD = 0.2
+
+# Heartbeat fermo da più di tanti secondi: il figlio è bloccato e viene ucciso
+HEARTBEAT_TIMEOUT = 3.0
+
+# Attesa del primo heartbeat dopo l'avvio (interprete, import, apertura delle porte)
+STARTUP_TIMEOUT = 15.0
+
+# Attesa prima di un riavvio, raddoppiata ad ogni guasto ravvicinato fino a MAX_RESTART_DELAY
+RESTART_DELAY = 0.5
+MAX_RESTART_DELAY = 10.0
+
+# Un figlio vissuto almeno tanti secondi azzera il ritardo di riavvio
+STABLE_TIME = 10.0
+
+
+def _find_ports(registry, refresh):
+    """Porte di Arduino e GPS dal registro, con i default come in main.find_serial_ports"""
+    from modules.device_registry import DEFAULT_PORTS
+    ports = registry.resolve(refresh=refresh)
+    return (ports.get('arduino') or DEFAULT_PORTS['arduino'],
+            ports.get('gps') or DEFAULT_PORTS['gps'])
+
+
+def _record(base, arduino, gps):
+    """Record del blocco condiviso dallo stato dei lettori, a partire da quello del figlio precedente"""
+    pots = arduino.snapshot
+    fix = gps.snapshot
+    decoder = arduino.decoder
+    parser = gps.parser
+    reconnects = metrics.RECONNECTS.values
+    if pots.seq:
+        pots_fields = (base.pots_seq + pots.seq, pots.timestamp, pots.full_scale) + tuple(pots.raw)
+    else:
+        # Nessun pacchetto ancora: restano i valori del figlio precedente
+        pots_fields = base[0:7]
+    if fix.seq:
+        nan = math.nan
+        gps_fields = (base.gps_seq + fix.seq, fix.timestamp,
+                      nan if fix.speed is None else fix.speed,
+                      nan if fix.lat is None else fix.lat,
+                      nan if fix.lon is None else fix.lon,
+                      fix.fix_quality, fix.satellites, 1 if fix.valid else 0)
+    else:
+        gps_fields = base[7:15]
+    return pots_fields + gps_fields + (
+        base.frames + decoder.frames, base.resyncs + decoder.resyncs,
+        base.dropped + decoder.dropped, base.corrupt + decoder.corrupt,
+        base.sentences + parser.decoded, base.gps_errors + parser.checksum_errors,
+        base.arduino_reconnects + reconnects.get('arduino', 0),
+        base.gps_reconnects + reconnects.get('gps', 0),
+        time.perf_counter(), os.getpid())
+
+
+def _acquisition_main(shm_name, lock, wake, options):
+    """Processo figlio: lettori dei sensori -> blocco condiviso"""
+    # Ctrl+C arriva a tutto il gruppo di processi: l'arresto lo decide il padre
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    from modules import logger
+    from modules.sensor_events import SensorEvents
+    from modules.session_recorder import SessionRecorder, SessionReplay, SOURCE_ARDUINO, SOURCE_GPS
+    from modules.arduino_reader import ArduinoReader
+    from modules.gps_reader import GPSReader
+    logger.configure(options['log_level'], options['log_levels'])
+
+    state = SharedState(shm_name, lock=lock)
+    base = state.read()
+    wake_fd = wake.fileno()
+    os.set_blocking(wake_fd, False)
+    events = SensorEvents()
+    recorder = SessionRecorder(options['record']) if options['record'] else None
+    reactor = None
+    if options['replay']:
+        # Ogni riavvio riparte dall'inizio della sessione
+        replay = SessionReplay(options['replay'], speed=options['replay_speed'])
+        arduino = ArduinoReader(events=events, serial_port=replay.serial_for(SOURCE_ARDUINO),
+                                recorder=recorder, protocol=options['protocol'])
+        gps = GPSReader(events=events, serial_port=replay.serial_for(SOURCE_GPS), recorder=recorder)
+    else:
+        from modules.device_registry import DeviceRegistry
+        from modules.serial_reactor import SerialReactor
+        registry = DeviceRegistry(overrides=options['port_overrides'])
+        arduino_port, gps_port = _find_ports(registry, options['rescan'])
+        reactor = SerialReactor()
+        reactor.start()
+        arduino = ArduinoReader(arduino_port, baudrate=9600, events=events, recorder=recorder,
+                                registry=registry, reactor=reactor, protocol=options['protocol'])
+        gps = GPSReader(gps_port, baudrate=9600, events=events, recorder=recorder,
+                        registry=registry, reactor=reactor)
+    arduino.start()
+    gps.start()
+    print(f"[ACQUISITION] Processo {os.getpid()} avviato")
+
+    parent = os.getppid()
+    try:
+        while not stop.is_set() and os.getppid() == parent:
+            pending = events.wait(HEARTBEAT_PERIOD)
+            state.write(_record(base, arduino, gps))
+            if pending:
+                try:
+                    os.write(wake_fd, b'w')
+                except BlockingIOError:
+                    pass        # Pipe piena: il padre ha già un risveglio in sospeso
+    finally:
+        arduino.stop()
+        gps.stop()
+        if reactor:
+            reactor.stop()
+        if recorder:
+            recorder.close()
+        state.close()
+
+
+class _SharedArduino:
+    """Facciata di ArduinoReader sul blocco condiviso"""
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.snapshot = PotSnapshot(0, (128, 128, 128, 128))
+        self.ready = threading.Event()
+
+    def _refresh(self):
+        record = self.owner.read()
+        if record.pots_seq != self.snapshot.seq:
+            self.snapshot = PotSnapshot(record.pots_seq, record[3:7], record.pots_time, record.full_scale)
+        return self.snapshot
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def wait_ready(self, timeout=None):
+        return self.ready.wait(timeout)
+
+    @property
+    def values(self):
+        return dict(zip(('pot1', 'pot2', 'pot3', 'pot4'), self._refresh().values))
+
+    @property
+    def raw_values(self):
+        return self._refresh().raw_dict()
+
+    def get_values(self):
+        return self._refresh().as_dict()
+
+    def get_snapshot(self):
+        return self._refresh()
+
+    def get_values_if_newer(self, seq):
+        snapshot = self._refresh()
+        if snapshot.seq > seq:
+            return snapshot
+        return None
+
+    def get_stats(self):
+        record = self.owner.last
+        return {'frames': record.frames, 'resyncs': record.resyncs, 'dropped': record.dropped,
+                'corrupt': record.corrupt, 'restarts': self.owner.restarts}
+
+
+class _SharedGPS:
+    """Facciata di GPSReader sul blocco condiviso"""
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.snapshot = GPSSnapshot(0)
+        self.ready = threading.Event()
+
+    def _refresh(self):
+        record = self.owner.read()
+        if record.gps_seq != self.snapshot.seq:
+            nan = math.isnan
+            self.snapshot = GPSSnapshot(record.gps_seq, record.gps_time,
+                                        None if nan(record.speed) else record.speed,
+                                        None if nan(record.lat) else record.lat,
+                                        None if nan(record.lon) else record.lon,
+                                        record.fix_quality, record.satellites, bool(record.valid))
+        return self.snapshot
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    @property
+    def speed(self):
+        return self._refresh().speed
+
+    def get_data(self):
+        return self._refresh().as_dict()
+
+    def get_snapshot(self):
+        return self._refresh()
+
+    def get_data_if_newer(self, seq):
+        snapshot = self._refresh()
+        if snapshot.seq > seq:
+            return snapshot
+        return None
+
+
+class AcquisitionProcess:
+    def __init__(self, events=None, protocol='auto', record=None, replay=None, replay_speed=1.0,
+                 rescan=False, port_overrides=None, log_level='INFO', log_levels=None,
+                 heartbeat_timeout=HEARTBEAT_TIMEOUT):
+        """
+        Inizializza il processo di acquisizione (avviato da start())
+
+        Args:
+            events: SensorEvents del processo di controllo su cui ripubblicare i nuovi dati
+            protocol: Formato dei pacchetti Arduino ('auto', 'v1', 'v2')
+            record: File di sessione su cui il figlio registra i byte grezzi
+            replay: File di sessione da riprodurre al posto dell'hardware
+            replay_speed: Velocità di riproduzione (come SessionReplay)
+            rescan: Ignora la cache del registro dei dispositivi
+            port_overrides: Porte indicate a mano per ruolo (come DeviceRegistry)
+            log_level, log_levels: Configurazione del log nel figlio (come logger.configure)
+            heartbeat_timeout: Secondi senza heartbeat dopo cui il figlio viene riavviato
+        """
+        self.events = events
+        self.options = {'protocol': protocol, 'record': record, 'replay': replay,
+                        'replay_speed': replay_speed, 'rescan': rescan,
+                        'port_overrides': port_overrides or {},
+                        'log_level': log_level, 'log_levels': log_levels or {}}
+        self.heartbeat_timeout = heartbeat_timeout
+        # spawn: il figlio non eredita thread, lock e socket del processo di controllo
+        self.context = multiprocessing.get_context('spawn')
+
+        self.state = None
+        self.last = None            # Ultimo record letto (metriche, statistiche)
+        self.process = None
+        self.started_at = 0.0
+        self.restarts = 0
+        # Figlio corrente e numero di riavvii cambiano insieme, dopo che il nuovo figlio è partito
+        self.process_lock = threading.Lock()
+        self.failures = 0
+        self.running = False
+        self.stop_event = threading.Event()
+        self.bridge = None
+        self.supervisor = None
+
+        self.arduino = _SharedArduino(self)
+        self.gps = _SharedGPS(self)
+
+        metrics.ACQ_RESTARTS.set_function(lambda: self.restarts)
+        metrics.ARDUINO_FRAMES.set_function(lambda: self.last.frames)
+        metrics.ARDUINO_RESYNCS.set_function(lambda: self.last.resyncs)
+        metrics.ARDUINO_DROPPED.set_function(lambda: self.last.dropped)
+        metrics.ARDUINO_CORRUPT.set_function(lambda: self.last.corrupt)
+        metrics.GPS_SENTENCES.set_function(lambda: self.last.sentences)
+        metrics.GPS_ERRORS.set_function(lambda: self.last.gps_errors)
+
+    def start(self):
+        """Crea il blocco condiviso, avvia il figlio, il thread di risveglio e il supervisore"""
+        if self.running:
+            return
+        self.state = SharedState(create=True)
+        self.last = self.state.read()
+        # Pipe di soli byte grezzi: le Connection servono solo a passare il descrittore al figlio
+        self.wake_read, self.wake_write = self.context.Pipe(duplex=False)
+        self.running = True
+        self.stop_event.clear()
+        self._spawn()
+        self.bridge = threading.Thread(target=self._bridge_thread, name="acquisition-bridge", daemon=True)
+        self.bridge.start()
+        self.supervisor = threading.Thread(target=self._supervise, name="acquisition-supervisor", daemon=True)
+        self.supervisor.start()
+        print(f"[ACQUISITION] Sensori nel processo {self.process.pid}, stato in {self.state.name}")
+
+    def stop(self):
+        """Ferma il figlio (SIGTERM, poi SIGKILL) e rimuove il blocco condiviso"""
+        if not self.running:
+            return
+        self.running = False
+        self.stop_event.set()
+        if self.supervisor:
+            self.supervisor.join(timeout=1.0)
+        self._terminate()
+        os.write(self.wake_write.fileno(), b'q')     # Sveglia il thread di risveglio
+        if self.bridge:
+            self.bridge.join(timeout=1.0)
+        self.last = self.state.read()
+        self.state.close()
+        self.wake_read.close()
+        self.wake_write.close()
+        print(f"[ACQUISITION] Arrestato ({self.restarts} riavvii)")
+
+    def read(self):
+        """Record corrente del blocco condiviso"""
+        if not self.running:
+            return self.last
+        self.last = self.state.read()
+        return self.last
+
+    def current_pid(self):
+        """Pid del figlio in esecuzione (None tra l'arresto di un figlio e l'avvio del successivo)"""
+        with self.process_lock:
+            return self.process.pid if self.process else None
+
+    def _spawn(self, restart=False):
+        # Lock nuovo ad ogni avvio: un figlio ucciso a metà scrittura può aver lasciato preso il precedente
+        lock = self.state.new_lock()
+        process = self.context.Process(
+            target=_acquisition_main, name="carretto-acquisition",
+            args=(self.state.name, lock, self.wake_write, self.options), daemon=True)
+        process.start()
+        with self.process_lock:
+            self.process = process
+            self.started_at = time.perf_counter()
+            if restart:
+                self.restarts += 1
+
+    def _terminate(self):
+        with self.process_lock:
+            process, self.process = self.process, None
+        if process is None:
+            return
+        if process.is_alive():
+            process.terminate()
+            process.join(timeout=2.0)
+            if process.is_alive():
+                process.kill()
+        process.join(timeout=1.0)
+        process.close()
+
+    def _bridge_thread(self):
+        """Byte sulla pipe -> eventi del processo di controllo con l'istante di arrivo del dato"""
+        pots_seq = gps_seq = 0
+        while self.running:
+            try:
+                os.read(self.wake_read.fileno(), 256)
+            except OSError:
+                break
+            if not self.running:
+                break
+            record = self.read()
+            if record.pots_seq != pots_seq:
+                pots_seq = record.pots_seq
+                self.arduino.ready.set()
+                if self.events:
+                    self.events.publish('arduino', record.pots_time)
+            if record.gps_seq != gps_seq:
+                gps_seq = record.gps_seq
+                self.gps.ready.set()
+                if self.events:
+                    self.events.publish('gps', record.gps_time)
+
+    def _heartbeat_age(self, now):
+        """Secondi dall'ultimo heartbeat del figlio corrente (o dal suo avvio, con più tolleranza)"""
+        record = self.read()
+        if record.pid == self.process.pid:
+            return now - record.heartbeat, self.heartbeat_timeout
+        return now - self.started_at, STARTUP_TIMEOUT
+
+    def _supervise(self):
+        """Riavvia il figlio se termina o se smette di scrivere l'heartbeat"""
+        while not self.stop_event.wait(HEARTBEAT_PERIOD):
+            now = time.perf_counter()
+            process = self.process
+            if process.is_alive():
+                self._sync_reconnects()
+                age, timeout = self._heartbeat_age(now)
+                if age <= timeout:
+                    continue
+                log.error("Processo di acquisizione %d bloccato (nessun heartbeat da %.1f s): riavvio",
+                          process.pid, age)
+                process.kill()
+            else:
+                log.error("Processo di acquisizione %d terminato (codice %s): riavvio",
+                          process.pid, process.exitcode)
+
+            # Guasti ravvicinati: attesa crescente per non girare a vuoto
+            if now - self.started_at >= STABLE_TIME:
+                self.failures = 0
+            delay = min(MAX_RESTART_DELAY, RESTART_DELAY * 2 ** self.failures)
+            self.failures += 1
+            self._terminate()
+            if self.stop_event.wait(delay):
+                break
+            self._spawn(restart=True)
+            log.warning("Processo di acquisizione riavviato (pid %d, riavvio %d)",
+                        self.process.pid, self.restarts)
+
+    def _sync_reconnects(self):
+        """Riconnessioni delle porte viste dal figlio nel contatore per dispositivo"""
+        record = self.last
+        for device, count in (('arduino', record.arduino_reconnects), ('gps', record.gps_reconnects)):
+            if count:
+                metrics.RECONNECTS.values[device] = count
+
+    def get_stats(self):
+        record = self.read()
+        return {'pid': self.current_pid(), 'restarts': self.restarts,
+                'pots_seq': record.pots_seq, 'gps_seq': record.gps_seq,
+                'stale_reads': self.state.stale if self.running else None}
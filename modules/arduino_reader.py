@@ -7,95 +7,105 @@ Data: 2025-06-15
 Versione: 2.7
 
 Questo modulo gestisce la comunicazione con Arduino Nano per leggere i potenziometri.
-Adattato per il formato binario specifico: [0xFF, val1, val2, val3, val4]
+Formato binario v1 [0xFF, val1, val2, val3, val4] o v2 (COBS, sequenza, CRC-8,
+valori a 10 bit), riconosciuto automaticamente dal decoder
 """
 
 import threading
 import time
+import logging
 import serial
-import glob
-import os
+from modules.packet_decoder import AutoDecoder
+from modules.snapshot import PotSnapshot
+from modules.session_recorder import SOURCE_ARDUINO
+from modules.logger import get_logger, Throttle, trace, EVT_FRAME, EVT_ERROR
+from modules import metrics
+
+log = get_logger("arduino")
 
 class ArduinoReader:
-    def __init__(self, port='/dev/ttyUSB0', baudrate=9600):  # Nota: baudrate 9600
+    def __init__(self, port='/dev/ttyUSB0', baudrate=9600, events=None,
+                 serial_port=None, recorder=None, registry=None, reactor=None,
+                 protocol='v1'):  # Nota: baudrate 9600
         """
         Inizializza il lettore Arduino
         
         Args:
-            port: Porta seriale Arduino
+            port: Porta seriale Arduino (usata così com'è: il rilevamento è in DeviceRegistry)
             baudrate: Velocità di comunicazione (9600 per l'Arduino Nano)
+            events: SensorEvents opzionale su cui pubblicare ogni nuovo pacchetto
+            serial_port: Oggetto già aperto compatibile con serial.Serial
+                         (riproduzione di una sessione, benchmark)
+            recorder: SessionRecorder opzionale su cui registrare i byte letti
+            registry: DeviceRegistry opzionale per ritrovare la porta dopo una disconnessione
+            reactor: SerialReactor opzionale: la porta viene servita dal suo thread di I/O
+                     (riconnessione non bloccante) invece che da un thread dedicato
+            protocol: Formato dei pacchetti: 'v1', 'v2' o 'auto' (riconosciuto dai
+                      primi pacchetti validi, pubblicati solo a formato noto)
         """
         self.port = port
         self.baudrate = baudrate
+        self.events = events
+        self.serial_port = serial_port
+        self.recorder = recorder
+        self.registry = registry
+        self.reactor = reactor
         self.serial = None
         self.running = False
         self.thread = None
-        self.values = {
-            'pot1': 0.5,  # Volume
-            'pot2': 0.5,  # BPM
-            'pot3': 0.5,  # Tune/Genre
-            'pot4': 0.5   # Pattern
-        }
-        self.raw_values = {
-            'pot1': 128,  # Volume (0-255)
-            'pot2': 128,  # BPM (0-255)
-            'pot3': 128,  # Tune/Genre (0-255)
-            'pot4': 128   # Pattern (0-255)
-        }
-        self.last_values = self.values.copy()
-        self.lock = threading.Lock()
+        
+        # Ultima istantanea dei potenziometri (Volume, BPM, Tune/Genre, Pattern):
+        # viene sostituita in blocco ad ogni pacchetto, mai modificata
+        self.snapshot = PotSnapshot(0, (128, 128, 128, 128))
+        self.last_logged = self.snapshot.raw
         self.debug_counter = 0
+        self.decoder = AutoDecoder(protocol)
         
-        # Cerca tutte le porte seriali disponibili
-        available_ports = self._find_available_ports()
-        print(f"[ARDUINO] Porte seriali disponibili: {available_ports}")
+        # Messaggi per-pacchetto: al massimo uno al secondo
+        self.packet_throttle = Throttle(interval=1.0)
+        self.change_throttle = Throttle(interval=0.2)
+        self.error_throttle = Throttle(interval=1.0)
         
-        # Rileva automaticamente la porta Arduino
-        self.port = self._auto_detect_port(available_ports)
-        print(f"[ARDUINO] Usando porta: {self.port}")
-        
-    def _find_available_ports(self):
-        """Trova tutte le porte seriali disponibili"""
-        if os.name == 'nt':  # Windows
-            return ['COM%s' % (i + 1) for i in range(256)]
-        else:  # Linux/Mac
-            ports = glob.glob('/dev/tty[A-Za-z]*')
-            return ports
-            
-    def _auto_detect_port(self, available_ports):
-        """Rileva automaticamente la porta Arduino"""
-        # Prova la porta specificata
-        if self.port in available_ports:
-            return self.port
-            
-        # Altrimenti cerca porte Arduino comuni
-        for port in available_ports:
-            if 'ACM' in port or 'USB' in port:
-                print(f"[ARDUINO] Rilevata porta Arduino: {port}")
-                return port
-                
-        # Se non viene trovata, mantieni quella specificata
-        print(f"[ARDUINO] Nessuna porta Arduino rilevata, usando: {self.port}")
-        return self.port
+        # Impostato al primo pacchetto valido (fine del reset del Nano) o in simulazione
+        self.ready = threading.Event()
         
+        # Contatori già tenuti dal decoder: letti solo allo scrape delle metriche
+        metrics.ARDUINO_FRAMES.set_function(lambda: self.decoder.frames)
+        metrics.ARDUINO_RESYNCS.set_function(lambda: self.decoder.resyncs)
+        metrics.ARDUINO_DROPPED.set_function(lambda: self.decoder.dropped)
+        metrics.ARDUINO_CORRUPT.set_function(lambda: self.decoder.corrupt)
+
     def start(self):
         """Avvia il thread di lettura"""
         if not self.running:
             self.running = True
             self.simulation_mode = False
             
+            # Porta già aperta fornita dal chiamante: nessun reset da attendere
+            if self.serial_port is not None:
+                self.serial = self.serial_port
+                self.thread = threading.Thread(target=self._read_thread)
+                self.thread.daemon = True
+                self.thread.start()
+                print("[ARDUINO] Thread di lettura avviato su porta fornita")
+                return
+            
+            # Porta servita dal reactor: apertura e riconnessioni avvengono nel suo thread
+            if self.reactor is not None:
+                resolve = (lambda: self.registry.lookup('arduino')) if self.registry else None
+                self.reactor.add('arduino', self.port, self._on_data, self.baudrate,
+                                 resolve=resolve, on_state=self._on_state)
+                print(f"[ARDUINO] Porta {self.port} registrata sul reactor")
+                return
+            
             # Prova ad aprire la porta seriale
             try:
                 print(f"[ARDUINO] Tentativo di apertura porta {self.port} a {self.baudrate} baud...")
                 self.serial = serial.Serial(self.port, self.baudrate, timeout=1.0)
-                time.sleep(2)  # Attesa per Arduino reset
                 print(f"[ARDUINO] Porta {self.port} aperta con successo")
                 
-                # Leggi eventuali dati iniziali
-                if self.serial.in_waiting > 0:
-                    initial_data = self.serial.read(self.serial.in_waiting)
-                    print(f"[ARDUINO] Dati iniziali: {initial_data.hex()}")
-                
+                # Nessuna attesa fissa per il reset del Nano: il thread legge subito
+                # e il primo pacchetto valido imposta self.ready
                 self.thread = threading.Thread(target=self._read_thread)
                 self.thread.daemon = True
                 self.thread.start()
@@ -112,6 +122,8 @@ class ArduinoReader:
     def stop(self):
         """Ferma il thread di lettura"""
         self.running = False
+        if self.reactor is not None:
+            self.reactor.remove('arduino')
         if self.thread:
             self.thread.join(timeout=1.0)
         if self.serial:
@@ -119,131 +131,186 @@ class ArduinoReader:
             self.serial = None
         print("[ARDUINO] Arrestato")
     
+    def wait_ready(self, timeout=None):
+        """Attende il primo pacchetto valido; restituisce True se arrivato entro timeout"""
+        return self.ready.wait(timeout)
+    
+    @property
+    def values(self):
+        """Valori normalizzati correnti come dizionario (senza pot5)"""
+        return dict(zip(('pot1', 'pot2', 'pot3', 'pot4'), self.snapshot.values))
+    
+    @property
+    def raw_values(self):
+        """Valori grezzi correnti (0-255, o 0-1023 con il formato v2) come dizionario"""
+        return self.snapshot.raw_dict()
+    
     def get_values(self):
         """Restituisce i valori correnti dei potenziometri"""
-        with self.lock:
-            # Adatta i potenziometri disponibili - il tuo Arduino ha 4 pot
-            # ma potrebbero essere necessari 5 valori per il sistema
-            values = self.values.copy()
-            
-            # Se non abbiamo pot5 nel tuo hardware, usa pot4 anche per pattern
-            if 'pot5' not in values:
-                values['pot5'] = values['pot4']
-                
-            return values
+        # Il tuo Arduino ha 4 pot ma il sistema si aspetta anche pot5:
+        # as_dict() usa pot4 anche per pot5
+        return self.snapshot.as_dict()
+    
+    def get_snapshot(self):
+        """Restituisce l'ultima istantanea (lettura senza lock né allocazioni)"""
+        return self.snapshot
+    
+    def get_values_if_newer(self, seq):
+        """
+        Restituisce l'istantanea solo se più recente di seq
+        
+        Args:
+            seq: Numero di sequenza dell'ultima istantanea elaborata
+        
+        Returns:
+            PotSnapshot nuova oppure None se non è arrivato nessun pacchetto
+        """
+        snapshot = self.snapshot
+        if snapshot.seq > seq:
+            return snapshot
+        return None
     
     def _read_thread(self):
         """Thread che legge i dati da Arduino in formato binario [0xFF, val1, val2, val3, val4]"""
-        buffer = bytearray()
-        marker = 0xFF  # Marker di inizio pacchetto
-        packet_size = 5  # 1 byte marker + 4 bytes dati
         last_data_time = time.time()
-        last_debug_time = time.time()
         data_received = False
         
         while self.running:
             try:
-                if self.serial and self.serial.in_waiting > 0:
-                    # Leggi un byte alla volta
-                    byte = self.serial.read(1)[0]
-                    
-                    # Se è un marker di inizio, resetta il buffer
-                    if byte == marker:
-                        buffer = bytearray([byte])
-                    # Altrimenti, aggiungi al buffer se non vuoto
-                    elif buffer:
-                        buffer.append(byte)
+                if self.serial:
+                    # Legge tutti i byte disponibili in un'unica chiamata
+                    # (o blocca fino al timeout della porta se non c'è nulla)
+                    chunk = self.serial.read(max(1, self.serial.in_waiting))
                     
-                    # Se abbiamo un pacchetto completo
-                    if len(buffer) == packet_size and buffer[0] == marker:
+                    if chunk and self._on_data(chunk, time.perf_counter()):
                         last_data_time = time.time()
                         data_received = True
-                        
-                        # Estrai i 4 valori dei potenziometri (bytes 1-4)
-                        pot_values = [buffer[i] for i in range(1, 5)]
-                        
-                        # Debug periodico del pacchetto ricevuto
-                        current_time = time.time()
-                        if current_time - last_debug_time > 1.0:  # Debug ogni secondo
-                            print(f"[ARDUINO] Pacchetto: {buffer.hex()} => Valori: {pot_values}")
-                            last_debug_time = current_time
-                        
-                        # Normalizza i valori da 0-255 a 0.0-1.0
-                        with self.lock:
-                            # Salva i valori raw
-                            self.raw_values['pot1'] = pot_values[0]
-                            self.raw_values['pot2'] = pot_values[1]
-                            self.raw_values['pot3'] = pot_values[2]
-                            self.raw_values['pot4'] = pot_values[3]
-                            
-                            # Normalizza e salva i valori
-                            self.values['pot1'] = pot_values[0] / 255.0
-                            self.values['pot2'] = pot_values[1] / 255.0
-                            self.values['pot3'] = pot_values[2] / 255.0
-                            self.values['pot4'] = pot_values[3] / 255.0
-                            
-                            # Debug dei cambiamenti significativi
-                            changed = False
-                            for key in self.values.keys():
-                                if abs(self.values[key] - self.last_values.get(key, 0)) > 0.02:
-                                    changed = True
-                            
-                            if changed:
-                                print(f"[ARDUINO] Valori raw: {self.raw_values}")
-                                print(f"[ARDUINO] Valori normalizzati: {self.values}")
-                                self.last_values = self.values.copy()
-                        
-                        # Resetta il buffer per il prossimo pacchetto
-                        buffer = bytearray()
+                else:
+                    time.sleep(0.1)
                 
                 # Verifica timeout - se non riceviamo dati per 10 secondi, avvisa
                 if data_received and time.time() - last_data_time > 10:
-                    print("[ARDUINO] ATTENZIONE: Nessun dato ricevuto da Arduino per 10 secondi!")
+                    log.warning("ATTENZIONE: Nessun dato ricevuto da Arduino per 10 secondi!")
                     data_received = False
             except Exception as e:
-                print(f"[ARDUINO] Errore lettura seriale: {e}")
+                trace(EVT_ERROR, 1)
+                if self.error_throttle():
+                    log.error("Errore lettura seriale: %s", e)
+                self.decoder.reset()
+                if self.serial_port is not None:
+                    # Porta fornita dal chiamante: non si può riaprire
+                    time.sleep(1)
+                    continue
                 # Riconnessione in caso di errore
                 if self.serial:
                     self.serial.close()
+                if self.registry:
+                    # Dopo un hotplug il kernel può aver assegnato un altro nome
+                    self.port = self.registry.lookup('arduino')
                 try:
                     self.serial = serial.Serial(self.port, self.baudrate, timeout=1.0)
-                    print(f"[ARDUINO] Riconnessione alla porta {self.port}")
+                    log.warning("Riconnessione alla porta %s", self.port)
+                    metrics.RECONNECTS.inc(label_value='arduino')
                 except Exception as reconnect_error:
-                    print(f"[ARDUINO] Riconnessione fallita: {reconnect_error}")
+                    log.error("Riconnessione fallita: %s", reconnect_error)
                     time.sleep(5)  # Attesa prima di riprovare
+    
+    def _on_data(self, chunk, arrival):
+        """
+        Elabora un blocco di byte letto dalla porta (dal thread di lettura o dal reactor)
+        
+        Returns:
+            Numero di pacchetti completi nel blocco
+        """
+        if self.recorder:
+            self.recorder.write(SOURCE_ARDUINO, chunk)
+        
+        frames = self.decoder.feed(chunk)
+        if frames:
+            # Conserviamo solo l'ultimo pacchetto completo
+            pot_values = self.decoder.latest
+            trace(EVT_FRAME, pot_values[0], pot_values[1], pot_values[2], pot_values[3])
+            
+            # Debug periodico del pacchetto ricevuto
+            if log.isEnabledFor(logging.DEBUG) and self.packet_throttle():
+                log.debug("Pacchetto %s => Valori: %s | Statistiche: %s",
+                          self.decoder.protocol, list(pot_values), self.decoder.get_stats())
             
-            time.sleep(0.01)  # 10ms per non sovraccaricare la CPU
+            self._update_values(pot_values, arrival, self.decoder.full_scale)
+        return frames
+    
+    def _on_state(self, connected):
+        """Connessione/disconnessione segnalata dal reactor"""
+        if connected:
+            self.simulation_mode = False
+        else:
+            # Pacchetto parziale della connessione precedente: da scartare
+            self.decoder.reset()
+            if not self.ready.is_set() and not self.simulation_mode:
+                # Nessun Arduino all'avvio: simula finché la porta non si apre
+                print("[ARDUINO] Porta non disponibile, simulazione fino alla connessione")
+                self.simulation_mode = True
+                self.thread = threading.Thread(target=self._simulate_thread)
+                self.thread.daemon = True
+                self.thread.start()
+    
+    def _update_values(self, pot_values, arrival=None, full_scale=255):
+        """Pubblica l'istantanea dell'ultimo pacchetto ricevuto e notifica il consumatore"""
+        if arrival is None:
+            arrival = time.perf_counter()
+        
+        # Un solo assegnamento: i lettori vedono la vecchia o la nuova istantanea, mai un misto
+        snapshot = PotSnapshot(self.snapshot.seq + 1, pot_values, arrival, full_scale)
+        self.snapshot = snapshot
+        if snapshot.seq == 1:
+            self.ready.set()
+        
+        # Debug dei cambiamenti significativi (calcolato solo se il debug è attivo)
+        if log.isEnabledFor(logging.DEBUG):
+            # 2% del fondo scala (~5 passi a 8 bit)
+            threshold = full_scale // 50
+            changed = any(abs(a - b) > threshold for a, b in zip(snapshot.raw, self.last_logged))
+            if changed and self.change_throttle():
+                log.debug("Valori raw: %s", snapshot.raw_dict())
+                log.debug("Valori normalizzati: %s", snapshot.as_dict())
+                self.last_logged = snapshot.raw
+        
+        if self.events:
+            self.events.publish('arduino', arrival)
+    
+    def get_stats(self):
+        """Restituisce i contatori del decoder (pacchetti, risincronizzazioni, byte)"""
+        return self.decoder.get_stats()
     
     def _simulate_thread(self):
         """Thread che simula i valori in caso di errore hardware"""
         print("[ARDUINO] Modalità simulazione attiva")
+        self.ready.set()
         step = 0
+        pot4 = 0.5
         
-        while self.running:
+        while self.running and self.simulation_mode:
             # Simula valori che cambiano
             step += 1
-            with self.lock:
-                # Volume oscilla lentamente
-                self.values['pot1'] = 0.7 + 0.3 * ((step % 20) / 20.0)
-                
-                # BPM aumenta e diminuisce
-                self.values['pot2'] = 0.3 + 0.4 * ((step % 30) / 30.0)
-                
-                # Tune rimane costante
-                self.values['pot3'] = 0.5
-                
-                # Pattern/Genre cambia ogni 40 cicli
-                if step % 40 == 0:
-                    self.values['pot4'] = (int(self.values['pot4'] * 6 + 1) % 7) / 6.0
-                    
-                # Salva anche i valori raw simulati (0-255)
-                self.raw_values['pot1'] = int(self.values['pot1'] * 255)
-                self.raw_values['pot2'] = int(self.values['pot2'] * 255)
-                self.raw_values['pot3'] = int(self.values['pot3'] * 255)
-                self.raw_values['pot4'] = int(self.values['pot4'] * 255)
+            
+            # Volume oscilla lentamente
+            pot1 = 0.7 + 0.3 * ((step % 20) / 20.0)
+            
+            # BPM aumenta e diminuisce
+            pot2 = 0.3 + 0.4 * ((step % 30) / 30.0)
+            
+            # Tune rimane costante
+            pot3 = 0.5
+            
+            # Pattern/Genre cambia ogni 40 cicli
+            if step % 40 == 0:
+                pot4 = (int(pot4 * 6 + 1) % 7) / 6.0
+            
+            # Pubblica come un pacchetto raw simulato (0-255)
+            self._update_values(bytes(int(v * 255) for v in (pot1, pot2, pot3, pot4)))
                     
             if step % 10 == 0:  # Ogni 10 step (circa 1 secondo) stampa i valori simulati
-                print(f"[ARDUINO] Simulazione - valori: {self.values}")
+                log.debug("Simulazione - valori: %s", self.values)
                 
             time.sleep(0.1)  # Aggiorna ogni 100ms
 
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - CONTROL LOOP
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Loop di controllo guidato dagli eventi: si sveglia appena un lettore pubblica
+un nuovo dato, lo passa allo stadio di filtro (SignalFilter) e aggiorna il
+MusicEngine solo se un'uscita filtrata è cambiata.
+Tra un evento e l'altro il processo resta fermo.
+"""
+
+import time
+import logging
+from modules.logger import get_logger, Throttle
+from modules.signal_filter import SignalFilter
+from modules import metrics
+
+log = get_logger("main")
+
+
+class ControlLoop:
+    def __init__(self, arduino, gps, music, events, measure_latency=False, filters=None):
+        """
+        Inizializza il loop di controllo
+
+        Args:
+            arduino: ArduinoReader (pubblica su events)
+            gps: Lettore GPS con get_data()
+            music: MusicEngine da aggiornare
+            events: SensorEvents condiviso con i lettori
+            measure_latency: Se True misura la latenza arrivo pacchetto -> invio UDP
+            filters: SignalFilter con le catene di filtri per canale (default DEFAULT_CONFIG)
+        """
+        self.arduino = arduino
+        self.gps = gps
+        self.music = music
+        self.events = events
+        self.running = False
+
+        # Smorzamento, soglie e isteresi di tutti i canali: al posto delle vecchie soglie
+        # fisse (5% pot, 1.5% genere/pattern, 0.5 km/h) c'è la configurazione dei filtri
+        self.filters = filters or SignalFilter()
+
+        # Aggiornamento forzato e debug periodici (secondi)
+        self.force_update_interval = 10.0
+        self.debug_interval = 30.0
+
+        # Il GPS aggiorna circa una volta al secondo: se nessun evento arriva
+        # entro questo tempo il loop si sveglia comunque per controllarlo
+        self.idle_timeout = 1.0
+
+        # Ultima istantanea dei potenziometri, ultima velocità e ultima posizione già elaborate
+        self.pots_seq = -1
+        self.last_speed = None
+        self.last_position = None
+
+        # Le latenze vengono raccolte da music.latency al momento dell'invio UDP
+        self.measure_latency = measure_latency
+
+        # Un aggiornamento può arrivare ad ogni pacchetto: debug limitato
+        self.update_throttle = Throttle(interval=0.5)
+
+    def apply(self, pots, gps_data, timestamp=None):
+        """Invia i valori filtrati al MusicEngine"""
+        self.music.update(pots, gps_data, timestamp)
+
+    def step(self, pending, force=False):
+        """
+        Elabora un risveglio del loop
+
+        Args:
+            pending: Eventi consumati {sorgente: timestamp di arrivo}
+            force: Se True aggiorna anche senza cambiamenti, reinviando tutti i valori
+
+        Returns:
+            True se il MusicEngine è stato aggiornato
+        """
+        inputs = {}
+        sample_time = None
+
+        # Nessun nuovo pacchetto: i potenziometri non vanno nemmeno filtrati
+        snapshot = self.arduino.get_values_if_newer(self.pots_seq)
+        if snapshot is not None:
+            self.pots_seq = snapshot.seq
+            inputs = snapshot.as_dict()
+            sample_time = snapshot.timestamp or None
+
+        gps_data = self.gps.get_data()
+        speed = gps_data.get('speed') if gps_data else None
+        lost = False
+        if speed is None:
+            # Fix perso: la velocità sparisce dalla mappatura subito, anche a potenziometri
+            # fermi, e al ritorno anche la stessa velocità di prima va rielaborata
+            lost = self.last_speed is not None
+            self.last_speed = None
+        elif speed != self.last_speed:
+            self.last_speed = speed
+            inputs['speed'] = speed
+            if sample_time is None:
+                # Solo la velocità: il campione ha l'istante di arrivo della frase GPS
+                sample_time = gps_data.get('timestamp') or None
+
+        changed = self.filters.process(inputs, sample_time) if inputs else False
+        changed = changed or lost
+
+        # Con le zone geografiche anche un nuovo fix a velocità costante può cambiare la musica
+        if gps_data and self.music.zones:
+            position = (gps_data.get('lat'), gps_data.get('lon'))
+            if position[0] is not None and position != self.last_position:
+                self.last_position = position
+                changed = True
+
+        if not (force or changed):
+            return False
+
+        if force:
+            # La cache del MusicEngine scarterebbe i valori invariati: l'aggiornamento forzato
+            # reinvia tutto, così un sclang riavviato riceve lo stato anche senza --keyframe
+            self.music.resync()
+
+        # Istante di arrivo del dato più vecchio tra quelli in attesa
+        timestamp = min(pending.values()) if pending else None
+        outputs = self.filters.outputs
+        # Senza fix la velocità filtrata è solo l'ultima nota: non va passata come attuale
+        gps_filtered = dict(gps_data or {}, speed=outputs.get('speed') if speed is not None else None)
+        self.apply(dict(outputs), gps_filtered, timestamp)
+
+        # Debug quando i valori cambiano
+        if log.isEnabledFor(logging.DEBUG) and self.update_throttle():
+            log.debug("Aggiornamento - Filtrati: %s | GPS: %s", outputs, gps_data)
+        return True
+
+    def run(self):
+        """Loop principale: attende gli eventi dei sensori e aggiorna la musica"""
+        self.running = True
+        now = time.monotonic()
+        next_force = now + self.force_update_interval
+        next_debug = now + self.debug_interval
+
+        while self.running:
+            pending = self.events.wait(self.idle_timeout)
+
+            now = time.monotonic()
+            force = now >= next_force
+            if force:
+                # Forza un aggiornamento ogni ~10 secondi anche se i valori non cambiano
+                log.debug("Aggiornamento forzato periodico")
+                next_force = now + self.force_update_interval
+
+            started = time.perf_counter()
+            self.step(pending, force)
+            metrics.LOOP_TIME.observe(time.perf_counter() - started)
+
+            if self.measure_latency:
+                self.music.latency.maybe_report()
+
+            # Debug ogni ~30 secondi indipendentemente dai cambiamenti
+            if now >= next_debug:
+                log.info("Potenziometri: %s | GPS: %s", self.arduino.get_values(), self.gps.get_data())
+                log.info("Invii OSC: %s | Cambi genere/pattern: %s",
+                         self.music.get_metrics(), self.filters.get_stats())
+                next_debug = now + self.debug_interval
+
+    def stop(self):
+        """Ferma il loop al prossimo risveglio"""
+        self.running = False
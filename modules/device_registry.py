@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - DEVICE REGISTRY
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Registro dei dispositivi seriali USB.
+Le porte vengono associate ai ruoli (arduino, gps) in base a VID/PID/seriale letti
+da sysfs (/sys/class/tty/*/device) invece che dal nome del file in /dev.
+L'associazione viene salvata su disco: all'avvio basta un solo elenco di
+/sys/class/tty per confermarla, e la scansione completa si ripete solo se i
+dispositivi collegati sono cambiati (hotplug) o se una porta salvata non
+corrisponde più al dispositivo atteso.
+I ruoli senza un dispositivo riconosciuto ricevono le porte USB rimaste (adattatori
+non in elenco); una porta indicata a mano (--arduino-port, --gps-port) viene
+fissata nella cache con la sua identità e segue il dispositivo anche se cambia nome.
+"""
+
+import json
+import os
+from modules.logger import get_logger
+
+log = get_logger("devices")
+
+# Dispositivi riconosciuti per ruolo: (VID, PID o None = qualsiasi), in ordine di preferenza
+DEFAULT_RULES = {
+    'arduino': [
+        ('2341', None),     # Arduino originale
+        ('2a03', None),     # Arduino.org
+        ('1a86', '7523'),   # CH340 (Nano compatibili)
+        ('0403', '6001'),   # FTDI FT232R (Nano originale)
+    ],
+    'gps': [
+        ('1546', None),     # u-blox
+        ('067b', '2303'),   # Prolific PL2303
+        ('10c4', 'ea60'),   # Silicon Labs CP210x
+    ]
+}
+
+# Porte usate se nessun dispositivo viene riconosciuto
+DEFAULT_PORTS = {
+    'arduino': '/dev/ttyUSB0',
+    'gps': '/dev/ttyUSB1'
+}
+
+TTY_PREFIXES = ('ttyUSB', 'ttyACM')
+
+
+def default_cache_path():
+    """File di cache in ~/.cache/carretto (o $XDG_CACHE_HOME/carretto)"""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'carretto', 'devices.json')
+
+
+class UsbPort:
+    __slots__ = ('name', 'vid', 'pid', 'serial', 'usb_path')
+
+    def __init__(self, name, vid, pid, serial=None, usb_path=None):
+        """
+        Porta seriale USB vista in sysfs
+
+        Args:
+            name: Nome del tty (es. 'ttyUSB0')
+            vid, pid: Vendor/Product ID esadecimali minuscoli (es. '1a86', '7523')
+            serial: Numero di serie USB, se il dispositivo lo espone
+            usb_path: Posizione fisica sul bus (es. '1-1.2'), stabile se non si cambia presa
+        """
+        self.name = name
+        self.vid = vid
+        self.pid = pid
+        self.serial = serial
+        self.usb_path = usb_path
+
+    def __repr__(self):
+        return f"UsbPort({self.name}, {self.vid}:{self.pid}, serial={self.serial}, path={self.usb_path})"
+
+    @property
+    def identity(self):
+        """Identità del dispositivo, indipendente dal nome assegnato dal kernel"""
+        return (self.vid, self.pid, self.serial or self.usb_path)
+
+    def as_dict(self):
+        return {'name': self.name, 'vid': self.vid, 'pid': self.pid,
+                'serial': self.serial, 'usb_path': self.usb_path}
+
+
+class DeviceRegistry:
+    def __init__(self, sysfs_root='/sys', dev_root='/dev', cache_path=None, rules=None, overrides=None):
+        """
+        Inizializza il registro
+
+        Args:
+            sysfs_root: Radice di sysfs (un albero finto per i test)
+            dev_root: Directory dei nodi dei dispositivi
+            cache_path: File JSON della cache (None = default_cache_path(), '' = nessuna cache)
+            rules: Dizionario ruolo -> [(vid, pid o None), ...] (default DEFAULT_RULES)
+            overrides: Dizionario ruolo -> percorso indicato a mano (es. '/dev/ttyUSB1')
+        """
+        self.sysfs_root = sysfs_root
+        self.dev_root = dev_root
+        self.cache_path = default_cache_path() if cache_path is None else cache_path
+        self.rules = rules or DEFAULT_RULES
+        self.overrides = {role: path for role, path in (overrides or {}).items() if path}
+        self.tty_dir = os.path.join(sysfs_root, 'class', 'tty')
+        self.probes = 0     # Scansioni complete eseguite (per test e diagnostica)
+
+    def signature(self):
+        """Elenco delle porte USB presenti: cambia solo con un hotplug"""
+        try:
+            names = os.listdir(self.tty_dir)
+        except OSError:
+            return []
+        return sorted(name for name in names if name.startswith(TTY_PREFIXES))
+
+    def read_port(self, name):
+        """Legge VID/PID/seriale di un tty risalendo dal suo device fino al dispositivo USB"""
+        device = os.path.join(self.tty_dir, name, 'device')
+        if not os.path.exists(device):
+            return None
+        path = os.path.realpath(device)
+        root = os.path.realpath(self.sysfs_root)
+        while path.startswith(root) and path != root:
+            if os.path.exists(os.path.join(path, 'idVendor')):
+                return UsbPort(name,
+                               self._read_attr(path, 'idVendor'),
+                               self._read_attr(path, 'idProduct'),
+                               self._read_attr(path, 'serial'),
+                               os.path.basename(path))
+            path = os.path.dirname(path)
+        return None
+
+    @staticmethod
+    def _read_attr(path, attr):
+        try:
+            with open(os.path.join(path, attr)) as f:
+                value = f.read().strip()
+        except OSError:
+            return None
+        # VID/PID in minuscolo come nelle regole; il seriale resta com'è
+        return value if attr == 'serial' else value.lower()
+
+    def probe(self, names=None):
+        """Scansione completa: restituisce le porte USB con i loro identificativi"""
+        self.probes += 1
+        ports = []
+        for name in self.signature() if names is None else names:
+            port = self.read_port(name)
+            if port is not None:
+                ports.append(port)
+        return ports
+
+    def _matches(self, role, port):
+        """Indice della regola soddisfatta (più basso = preferito), None se nessuna"""
+        for index, (vid, pid) in enumerate(self.rules.get(role, ())):
+            if port.vid == vid and (pid is None or port.pid == pid):
+                return index
+        return None
+
+    def assign(self, ports, pinned=None, roles=None):
+        """
+        Associa le porte ai ruoli
+
+        Args:
+            ports: Porte trovate da probe()
+            pinned: Dizionario ruolo -> identità salvata; se il dispositivo è ancora
+                    presente mantiene il suo ruolo anche se cambia nome (ttyUSB0 <-> ttyUSB1)
+            roles: Ruoli da associare (default tutti quelli delle regole)
+
+        Returns:
+            Dizionario ruolo -> UsbPort
+        """
+        roles = list(self.rules) if roles is None else roles
+        assigned = {}
+        used = set()
+        for role, identity in (pinned or {}).items():
+            if role not in roles:
+                continue
+            for port in ports:
+                if port.name not in used and list(port.identity) == list(identity):
+                    assigned[role] = port
+                    used.add(port.name)
+                    break
+        for role in roles:
+            if role in assigned:
+                continue
+            candidates = [(self._matches(role, port), port.name, port) for port in ports
+                          if port.name not in used and self._matches(role, port) is not None]
+            if candidates:
+                candidates.sort(key=lambda item: item[:2])
+                port = candidates[0][2]
+                if len(candidates) > 1 and candidates[1][0] == candidates[0][0] and not port.serial:
+                    log.warning("%s: dispositivi uguali senza seriale %s, scelto %s per nome "
+                                "(--%s-port per fissarlo)", role,
+                                [c[1] for c in candidates if c[0] == candidates[0][0]], port.name, role)
+                assigned[role] = port
+                used.add(port.name)
+        # Ruoli ancora vuoti: le porte rimaste, anche di chip non in elenco o già usati
+        # da un altro ruolo (il CH340 è un adattatore USB-TTL generico)
+        leftover = sorted((port for port in ports if port.name not in used), key=lambda port: port.name)
+        for role in roles:
+            if role not in assigned and leftover:
+                port = leftover.pop(0)
+                log.warning("%s: nessun dispositivo riconosciuto, uso la porta rimasta %s (%s:%s)",
+                            role, port.name, port.vid, port.pid)
+                assigned[role] = port
+                used.add(port.name)
+        return assigned
+
+    def _load_cache(self):
+        if not self.cache_path:
+            return None
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_cache(self, signature, assigned):
+        if not self.cache_path:
+            return
+        data = {
+            'signature': signature,
+            'ports': {role: port.as_dict() for role, port in assigned.items()}
+        }
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            tmp = self.cache_path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            log.warning("Impossibile salvare la cache dispositivi %s: %s", self.cache_path, e)
+
+    def _verify(self, cached):
+        """Controlla che ogni porta salvata corrisponda ancora allo stesso dispositivo"""
+        for entry in cached.values():
+            port = self.read_port(entry['name'])
+            if port is None or port.as_dict() != entry:
+                return False
+        return True
+
+    def resolve(self, refresh=False):
+        """
+        Restituisce il dizionario ruolo -> percorso in /dev
+
+        Con una cache valida costa un elenco di /sys/class/tty più la lettura degli
+        attributi delle sole porte salvate; altrimenti esegue una scansione completa.
+        Le porte indicate a mano vincono sulla cache e sulle regole; quelle non USB
+        (es. /dev/ttyAMA0) vengono restituite così come sono.
+
+        Args:
+            refresh: Ignora la cache e riesegue la scansione
+        """
+        signature = self.signature()
+        cache = None if refresh else self._load_cache()
+
+        # Porte indicate a mano: quelle USB diventano identità fissate, le altre restano percorsi
+        forced, fixed = {}, {}
+        for role, path in self.overrides.items():
+            port = self.read_port(os.path.basename(os.path.realpath(path)))
+            if port is None:
+                fixed[role] = path
+            else:
+                forced[role] = port.identity
+
+        cached = cache.get('ports', {}) if cache else {}
+        if cache and cache.get('signature') == signature and self._verify(cached) and \
+                all(role in cached and UsbPort(**cached[role]).identity == identity
+                    for role, identity in forced.items()):
+            assigned = {role: UsbPort(**entry) for role, entry in cached.items()}
+            log.debug("Dispositivi dalla cache: %s", assigned)
+        else:
+            # Prima le porte indicate a mano, poi i ruoli salvati che non le contendono
+            pinned = dict(forced)
+            for role, entry in cached.items():
+                identity = UsbPort(**entry).identity
+                if role not in pinned and identity not in forced.values():
+                    pinned[role] = identity
+            roles = [role for role in self.rules if role not in fixed]
+            assigned = self.assign(self.probe(signature), pinned, roles)
+            log.info("Scansione dispositivi USB: %s", assigned or "nessun dispositivo riconosciuto")
+            self._save_cache(signature, assigned)
+        ports = {role: os.path.join(self.dev_root, port.name) for role, port in assigned.items()}
+        ports.update(fixed)
+        return ports
+
+    def lookup(self, role, refresh=False):
+        """Percorso della porta di un ruolo (DEFAULT_PORTS se non riconosciuta)"""
+        return self.resolve(refresh).get(role, DEFAULT_PORTS.get(role))
+
+
+# Per test standalone: elenca i dispositivi riconosciuti
+if __name__ == "__main__":
+    registry = DeviceRegistry()
+    for port in registry.probe():
+        print(port)
+    print(registry.resolve(refresh=True))
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - GEOFENCE
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Zone geografiche che scelgono la musica in base alla posizione GPS.
+- Poligoni da un file GeoJSON (Polygon e MultiPolygon, con buchi); le proprietà
+  di ogni zona indicano genere, intervallo di BPM e volume massimo:
+    {"name": "Piazza Navona", "genre": "reggae", "bpm": [80, 100],
+     "volume_max": 0.6, "priority": 1}
+- All'avvio le coordinate vengono proiettate in metri su un piano locale
+  (equirettangolare attorno al centro delle zone) e indicizzate in una griglia
+  uniforme: ogni cella contiene le zone il cui rettangolo la tocca; le zone più
+  grandi di MAX_CELLS celle restano in un elenco a parte, controllato sempre
+- Una posizione costa la lettura di una cella, il confronto con i rettangoli dei
+  candidati e il test punto-poligono (ray casting) solo su quelli rimasti
+- Isteresi ai confini: la zona corrente resta valida finché la posizione non è
+  oltre 'margin' metri dal suo bordo; tra zone che contengono la posizione vince
+  la priorità più alta, a parità la zona corrente, poi la più piccola
+"""
+
+import json
+import math
+from modules.logger import get_logger
+from modules.mapping import GENRES
+
+log = get_logger("geofence")
+
+# Raggio terrestre medio in metri
+EARTH_RADIUS = 6371008.8
+
+# Isteresi di default ai confini (metri): poco oltre l'errore tipico di un GPS
+DEFAULT_MARGIN = 15.0
+
+# Zone che coprono più celle di così vanno nell'elenco delle zone grandi
+MAX_CELLS = 1024
+
+
+def _ring_contains(ring, x, y):
+    """Ray casting: True se (x, y) è dentro l'anello chiuso implicitamente"""
+    inside = False
+    x0, y0 = ring[-1]
+    for x1, y1 in ring:
+        if (y1 > y) != (y0 > y) and x < (x0 - x1) * (y - y1) / (y0 - y1) + x1:
+            inside = not inside
+        x0, y0 = x1, y1
+    return inside
+
+
+def _ring_distance2(ring, x, y):
+    """Quadrato della distanza di (x, y) dal bordo dell'anello"""
+    best = float('inf')
+    x0, y0 = ring[-1]
+    for x1, y1 in ring:
+        dx, dy = x1 - x0, y1 - y0
+        length2 = dx * dx + dy * dy
+        t = ((x - x0) * dx + (y - y0) * dy) / length2 if length2 else 0.0
+        t = 0.0 if t < 0.0 else (1.0 if t > 1.0 else t)
+        ex, ey = x0 + t * dx - x, y0 + t * dy - y
+        d2 = ex * ex + ey * ey
+        if d2 < best:
+            best = d2
+        x0, y0 = x1, y1
+    return best
+
+
+def _ring_area(ring):
+    area = 0.0
+    x0, y0 = ring[-1]
+    for x1, y1 in ring:
+        area += x0 * y1 - x1 * y0
+        x0, y0 = x1, y1
+    return abs(area) / 2.0
+
+
+class Zone:
+    __slots__ = ('index', 'name', 'genre', 'bpm', 'volume_max', 'priority',
+                 'polygons', 'bbox', 'area', 'rank')
+
+    def __init__(self, index, properties, polygons):
+        """
+        Zona con i suoi poligoni già proiettati in metri
+
+        Args:
+            index: Posizione nel file (per i messaggi)
+            properties: Proprietà GeoJSON (name, genre, bpm [min, max], volume_max, priority)
+            polygons: Lista di poligoni, ognuno [anello esterno, buchi...] di punti (x, y)
+        """
+        self.index = index
+        self.name = str(properties.get('name', f"zona {index}"))
+        self.genre = properties.get('genre')
+        if self.genre is not None and self.genre not in GENRES:
+            raise ValueError(f"{self.name}: genere sconosciuto '{self.genre}'")
+        bpm = properties.get('bpm')
+        if bpm is not None:
+            bpm = (float(bpm[0]), float(bpm[1]))
+            if bpm[0] > bpm[1]:
+                raise ValueError(f"{self.name}: intervallo di BPM invertito {list(bpm)}")
+        self.bpm = bpm
+        volume_max = properties.get('volume_max')
+        self.volume_max = float(volume_max) if volume_max is not None else None
+        self.priority = properties.get('priority', 0)
+        self.polygons = polygons
+
+        xs = [x for polygon in polygons for x, _ in polygon[0]]
+        ys = [y for polygon in polygons for _, y in polygon[0]]
+        self.bbox = (min(xs), min(ys), max(xs), max(ys))
+        self.area = sum(_ring_area(polygon[0]) - sum(_ring_area(hole) for hole in polygon[1:])
+                        for polygon in polygons)
+        # A parità di priorità vince la zona più piccola (la più specifica)
+        self.rank = (self.priority, -self.area)
+
+    def __repr__(self):
+        return f"Zone({self.name!r}, genre={self.genre}, bpm={self.bpm}, volume_max={self.volume_max})"
+
+    def contains(self, x, y):
+        for polygon in self.polygons:
+            if _ring_contains(polygon[0], x, y) and not any(_ring_contains(hole, x, y) for hole in polygon[1:]):
+                return True
+        return False
+
+    def near(self, x, y, margin):
+        """True se (x, y) è a non più di margin metri dal bordo della zona"""
+        x_min, y_min, x_max, y_max = self.bbox
+        if x < x_min - margin or x > x_max + margin or y < y_min - margin or y > y_max + margin:
+            return False
+        margin2 = margin * margin
+        return any(_ring_distance2(ring, x, y) <= margin2 for polygon in self.polygons for ring in polygon)
+
+    def apply(self, values):
+        """
+        Limita i parametri musicali secondo la zona (modifica values)
+
+        Args:
+            values: Dizionario parametro -> valore; solo le chiavi presenti vengono toccate
+        """
+        if self.genre is not None and 'pattern' in values:
+            values['pattern'] = self.genre
+        if self.bpm is not None and 'bpm' in values:
+            values['bpm'] = min(max(values['bpm'], self.bpm[0]), self.bpm[1])
+        if self.volume_max is not None and 'volume' in values:
+            values['volume'] = min(values['volume'], self.volume_max)
+
+
+# Parametri del MusicEngine su cui agiscono le zone
+ZONE_PARAMS = ('pattern', 'bpm', 'volume')
+
+
+def load_zones(path):
+    """Legge una FeatureCollection GeoJSON (o una lista di Feature)"""
+    with open(path) as f:
+        return json.load(f)
+
+
+class Geofence:
+    def __init__(self, geojson, margin=DEFAULT_MARGIN, cell_size=None):
+        """
+        Proietta le zone e costruisce la griglia
+
+        Args:
+            geojson: FeatureCollection (dizionario) o lista di Feature
+            margin: Isteresi ai confini in metri
+            cell_size: Lato delle celle in metri (default: lato medio dei rettangoli delle zone)
+        """
+        features = geojson.get('features', []) if isinstance(geojson, dict) else geojson
+        shapes = []
+        for i, feature in enumerate(features):
+            geometry = feature.get('geometry') or {}
+            kind = geometry.get('type')
+            if kind == 'Polygon':
+                shapes.append((i, feature, [geometry['coordinates']]))
+            elif kind == 'MultiPolygon':
+                shapes.append((i, feature, geometry['coordinates']))
+            else:
+                log.warning("Feature %d ignorata: geometria %s", i, kind)
+
+        # Piano locale centrato sulle zone: x verso est, y verso nord, in metri
+        lons = [p[0] for _, _, polygons in shapes for polygon in polygons for p in polygon[0]]
+        lats = [p[1] for _, _, polygons in shapes for polygon in polygons for p in polygon[0]]
+        self.lon0 = (min(lons) + max(lons)) / 2 if lons else 0.0
+        self.lat0 = (min(lats) + max(lats)) / 2 if lats else 0.0
+        self.ky = math.radians(1.0) * EARTH_RADIUS
+        self.kx = self.ky * math.cos(math.radians(self.lat0))
+
+        self.zones = []
+        for i, feature, polygons in shapes:
+            projected = [[self._project_ring(ring) for ring in polygon] for polygon in polygons]
+            self.zones.append(Zone(i, feature.get('properties') or {}, projected))
+
+        self.margin = margin
+        if cell_size is None:
+            sides = [max(z.bbox[2] - z.bbox[0], z.bbox[3] - z.bbox[1]) for z in self.zones]
+            cell_size = sum(sides) / len(sides) if sides else 100.0
+        self.cell_size = max(float(cell_size), 1.0)
+        self.inv_cell = 1.0 / self.cell_size
+
+        # Griglia sparsa: (colonna, riga) -> tupla di zone; le zone enormi a parte
+        cells = {}
+        self.large = []
+        for zone in self.zones:
+            x_min, y_min, x_max, y_max = zone.bbox
+            c0, c1 = math.floor(x_min * self.inv_cell), math.floor(x_max * self.inv_cell)
+            r0, r1 = math.floor(y_min * self.inv_cell), math.floor(y_max * self.inv_cell)
+            if (c1 - c0 + 1) * (r1 - r0 + 1) > MAX_CELLS:
+                self.large.append(zone)
+                continue
+            for c in range(c0, c1 + 1):
+                for r in range(r0, r1 + 1):
+                    cells.setdefault((c, r), []).append(zone)
+        self.cells = {key: tuple(zones) for key, zones in cells.items()}
+        self.large = tuple(self.large)
+
+        self.zone = None
+        self.stats = {"updates": 0, "changes": 0, "held": 0}
+        log.info("%d zone, %d celle da %.0f m, %d zone grandi",
+                 len(self.zones), len(self.cells), self.cell_size, len(self.large))
+
+    def _project_ring(self, ring):
+        points = [self.project(lat, lon) for lon, lat in (p[:2] for p in ring)]
+        if len(points) > 1 and points[0] == points[-1]:
+            points.pop()        # GeoJSON ripete il primo punto
+        if len(points) < 3:
+            raise ValueError("Anello con meno di tre punti")
+        return tuple(points)
+
+    def project(self, lat, lon):
+        """Coordinate (x, y) in metri sul piano locale"""
+        return (lon - self.lon0) * self.kx, (lat - self.lat0) * self.ky
+
+    def _candidates(self, x, y):
+        cell = self.cells.get((math.floor(x * self.inv_cell), math.floor(y * self.inv_cell)), ())
+        return cell + self.large if self.large else cell
+
+    def locate(self, lat, lon):
+        """
+        Zona che contiene la posizione, senza isteresi
+
+        Returns:
+            Zone con la priorità più alta (a parità la più piccola), o None
+        """
+        x, y = self.project(lat, lon)
+        best = None
+        for zone in self._candidates(x, y):
+            x_min, y_min, x_max, y_max = zone.bbox
+            if x_min <= x <= x_max and y_min <= y <= y_max and (best is None or zone.rank > best.rank) \
+                    and zone.contains(x, y):
+                best = zone
+        return best
+
+    def update(self, lat, lon):
+        """
+        Zona corrente dopo un nuovo fix, con l'isteresi ai confini
+
+        Args:
+            lat, lon: Posizione in gradi decimali
+
+        Returns:
+            Zone corrente o None fuori da tutte le zone
+        """
+        self.stats["updates"] += 1
+        x, y = self.project(lat, lon)
+        current = self.zone
+        best = None
+        for zone in self._candidates(x, y):
+            if zone is current:
+                continue
+            x_min, y_min, x_max, y_max = zone.bbox
+            if x_min <= x <= x_max and y_min <= y <= y_max and (best is None or zone.rank > best.rank) \
+                    and zone.contains(x, y):
+                best = zone
+
+        if current is not None and (best is None or best.priority <= current.priority):
+            if current.contains(x, y):
+                return current
+            if current.near(x, y, self.margin):
+                # Appena fuori dal bordo: la zona resta quella corrente
+                self.stats["held"] += 1
+                return current
+        if best is not current:
+            self.zone = best
+            self.stats["changes"] += 1
+            log.info("Zona: %s -> %s", current.name if current else "nessuna", best.name if best else "nessuna")
+        return best
+
+    def clear(self):
+        """Posizione non più nota (fix perso): nessuna zona corrente, anche senza isteresi"""
+        if self.zone is not None:
+            log.info("Zona: %s -> nessuna (posizione non disponibile)", self.zone.name)
+            self.zone = None
+            self.stats["changes"] += 1
+        return None
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["zone"] = self.zone.name if self.zone else None
+        stats["zones"] = len(self.zones)
+        stats["cells"] = len(self.cells)
+        return stats
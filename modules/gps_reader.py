@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - GPS READER
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Lettore GPS con parser NMEA a flusso.
+- Legge dalla seriale a blocchi e accumula in un buffer riutilizzato
+- Verifica il checksum solo delle frasi che usiamo (RMC, VTG, GGA)
+- Estrae i campi cercando le virgole nel buffer, senza split per ogni frase
+- Pubblica una GPSSnapshot immutabile con timestamp e qualità del fix
+- Senza fix (RMC 'V', VTG 'N', GGA qualità 0) velocità e posizione tornano a None:
+  chi le usa non resta agganciato all'ultimo valore buono
+"""
+
+import threading
+import time
+import logging
+import serial
+from modules.snapshot import GPSSnapshot
+from modules.session_recorder import SOURCE_GPS
+from modules.logger import get_logger, Throttle, trace, EVT_GPS, EVT_ERROR
+from modules import metrics
+
+log = get_logger("gps")
+
+KNOTS_TO_KMH = 1.852
+
+# Cifra esadecimale ASCII -> valore (-1 se non valida)
+_HEX = [-1] * 256
+for _i, _c in enumerate(b'0123456789ABCDEF'):
+    _HEX[_c] = _i
+for _i, _c in enumerate(b'abcdef'):
+    _HEX[_c] = 10 + _i
+
+MAX_SENTENCE = 96   # NMEA 0183: massimo 82 caratteri, con un po' di margine
+
+
+def nmea_checksum(buf, start, end):
+    """
+    XOR di tutti i byte tra start ed end
+
+    I byte vengono letti come un unico intero e ripiegati a metà finché resta
+    un solo byte: poche operazioni su interi invece di un ciclo per byte.
+    """
+    width = end - start
+    if width <= 0:
+        return 0
+    value = int.from_bytes(buf[start:end], 'little')
+    while width > 1:
+        half = (width + 1) >> 1
+        bits = half << 3
+        value = (value & ((1 << bits) - 1)) ^ (value >> bits)
+        width = half
+    return value
+
+
+def _parse_coord(buf, start, end, hemi):
+    """Coordinata NMEA (d)ddmm.mmmm + emisfero -> gradi decimali"""
+    raw = float(buf[start:end])
+    degrees = int(raw / 100)
+    value = degrees + (raw - degrees * 100) / 60.0
+    if hemi in (0x53, 0x57):  # 'S' o 'W'
+        value = -value
+    return value
+
+
+class NmeaParser:
+    def __init__(self):
+        """Parser a flusso: accetta blocchi arbitrari di byte e aggiorna lo stato GPS"""
+        self.buffer = bytearray()
+        self.sentences = 0      # Frasi complete viste
+        self.decoded = 0        # Frasi usate (RMC/VTG/GGA) con checksum valido
+        self.checksum_errors = 0
+        self.overflows = 0
+        self.truncated = 0      # Frasi interrotte da un nuovo '$' (riapertura, '\n' perso)
+
+        # Stato corrente (da cui si costruiscono le istantanee)
+        self.speed = None
+        self.lat = None
+        self.lon = None
+        self.fix_quality = 0
+        self.satellites = 0
+        self.valid = False
+
+    def feed(self, data):
+        """
+        Elabora i byte ricevuti
+
+        Returns:
+            Numero di frasi utili decodificate in questo blocco
+        """
+        buf = self.buffer
+        buf += data
+        decoded = 0
+        pos = 0
+        while True:
+            start = buf.find(b'$', pos)
+            if start < 0:
+                pos = len(buf)
+                break
+            end = buf.find(b'\n', start)
+            if end < 0:
+                if len(buf) - start > MAX_SENTENCE:
+                    # Frase senza terminatore: scarta e risincronizza
+                    self.overflows += 1
+                    pos = start + 1
+                    continue
+                pos = start
+                break
+            restart = buf.rfind(b'$', start + 1, end)
+            if restart >= 0:
+                # Frase troncata: la frase valida comincia dall'ultimo '$'
+                self.truncated += 1
+                start = restart
+            if end - start <= MAX_SENTENCE:
+                self.sentences += 1
+                decoded += self._parse_sentence(buf, start, end)
+            else:
+                self.overflows += 1
+            pos = end + 1
+        del buf[:pos]
+        self.decoded += decoded
+        return decoded
+
+    def _fields(self, buf, start, star, count):
+        """Posizioni delle prime count virgole della frase (quelle mancanti valgono star)"""
+        commas = []
+        find = buf.find
+        pos = start
+        for _ in range(count):
+            pos = find(b',', pos, star)
+            if pos < 0:
+                commas.extend([star] * (count - len(commas)))
+                break
+            commas.append(pos)
+            pos += 1
+        return commas
+
+    def _parse_sentence(self, buf, start, end):
+        """Decodifica una frase $....*hh se è di un tipo usato; restituisce 1 se valida"""
+        # Tipo frase dopo il talker ($GP, $GN, $GL, ...)
+        kind = start + 3
+        if buf.startswith(b'RMC', kind):
+            fields = 10
+        elif buf.startswith(b'VTG', kind):
+            fields = 9
+        elif buf.startswith(b'GGA', kind):
+            fields = 8
+        else:
+            return 0
+
+        star = buf.rfind(b'*', start, end)
+        if star < 0 or star + 2 >= end:
+            self.checksum_errors += 1
+            return 0
+        high = _HEX[buf[star + 1]]
+        low = _HEX[buf[star + 2]]
+        if high < 0 or low < 0 or nmea_checksum(buf, start + 1, star) != (high << 4 | low):
+            self.checksum_errors += 1
+            return 0
+
+        c = self._fields(buf, start, star, fields)
+        try:
+            if fields == 10:
+                # RMC: 1 ora, 2 stato, 3-4 lat, 5-6 lon, 7 velocità (nodi)
+                self.valid = buf[c[1] + 1] == 0x41  # 'A'
+                if self.valid:
+                    if c[3] - c[2] > 1:
+                        self.lat = _parse_coord(buf, c[2] + 1, c[3], buf[c[3] + 1])
+                        self.lon = _parse_coord(buf, c[4] + 1, c[5], buf[c[5] + 1])
+                    if c[7] - c[6] > 1:
+                        self.speed = float(buf[c[6] + 1:c[7]]) * KNOTS_TO_KMH
+                else:
+                    # Fix perso: niente ultimi valori buoni spacciati per correnti
+                    self.speed = self.lat = self.lon = None
+            elif fields == 9:
+                # VTG: 7 velocità in km/h, 9 modo (NMEA 2.3, 'N' = dato non valido)
+                if c[8] + 1 < star and buf[c[8] + 1] == 0x4E:  # 'N'
+                    self.speed = None
+                elif c[7] - c[6] > 1:
+                    self.speed = float(buf[c[6] + 1:c[7]])
+            else:
+                # GGA: 2-3 lat, 4-5 lon, 6 qualità fix, 7 satelliti
+                self.fix_quality = int(buf[c[5] + 1:c[6]]) if c[6] - c[5] > 1 else 0
+                self.satellites = int(buf[c[6] + 1:c[7]]) if c[7] - c[6] > 1 else 0
+                if not self.fix_quality:
+                    self.lat = self.lon = None
+                elif c[2] - c[1] > 1:
+                    self.lat = _parse_coord(buf, c[1] + 1, c[2], buf[c[2] + 1])
+                    self.lon = _parse_coord(buf, c[3] + 1, c[4], buf[c[4] + 1])
+        except (ValueError, IndexError):
+            self.checksum_errors += 1
+            return 0
+        return 1
+
+    def get_stats(self):
+        """Restituisce i contatori del parser"""
+        return {
+            'sentences': self.sentences,
+            'decoded': self.decoded,
+            'checksum_errors': self.checksum_errors,
+            'overflows': self.overflows,
+            'truncated': self.truncated
+        }
+
+
+class GPSReader:
+    def __init__(self, port='/dev/ttyUSB1', baudrate=9600, events=None,
+                 serial_port=None, recorder=None, registry=None, reactor=None):
+        """
+        Inizializza il lettore GPS
+
+        Args:
+            port: Porta seriale del GPS
+            baudrate: Velocità di comunicazione (9600 per i moduli NMEA comuni)
+            events: SensorEvents opzionale su cui pubblicare ogni nuova istantanea
+            serial_port: Oggetto già aperto compatibile con serial.Serial (riproduzione, benchmark)
+            recorder: SessionRecorder opzionale su cui registrare i byte letti
+            registry: DeviceRegistry opzionale per ritrovare la porta dopo una disconnessione
+            reactor: SerialReactor opzionale che serve la porta al posto del thread dedicato
+        """
+        self.port = port
+        self.baudrate = baudrate
+        self.events = events
+        self.serial_port = serial_port
+        self.recorder = recorder
+        self.registry = registry
+        self.reactor = reactor
+        self.serial = None
+        self.running = False
+        self.thread = None
+        self.parser = NmeaParser()
+        self.opened = False
+
+        # Ultima istantanea: sostituita in blocco, mai modificata
+        self.snapshot = GPSSnapshot(0)
+
+        # Impostato alla prima frase utile decodificata
+        self.ready = threading.Event()
+
+        metrics.GPS_SENTENCES.set_function(lambda: self.parser.decoded)
+        metrics.GPS_ERRORS.set_function(lambda: self.parser.checksum_errors)
+
+        self.error_throttle = Throttle(interval=5.0)
+        self.debug_throttle = Throttle(interval=1.0)
+
+    @property
+    def speed(self):
+        """Velocità corrente in km/h (None se sconosciuta)"""
+        return self.snapshot.speed
+
+    def start(self):
+        """Avvia il thread di lettura"""
+        if not self.running:
+            self.running = True
+            if self.reactor is not None and self.serial_port is None:
+                resolve = (lambda: self.registry.lookup('gps')) if self.registry else None
+                self.reactor.add('gps', self.port, self._on_data, self.baudrate,
+                                 resolve=resolve, on_state=self._on_state)
+                print(f"[GPS] Porta {self.port} registrata sul reactor")
+                return
+            self.thread = threading.Thread(target=self._read_thread)
+            self.thread.daemon = True
+            self.thread.start()
+            print(f"[GPS] Thread di lettura avviato ({self.port if self.serial_port is None else 'porta fornita'})")
+
+    def stop(self):
+        """Ferma il thread di lettura"""
+        self.running = False
+        if self.reactor is not None:
+            self.reactor.remove('gps')
+        if self.thread:
+            self.thread.join(timeout=1.5)
+        if self.serial and self.serial_port is None:
+            self.serial.close()
+        self.serial = None
+        print("[GPS] Arrestato")
+
+    def get_data(self):
+        """Restituisce i dati GPS correnti come dizionario"""
+        return self.snapshot.as_dict()
+
+    def get_snapshot(self):
+        """Restituisce l'ultima istantanea (lettura senza lock né allocazioni)"""
+        return self.snapshot
+
+    def get_data_if_newer(self, seq):
+        """Restituisce l'istantanea solo se più recente di seq, altrimenti None"""
+        snapshot = self.snapshot
+        if snapshot.seq > seq:
+            return snapshot
+        return None
+
+    def _open(self):
+        """Apre la porta seriale; restituisce True se riuscito"""
+        if self.serial_port is not None:
+            self.serial = self.serial_port
+            return True
+        if self.registry and self.opened:
+            # Riapertura dopo un errore: la porta può aver cambiato nome (hotplug)
+            self.port = self.registry.lookup('gps')
+        self.opened = True
+        try:
+            self.serial = serial.Serial(self.port, self.baudrate, timeout=1.0)
+            print(f"[GPS] Porta {self.port} aperta con successo")
+            return True
+        except Exception as e:
+            self.serial = None
+            if self.error_throttle():
+                log.error("Errore apertura porta %s: %s", self.port, e)
+            return False
+
+    def _publish(self, arrival):
+        """Costruisce e pubblica l'istantanea dallo stato del parser"""
+        parser = self.parser
+        snapshot = GPSSnapshot(self.snapshot.seq + 1, arrival, parser.speed, parser.lat, parser.lon,
+                               parser.fix_quality, parser.satellites, parser.valid)
+        self.snapshot = snapshot
+        if snapshot.seq == 1:
+            self.ready.set()
+        trace(EVT_GPS, int((snapshot.speed or 0) * 100), snapshot.fix_quality, snapshot.satellites)
+        if log.isEnabledFor(logging.DEBUG) and self.debug_throttle():
+            log.debug("%s | %s", snapshot, parser.get_stats())
+        if self.events:
+            self.events.publish('gps', arrival)
+
+    def _on_data(self, chunk, arrival):
+        """Elabora un blocco di byte letto dalla porta (dal thread di lettura o dal reactor)"""
+        if self.recorder:
+            self.recorder.write(SOURCE_GPS, chunk)
+        if self.parser.feed(chunk):
+            self._publish(arrival)
+
+    def _on_state(self, connected):
+        """Connessione/disconnessione segnalata dal reactor"""
+        if not connected:
+            # Frase troncata della connessione precedente: da scartare
+            self.parser.buffer.clear()
+
+    def _read_thread(self):
+        """Thread che legge la seriale a blocchi e decodifica le frasi NMEA"""
+        while self.running:
+            if self.serial is None and not self._open():
+                time.sleep(1.0)
+                continue
+            try:
+                chunk = self.serial.read(max(1, self.serial.in_waiting))
+                if not chunk:
+                    continue
+                self._on_data(chunk, time.perf_counter())
+            except Exception as e:
+                trace(EVT_ERROR, 3)
+                if self.error_throttle():
+                    log.error("Errore lettura seriale: %s", e)
+                self.parser.buffer.clear()
+                if self.serial_port is None and self.serial:
+                    self.serial.close()
+                    self.serial = None
+                time.sleep(1.0)
+
+
+# Per test standalone
+if __name__ == "__main__":
+    reader = GPSReader()
+    reader.start()
+    try:
+        while True:
+            print(f"GPS: {reader.get_data()} | {reader.parser.get_stats()}")
+            time.sleep(1)
+    except KeyboardInterrupt:
+        reader.stop()
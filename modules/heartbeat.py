@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - HEARTBEAT
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Heartbeat a richiesta/risposta verso sclang, al posto del keepalive /test.
+- Python invia /carretto/hb <seq> a tutte le destinazioni dal socket del fanout
+- sclang risponde al mittente con /carretto/hb/reply <seq> <sessione>, senza
+  creare synth né nodi sul server audio
+- Per ogni destinazione: RTT, assenza (nessuna risposta per timeout secondi) e
+  riavvio (identificativo di sessione diverso)
+- Alla prima risposta, al ritorno dopo un'assenza e dopo un riavvio quella
+  destinazione ha perso lo stato: viene chiamato on_resync(destinazione)
+"""
+
+import select
+import threading
+import time
+from pythonosc import osc_message_builder
+from pythonosc.osc_message import OscMessage
+from modules.logger import get_logger
+from modules import metrics
+
+log = get_logger("heartbeat")
+
+PING_ADDRESS = "/carretto/hb"
+REPLY_ADDRESS = "/carretto/hb/reply"
+
+
+class Heartbeat:
+    def __init__(self, fanout, interval=1.0, timeout=None, on_resync=None):
+        """
+        Inizializza il heartbeat
+
+        Args:
+            fanout: OscFanout: destinazioni e socket da cui partono i ping e arrivano le risposte
+            interval: Secondi tra due ping
+            timeout: Secondi senza risposta dopo i quali una destinazione è assente (default 3 ping)
+            on_resync: Funzione chiamata con la destinazione da risincronizzare
+        """
+        self.fanout = fanout
+        self.interval = interval
+        self.timeout = timeout if timeout is not None else 3 * interval
+        self.on_resync = on_resync
+
+        self.running = False
+        self.thread = None
+
+        # Ping inviati e non ancora scaduti: seq -> istante di invio (perf_counter)
+        self.seq = 0
+        self.pending = {}
+
+        self.stats = {"pings": 0, "replies": 0, "late": 0, "timeouts": 0, "restarts": 0, "resyncs": 0}
+
+        targets = fanout.targets
+        metrics.SC_ALIVE.set_function(lambda: sum(1 for t in targets if t.alive))
+        metrics.SC_RESTARTS.set_function(lambda: self.stats["restarts"])
+
+    @property
+    def alive(self):
+        """True se tutte le destinazioni rispondono"""
+        return all(target.alive for target in self.fanout.targets)
+
+    def start(self):
+        """Avvia il thread che invia i ping e riceve le risposte"""
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name="heartbeat", daemon=True)
+            self.thread.start()
+            print(f"[HEARTBEAT] Ping a {len(self.fanout.targets)} destinazioni ogni {self.interval:g} s, "
+                  f"risposte sulla porta {self.fanout.local_port}")
+
+    def stop(self):
+        """Ferma il thread"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=self.interval + 1.0)
+
+    def _send_ping(self, now):
+        self.seq = (self.seq + 1) & 0x7FFFFFFF
+        msg = osc_message_builder.OscMessageBuilder(address=PING_ADDRESS)
+        msg.add_arg(self.seq)
+        self.fanout.send(msg.build().dgram)
+        self.pending[self.seq] = now
+        self.stats["pings"] += 1
+        # Le risposte più vecchie del timeout non servono più
+        for seq in [s for s, sent in self.pending.items() if now - sent > self.timeout]:
+            del self.pending[seq]
+
+    def _on_reply(self, data, addr, now):
+        target = self.fanout.target_for(addr)
+        if target is None:
+            return
+        try:
+            message = OscMessage(data)
+        except Exception:
+            return
+        if message.address != REPLY_ADDRESS or len(message.params) < 2:
+            return
+        seq, session = message.params[0], message.params[1]
+
+        sent = self.pending.get(seq)
+        if sent is None or seq == target.last_seq:
+            self.stats["late"] += 1
+            return
+        target.last_seq = seq
+        self.stats["replies"] += 1
+        target.last_rtt = now - sent
+        target.rtt.add(target.last_rtt)
+        metrics.HEARTBEAT_RTT.observe(target.last_rtt)
+        target.last_reply = now
+
+        resync = False
+        if not target.alive:
+            target.alive = True
+            resync = True
+            log.info("%s raggiungibile (sessione %s, RTT %.2f ms)", target.name, session, target.last_rtt * 1000)
+        if session != target.session:
+            if target.session is not None:
+                target.restarts += 1
+                self.stats["restarts"] += 1
+                log.warning("sclang su %s riavviato (sessione %s -> %s)", target.name, target.session, session)
+            target.session = session
+            resync = True
+        if resync:
+            self._resync(target)
+
+    def _resync(self, target):
+        self.stats["resyncs"] += 1
+        if self.on_resync:
+            try:
+                self.on_resync(target)
+            except Exception as e:
+                log.error("Errore nella risincronizzazione di %s: %s", target.name, e)
+
+    def _check_timeouts(self, now):
+        for target in self.fanout.targets:
+            if target.alive and now - target.last_reply > self.timeout:
+                target.alive = False
+                target.timeouts += 1
+                self.stats["timeouts"] += 1
+                log.warning("Nessuna risposta da %s da %.1f s", target.name, now - target.last_reply)
+
+    def _run(self):
+        sock = self.fanout.sock
+        next_ping = time.perf_counter()
+        while self.running:
+            now = time.perf_counter()
+            if now >= next_ping:
+                self._send_ping(now)
+                next_ping = now + self.interval
+            self._check_timeouts(now)
+
+            # Attende le risposte fino al prossimo ping: l'RTT è misurato all'arrivo
+            try:
+                readable, _, _ = select.select([sock], [], [], max(0.001, next_ping - now))
+            except (OSError, ValueError):
+                break       # Socket chiuso in arresto
+            if not readable:
+                continue
+            while True:
+                try:
+                    data, addr = sock.recvfrom(1024)
+                except BlockingIOError:
+                    break
+                except OSError:
+                    # Errore ICMP di una destinazione (porta chiusa): riguarda solo quella
+                    break
+                self._on_reply(data, addr, time.perf_counter())
+
+    def get_stats(self):
+        """Contatori e stato per destinazione"""
+        stats = dict(self.stats)
+        stats["targets"] = {target.name: {"alive": target.alive, "session": target.session,
+                                          "rtt": target.rtt.summary()}
+                            for target in self.fanout.targets}
+        return stats
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - LOGGING
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Logging a basso costo per i percorsi caldi (lettura seriale -> invio OSC).
+- Livelli per modulo sopra il modulo standard logging ("carretto.arduino", ...)
+- Formattazione pigra: i messaggi usano argomenti %-style e vengono
+  formattati solo se il livello è attivo
+- Throttle per i messaggi per-pacchetto: limitati nel tempo e/o campionati
+- Ring buffer binario opzionale con record a dimensione fissa, scaricabile a richiesta
+"""
+
+import logging
+import struct
+import sys
+import time
+
+ROOT = "carretto"
+
+# Codici evento del ring buffer
+EVT_FRAME = 1       # a-d = valori raw dei 4 potenziometri
+EVT_SEND = 2        # a = parametri nel bundle, b = latenza in microsecondi
+EVT_RESYNC = 3      # a = risincronizzazioni totali
+EVT_ERROR = 4       # a = codice errore del modulo
+EVT_GPS = 5         # a = velocità in centesimi di km/h, b = qualità fix
+
+EVENT_NAMES = {
+    EVT_FRAME: "FRAME",
+    EVT_SEND: "SEND",
+    EVT_RESYNC: "RESYNC",
+    EVT_ERROR: "ERROR",
+    EVT_GPS: "GPS"
+}
+
+
+class _PrefixFormatter(logging.Formatter):
+    """Mantiene il formato storico dei messaggi: [MODULO] testo"""
+
+    def format(self, record):
+        record.prefix = record.name.rsplit('.', 1)[-1].upper()
+        return super().format(record)
+
+
+def get_logger(name):
+    """Restituisce il logger di un modulo (es. 'arduino' -> 'carretto.arduino')"""
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+def configure(level="INFO", module_levels=None, ring_size=0, stream=None):
+    """
+    Configura il logging del carretto
+
+    Args:
+        level: Livello predefinito (DEBUG, INFO, WARNING, ...)
+        module_levels: Dizionario modulo -> livello (es. {'arduino': 'DEBUG'})
+        ring_size: Record del ring buffer binario (0 = disattivato)
+        stream: Destinazione dei messaggi (default stdout)
+    """
+    root = logging.getLogger(ROOT)
+    root.handlers.clear()
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(_PrefixFormatter("[%(prefix)s] %(message)s"))
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.propagate = False
+
+    for name, module_level in (module_levels or {}).items():
+        get_logger(name).setLevel(module_level.upper() if isinstance(module_level, str) else module_level)
+
+    global _ring
+    _ring = EventRing(ring_size) if ring_size > 0 else None
+    return _ring
+
+
+class Throttle:
+    def __init__(self, interval=0.0, every=1):
+        """
+        Filtro per i messaggi ad alta frequenza
+
+        Args:
+            interval: Secondi minimi tra due messaggi (0 = nessun limite di tempo)
+            every: Lascia passare un messaggio ogni N chiamate (campionamento)
+        """
+        self.interval = interval
+        self.every = max(1, every)
+        self.count = 0
+        self.suppressed = 0
+        self.next_time = 0.0
+
+    def __call__(self):
+        """True se il messaggio può essere emesso ora"""
+        self.count += 1
+        if self.count % self.every:
+            self.suppressed += 1
+            return False
+        if self.interval:
+            now = time.monotonic()
+            if now < self.next_time:
+                self.suppressed += 1
+                return False
+            self.next_time = now + self.interval
+        return True
+
+
+class EventRing:
+    # timestamp (double), codice (uint16), 4 valori interi (int32)
+    RECORD = struct.Struct('<dH2xiiii')
+
+    def __init__(self, size):
+        """
+        Ring buffer binario preallocato: nessuna allocazione durante la registrazione
+
+        Args:
+            size: Numero di record conservati
+        """
+        self.size = size
+        self.data = bytearray(size * self.RECORD.size)
+        self.index = 0      # Record totali scritti
+
+    def record(self, code, a=0, b=0, c=0, d=0):
+        """Scrive un record sovrascrivendo il più vecchio"""
+        offset = (self.index % self.size) * self.RECORD.size
+        self.RECORD.pack_into(self.data, offset, time.time(), code, a, b, c, d)
+        self.index += 1
+
+    def records(self):
+        """Restituisce i record in ordine cronologico"""
+        count = min(self.index, self.size)
+        start = self.index - count
+        unpack = self.RECORD.unpack_from
+        return [unpack(self.data, ((start + i) % self.size) * self.RECORD.size) for i in range(count)]
+
+    def dump(self, stream=None):
+        """Scrive i record in formato testo"""
+        stream = stream or sys.stderr
+        records = self.records()
+        stream.write(f"=== RING BUFFER: {len(records)} record (su {self.index} totali) ===\n")
+        for timestamp, code, a, b, c, d in records:
+            stamp = time.strftime('%H:%M:%S', time.localtime(timestamp))
+            millis = int((timestamp % 1) * 1000)
+            stream.write(f"{stamp}.{millis:03d} {EVENT_NAMES.get(code, code):6s} {a} {b} {c} {d}\n")
+        stream.flush()
+
+    def save(self, path):
+        """Salva i record grezzi in un file binario"""
+        with open(path, 'wb') as f:
+            for record in self.records():
+                f.write(self.RECORD.pack(*record))
+
+
+_ring = None
+
+
+def trace(code, a=0, b=0, c=0, d=0):
+    """Registra un evento nel ring buffer, se attivo (costo trascurabile altrimenti)"""
+    if _ring is not None:
+        _ring.record(code, a, b, c, d)
+
+
+def get_ring():
+    """Restituisce il ring buffer attivo o None"""
+    return _ring
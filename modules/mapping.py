@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - MAPPING
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Mappatura dichiarativa dagli ingressi (potenziometri, velocità GPS) ai parametri musicali.
+Ogni parametro di uscita è un termine (o la somma di più termini, con limiti) su una sorgente:
+    linear   spezzata per punti [[x, y], ...], costante oltre gli estremi (senza punti: identità)
+    exp      curva esponenziale da min a max sull'intervallo della sorgente
+    bins     indice discreto (con margine di isteresi) ed eventuale lista di valori;
+             'index' indica un ingresso che contiene già l'indice (es. genre_idx
+             calcolato con isteresi da SignalFilter)
+All'avvio ogni termine viene compilato nella forma più economica da valutare:
+- retta tra due punti (la mappatura predefinita): y0 + (x - x0) * pendenza, esatta
+  per qualsiasi valore filtrato, con i coefficienti in una tupla e nessuna chiamata
+- intervalli: la posizione nell'intervallo, con l'isteresi del filtro Hysteresis
+- exp e spezzate con più segmenti: tabella di TABLE_SIZE voci per i potenziometri
+  (una per valore grezzo dei pacchetti v2 a 10 bit) o densa per la velocità (intervallo
+  e passo in DENSE_SOURCES), letta con interpolazione lineare tra due voci
+
+Esempio di configurazione JSON (--mapping FILE) con il BPM legato alla velocità:
+    "bpm": {"sum": [{"source": "pot2", "curve": "linear", "points": [[0, 60], [1, 120]]},
+                    {"source": "speed", "curve": "linear", "points": [[0, 0], [20, 60]]}],
+            "clip": [60, 180]}
+"""
+
+import json
+
+# Voci delle tabelle dei potenziometri: una per valore grezzo dei pacchetti v2 (0-1023)
+TABLE_SIZE = 1024
+
+# Sorgenti non normalizzate: intervallo e passo della tabella densa
+DENSE_SOURCES = {
+    'speed': {'range': [0.0, 100.0], 'step': 0.1}     # km/h
+}
+
+GENRES = ["dub", "techno", "reggae", "house", "drumandbass", "ambient", "random"]
+
+# Parametro musicale (chiave di MusicEngine.current_values) -> mappatura.
+# Riproduce la mappatura storica del MusicEngine: BPM = 60 + pot2 * 120,
+# genere = int(pot3 * 6.99), pattern = int(pot4 * 3.99), velocità inoltrata
+DEFAULT_MAPPING = {
+    'volume': {'source': 'pot1', 'curve': 'linear', 'points': [[0, 0], [1, 1]]},
+    'bpm': {'source': 'pot2', 'curve': 'linear', 'points': [[0, 60], [1, 180]]},
+    'pattern': {'source': 'pot3', 'curve': 'bins', 'bins': 7, 'values': GENRES, 'index': 'genre_idx'},
+    'tune': {'source': 'pot3', 'curve': 'linear', 'points': [[0, 0], [1, 1]]},
+    'patternIdx': {'source': 'pot4', 'curve': 'bins', 'bins': 4, 'index': 'pattern_idx'},
+    'speed': {'source': 'speed', 'curve': 'linear', 'points': [[0, 0], [100, 100]]}
+}
+
+
+def _linear(points):
+    points = sorted(points)
+
+    def curve(x):
+        if x <= points[0][0]:
+            return points[0][1]
+        for (x0, y0), (x1, y1) in zip(points, points[1:]):
+            if x <= x1:
+                return y0 + (x - x0) * (y1 - y0) / (x1 - x0) if x1 != x0 else y1
+        return points[-1][1]
+    return curve
+
+
+def _exp(low, high, minimum, maximum):
+    if minimum <= 0 or maximum <= 0:
+        raise ValueError("La curva exp richiede min e max positivi")
+    ratio = maximum / minimum
+    return lambda x: minimum * ratio ** ((x - low) / (high - low))
+
+
+def _range(spec):
+    """Intervallo della sorgente: 0.0-1.0 per i potenziometri, da DENSE_SOURCES per le altre"""
+    dense = DENSE_SOURCES.get(spec['source'])
+    if dense:
+        low, high = spec.get('range', dense['range'])
+        return float(low), float(high)
+    return 0.0, 1.0
+
+
+def _missing(term, inputs):
+    """Sorgente assente da questo pacchetto: l'ultimo valore visto; presente ma None
+    (es. velocità dopo la perdita del fix): nessun valore, anche per i pacchetti dopo"""
+    if term.source in inputs:
+        term.value = None
+    return term.value
+
+
+class _Line:
+    """Retta tra due punti, costante oltre gli estremi: calcolata, non tabulata"""
+    __slots__ = ('source', 'x0', 'x1', 'y0', 'slope', 'value')
+
+    def __init__(self, spec, points):
+        (x0, y0), (x1, y1) = sorted(points)
+        self.source = spec['source']
+        self.x0, self.x1, self.y0 = x0, x1, y0
+        self.slope = (y1 - y0) / (x1 - x0) if x1 != x0 else 0.0
+        self.value = None
+
+    def __call__(self, inputs):
+        x = inputs.get(self.source)
+        if x is None:
+            return _missing(self, inputs)
+        x0, x1 = self.x0, self.x1
+        self.value = self.y0 + ((x0 if x < x0 else (x1 if x > x1 else x)) - x0) * self.slope
+        return self.value
+
+
+class _Curve:
+    """Curva tabulata (exp, spezzata con più segmenti) letta con interpolazione lineare"""
+    __slots__ = ('source', 'table', 'deltas', 'scale', 'offset', 'top', 'value')
+
+    def __init__(self, spec):
+        self.source = spec['source']
+        low, high = _range(spec)
+        dense = DENSE_SOURCES.get(self.source)
+        if dense:
+            size = int(round((high - low) / spec.get('step', dense['step']))) + 1
+        else:
+            size = TABLE_SIZE
+        xs = [low + (high - low) * i / (size - 1) for i in range(size)]
+        if spec.get('curve', 'linear') == 'linear':
+            curve = _linear(spec['points'])
+        else:
+            curve = _exp(low, high, spec['min'], spec['max'])
+        self.table = tuple(curve(x) for x in xs)
+        self.deltas = tuple(b - a for a, b in zip(self.table, self.table[1:])) + (0.0,)
+        # posizione nella tabella = x * scale - offset
+        self.scale = (size - 1) / (high - low)
+        self.offset = low * self.scale
+        self.top = size - 1
+        self.value = None
+
+    def at(self, x):
+        f = x * self.scale - self.offset
+        if f <= 0.0:
+            return self.table[0]
+        if f >= self.top:
+            return self.table[self.top]
+        i = int(f)
+        return self.table[i] + self.deltas[i] * (f - i)
+
+    def __call__(self, inputs):
+        x = inputs.get(self.source)
+        if x is None:
+            return _missing(self, inputs)
+        self.value = self.at(x)
+        return self.value
+
+
+class _Bins:
+    """Indice discreto con isteresi: posizione = x riportato su [0, scale), come il filtro
+    Hysteresis; l'indice cambia solo oltre margin dai bordi di quello corrente"""
+    __slots__ = ('source', 'low', 'factor', 'bins', 'margin', 'values', 'table', 'index_key',
+                 'last_index', 'value', 'changes')
+
+    def __init__(self, spec):
+        self.source = spec['source']
+        low, high = _range(spec)
+        bins = spec['bins']
+        scale = spec.get('scale', bins - 0.01)     # Come int(v * 6.99) per 7 generi
+        self.low = low
+        self.factor = scale / (high - low)
+        self.bins = bins
+        self.margin = spec.get('margin', 0.0)
+        self.values = spec.get('values')
+        if self.values is not None and len(self.values) != bins:
+            raise ValueError(f"{self.source}: {bins} intervalli ma {len(self.values)} valori")
+        self.table = self.values or tuple(range(bins))
+        self.index_key = spec.get('index')
+        self.last_index = None
+        self.value = None
+        self.changes = 0
+
+    def index_of(self, x, index):
+        """Nuovo indice per il valore x partendo dall'indice corrente (None = nessuno)"""
+        position = (x - self.low) * self.factor
+        if index is None or position < index - self.margin or position >= index + 1 + self.margin:
+            index = int(position)
+            index = 0 if index < 0 else (self.bins - 1 if index >= self.bins else index)
+        return index
+
+    def __call__(self, inputs):
+        index = inputs.get(self.index_key) if self.index_key else None
+        if index is None:
+            x = inputs.get(self.source)
+            if x is None:
+                if self.source in inputs:
+                    self.last_index = None
+                return _missing(self, inputs)
+            index = self.index_of(x, self.last_index)
+        if index != self.last_index:
+            if self.last_index is not None:
+                self.changes += 1
+            self.last_index = index
+            self.value = self.table[index]
+        return self.value
+
+
+def _compile(spec):
+    curve = spec.get('curve', 'linear')
+    if curve == 'linear':
+        # Senza punti: il valore della sorgente inalterato
+        low, high = _range(spec)
+        points = spec.get('points', [[low, low], [high, high]])
+        return _Line(spec, points) if len(points) == 2 else _Curve(dict(spec, points=points))
+    if curve == 'exp':
+        return _Curve(spec)
+    if curve == 'bins':
+        return _Bins(spec)
+    raise ValueError(f"Curva sconosciuta per {spec.get('source')}: {curve}")
+
+
+class _Sum:
+    """Somma di termini con limiti; None se nessuna sorgente è presente nel pacchetto"""
+    __slots__ = ('terms', 'clip')
+
+    def __init__(self, spec):
+        self.terms = [_compile(term) for term in spec['sum']]
+        self.clip = spec.get('clip')
+
+    def __call__(self, inputs):
+        present = False
+        value = 0.0
+        for term in self.terms:
+            # Ogni termine va valutato anche senza uscita: una sorgente persa azzera il suo valore
+            present = present or inputs.get(term.source) is not None
+            part = term(inputs)
+            if part is not None:
+                value += part
+        if not present:
+            return None
+        if self.clip:
+            value = min(max(value, self.clip[0]), self.clip[1])
+        return value
+
+
+def load_mapping(path):
+    """Legge una mappatura JSON con la stessa struttura di DEFAULT_MAPPING"""
+    with open(path) as f:
+        return json.load(f)
+
+
+class Mapping:
+    def __init__(self, config=None):
+        """
+        Compila i termini di tutti i parametri
+
+        Args:
+            config: Dizionario parametro -> termine, oppure {'sum': [termini], 'clip': [min, max]}
+                    (default DEFAULT_MAPPING)
+        """
+        self.config = config or DEFAULT_MAPPING
+        # Elenchi piatti per tipo di termine; le rette come coefficienti, senza chiamate per pacchetto
+        self.lines = []         # (parametro, sorgente, x0, x1, y0, pendenza)
+        self.curves = []        # (parametro, termine _Curve)
+        self.bins = []          # (parametro, termine _Bins)
+        self.sums = []          # (parametro, termine _Sum)
+        for name, spec in self.config.items():
+            if 'sum' in spec:
+                self.sums.append((name, _Sum(spec)))
+                continue
+            term = _compile(spec)
+            if isinstance(term, _Line):
+                self.lines.append((name, term.source, term.x0, term.x1, term.y0, term.slope))
+            elif isinstance(term, _Curve):
+                self.curves.append((name, term))
+            else:
+                self.bins.append((name, term))
+
+    def apply(self, inputs):
+        """
+        Parametri musicali dagli ingressi di questo aggiornamento
+
+        Args:
+            inputs: Dizionario sorgente -> valore (pot1..pot4 0.0-1.0, indici, speed in km/h)
+
+        Returns:
+            Dizionario parametro -> valore, solo per i parametri con almeno una sorgente presente
+            (le altre sorgenti di una somma usano l'ultimo valore visto)
+        """
+        result = {}
+        get = inputs.get
+        for name, source, x0, x1, y0, slope in self.lines:
+            x = get(source)
+            if x is not None:
+                result[name] = y0 + ((x0 if x < x0 else (x1 if x > x1 else x)) - x0) * slope
+
+        for name, term in self.curves:
+            x = get(term.source)
+            if x is not None:
+                result[name] = term.at(x)
+
+        for name, term in self.bins:
+            index = get(term.index_key)
+            if index is None:
+                x = get(term.source)
+                if x is None:
+                    continue
+                index = term.index_of(x, term.last_index)
+            if index != term.last_index:
+                if term.last_index is not None:
+                    term.changes += 1
+                term.last_index = index
+                term.value = term.table[index]
+            result[name] = term.value
+
+        for name, term in self.sums:
+            value = term(inputs)
+            if value is not None:
+                result[name] = value
+        return result
+
+    def get_stats(self):
+        """Cambi di indice dei parametri discreti"""
+        stats = {name: term.changes for name, term in self.bins}
+        for name, term in self.sums:
+            for part in term.terms:
+                if isinstance(part, _Bins):
+                    stats[name] = part.changes
+        return stats
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - METRICS
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Metriche sempre attive del carretto, esposte in formato testo Prometheus.
+- Counter, Gauge e Histogram minimi, senza dipendenze esterne
+- Costo di registrazione di poche operazioni su interi: contatori e istogrammi
+  a bucket fissi vengono aggiornati senza lock dal thread che li produce
+- Le grandezze già contate altrove (pacchetti del decoder, valori correnti del
+  MusicEngine) sono lette solo al momento dello scrape tramite funzioni
+- Endpoint HTTP locale (host:porta) o socket Unix (unix:/percorso)
+"""
+
+import bisect
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from modules.logger import get_logger
+
+log = get_logger("metrics")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Bucket in secondi: da 50 µs a 1 s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, label=None, registry=None):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.func = None
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def set_function(self, func):
+        """Il valore viene calcolato da func() al momento dello scrape (costo zero a regime)"""
+        self.func = func
+
+    def _series(self):
+        """Coppie (etichetta, valore) da esporre"""
+        raise NotImplementedError
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        for label_value, value in self._series():
+            if label_value is None:
+                lines.append(f"{self.name} {_format_value(value)}")
+            else:
+                lines.append(f'{self.name}{{{self.label}="{_escape(label_value)}"}} {_format_value(value)}')
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, label=None, registry=None):
+        """
+        Contatore crescente, opzionalmente con una sola etichetta
+
+        Args:
+            name: Nome Prometheus (es. 'carretto_arduino_frames_total')
+            help_text: Descrizione
+            label: Nome dell'etichetta (es. 'address'); i valori vengono creati al primo inc()
+        """
+        super().__init__(name, help_text, label, registry)
+        self.value = 0
+        self.values = {}
+
+    def inc(self, amount=1, label_value=None):
+        if label_value is None:
+            self.value += amount
+        else:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def _series(self):
+        if self.func is not None:
+            return [(None, self.func())]
+        if self.label:
+            return sorted(self.values.items())
+        return [(None, self.value)]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, label=None, registry=None):
+        """Valore istantaneo; con label è un'informazione (etichetta corrente = 1)"""
+        super().__init__(name, help_text, label, registry)
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def _series(self):
+        value = self.func() if self.func is not None else self.value
+        if self.label:
+            return [(value, 1)] if value is not None else []
+        return [(None, value if value is not None else float('nan'))]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, registry=None):
+        """Istogramma a bucket fissi: observe() costa una ricerca binaria e due somme"""
+        super().__init__(name, help_text, None, registry)
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # ultimo = oltre l'ultimo bucket
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} histogram")
+        counts = list(self.counts)
+        total = 0
+        for bound, count in zip(self.bounds + (float('inf'),), counts):
+            total += count
+            lines.append(f'{self.name}_bucket{{le="{_format_value(float(bound))}"}} {total}')
+        lines.append(f"{self.name}_sum {_format_value(self.sum)}")
+        lines.append(f"{self.name}_count {total}")
+
+
+class Registry:
+    def __init__(self):
+        """Insieme delle metriche esposte"""
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        """Testo completo in formato Prometheus"""
+        lines = []
+        for metric in self.metrics:
+            try:
+                metric.render(lines)
+            except Exception as e:
+                log.warning("Metrica %s non disponibile: %s", metric.name, e)
+        lines.append("")
+        return "\n".join(lines)
+
+
+REGISTRY = Registry()
+
+# --- Catalogo delle metriche del carretto ---
+
+ARDUINO_FRAMES = Counter("carretto_arduino_frames_total", "Pacchetti Arduino decodificati")
+ARDUINO_RESYNCS = Counter("carretto_arduino_resyncs_total", "Risincronizzazioni del decoder Arduino")
+ARDUINO_DROPPED = Counter("carretto_arduino_dropped_total", "Pacchetti Arduino persi (salti di sequenza, v2)")
+ARDUINO_CORRUPT = Counter("carretto_arduino_corrupt_total", "Pacchetti Arduino scartati per CRC o COBS (v2)")
+GPS_SENTENCES = Counter("carretto_gps_sentences_total", "Frasi NMEA utili decodificate")
+GPS_ERRORS = Counter("carretto_gps_checksum_errors_total", "Frasi NMEA scartate per checksum o formato")
+RECONNECTS = Counter("carretto_serial_reconnects_total", "Riconnessioni delle porte seriali", label="device")
+
+OSC_MESSAGES = Counter("carretto_osc_messages_total", "Parametri inviati a SuperCollider per indirizzo",
+                       label="address")
+OSC_DATAGRAMS = Counter("carretto_osc_datagrams_total", "Datagrammi (bundle) OSC inviati")
+OSC_ERRORS = Counter("carretto_osc_send_errors_total", "Errori di invio OSC")
+FANOUT_ERRORS = Counter("carretto_osc_target_errors_total", "Datagrammi non consegnati per destinazione",
+                        label="target")
+OSC_QUEUE = Gauge("carretto_osc_queue_depth", "Indirizzi nella coda di invio asincrona")
+
+SEND_LATENCY = Histogram("carretto_sensor_to_send_seconds", "Latenza arrivo dato sensore -> invio UDP")
+LOOP_TIME = Histogram("carretto_control_iteration_seconds", "Durata di un'iterazione del loop di controllo")
+
+BPM = Gauge("carretto_bpm", "BPM corrente")
+GENRE = Gauge("carretto_genre", "Genere musicale corrente", label="genre")
+PATTERN = Gauge("carretto_pattern_index", "Indice del pattern corrente")
+VOLUME = Gauge("carretto_volume", "Volume corrente (0-1)")
+SPEED = Gauge("carretto_speed_kmh", "Velocità GPS in km/h")
+ZONE = Gauge("carretto_zone", "Zona geografica corrente", label="zone")
+
+SC_ALIVE = Gauge("carretto_sclang_up", "Destinazioni OSC in cui sclang risponde al heartbeat")
+SC_RESTARTS = Counter("carretto_sclang_restarts_total", "Riavvii di sclang rilevati dal heartbeat")
+HEARTBEAT_RTT = Histogram("carretto_heartbeat_rtt_seconds", "Tempo di andata e ritorno del heartbeat")
+
+SEQ_NOTES = Counter("carretto_sequencer_notes_total", "Note /s_new inviate a scsynth dal sequencer")
+SEQ_LATE = Counter("carretto_sequencer_late_total", "Note inviate con il timetag già nel passato")
+
+SC_CPU_AVG = Gauge("carretto_scsynth_cpu_avg_percent", "CPU media di scsynth da /status")
+SC_CPU_PEAK = Gauge("carretto_scsynth_cpu_peak_percent", "CPU di picco di scsynth da /status")
+SC_UGENS = Gauge("carretto_scsynth_ugens", "UGen attive su scsynth")
+SC_SYNTHS = Gauge("carretto_scsynth_synths", "Synth attivi su scsynth")
+SHED_LEVEL = Gauge("carretto_shed_level", "Livello di riduzione del carico (0 = nessuna riduzione)")
+
+ACQ_RESTARTS = Counter("carretto_acquisition_restarts_total", "Riavvii del processo di acquisizione dei sensori")
+
+CPU = Counter("carretto_process_cpu_seconds_total", "Tempo CPU del processo (utente + sistema)")
+CPU.set_function(time.process_time)
+UPTIME = Gauge("carretto_uptime_seconds", "Secondi dall'avvio del processo")
+_start_time = time.monotonic()
+UPTIME.set_function(lambda: time.monotonic() - _start_time)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Socket Unix: nessun indirizzo del client
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        log.debug("%s - %s", self.address_string(), format % args)
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = "carretto"
+        self.server_port = 0
+
+
+class _TCPHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+    def __init__(self, address, registry=None):
+        """
+        Endpoint delle metriche
+
+        Args:
+            address: 'host:porta' (HTTP su TCP, es. '127.0.0.1:9108') o 'unix:/percorso'
+            registry: Registry da esporre (default REGISTRY)
+        """
+        handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry or REGISTRY})
+        self.address = address
+        self.path = None
+        if address.startswith("unix:"):
+            self.path = address[5:]
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self.server = _UnixHTTPServer(self.path, handler)
+        else:
+            host, _, port = address.rpartition(':')
+            self.server = _TCPHTTPServer((host or '127.0.0.1', int(port)), handler)
+        self.thread = None
+
+    def start(self):
+        """Serve le richieste in un thread in background"""
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+        print(f"[METRICS] Metriche Prometheus su {self.address}")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
@@ -12,17 +12,73 @@ Questa versione include fix specifici per assicurare la corretta trasmissione de
 
 import threading
 import time
-from pythonosc import udp_client
+import logging
+from collections import OrderedDict
+from pythonosc import osc_message_builder
+from pythonosc import osc_bundle_builder
 import socket
+from modules.sensor_events import LatencyStats
+from modules.heartbeat import Heartbeat
+from modules.osc_fanout import OscFanout
+from modules.mapping import Mapping
+from modules.geofence import ZONE_PARAMS
+from modules.logger import get_logger, Throttle, trace, EVT_SEND, EVT_ERROR
+from modules import metrics
+
+log = get_logger("music")
+
+# Parametri inviati insieme nel messaggio /carretto/state -> chiave in current_values
+STATE_ADDRESSES = {
+    "/carretto/volume": "volume",
+    "/carretto/bpm": "bpm",
+    "/carretto/pattern": "pattern",
+    "/carretto/patternIdx": "patternIdx"
+}
+
+# Parametro musicale (uscita della mappatura) -> indirizzo OSC
+PARAM_ADDRESSES = {
+    "volume": "/carretto/volume",
+    "bpm": "/carretto/bpm",
+    "pattern": "/carretto/pattern",
+    "tune": "/carretto/tune",
+    "patternIdx": "/carretto/patternIdx",
+    "speed": "/carretto/speed"
+}
 
 class MusicEngine:
-    def __init__(self, host="127.0.0.1", port=57120):
-        """Inizializza il motore musicale"""
+    def __init__(self, host="127.0.0.1", port=57120, keyframe_interval=None, bundle_latency=None,
+                 async_send=False, max_queue=64, heartbeat_interval=None, targets=None,
+                 sequencer=None, mapping=None, monitor=None, zones=None):
+        """
+        Inizializza il motore musicale
+        
+        Args:
+            host: Indirizzo di SuperCollider (sclang)
+            port: Porta OSC di sclang
+            keyframe_interval: Secondi tra due reinvii completi dello stato
+                               (None = solo invii dei valori cambiati)
+            bundle_latency: Anticipo in secondi del timetag dei bundle
+                            (None = esecuzione immediata)
+            async_send: Se True update() accoda e un thread dedicato invia
+            max_queue: Indirizzi distinti massimi nella coda di invio
+            heartbeat_interval: Secondi tra due ping a sclang (None = nessun heartbeat)
+            targets: Lista di (host, porta) a cui inviare lo stesso stato
+                     (default solo host:port)
+            sequencer: Sequencer che suona le note direttamente su scsynth
+                       (None = suonano i player di sclang)
+            mapping: Mapping dagli ingressi ai parametri musicali (default DEFAULT_MAPPING)
+            monitor: ServerMonitor che interroga scsynth e decide la riduzione del carico
+                     (None = nessun controllo)
+            zones: Geofence: la zona della posizione GPS impone genere, intervallo
+                   di BPM e volume massimo (None = solo i potenziometri)
+        """
         self.host = host
         self.port = port
         
-        print(f"[MUSIC] Inizializzazione client OSC su {host}:{port}")
-        self.client = udp_client.SimpleUDPClient(host, port)
+        # Tutte le destinazioni su un solo socket: ogni bundle viene codificato una volta
+        targets = targets or [(host, port)]
+        print(f"[MUSIC] Inizializzazione client OSC su {', '.join(f'{h}:{p}' for h, p in targets)}")
+        self.client = OscFanout(targets, on_recover=self.send_full_state)
         
         self.running = False
         self.thread = None
@@ -37,157 +93,499 @@ class MusicEngine:
             "speed": 0
         }
         
-        # Valori precedenti per confronto
-        self.prev_values = {}
+        # Tabelle ingressi -> parametri musicali, compilate una volta
+        self.mapping = mapping or Mapping()
+        # Valori dei soli ingressi, prima dei limiti della zona corrente
+        self.base_values = dict(self.current_values)
+        unknown = [name for name in self.mapping.config if name not in PARAM_ADDRESSES]
+        if unknown:
+            raise ValueError(f"Parametri di mappatura sconosciuti: {', '.join(unknown)}")
+        
+        # Valori precedenti dei potenziometri
         self.prev_pots = {}
         
-        # Debug flag per verificare la comunicazione
-        self.debug_mode = True
+        # Cache dell'ultimo valore inviato per ogni indirizzo OSC:
+        # si invia solo se il valore quantizzato è cambiato
+        self.sent_values = {}
         
-        # Test iniziale esplicito
-        try:
-            print("[MUSIC] Invio test iniziale esplicito...")
-            self.client.send_message("/test", 1)
-        except Exception as e:
-            print(f"[MUSIC] Errore test iniziale: {e}")
+        # Quantizzazione per indirizzo: passo di arrotondamento...
+        self.osc_steps = {
+            "/carretto/bpm": 1.0        # 1 BPM
+        }
+        # ...oppure variazione minima rispetto all'ultimo valore inviato
+        self.osc_epsilons = {
+            "/carretto/volume": 0.01,   # 1% di volume
+            "/carretto/tune": 0.02,
+            "/carretto/speed": 0.5      # 0.5 km/h
+        }
+        # Genere (stringa) e patternIdx (intero) si confrontano per uguaglianza
+        
+        # Reinvio periodico completo (keyframe) per risincronizzare SuperCollider
+        self.keyframe_interval = keyframe_interval
+        self.last_keyframe_time = None      # Istante di self.clock, fissato al primo aggiornamento
+        
+        # Timetag dei bundle OSC
+        self.bundle_latency = bundle_latency
+        
+        # Limitatore BPM: al massimo un cambio di tempo ogni bpm_min_beats battiti
+        # (0 = disattivato). I valori intermedi vengono fusi nell'ultimo.
+        self.bpm_min_beats = 1.0
+        self.last_bpm_time = 0.0
+        self.pending_bpm = None
+        # Orologio del limitatore e dei keyframe (sostituito da un orologio virtuale nel rendering offline)
+        self.clock = time.monotonic
+        
+        # update() e il thread di aggiornamento condividono cache e client.
+        # Rientrante: una destinazione che torna raggiungibile durante un invio
+        # viene risincronizzata subito, dallo stesso thread
+        self.lock = threading.RLock()
+        
+        # Statistiche invii (sent = bundle inviati)
+        self.stats = {"sent": 0, "suppressed": 0, "keyframes": 0, "bpm_coalesced": 0,
+                      "errors": 0, "coalesced": 0, "dropped": 0, "max_depth": 0}
+        
+        # Latenza dall'arrivo del dato (o dalla chiamata a update) all'invio UDP
+        self.latency = LatencyStats()
+        
+        # Modalità asincrona: coda limitata che conserva solo l'ultimo valore per indirizzo
+        self.async_send = async_send
+        self.max_queue = max_queue
+        self.outbox = OrderedDict()
+        self.outbox_time = None
+        self.outbox_cond = threading.Condition(threading.Lock())
+        self.sender_thread = None
+        
+        # Errori di invio ripetuti: al massimo un messaggio al secondo
+        self.error_throttle = Throttle(interval=1.0)
+        
+        # Istante (perf_counter) dell'ultimo datagramma inviato, per la misura di latenza
+        self.last_send_time = 0.0
+        
+        # Metriche lette allo scrape: nessun costo sul percorso di invio
+        metrics.OSC_DATAGRAMS.set_function(lambda: self.stats["sent"])
+        metrics.OSC_ERRORS.set_function(lambda: self.stats["errors"])
+        metrics.OSC_QUEUE.set_function(lambda: len(self.outbox))
+        metrics.BPM.set_function(lambda: self.current_values["bpm"])
+        metrics.GENRE.set_function(lambda: self.current_values["pattern"])
+        metrics.PATTERN.set_function(lambda: self.current_values["patternIdx"])
+        metrics.VOLUME.set_function(lambda: self.current_values["volume"])
+        metrics.SPEED.set_function(lambda: self.current_values["speed"])
+        
+        # Sequencer Python: riceve lo stato a ogni cambiamento, sclang smette di suonare
+        self.sequencer = sequencer
+        
+        # Carico di scsynth: il livello di riduzione va a sclang e al sequencer
+        self.monitor = monitor
+        self.shed_level = 0
+        if monitor:
+            monitor.on_level = self.set_shed_level
+        
+        # Zone geografiche: la zona corrente limita i parametri dei potenziometri
+        self.zones = zones
+        self.zone = None
+        metrics.ZONE.set_function(lambda: self.zone.name if self.zone else None)
+        
+        # Heartbeat silenzioso: RTT, sclang assente o riavviato -> reinvio dello stato
+        self.heartbeat = None
+        if heartbeat_interval:
+            self.heartbeat = Heartbeat(self.client, interval=heartbeat_interval,
+                                       on_resync=self.send_full_state)
     
     def start(self):
-        """Avvia il thread di aggiornamento"""
+        """Avvia il thread di aggiornamento (e quello di invio in modalità asincrona)"""
         if not self.running:
             self.running = True
+            
+            if self.async_send:
+                self.sender_thread = threading.Thread(target=self._sender_thread)
+                self.sender_thread.daemon = True
+                self.sender_thread.start()
+                print("[MUSIC] Thread di invio avviato")
+            
             self.thread = threading.Thread(target=self._update_thread)
             self.thread.daemon = True
             self.thread.start()
             
             print("[MUSIC] Thread di aggiornamento avviato")
             
-            # Invia comandi iniziali espliciti
-            try:
-                # Sequenza iniziale per assicurarsi che tutto funzioni
-                print("[MUSIC] Invio sequenza iniziale...")
-                time.sleep(0.1)
-                self.client.send_message("/test", 1)
-                time.sleep(0.1)
-                self.client.send_message("/carretto/volume", 0.8)
-                time.sleep(0.1)
-                self.client.send_message("/carretto/pattern", "dub")
-                time.sleep(0.1)
-                self.client.send_message("/carretto/patternIdx", 0)
-                print("[MUSIC] Sequenza iniziale completata")
-            except Exception as e:
-                print(f"[MUSIC] Errore sequenza iniziale: {e}")
+            if self.heartbeat:
+                self.heartbeat.start()
+            if self.sequencer:
+                self.sequencer.start()
+            if self.monitor:
+                self.monitor.start()
+            
+            # Stato iniziale in un unico bundle, senza attese:
+            # in modalità asincrona viene solo accodato
+            print("[MUSIC] Invio sequenza iniziale...")
+            with self.lock:
+                initial = {
+                    "/carretto/volume": 0.8,
+                    "/carretto/bpm": 120.0,
+                    "/carretto/pattern": "dub",
+                    "/carretto/patternIdx": 0
+                }
+                if self.sequencer:
+                    initial["/carretto/sequencer"] = 1
+                self._send_changes(initial)
     
     def stop(self):
-        """Ferma il thread di aggiornamento"""
+        """Ferma il thread di aggiornamento e quello di invio"""
         self.running = False
+        if self.heartbeat:
+            self.heartbeat.stop()
+        if self.monitor:
+            self.monitor.stop()
+        with self.outbox_cond:
+            self.outbox_cond.notify()
+        if self.sender_thread:
+            self.sender_thread.join(timeout=1.0)
         if self.thread:
             self.thread.join(timeout=1.0)
+        if self.sequencer:
+            # sclang riprende a suonare il pattern corrente
+            self.sequencer.stop()
+            try:
+                self.client.send_message("/carretto/sequencer", 0)
+            except OSError:
+                pass
+        self.client.close()
         print("[MUSIC] Thread di aggiornamento arrestato")
     
-    def _send_osc_message(self, address, value):
-        """Funzione helper per inviare messaggi OSC con gestione degli errori"""
-        try:
-            self.client.send_message(address, value)
-            if self.debug_mode:
-                print(f"[MUSIC] Inviato: {address} = {value}")
+    def _quantize(self, address, value):
+        """Arrotonda il valore al passo configurato per l'indirizzo"""
+        step = self.osc_steps.get(address)
+        if step:
+            return round(value / step) * step
+        return value
+    
+    def _check_changed(self, address, value, changes):
+        """
+        Aggiunge a changes il valore quantizzato se differisce dall'ultimo inviato
+        
+        Returns:
+            True se il valore è cambiato
+        """
+        value = self._quantize(address, value)
+        
+        if address in self.sent_values:
+            last = self.sent_values[address]
+            epsilon = self.osc_epsilons.get(address)
+            if epsilon is not None:
+                unchanged = abs(value - last) <= epsilon
+            else:
+                unchanged = value == last
+            if unchanged:
+                self.stats["suppressed"] += 1
+                return False
+        
+        changes[address] = value
+        return True
+    
+    def _state_value(self, address, changes):
+        """Valore di un parametro di stato: cambiato in questo tick, già inviato o corrente"""
+        if address in changes:
+            return changes[address]
+        if address in self.sent_values:
+            return self.sent_values[address]
+        return self._quantize(address, self.current_values[STATE_ADDRESSES[address]])
+    
+    def _build_bundle(self, changes):
+        """
+        Costruisce un unico bundle OSC con tutti i parametri cambiati
+        
+        Volume, BPM, genere e patternIdx viaggiano insieme in /carretto/state
+        così SuperCollider riavvia il pattern al massimo una volta.
+        """
+        if self.bundle_latency is None:
+            timetag = osc_bundle_builder.IMMEDIATELY
+        else:
+            timetag = time.time() + self.bundle_latency
+        bundle = osc_bundle_builder.OscBundleBuilder(timetag)
+        
+        if any(address in changes for address in STATE_ADDRESSES):
+            msg = osc_message_builder.OscMessageBuilder(address="/carretto/state")
+            msg.add_arg(float(self._state_value("/carretto/volume", changes)))
+            msg.add_arg(float(self._state_value("/carretto/bpm", changes)))
+            msg.add_arg(str(self._state_value("/carretto/pattern", changes)))
+            msg.add_arg(int(self._state_value("/carretto/patternIdx", changes)))
+            bundle.add_content(msg.build())
+        
+        for address, value in changes.items():
+            if address not in STATE_ADDRESSES:
+                msg = osc_message_builder.OscMessageBuilder(address=address)
+                msg.add_arg(value)
+                bundle.add_content(msg.build())
+        
+        return bundle.build()
+    
+    def _send_changes(self, changes, timestamp=None):
+        """
+        Invia in un solo datagramma tutti i parametri cambiati e aggiorna la cache.
+        In modalità asincrona i cambiamenti vengono solo accodati.
+        
+        Args:
+            changes: Dizionario indirizzo -> valore quantizzato
+            timestamp: Arrivo del dato che ha causato l'invio (perf_counter)
+        
+        Returns:
+            True se il bundle è stato inviato (o accodato)
+        """
+        if not changes:
+            return False
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        
+        if self.async_send:
+            # Cache aggiornata subito: il confronto del prossimo update
+            # deve vedere i valori già in coda
+            self.sent_values.update(changes)
+            self._enqueue(changes, timestamp)
+            return True
+        
+        if self._transmit(changes, timestamp):
+            self.sent_values.update(changes)
             return True
+        return False
+    
+    def _transmit(self, changes, timestamp):
+        """Costruisce e spedisce il bundle, registrando latenza e statistiche"""
+        try:
+            # Consegnato ad almeno una destinazione: le altre vengono
+            # risincronizzate quando tornano raggiungibili
+            if not self.client.send(self._build_bundle(changes)):
+                raise OSError("nessuna destinazione raggiungibile")
+            self.last_send_time = time.perf_counter()
         except Exception as e:
-            print(f"[MUSIC] Errore invio {address}: {e}")
+            self.stats["errors"] += 1
+            trace(EVT_ERROR, 2)
+            if self.error_throttle():
+                log.error("Errore invio bundle %s: %s", list(changes), e)
             return False
+        
+        latency = self.last_send_time - timestamp
+        self.stats["sent"] += 1
+        self.latency.add(latency)
+        metrics.SEND_LATENCY.observe(latency)
+        for address in changes:
+            metrics.OSC_MESSAGES.inc(label_value=address)
+        trace(EVT_SEND, len(changes), int(latency * 1e6))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Inviato bundle: %s", changes)
+        return True
+    
+    def _enqueue(self, changes, timestamp):
+        """Accoda i cambiamenti: per ogni indirizzo vince il valore più recente"""
+        dropped = []
+        with self.outbox_cond:
+            for address, value in changes.items():
+                if address in self.outbox:
+                    self.stats["coalesced"] += 1
+                elif len(self.outbox) >= self.max_queue:
+                    # Coda piena: scarta l'indirizzo più vecchio
+                    dropped.append(self.outbox.popitem(last=False)[0])
+                    self.stats["dropped"] += 1
+                self.outbox[address] = value
+            
+            # Conserva l'arrivo più vecchio tra quelli in coda
+            if self.outbox_time is None:
+                self.outbox_time = timestamp
+            self.stats["max_depth"] = max(self.stats["max_depth"], len(self.outbox))
+            self.outbox_cond.notify()
+        
+        # Un valore scartato non è mai partito: verrà reinviato al prossimo update
+        for address in dropped:
+            self.sent_values.pop(address, None)
     
-    def update(self, pots, gps):
+    def _sender_thread(self):
+        """Thread che svuota la coda e invia un bundle per ogni risveglio"""
+        while self.running:
+            with self.outbox_cond:
+                if not self.outbox:
+                    self.outbox_cond.wait(0.5)
+                if not self.outbox:
+                    continue
+                changes = dict(self.outbox)
+                timestamp = self.outbox_time
+                self.outbox.clear()
+                self.outbox_time = None
+            
+            if not self._transmit(changes, timestamp):
+                # Invio fallito: dimentica i valori così update() li riproverà
+                with self.lock:
+                    for address, value in changes.items():
+                        if self.sent_values.get(address) == value:
+                            del self.sent_values[address]
+    
+    def get_metrics(self):
+        """Restituisce profondità della coda, contatori di invio e latenza di invio"""
+        with self.outbox_cond:
+            depth = len(self.outbox)
+        metrics = dict(self.stats)
+        metrics["queue_depth"] = depth
+        metrics["latency"] = self.latency.summary()
+        metrics["targets"] = self.client.get_stats()
+        if self.heartbeat:
+            metrics["heartbeat"] = self.heartbeat.get_stats()
+        if self.sequencer:
+            metrics["sequencer"] = self.sequencer.get_stats()
+        if self.monitor:
+            metrics["scsynth"] = self.monitor.get_stats()
+        if self.zones:
+            metrics["zones"] = self.zones.get_stats()
+        return metrics
+    
+    def _limit_bpm(self, changes):
+        """Rimanda il cambio di BPM se l'ultimo è stato inviato meno di un battito fa"""
+        if "/carretto/bpm" not in changes or not self.bpm_min_beats:
+            return
+        
+        now = self.clock()
+        last_bpm = self.sent_values.get("/carretto/bpm", changes["/carretto/bpm"])
+        beat = 60.0 / max(last_bpm, 1.0)
+        
+        if now - self.last_bpm_time < beat * self.bpm_min_beats:
+            # Troppo presto: conserva solo il valore più recente
+            self.pending_bpm = changes.pop("/carretto/bpm")
+            self.stats["bpm_coalesced"] += 1
+        else:
+            self.pending_bpm = None
+            self.last_bpm_time = now
+    
+    def flush_pending_bpm(self):
+        """Invia il BPM rimandato dal limitatore, se è trascorso un battito"""
+        with self.lock:
+            if self.pending_bpm is None:
+                return
+            changes = {}
+            if not self._check_changed("/carretto/bpm", self.pending_bpm, changes):
+                self.pending_bpm = None
+                return
+            self._limit_bpm(changes)
+            self._send_changes(changes)
+    
+    def set_shed_level(self, level):
+        """
+        Applica un livello di riduzione del carico (chiamata dal ServerMonitor)
+        
+        Args:
+            level: 0 = nessuna riduzione, 1 = niente synth di conferma,
+                   2 = charleston dimezzati, 3 = solo cassa, basso e pad
+        """
+        with self.lock:
+            self.shed_level = level
+            if self.sequencer:
+                self.sequencer.set_shed(level)
+            self._send_changes({"/carretto/shed": level})
+    
+    def resync(self):
+        """Svuota la cache: il prossimo update reinvia tutti i valori"""
+        self.sent_values = {}
+    
+    def send_full_state(self, target=None):
+        """
+        Reinvia subito tutti i valori correnti in un unico bundle
+        (chiamata dal heartbeat quando sclang torna raggiungibile o è stato riavviato,
+        e dal fanout quando una destinazione torna a ricevere)
+        
+        Args:
+            target: OscTarget da risincronizzare (None = tutte le destinazioni)
+        """
+        with self.lock:
+            # Valori correnti, non quelli in cache: sono i più recenti anche con invii in coda
+            changes = {address: self._quantize(address, self.current_values[key])
+                       for address, key in STATE_ADDRESSES.items()}
+            for address, key in (("/carretto/tune", "tune"), ("/carretto/speed", "speed")):
+                changes[address] = self._quantize(address, self.current_values[key])
+            if self.sequencer:
+                # Un sclang riavviato torna a suonare i propri player
+                changes["/carretto/sequencer"] = 1
+            if self.monitor:
+                # ...e con tutte le voci: il livello di riduzione va ripetuto
+                changes["/carretto/shed"] = self.shed_level
+            bundle = self._build_bundle(changes)
+        self.client.send(bundle, None if target is None else [target])
+        log.info("Stato completo reinviato a %s", target.name if target else "tutte le destinazioni")
+    
+    def update(self, pots, gps, timestamp=None):
         """
         Aggiorna i valori correnti in base ai potenziometri e al GPS
+        e invia a SuperCollider solo gli indirizzi il cui valore è cambiato
         
         Args:
             pots: Dizionario con i valori dei potenziometri
             gps: Dizionario con i dati GPS
+            timestamp: Arrivo del dato dal sensore (perf_counter), per la latenza
         """
-        # IMPORTANTE: Invia sempre un comando di test per mantenere attiva la connessione
-        self._send_osc_message("/test", 1)
-        
-        # Elabora tutti i potenziometri, anche se non sono cambiati significativamente
-        # Questo assicura che i comandi vengano inviati anche se i potenziometri
-        # non cambiano molto ma vengono comunque spostati
-        
-        # VOLUME (pot1)
-        if 'pot1' in pots:
-            volume = float(pots['pot1'])
-            
-            # Manda esplicitamente come float
-            self._send_osc_message("/carretto/volume", volume)
-            self.current_values["volume"] = volume
-            
-            # Forza un refresh del volume master
-            self._send_osc_message("/carretto/volume", volume)
+        with self.lock:
+            self._update(pots, gps, timestamp)
+    
+    def _update(self, pots, gps, timestamp):
+        """Corpo di update(), eseguito con il lock acquisito"""
+        # Keyframe periodico: reinvia tutto lo stato
+        if self.keyframe_interval:
+            now = self.clock()
+            if self.last_keyframe_time is None:
+                self.last_keyframe_time = now
+            elif now - self.last_keyframe_time >= self.keyframe_interval:
+                self.resync()
+                self.last_keyframe_time = now
+                self.stats["keyframes"] += 1
         
-        # BPM (pot2)
-        if 'pot2' in pots:
-            # Mappa 0-1 a 60-180 BPM
-            bpm = 60.0 + (float(pots['pot2']) * 120.0)
-            
-            # Manda esplicitamente come float
-            self._send_osc_message("/carretto/bpm", bpm)
-            self.current_values["bpm"] = bpm
+        # Parametri cambiati in questo tick: partiranno in un unico bundle
+        changes = {}
         
-        # GENRE (pot3)
-        if 'pot3' in pots:
-            pot3_value = float(pots['pot3'])
-            
-            # Mappa 0-1 a 7 generi, usando floor per evitare out of range
-            genre_idx = min(int(pot3_value * 6.99), 6)
-            genres = ["dub", "techno", "reggae", "house", "drumandbass", "ambient", "random"]
-            new_pattern = genres[genre_idx]
-            
-            # Invia sempre il pattern, anche se non è cambiato
-            self._send_osc_message("/carretto/pattern", new_pattern)
-            self.current_values["pattern"] = new_pattern
-            
-            # Invia sempre tune
-            self._send_osc_message("/carretto/tune", pot3_value)
-            self.current_values["tune"] = pot3_value
+        # Parametri musicali dalla mappatura compilata (solo quelli con un ingresso presente)
+        # La velocità arriva solo da gps: senza fix anche un valore filtrato rimasto
+        # tra gli ingressi dei potenziometri va ignorato
+        # (None = fix perso, che azzera anche il termine di velocità di una somma)
+        inputs = pots
+        if 'speed' in gps or 'speed' in pots:
+            speed = gps.get('speed')
+            inputs = dict(pots, speed=float(speed) if speed is not None else None)
+        mapped = self.mapping.apply(inputs)
+        if self.zones:
+            mapped = self._apply_zone(mapped, gps)
         
-        # PATTERN INDEX (pot4)
-        if 'pot4' in pots:
-            pot4_value = float(pots['pot4'])
-            
-            # Mappa 0-1 a 0-3 pattern index
-            pattern_idx = min(int(pot4_value * 3.99), 3)
-            
-            # Invia sempre il pattern index, anche se non è cambiato
-            self._send_osc_message("/carretto/patternIdx", pattern_idx)
-            self.current_values["patternIdx"] = pattern_idx
+        for key, value in mapped.items():
+            self.current_values[key] = value
+            if not self._check_changed(PARAM_ADDRESSES[key], value, changes) and key == "bpm":
+                # Tornato al valore già inviato: annulla un eventuale BPM in attesa
+                self.pending_bpm = None
         
         # Aggiorna i valori precedenti dei potenziometri
         self.prev_pots = pots.copy()
         
-        # GPS - opzionale
-        if 'speed' in gps and gps['speed'] is not None:
-            speed = float(gps['speed'])
-            self.current_values["speed"] = speed
-            
-            # Invia solo se è cambiata significativamente
-            if abs(speed - self.prev_values.get("speed", 0)) > 0.5:
-                self._send_osc_message("/carretto/speed", speed)
-                self.prev_values["speed"] = speed
+        if self.sequencer and changes:
+            # Il sequencer usa il BPM corrente, senza il limitatore pensato per sclang
+            values = self.current_values
+            self.sequencer.set_state(values["volume"], values["bpm"], values["pattern"], values["patternIdx"])
+        
+        self._limit_bpm(changes)
+        self._send_changes(changes, timestamp)
+    
+    def _apply_zone(self, mapped, gps):
+        """Aggiorna la zona dalla posizione GPS e ne applica i limiti ai parametri mappati"""
+        self.base_values.update(mapped)
+        lat, lon = gps.get('lat'), gps.get('lon')
+        if lat is not None and lon is not None:
+            zone = self.zones.update(lat, lon)
+        else:
+            # Posizione sconosciuta (fix perso): i limiti della zona non valgono più
+            zone = self.zones.clear()
+        if zone is not self.zone:
+            self.zone = zone
+            # Cambio di zona: limiti nuovi (o nessuno) anche per i parametri fermi
+            mapped = dict({key: self.base_values[key] for key in ZONE_PARAMS}, **mapped)
+        if self.zone:
+            self.zone.apply(mapped)
+        return mapped
     
     def _update_thread(self):
-        """Thread che invia ping periodici e test"""
-        last_ping_time = time.time()
-        last_test_time = time.time()
-        
+        """Thread che invia i BPM rimandati dal limitatore"""
         while self.running:
-            current_time = time.time()
-            
-            # Invia ping ogni 3 secondi
-            if current_time - last_ping_time > 3.0:
-                self._send_osc_message("/carretto/ping", int(current_time))
-                last_ping_time = current_time
-            
-            # Invia test ogni 1 secondo per mantenere attiva la connessione
-            if current_time - last_test_time > 1.0:
-                self._send_osc_message("/test", 1)
-                last_test_time = current_time
+            # BPM rimandati dal limitatore
+            self.flush_pending_bpm()
             
             # Pausa breve
             time.sleep(0.1)
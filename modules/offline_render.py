@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - OFFLINE RENDER
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Rendering offline di una sessione registrata, più veloce del tempo reale.
+- I byte registrati passano dagli stessi decoder (ArduinoReader, GPSReader), dal
+  ControlLoop (filtri e rilevamento dei cambiamenti) e da MusicEngine.update su un
+  orologio virtuale: il tempo avanza con i timestamp della sessione, senza attese
+- Le note vengono dal sequencer Python (gli stessi pattern dei player di sclang),
+  interrogato ogni TICK secondi virtuali come il suo thread in tempo reale
+- Uscita: file di comandi NRT per scsynth -N, cioè bundle [lunghezza int32][bundle]
+  con timetag in secondi dall'inizio; al tempo 0 /d_loadDir delle SynthDef e
+  /g_new 1, alla fine un /c_set che fissa la durata. Il file è deterministico:
+  utile anche come riferimento di regressione quando cambia la logica
+- Script sclang di accompagnamento: scrive su disco le SynthDef di carretto_music.scd
+  e lancia scsynth -N sul file (dopo la prima volta basta scsynth -N)
+
+Uso:
+    python main.py --replay sessione.bin --render sessione.osc
+    sclang sessione.scd
+"""
+
+import os
+import random
+import re
+import struct
+import time
+from pythonosc import osc_message_builder
+from pythonosc.osc_packet import OscPacket
+from modules.arduino_reader import ArduinoReader
+from modules.controller import ControlLoop
+from modules.gps_reader import GPSReader
+from modules.music_engine import MusicEngine
+from modules.patterns import PATTERNS
+from modules.sensor_events import SensorEvents
+from modules.sequencer import Sequencer
+from modules.session_recorder import read_session, SOURCE_ARDUINO, SOURCE_GPS
+from modules.logger import get_logger
+
+log = get_logger("render")
+
+# Passo dell'orologio virtuale (secondi): deve restare sotto l'anticipo del sequencer
+TICK = 0.05
+LOOKAHEAD = 0.1
+
+# Secondi dopo l'ultimo dato: le code delle ultime note (pad, campane)
+TAIL = 3.0
+
+SAMPLE_RATE = 48000
+
+# SynthDef dei pattern
+SCD_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "carretto_music.scd")
+
+
+def synthdef_sources(path=SCD_PATH):
+    """
+    Sorgenti delle SynthDef di un file .scd
+
+    Returns:
+        Dizionario nome -> testo 'SynthDef(\\nome, {...})' (senza .add)
+    """
+    with open(path) as f:
+        text = f.read()
+    sources = {}
+    for match in re.finditer(r'SynthDef\(\\(\w+)', text):
+        depth = 0
+        for end in range(match.start() + len('SynthDef'), len(text)):
+            char = text[end]
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+                if depth == 0:
+                    break
+        sources[match.group(1)] = text[match.start():end + 1]
+    return sources
+
+
+def _message(address, *args):
+    msg = osc_message_builder.OscMessageBuilder(address=address)
+    for arg in args:
+        msg.add_arg(arg)
+    return msg.build()
+
+
+def nrt_bundle(when, messages):
+    """Bundle NRT preceduto dalla lunghezza: timetag = secondi dall'inizio in virgola fissa 32.32"""
+    parts = [b'#bundle\x00', struct.pack('>Q', int(round(when * 4294967296.0)))]
+    for message in messages:
+        parts.append(struct.pack('>i', len(message.dgram)))
+        parts.append(message.dgram)
+    bundle = b''.join(parts)
+    return struct.pack('>i', len(bundle)) + bundle
+
+
+def read_score(path):
+    """
+    Legge un file di comandi NRT
+
+    Returns:
+        Lista di (secondi, [(indirizzo, parametri), ...])
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    bundles = []
+    pos = 0
+    while pos + 4 <= len(data):
+        size, = struct.unpack_from('>i', data, pos)
+        bundle = data[pos + 4:pos + 4 + size]
+        pos += 4 + size
+        when = struct.unpack_from('>Q', bundle, 8)[0] / 4294967296.0
+        messages = [(timed.message.address, timed.message.params) for timed in OscPacket(bundle).messages]
+        bundles.append((when, messages))
+    return bundles
+
+
+class _ScoreClient:
+    """Al posto di OscFanout nel MusicEngine: i messaggi per sclang restano in memoria"""
+
+    def __init__(self, render):
+        self.render = render
+        self.messages = []      # (secondi virtuali, indirizzo, parametri)
+
+    def send(self, content, targets=None):
+        now = self.render.now
+        for timed in OscPacket(content.dgram).messages:
+            self.messages.append((now, timed.message.address, timed.message.params))
+        return True
+
+    def close(self):
+        pass
+
+
+class OfflineRender:
+    def __init__(self, session, protocol='auto', filters=None, mapping=None, zones=None,
+                 tail=TAIL, seed=0):
+        """
+        Prepara la catena dei moduli su orologio virtuale
+
+        Args:
+            session: File di sessione o lista di record (timestamp, sorgente, byte)
+            protocol: Formato dei pacchetti Arduino ('auto', 'v1', 'v2')
+            filters: SignalFilter (default DEFAULT_CONFIG, come main.py)
+            mapping: Mapping (default DEFAULT_MAPPING)
+            zones: Geofence opzionale
+            tail: Secondi aggiunti dopo l'ultimo dato
+            seed: Seme del genere "random": stesso seme, stesso file
+        """
+        self.records = read_session(session) if isinstance(session, str) else session
+        self.tail = tail
+        self.seed = seed
+        self.now = 0.0
+
+        self.arduino = ArduinoReader(protocol=protocol)
+        self.gps = GPSReader()
+        self.sequencer = Sequencer(lookahead=LOOKAHEAD, period=TICK)
+        self.sequencer.client.close()
+        self.music = MusicEngine(sequencer=self.sequencer, mapping=mapping, zones=zones)
+        self.music.client.close()
+        self.music.client = _ScoreClient(self)
+        self.music.clock = lambda: self.now
+        self.control = ControlLoop(self.arduino, self.gps, self.music, SensorEvents(), filters=filters)
+
+        self.bundles = []       # (secondi, [OscMessage /s_new])
+        self.duration = 0.0
+        self.next_force = 0.0
+        self.stats = {"records": 0, "updates": 0, "notes": 0, "bundles": 0, "render_seconds": 0.0}
+
+    def _tick(self, now):
+        """Un giro del thread del sequencer e del MusicEngine all'istante virtuale now"""
+        self.now = now
+        if now >= self.next_force:
+            # Aggiornamento forzato periodico del loop di controllo
+            self.next_force += self.control.force_update_interval
+            self.stats["updates"] += self.control.step({}, force=True)
+        self.music.flush_pending_bpm()
+        for when, notes in self.sequencer.collect(now):
+            self.bundles.append((when, self.sequencer.note_messages(notes)))
+            self.stats["notes"] += len(notes)
+
+    def run(self):
+        """
+        Elabora tutta la sessione
+
+        Returns:
+            Statistiche del rendering
+        """
+        random.seed(self.seed)
+        started = time.perf_counter()
+        origin = self.records[0][0] if self.records else 0.0
+        self.sequencer.reset(0.0)
+        self.next_force = self.control.force_update_interval
+        ticks = 0
+
+        for timestamp, source, data in self.records:
+            t = timestamp - origin
+            while ticks * TICK <= t:
+                self._tick(ticks * TICK)
+                ticks += 1
+            self.now = t
+            if source == SOURCE_ARDUINO:
+                self.arduino._on_data(data, t)
+            elif source == SOURCE_GPS:
+                self.gps._on_data(data, t)
+            else:
+                continue
+            self.stats["records"] += 1
+            # Niente timestamp di arrivo: la latenza in tempo virtuale non ha senso
+            self.stats["updates"] += self.control.step({})
+
+        end = (self.records[-1][0] - origin) if self.records else 0.0
+        while ticks * TICK <= end:
+            self._tick(ticks * TICK)
+            ticks += 1
+
+        last_note = self.bundles[-1][0] if self.bundles else 0.0
+        self.duration = max(end, last_note) + self.tail
+        self.stats["bundles"] = len(self.bundles)
+        self.stats["session_seconds"] = end
+        self.stats["render_seconds"] = time.perf_counter() - started
+        self.stats["speedup"] = end / max(self.stats["render_seconds"], 1e-9)
+        self.stats["control_messages"] = len(self.music.client.messages)
+        return self.stats
+
+    def write_score(self, path, synthdef_dir):
+        """
+        Scrive il file di comandi NRT per scsynth -N
+
+        Args:
+            path: File di uscita (.osc)
+            synthdef_dir: Cartella delle SynthDef compilate (/d_loadDir)
+        """
+        with open(path, 'wb') as f:
+            f.write(nrt_bundle(0.0, [_message('/d_loadDir', os.path.abspath(synthdef_dir)),
+                                     _message('/g_new', self.sequencer.group, 0, 0)]))
+            for when, messages in self.bundles:
+                f.write(nrt_bundle(when, messages))
+            # Ultimo comando: scsynth -N si ferma qui
+            f.write(nrt_bundle(self.duration, [_message('/c_set', 0, 0)]))
+        log.info("Score NRT: %d note in %d bundle, %.1f s -> %s",
+                 self.stats["notes"], len(self.bundles), self.duration, path)
+
+    def write_script(self, path, score_path, audio_path, synthdef_dir, scd_path=SCD_PATH,
+                     sample_rate=SAMPLE_RATE):
+        """
+        Scrive lo script sclang che prepara le SynthDef e rende lo score
+
+        Args:
+            path: Script di uscita (.scd)
+            score_path: File NRT scritto da write_score
+            audio_path: File audio da produrre (WAV stereo)
+            synthdef_dir: Cartella in cui scrivere le SynthDef (la stessa dello score)
+            scd_path: File .scd con le SynthDef
+            sample_rate: Frequenza di campionamento del rendering
+        """
+        sources = synthdef_sources(scd_path)
+        instruments = {track['instrument'] for genre in PATTERNS.values() for pattern in genre for track in pattern}
+        missing = sorted(instruments - set(sources))
+        if missing:
+            log.warning("SynthDef mancanti in %s: %s", scd_path, ", ".join(missing))
+
+        def quoted(p):
+            return '"' + os.path.abspath(p).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+        lines = [
+            "/*",
+            "* CARRETTO MUSICALE - RENDER OFFLINE",
+            f"* Score: {os.path.basename(score_path)} ({self.stats['notes']} note, {self.duration:.1f} s)",
+            f"* SynthDef da {os.path.basename(scd_path)}",
+            "*",
+            f"* Uso: sclang {os.path.basename(path)}",
+            "*/",
+            "",
+            "(",
+            f"var dir = {quoted(synthdef_dir)};",
+            "File.mkdir(dir);",
+            ""
+        ]
+        for name in sorted(sources):
+            lines.append(sources[name] + ".writeDefFile(dir);")
+            lines.append("")
+        command = (f"Server.program + \"-N\" + {quoted(score_path)}.quote + \"_\" + {quoted(audio_path)}.quote"
+                   f" + \"{sample_rate} WAV int16 -o 2\"")
+        lines += [
+            f"({command}).postln.unixCmd({{ |code|",
+            f"    (\"Render terminato (\" ++ code ++ \"): \" ++ {quoted(audio_path)}).postln;",
+            "    0.exit;",
+            "});",
+            ")",
+            ""
+        ]
+        with open(path, 'w') as f:
+            f.write("\n".join(lines))
+
+    def command_line(self, score_path, audio_path, sample_rate=SAMPLE_RATE):
+        """Riga di comando di scsynth -N (con le SynthDef già scritte dallo script)"""
+        return f"scsynth -N {score_path} _ {audio_path} {sample_rate} WAV int16 -o 2"
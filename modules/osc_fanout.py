@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - OSC FANOUT
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Invio dello stesso datagramma OSC a più destinazioni (carretti, nodi altoparlante).
+- Un solo socket UDP non bloccante, aperto una volta: un nodo lento o spento non
+  rallenta gli altri (un buffer pieno fa perdere il datagramma solo a quel nodo)
+- Il datagramma viene codificato una volta sola e spedito a tutti con una sola
+  chiamata sendmmsg() dove disponibile (Linux), altrimenti con un sendto() per
+  destinazione
+- Ogni destinazione ha il suo stato: invii falliti, ultimo errore e, se attivo il
+  heartbeat, raggiungibilità, RTT e sessione di sclang
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import socket
+import sys
+import threading
+from pythonosc import osc_message_builder
+from modules.sensor_events import LatencyStats
+from modules.logger import get_logger
+from modules import metrics
+
+log = get_logger("fanout")
+
+# Buffer di invio ampio: assorbe i picchi senza bloccare (il socket non blocca comunque)
+SEND_BUFFER = 1 << 20
+
+# Datagramma massimo spedito con sendmmsg (oltre si usa sendto)
+MAX_DATAGRAM = 8192
+
+# Sotto questo numero di destinazioni la chiamata ctypes costa più dei sendto
+# risparmiati (bench fanout: ~4 µs per sendto, ~6 µs di chiamata sendmmsg)
+SENDMMSG_MIN_TARGETS = 12
+
+# Errori che indicano un problema della sola destinazione (rete, nodo spento, buffer pieno)
+TARGET_ERRORS = (errno.EAGAIN, errno.ENOBUFS, errno.ECONNREFUSED, errno.EHOSTUNREACH,
+                 errno.ENETUNREACH, errno.EHOSTDOWN, errno.ENETDOWN)
+
+
+def parse_target(text, default_port=57120):
+    """'host:porta' (o solo 'host') -> (host, porta)"""
+    host, sep, port = text.rpartition(':')
+    if not sep:
+        return text, default_port
+    return host, int(port)
+
+
+class OscTarget:
+    def __init__(self, host, port):
+        """
+        Destinazione OSC con il suo stato di salute
+
+        Args:
+            host: Nome o indirizzo IPv4 del nodo
+            port: Porta OSC di sclang sul nodo
+        """
+        self.host = host
+        self.port = port
+        self.addr = (socket.gethostbyname(host), port)
+        self.name = f"{host}:{port}"
+
+        # Invio
+        self.failed = 0             # Datagrammi non consegnati al sistema
+        self.consecutive_errors = 0
+        self.last_error = None
+
+        # Heartbeat (aggiornati da Heartbeat)
+        self.alive = False
+        self.session = None
+        self.last_reply = None
+        self.last_seq = None
+        self.rtt = LatencyStats()
+        self.last_rtt = None
+        self.restarts = 0
+        self.timeouts = 0
+
+    def __repr__(self):
+        return f"OscTarget({self.name})"
+
+    def get_stats(self, datagrams):
+        """Stato della destinazione; datagrams = datagrammi inviati dal fanout"""
+        return {
+            'sent': datagrams - self.failed,
+            'failed': self.failed,
+            'last_error': self.last_error,
+            'alive': self.alive,
+            'session': self.session,
+            'restarts': self.restarts,
+            'rtt': self.rtt.summary()
+        }
+
+
+class _Iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _Msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_Iovec)), ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class _Mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _Msghdr), ("msg_len", ctypes.c_uint)]
+
+
+class _SockaddrIn(ctypes.Structure):
+    _fields_ = [("sin_family", ctypes.c_ushort), ("sin_port", ctypes.c_uint16),
+                ("sin_addr", ctypes.c_ubyte * 4), ("sin_zero", ctypes.c_ubyte * 8)]
+
+
+def _load_sendmmsg():
+    """sendmmsg() della libc, o None se non disponibile"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        func = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = (ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int)
+    func.restype = ctypes.c_int
+    return func
+
+
+_sendmmsg = _load_sendmmsg()
+
+
+class OscFanout:
+    def __init__(self, targets, use_sendmmsg=None, on_recover=None):
+        """
+        Apre il socket condiviso e prepara le destinazioni
+
+        Args:
+            targets: Lista di (host, porta)
+            use_sendmmsg: True/False per forzare sendmmsg() o un sendto() per destinazione
+                          (None = sendmmsg da SENDMMSG_MIN_TARGETS destinazioni, se disponibile)
+            on_recover: Funzione chiamata con la destinazione quando torna a ricevere
+                        dopo invii falliti (i valori persi vanno reinviati)
+        """
+        if not targets:
+            raise ValueError("Nessuna destinazione OSC")
+        self.targets = [OscTarget(host, port) for host, port in targets]
+        self.on_recover = on_recover
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        local = all(target.addr[0].startswith('127.') for target in self.targets)
+        self.sock.bind(('127.0.0.1' if local else '', 0))
+        self.sock.setblocking(False)
+        self.local_port = self.sock.getsockname()[1]
+
+        self.datagrams = 0
+        self.failing = set()        # Destinazioni con l'ultimo invio fallito
+        # Sender, heartbeat e sequencer inviano da thread diversi: il lock protegge lo stato
+        # delle destinazioni e il buffer di sendmmsg, mai tenuto durante on_recover
+        self.lock = threading.Lock()
+
+        if use_sendmmsg is None:
+            use_sendmmsg = len(self.targets) >= SENDMMSG_MIN_TARGETS
+        self.sendmmsg = _sendmmsg if use_sendmmsg else None
+        if self.sendmmsg:
+            self._prepare_batch()
+
+    def _prepare_batch(self):
+        """Strutture di sendmmsg costruite una volta: per ogni invio cambiano solo i byte e la lunghezza"""
+        n = len(self.targets)
+        self.buffer = ctypes.create_string_buffer(MAX_DATAGRAM)
+        self.iov = _Iovec(ctypes.addressof(self.buffer), 0)
+        self.addrs = (_SockaddrIn * n)()
+        self.msgs = (_Mmsghdr * n)()
+        for i, target in enumerate(self.targets):
+            addr = self.addrs[i]
+            addr.sin_family = socket.AF_INET
+            addr.sin_port = socket.htons(target.port)
+            addr.sin_addr[:] = socket.inet_aton(target.addr[0])
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(addr)
+            hdr.msg_namelen = ctypes.sizeof(_SockaddrIn)
+            hdr.msg_iov = ctypes.pointer(self.iov)
+            hdr.msg_iovlen = 1
+        self.msg_size = ctypes.sizeof(_Mmsghdr)
+        self.msgs_addr = ctypes.addressof(self.msgs)
+        self.fd = self.sock.fileno()
+
+    def send(self, content, targets=None):
+        """
+        Spedisce un datagramma a tutte le destinazioni (o a quelle indicate)
+
+        Args:
+            content: bytes o messaggio/bundle di pythonosc (con .dgram)
+            targets: Sottoinsieme di self.targets (es. risincronizzazione di un nodo)
+
+        Returns:
+            Numero di destinazioni a cui il datagramma è stato consegnato
+        """
+        dgram = content if isinstance(content, (bytes, bytearray)) else content.dgram
+        if targets is None:
+            self.datagrams += 1
+            if self.sendmmsg and len(dgram) <= MAX_DATAGRAM:
+                failed = self._send_batch(dgram)
+            else:
+                failed = self._send_each(dgram, self.targets)
+            delivered = len(self.targets) - len(failed)
+        else:
+            failed = self._send_each(dgram, targets)
+            delivered = len(targets) - len(failed)
+
+        if not failed:
+            with self.lock:
+                if not self.failing:
+                    return delivered
+        self._update_health(failed, targets)
+        return delivered
+
+    def _send_each(self, dgram, targets):
+        failed = []
+        sendto = self.sock.sendto
+        for target in targets:
+            try:
+                sendto(dgram, target.addr)
+            except OSError as e:
+                failed.append((target, e.errno))
+        return failed
+
+    def _send_batch(self, dgram):
+        """Una sola chiamata sendmmsg(); in caso di errore riprende dal messaggio successivo"""
+        failed = []
+        n = len(self.targets)
+        start = 0
+        with self.lock:
+            ctypes.memmove(self.buffer, dgram, len(dgram))
+            self.iov.iov_len = len(dgram)
+            while start < n:
+                sent = self.sendmmsg(self.fd, self.msgs_addr + start * self.msg_size, n - start, 0)
+                if sent < 0:
+                    # Fallito il primo messaggio del gruppo: solo quella destinazione
+                    failed.append((self.targets[start], ctypes.get_errno()))
+                    start += 1
+                elif sent == 0:
+                    break
+                else:
+                    start += sent
+        return failed
+
+    def _update_health(self, failed, targets):
+        """Aggiorna lo stato delle destinazioni dopo un invio (chiamata solo se qualcosa non va)"""
+        failed_now = set()
+        candidates = self.targets if targets is None else targets
+        with self.lock:
+            for target, code in failed:
+                failed_now.add(target)
+                if targets is None:
+                    target.failed += 1
+                target.consecutive_errors += 1
+                if code not in TARGET_ERRORS:
+                    log.debug("Errore inatteso verso %s: %s", target.name, code)
+                if target.consecutive_errors == 1:
+                    log.warning("Invio a %s fallito: %s", target.name, errno.errorcode.get(code, code))
+                target.last_error = errno.errorcode.get(code, str(code))
+                metrics.FANOUT_ERRORS.inc(label_value=target.name)
+
+            recovered = [t for t in self.failing if t in candidates and t not in failed_now]
+            for target in recovered:
+                log.info("%s di nuovo raggiungibile dopo %d invii falliti", target.name, target.consecutive_errors)
+                target.consecutive_errors = 0
+                self.failing.discard(target)
+            self.failing |= failed_now
+        # Fuori dal lock: on_recover reinvia lo stato con send()
+        if self.on_recover:
+            for target in recovered:
+                self.on_recover(target)
+
+    def send_message(self, address, value):
+        """Messaggio OSC singolo a tutte le destinazioni (compatibile con SimpleUDPClient)"""
+        msg = osc_message_builder.OscMessageBuilder(address=address)
+        msg.add_arg(value)
+        return self.send(msg.build())
+
+    def target_for(self, addr):
+        """Destinazione con l'indirizzo (ip, porta) dato, o None"""
+        for target in self.targets:
+            if target.addr == addr:
+                return target
+        return None
+
+    def close(self):
+        self.sock.close()
+
+    def get_stats(self):
+        """Stato per destinazione"""
+        return {target.name: target.get_stats(self.datagrams) for target in self.targets}
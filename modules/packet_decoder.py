@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - PACKET DECODER
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Decoder a blocchi per i formati binari dell'Arduino.
+Elaborano in un solo passaggio tutti i byte disponibili e conservano solo l'ultimo
+pacchetto completo, insieme ai contatori di pacchetti e risincronizzazioni.
+
+v1: [0xFF, val1, val2, val3, val4], valori 0-255. Un potenziometro a fondo scala
+    invia 255 = marker: il pacchetto viene scartato proprio a manopola tutta aperta.
+v2: pacchetti COBS terminati da 0x00, valori a 10 bit, sequenza e CRC-8:
+        dati = [seq, v (5 byte), crc]   7 byte
+        v    = val1 | val2 << 10 | val3 << 20 | val4 << 30   (little endian)
+        crc  = CRC-8 (polinomio 0x07, iniziale 0x00) di seq e v
+        filo = COBS(dati) + 0x00        9 byte per pacchetto
+    Lo 0x00 compare solo come delimitatore: qualunque valore è trasmissibile e
+    dopo un errore il pacchetto successivo è sempre riconosciuto. I salti di
+    sequenza contano i pacchetti persi, i CRC errati quelli corrotti.
+AutoDecoder riconosce il formato dai primi pacchetti validi.
+"""
+
+
+class PacketDecoder:
+    MARKER = 0xFF      # Marker di inizio pacchetto
+    PACKET_SIZE = 5    # 1 byte marker + 4 bytes dati
+
+    def __init__(self):
+        """Inizializza il decoder con buffer vuoto e contatori a zero"""
+        self.buffer = bytearray()
+        self.latest = None      # Ultimo pacchetto completo (4 bytes, senza marker)
+        self.full_scale = 255
+        self.frames = 0         # Pacchetti completi decodificati
+        self.resyncs = 0        # Volte in cui è stato necessario cercare un nuovo marker
+        self.bytes_in = 0       # Byte totali ricevuti
+
+    def reset(self):
+        """Svuota il buffer (es. dopo una riconnessione) mantenendo i contatori"""
+        self.buffer.clear()
+
+    def feed(self, data):
+        """
+        Aggiunge i byte ricevuti ed estrae tutti i pacchetti completi
+
+        Args:
+            data: bytes/bytearray letti dalla seriale (anche parziali)
+
+        Returns:
+            Numero di nuovi pacchetti completi trovati in questo blocco
+        """
+        if not data:
+            return 0
+
+        self.bytes_in += len(data)
+        buf = self.buffer
+        buf += data
+
+        marker = self.MARKER
+        size = self.PACKET_SIZE
+        n = len(buf)
+
+        pos = buf.find(marker)
+        if pos < 0:
+            # Nessun marker: tutto il blocco è rumore
+            self.resyncs += 1
+            buf.clear()
+            return 0
+        if pos > 0:
+            # Byte spuri prima del primo marker
+            self.resyncs += 1
+
+        found = 0
+        latest_pos = -1
+        while True:
+            end = pos + size
+            if end > n:
+                # Pacchetto parziale: lo conserviamo per il prossimo blocco
+                break
+
+            # Un marker dentro il pacchetto significa che questo è troncato
+            nxt = buf.find(marker, pos + 1, end)
+            if nxt >= 0:
+                self.resyncs += 1
+                pos = nxt
+                continue
+
+            latest_pos = pos
+            found += 1
+            pos = end
+
+            if pos >= n:
+                break
+            if buf[pos] != marker:
+                # Il prossimo byte non è un marker: risincronizza
+                self.resyncs += 1
+                nxt = buf.find(marker, pos)
+                if nxt < 0:
+                    pos = n
+                    break
+                pos = nxt
+
+        if found:
+            self.latest = bytes(buf[latest_pos + 1:latest_pos + size])
+            self.frames += found
+
+        del buf[:pos]
+        return found
+
+    def get_stats(self):
+        """Restituisce i contatori del decoder"""
+        return {
+            'protocol': 'v1',
+            'frames': self.frames,
+            'resyncs': self.resyncs,
+            'bytes': self.bytes_in,
+            'pending': len(self.buffer)
+        }
+
+
+def _crc8_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+
+CRC8_TABLE = _crc8_table()
+
+
+def crc8(data):
+    """CRC-8 con polinomio 0x07 e valore iniziale 0x00"""
+    crc = 0
+    table = CRC8_TABLE
+    for b in data:
+        crc = table[crc ^ b]
+    return crc
+
+
+def cobs_encode(data):
+    """Codifica COBS: il risultato non contiene byte 0x00 (delimitatore escluso)"""
+    out = bytearray(b'\x00')
+    code_pos = 0
+    code = 1
+    for b in data:
+        if b:
+            out.append(b)
+            code += 1
+        if not b or code == 0xFF:
+            out[code_pos] = code
+            code_pos = len(out)
+            out.append(0)
+            code = 1
+    out[code_pos] = code
+    return bytes(out)
+
+
+def cobs_decode(data):
+    """
+    Decodifica COBS di un pacchetto senza delimitatore
+
+    Returns:
+        bytes decodificati, o None se la codifica non è valida
+    """
+    out = bytearray()
+    pos = 0
+    n = len(data)
+    while pos < n:
+        code = data[pos]
+        end = pos + code
+        if code == 0 or end > n:
+            return None
+        out += data[pos + 1:end]
+        pos = end
+        if code < 0xFF and pos < n:
+            out.append(0)
+    return bytes(out)
+
+
+def encode_frame_v2(seq, values):
+    """
+    Pacchetto v2 pronto per la seriale (riferimento per il firmware e per i test)
+
+    Args:
+        seq: Numero di sequenza (modulo 256)
+        values: 4 valori 0-1023
+    """
+    v1, v2, v3, v4 = values
+    packed = (v1 & 0x3FF) | (v2 & 0x3FF) << 10 | (v3 & 0x3FF) << 20 | (v4 & 0x3FF) << 30
+    payload = bytes((seq & 0xFF,)) + packed.to_bytes(5, 'little')
+    return cobs_encode(payload + bytes((crc8(payload),))) + b'\x00'
+
+
+class PacketDecoderV2:
+    DELIMITER = 0x00
+    PAYLOAD_SIZE = 7          # seq + 5 byte di valori + crc
+    ENCODED_SIZE = 8          # COBS aggiunge un byte
+    MAX_PENDING = 64          # Oltre, senza delimitatore, il buffer è rumore
+
+    def __init__(self):
+        """Inizializza il decoder v2 con buffer vuoto e contatori a zero"""
+        self.buffer = bytearray()
+        self.latest = None      # Ultimi 4 valori (tupla di interi 0-1023)
+        self.full_scale = 1023
+        self.frames = 0         # Pacchetti validi
+        self.corrupt = 0        # Pacchetti con lunghezza, COBS o CRC errati
+        self.dropped = 0        # Pacchetti persi, corrotti compresi (salti di sequenza)
+        self.bytes_in = 0
+        self.last_seq = None
+
+    @property
+    def resyncs(self):
+        """Per uniformità con il v1: ogni pacchetto corrotto è una risincronizzazione"""
+        return self.corrupt
+
+    def reset(self):
+        """Svuota il buffer (es. dopo una riconnessione): la sequenza riparte"""
+        self.buffer.clear()
+        self.last_seq = None
+
+    def feed(self, data):
+        """
+        Aggiunge i byte ricevuti ed estrae tutti i pacchetti completi
+
+        Returns:
+            Numero di nuovi pacchetti validi trovati in questo blocco
+        """
+        if not data:
+            return 0
+
+        self.bytes_in += len(data)
+        buf = self.buffer
+        buf += data
+
+        table = CRC8_TABLE
+        encoded_size = self.ENCODED_SIZE
+        last_seq = self.last_seq
+        found = 0
+        latest = None
+        start = 0
+        while True:
+            end = buf.find(0, start)
+            if end < 0:
+                break
+            if end - start == encoded_size:
+                payload = cobs_decode(buf[start:end])
+                crc = 0
+                if payload is not None:
+                    for b in payload:
+                        crc = table[crc ^ b]
+                if crc == 0 and payload is not None:
+                    # CRC calcolato sul pacchetto completo: 0 se integro
+                    seq = payload[0]
+                    if last_seq is not None:
+                        gap = (seq - last_seq - 1) & 0xFF
+                        if gap != 0xFF:     # 0xFF = stesso seq ripetuto, nessuna perdita
+                            self.dropped += gap
+                    last_seq = seq
+                    latest = payload
+                    found += 1
+                else:
+                    self.corrupt += 1
+            elif end > start:
+                # Lunghezza errata (byte persi o spuri); due 0x00 di fila sono solo rumore
+                self.corrupt += 1
+            start = end + 1
+
+        if start:
+            del buf[:start]
+        elif len(buf) > self.MAX_PENDING:
+            self.corrupt += 1
+            buf.clear()
+
+        self.last_seq = last_seq
+        if found:
+            packed = int.from_bytes(latest[1:6], 'little')
+            self.latest = (packed & 0x3FF, packed >> 10 & 0x3FF, packed >> 20 & 0x3FF, packed >> 30 & 0x3FF)
+            self.frames += found
+        return found
+
+    def get_stats(self):
+        """Restituisce i contatori del decoder"""
+        return {
+            'protocol': 'v2',
+            'frames': self.frames,
+            'resyncs': self.corrupt,
+            'corrupt': self.corrupt,
+            'dropped': self.dropped,
+            'bytes': self.bytes_in,
+            'pending': len(self.buffer)
+        }
+
+
+class AutoDecoder:
+    # Pacchetti validi necessari per scegliere il formato: il v2 ha il CRC, il v1 no
+    V2_FRAMES = 3
+    V1_FRAMES = 8
+    # Il v1 vince se i suoi pacchetti sono più di V1_RATIO volte quelli v2: un pacchetto v2
+    # con CRC valido per caso nel flusso v1 non blocca il riconoscimento
+    V1_RATIO = 4
+
+    def __init__(self, protocol='auto'):
+        """
+        Decoder che riconosce il formato v1 o v2 dal flusso
+
+        Args:
+            protocol: 'auto', 'v1' o 'v2' (formato imposto, nessun riconoscimento)
+        """
+        if protocol not in ('auto', 'v1', 'v2'):
+            raise ValueError(f"Protocollo sconosciuto: {protocol}")
+        self.v1 = PacketDecoder() if protocol in ('auto', 'v1') else None
+        self.v2 = PacketDecoderV2() if protocol in ('auto', 'v2') else None
+        self.active = self.v1 if protocol == 'v1' else self.v2 if protocol == 'v2' else None
+
+    @property
+    def protocol(self):
+        """'v1', 'v2' o None finché il formato non è riconosciuto"""
+        if self.active is None:
+            return None
+        return 'v2' if self.active is self.v2 else 'v1'
+
+    @property
+    def latest(self):
+        return self.active.latest if self.active else None
+
+    @property
+    def full_scale(self):
+        return self.active.full_scale if self.active else 255
+
+    @property
+    def frames(self):
+        return self.active.frames if self.active else 0
+
+    @property
+    def resyncs(self):
+        return self.active.resyncs if self.active else 0
+
+    @property
+    def dropped(self):
+        return self.active.dropped if self.active is self.v2 and self.v2 else 0
+
+    @property
+    def corrupt(self):
+        return self.active.corrupt if self.active is self.v2 and self.v2 else 0
+
+    def reset(self):
+        """Svuota i buffer mantenendo il formato riconosciuto"""
+        for decoder in (self.v1, self.v2):
+            if decoder:
+                decoder.reset()
+
+    def feed(self, data):
+        """
+        Aggiunge i byte ricevuti; finché il formato non è noto li passa a entrambi i decoder
+
+        Returns:
+            Numero di nuovi pacchetti completi del formato attivo
+        """
+        if self.active is not None:
+            return self.active.feed(data)
+
+        found_v1 = self.v1.feed(data)
+        found_v2 = self.v2.feed(data)
+        if self.v2.frames >= self.V2_FRAMES:
+            self.active = self.v2
+            self.v1 = None
+            return found_v2
+        if self.v1.frames >= self.V1_FRAMES and self.v1.frames > self.V1_RATIO * self.v2.frames:
+            self.active = self.v1
+            self.v2 = None
+            return found_v1
+        return 0
+
+    def get_stats(self):
+        """Contatori del formato attivo"""
+        if self.active is None:
+            return {'protocol': None, 'frames': 0, 'resyncs': 0,
+                    'bytes': self.v1.bytes_in, 'pending': len(self.v1.buffer)}
+        return self.active.get_stats()
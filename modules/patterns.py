@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - PATTERNS
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+I pattern di ~patternFunctions (carretto_music.scd) come dati, per il sequencer Python.
+Genere -> 4 pattern (indici 0-3; il 3 è il ramo di default dello switch di sclang).
+Ogni pattern è una lista di tracce, una per Pbind del Ppar:
+    instrument  nome della SynthDef
+    dur         durate in battiti (Pseq ciclico)
+    amp         fattore moltiplicato per il volume corrente (Pfunc { ~currentVolume * amp })
+    freq        frequenza fissa o lista ciclica (Pseq)
+    altri       parametri aggiuntivi della SynthDef, fissi o ciclici (es. attack)
+Le liste di una traccia ciclano indipendentemente, come i Pseq di un Pbind.
+Il ruolo di una traccia (layer_role) decide cosa tacere quando scsynth è sovraccarico.
+"""
+
+import json
+
+# Suffissi dei nomi delle SynthDef: le voci essenziali restano anche con la polifonia ridotta
+CORE_SUFFIXES = ('Kick', 'Bass', 'Pad')
+HAT_SUFFIX = 'Hat'
+
+
+def _track(instrument, dur, amp, freq, **params):
+    track = {'instrument': instrument, 'dur': dur, 'amp': amp, 'freq': freq}
+    track.update(params)
+    return track
+
+
+_DUB_BASE = [_track('dubKick', [1, 1, 1, 1], 0.9, 60),
+             _track('dubHat', [0.5, 0.5, 0.5, 0.5], 0.6, 8000)]
+_DUB_BASS = [_track('dubKick', [1, 1, 1, 1], 0.9, 60),
+             _track('dubHat', [0.5, 0.5, 0.5, 0.5], 0.6, 8000),
+             _track('dubBass', [0.5, 0.5, 1, 1, 1], 0.9, [60, 60, 40, 50, 60])]
+
+_TECHNO_BASE = [_track('techKick', [0.5, 0.5, 0.5, 0.5], 0.9, 60),
+                _track('techHat', [0.25, 0.25, 0.25, 0.25], 0.7, 9000)]
+_TECHNO_BASS = _TECHNO_BASE + [_track('techBass', [0.25, 0.25, 0.25, 0.25, 0.5, 0.5], 0.8,
+                                      [60, 60, 60, 60, 80, 40])]
+
+_REGGAE_BASE = [_track('reggaeKick', [1, 1, 1, 1], 0.8, 60),
+                _track('reggaeSkank', [1, 1, 1, 1], 0.6, [440, 550, 440, 550])]
+
+_HOUSE_BASE = [_track('houseKick', [0.5, 0.5, 0.5, 0.5], 0.9, 60),
+               _track('houseHat', [0.25, 0.25, 0.25, 0.25], 0.7, 10000)]
+
+_AMBIENT_BASE = [_track('ambientPad', [4], 0.6, [220, 330, 440, 275], attack=0.3)]
+
+_DNB_BASE = [_track('dnbKick', [0.5, 0.5, 0.5, 0.5], 0.9, 60),
+             _track('dnbHat', [0.125, 0.125, 0.125, 0.125], 0.7, 12000)]
+
+_TRAP_BASE = [_track('trapKick', [1, 1, 1, 1], 0.9, 60),
+              _track('trapHat', [0.25, 0.25, 0.25, 0.25], 0.7, 12000)]
+
+PATTERNS = {
+    'dub': [
+        _DUB_BASE,
+        [_track('dubKick', [1, 1, 1, 1], 0.9, 60),
+         _track('dubSnare', [2, 2], 0.8, 100),
+         _track('dubHat', [0.5, 0.5, 0.5, 0.5], 0.6, 8000),
+         _track('dubBass', [0.5, 0.5, 1, 1, 1], 0.9, [60, 60, 40, 50, 60])],
+        [_track('dubKick', [1, 1, 1, 1], 0.9, 60),
+         _track('dubSnare', [2, 2], 0.8, 100),
+         _track('dubHat', [0.5, 0.5, 0.5, 0.5], 0.6, 8000),
+         _track('dubBass', [0.5, 0.5, 1, 1, 0.5, 0.5, 1, 1], 0.9, [60, 60, 40, 50, 60, 60, 45, 55])],
+        _DUB_BASS
+    ],
+    'techno': [_TECHNO_BASE, _TECHNO_BASS, _TECHNO_BASS, _TECHNO_BASE],
+    'reggae': [
+        _REGGAE_BASE,
+        _REGGAE_BASE + [_track('reggaeBass', [0.5, 0.5, 1, 1, 1], 0.9, [60, 60, 45, 50, 60])],
+        [_track('reggaeKick', [1, 1, 1, 1], 0.8, 60),
+         _track('reggaeSkank', [1, 1, 1, 1, 0.5, 0.5, 1, 1], 0.6, [440, 550, 440, 550, 660, 550, 440, 330]),
+         _track('reggaeBass', [0.5, 0.5, 1, 1, 1, 0.5, 0.5, 1, 1, 1], 0.9,
+                [60, 60, 45, 50, 60, 60, 60, 40, 45, 60])],
+        _REGGAE_BASE
+    ],
+    'house': [
+        _HOUSE_BASE,
+        _HOUSE_BASE + [_track('houseClap', [1, 1], 0.8, 800)],
+        [_track('houseKick', [0.5, 0.5, 0.5, 0.5, 0.25, 0.25, 0.5, 0.5], 0.9, 60),
+         _track('houseHat', [0.25, 0.25, 0.25, 0.25, 0.125, 0.125, 0.25, 0.25], 0.7, 10000),
+         _track('houseClap', [1, 1], 0.8, 800)],
+        _HOUSE_BASE
+    ],
+    'ambient': [
+        _AMBIENT_BASE,
+        _AMBIENT_BASE + [_track('ambientBell', [2, 4, 2], 0.5, [440, 550, 660])],
+        [_track('ambientPad', [4, 4, 4, 4], 0.6, [220, 330, 440, 275, 165, 220], attack=[0.3, 0.5, 0.3, 0.4]),
+         _track('ambientBell', [2, 4, 2, 3, 1], 0.5, [440, 550, 660, 770, 880, 990])],
+        _AMBIENT_BASE
+    ],
+    'drumandbass': [
+        _DNB_BASE,
+        _DNB_BASE + [_track('dnbBass', [0.25, 0.25, 0.125, 0.125, 0.25], 0.8, [60, 80, 100, 80, 60])],
+        [_track('dnbKick', [0.5, 0.5, 0.5, 0.5, 0.25, 0.25, 0.5, 0.5], 0.9, 60),
+         _track('dnbHat', [0.125, 0.125, 0.125, 0.125, 0.0625, 0.0625, 0.125, 0.125], 0.7, 12000),
+         _track('dnbBass', [0.25, 0.25, 0.125, 0.125, 0.25, 0.125, 0.125, 0.25], 0.8,
+                [60, 80, 100, 80, 60, 100, 80, 60])],
+        _DNB_BASE
+    ],
+    'trap': [
+        _TRAP_BASE,
+        _TRAP_BASE + [_track('trapBass', [0.5, 0.5, 0.5, 0.5, 2], 0.9, [40, 40, 40, 40, 30])],
+        [_track('trapKick', [1, 1, 1, 1, 0.5, 0.5, 1, 1], 0.9, 60),
+         _track('trapHat', [0.25, 0.25, 0.25, 0.25, 0.125, 0.125, 0.125, 0.125], 0.7, 12000),
+         _track('trapBass', [0.5, 0.5, 0.5, 0.5, 2, 0.5, 0.5, 0.5, 0.5, 2], 0.9,
+                [40, 40, 40, 40, 30, 40, 40, 40, 40, 35])],
+        _TRAP_BASE
+    ]
+}
+
+
+def load_patterns(path):
+    """Legge pattern da un file JSON con la stessa struttura di PATTERNS"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def layer_role(instrument):
+    """'core' (cassa, basso, pad), 'hat' (charleston) o 'extra' (rullante, clap, campane, ...)"""
+    if instrument.endswith(CORE_SUFFIXES):
+        return 'core'
+    if instrument.endswith(HAT_SUFFIX):
+        return 'hat'
+    return 'extra'
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - SCSYNTH MONITOR
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Controllo del carico di scsynth e riduzione adattiva del carico (load shedding).
+- Interroga scsynth con /status a intervalli fissi da un socket dedicato: CPU media
+  e di picco, UGen, synth, gruppi e SynthDef dalla risposta /status.reply
+- Carico sostenuto sopra la soglia 'enter' del livello successivo per 'hold'
+  secondi: si sale di un livello; sotto la soglia 'exit' del livello corrente
+  per 'release' secondi: si scende di uno. Un picco oltre 'peak' conta come
+  carico oltre tutte le soglie
+- Livelli (cumulativi):
+    1  niente synth di conferma (/test, volume, tune, cambio di pattern)
+    2  charleston dimezzati (una nota su due)
+    3  polifonia ridotta: suonano solo cassa, basso e pad
+- Il livello passa a on_level(livello): MusicEngine lo invia a sclang
+  (/carretto/shed) e al sequencer Python
+"""
+
+import json
+import select
+import socket
+import threading
+import time
+from pythonosc import osc_message_builder
+from pythonosc.osc_message import OscMessage
+from modules.logger import get_logger
+from modules import metrics
+
+log = get_logger("scsynth")
+
+STATUS_ADDRESS = "/status"
+REPLY_ADDRESS = "/status.reply"
+
+# Porta UDP di scsynth
+SCSYNTH_PORT = 57110
+
+# Livelli di riduzione del carico
+SHED_NONE = 0
+SHED_CONFIRM = 1        # Niente synth di conferma
+SHED_HATS = 2           # Charleston dimezzati
+SHED_POLYPHONY = 3      # Solo cassa, basso e pad
+
+# Soglie sulla CPU media di scsynth in percentuale: 'enter' per salire al livello,
+# 'exit' (più bassa: isteresi) per tornare al livello precedente
+DEFAULT_POLICY = {
+    'interval': 0.5,        # Secondi tra due /status
+    'timeout': 2.0,         # Secondi senza risposta: scsynth assente (livello invariato)
+    'hold': 2.0,            # Secondi di carico sostenuto prima di salire di un livello
+    'release': 5.0,         # Secondi di margine sostenuto prima di scendere di un livello
+    'peak': 95.0,           # CPU di picco oltre cui il carico vale come massimo
+    'levels': [
+        {'enter': 55.0, 'exit': 40.0},      # SHED_CONFIRM
+        {'enter': 70.0, 'exit': 55.0},      # SHED_HATS
+        {'enter': 80.0, 'exit': 65.0}       # SHED_POLYPHONY
+    ]
+}
+
+
+def load_policy(path):
+    """Legge una politica JSON con la stessa struttura di DEFAULT_POLICY (chiavi omesse = default)"""
+    with open(path) as f:
+        return json.load(f)
+
+
+class ServerMonitor:
+    def __init__(self, host="127.0.0.1", port=SCSYNTH_PORT, policy=None, on_level=None):
+        """
+        Inizializza il monitor
+
+        Args:
+            host: Indirizzo di scsynth
+            port: Porta UDP di scsynth
+            policy: Politica di riduzione (chiavi di DEFAULT_POLICY, quelle omesse restano di default)
+            on_level: Funzione chiamata con il nuovo livello a ogni cambio
+        """
+        self.address = (host, port)
+        self.policy = dict(DEFAULT_POLICY, **(policy or {}))
+        self.levels = self.policy['levels']
+        for i, level in enumerate(self.levels):
+            if level['exit'] >= level['enter']:
+                raise ValueError(f"Livello {i + 1}: la soglia exit deve essere minore di enter")
+        self.interval = self.policy['interval']
+        self.on_level = on_level
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("0.0.0.0", 0))
+        self.sock.setblocking(False)
+
+        # Ultima risposta di scsynth
+        self.status = {"ugens": 0, "synths": 0, "groups": 0, "synthdefs": 0,
+                       "avg_cpu": 0.0, "peak_cpu": 0.0, "sample_rate": 0.0}
+        self.alive = False
+        self.last_reply = 0.0
+
+        self.level = SHED_NONE
+        self.above_since = None     # Inizio del carico sopra la soglia del livello successivo
+        self.below_since = None     # Inizio del margine sotto la soglia di uscita
+
+        self.running = False
+        self.thread = None
+
+        self.stats = {"polls": 0, "replies": 0, "timeouts": 0, "raised": 0, "lowered": 0}
+
+        metrics.SC_CPU_AVG.set_function(lambda: self.status["avg_cpu"])
+        metrics.SC_CPU_PEAK.set_function(lambda: self.status["peak_cpu"])
+        metrics.SC_UGENS.set_function(lambda: self.status["ugens"])
+        metrics.SC_SYNTHS.set_function(lambda: self.status["synths"])
+        metrics.SHED_LEVEL.set_function(lambda: self.level)
+
+    def start(self):
+        """Avvia il thread che interroga scsynth"""
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name="scsynth-monitor", daemon=True)
+            self.thread.start()
+            print(f"[SCSYNTH] /status a {self.address[0]}:{self.address[1]} ogni {self.interval:g} s")
+
+    def stop(self):
+        """Ferma il thread e chiude il socket"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=self.interval + 1.0)
+        self.sock.close()
+
+    def _poll(self):
+        msg = osc_message_builder.OscMessageBuilder(address=STATUS_ADDRESS)
+        try:
+            self.sock.sendto(msg.build().dgram, self.address)
+            self.stats["polls"] += 1
+        except OSError:
+            pass        # scsynth non ancora avviato: conta come risposta mancante
+
+    def _on_reply(self, data, now):
+        try:
+            message = OscMessage(data)
+        except Exception:
+            return
+        params = message.params
+        if message.address != REPLY_ADDRESS or len(params) < 9:
+            return
+        self.status = {"ugens": params[1], "synths": params[2], "groups": params[3],
+                       "synthdefs": params[4], "avg_cpu": float(params[5]),
+                       "peak_cpu": float(params[6]), "sample_rate": float(params[8])}
+        self.stats["replies"] += 1
+        self.last_reply = now
+        if not self.alive:
+            self.alive = True
+            log.info("scsynth raggiungibile: %d UGen, %d synth, CPU %.1f%%",
+                     self.status["ugens"], self.status["synths"], self.status["avg_cpu"])
+        self.evaluate(self.status["avg_cpu"], self.status["peak_cpu"], now)
+
+    def evaluate(self, avg_cpu, peak_cpu, now):
+        """
+        Aggiorna il livello di riduzione da una misura di carico
+
+        Args:
+            avg_cpu: CPU media di scsynth in percentuale
+            peak_cpu: CPU di picco in percentuale
+            now: Istante della misura (perf_counter)
+
+        Returns:
+            Livello corrente
+        """
+        load = avg_cpu
+        if peak_cpu >= self.policy['peak']:
+            load = max(load, self.levels[-1]['enter'])
+
+        level = self.level
+        if level < len(self.levels) and load >= self.levels[level]['enter']:
+            self.below_since = None
+            if self.above_since is None:
+                self.above_since = now
+            elif now - self.above_since >= self.policy['hold']:
+                # Un livello alla volta: il successivo richiede un altro periodo sostenuto
+                self.above_since = now
+                self._set_level(level + 1, load)
+        elif level > 0 and load < self.levels[level - 1]['exit']:
+            self.above_since = None
+            if self.below_since is None:
+                self.below_since = now
+            elif now - self.below_since >= self.policy['release']:
+                self.below_since = now
+                self._set_level(level - 1, load)
+        else:
+            self.above_since = self.below_since = None
+        return self.level
+
+    def _set_level(self, level, load):
+        raised = level > self.level
+        self.level = level
+        self.stats["raised" if raised else "lowered"] += 1
+        if raised:
+            log.warning("Carico di scsynth %.1f%%: riduzione al livello %d", load, level)
+        else:
+            log.info("Carico di scsynth %.1f%%: riduzione al livello %d", load, level)
+        if self.on_level:
+            try:
+                self.on_level(level)
+            except Exception as e:
+                log.error("Errore nell'applicazione del livello %d: %s", level, e)
+
+    def _check_timeout(self, now):
+        if self.alive and now - self.last_reply > self.policy['timeout']:
+            self.alive = False
+            self.stats["timeouts"] += 1
+            # Nessuna misura: il livello resta quello corrente
+            self.above_since = self.below_since = None
+            log.warning("Nessuna risposta da scsynth da %.1f s", now - self.last_reply)
+
+    def _run(self):
+        next_poll = time.perf_counter()
+        while self.running:
+            now = time.perf_counter()
+            if now >= next_poll:
+                self._poll()
+                next_poll = now + self.interval
+            self._check_timeout(now)
+            try:
+                readable, _, _ = select.select([self.sock], [], [], max(0.001, next_poll - now))
+            except (OSError, ValueError):
+                break       # Socket chiuso in arresto
+            if not readable:
+                continue
+            while True:
+                try:
+                    data = self.sock.recv(1024)
+                except (BlockingIOError, OSError):
+                    break
+                self._on_reply(data, time.perf_counter())
+
+    def get_stats(self):
+        """Ultime cifre di scsynth, livello di riduzione e contatori"""
+        stats = dict(self.stats)
+        stats.update(self.status)
+        stats["alive"] = self.alive
+        stats["level"] = self.level
+        return stats
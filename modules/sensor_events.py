@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - SENSOR EVENTS
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Canale di notifica tra i lettori dei sensori (Arduino, GPS) e il loop di controllo.
+I lettori pubblicano un evento per ogni nuovo dato; il consumatore si sveglia subito
+invece di interrogare i lettori a intervalli fissi.
+"""
+
+import threading
+import time
+from collections import deque
+
+
+class SensorEvents:
+    def __init__(self):
+        """Inizializza il canale eventi"""
+        self.cond = threading.Condition(threading.Lock())
+        self.seq = 0
+        # Sorgente -> timestamp (perf_counter) del primo evento non ancora consumato
+        self.pending = {}
+
+    def publish(self, source, timestamp=None):
+        """
+        Segnala che una sorgente ha nuovi dati
+
+        Args:
+            source: Nome della sorgente ('arduino', 'gps', ...)
+            timestamp: Istante di arrivo del dato (time.perf_counter); default adesso
+        """
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        with self.cond:
+            self.seq += 1
+            # Conserva l'arrivo più vecchio: è quello che ha atteso di più
+            if source not in self.pending:
+                self.pending[source] = timestamp
+            self.cond.notify()
+
+    def wait(self, timeout=None):
+        """
+        Attende il prossimo evento e consuma tutti quelli in sospeso
+
+        Args:
+            timeout: Attesa massima in secondi (None = infinita)
+
+        Returns:
+            Dizionario {sorgente: timestamp di arrivo}; vuoto se scade il timeout
+        """
+        with self.cond:
+            if not self.pending:
+                self.cond.wait(timeout)
+            pending = self.pending
+            self.pending = {}
+            return pending
+
+
+class LatencyStats:
+    def __init__(self, report_interval=5.0, max_samples=4096):
+        """
+        Raccoglie le latenze sensore -> invio UDP e le riassume periodicamente
+
+        Args:
+            report_interval: Secondi tra un riepilogo e il successivo
+            max_samples: Campioni conservati (i più vecchi vengono scartati)
+        """
+        self.report_interval = report_interval
+        self.samples = deque(maxlen=max_samples)
+        self.total = 0
+        self.last_report = time.perf_counter()
+
+    def add(self, latency):
+        """Registra una latenza in secondi"""
+        self.samples.append(latency)
+        self.total += 1
+
+    def summary(self):
+        """Restituisce conteggio, p50, p99 e massimo in millisecondi"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        n = len(ordered)
+        return {
+            'count': n,
+            'p50_ms': ordered[n // 2] * 1000.0,
+            'p99_ms': ordered[min(n - 1, int(n * 0.99))] * 1000.0,
+            'max_ms': ordered[-1] * 1000.0
+        }
+
+    def maybe_report(self, now=None):
+        """Stampa il riepilogo se è trascorso l'intervallo e azzera i campioni"""
+        now = time.perf_counter() if now is None else now
+        if now - self.last_report < self.report_interval:
+            return
+        self.last_report = now
+        stats = self.summary()
+        if stats:
+            print(f"[LATENZA] {stats['count']} invii | p50 {stats['p50_ms']:.2f} ms | "
+                  f"p99 {stats['p99_ms']:.2f} ms | max {stats['max_ms']:.2f} ms")
+        self.samples.clear()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - SEQUENCER
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Sequencer a finestra di anticipo (lookahead) che suona i pattern direttamente su scsynth.
+- I pattern sono dati (modules/patterns.py), gli stessi di ~patternFunctions
+- Ogni nota è un /s_new in un bundle con timetag: scsynth la esegue all'istante
+  esatto, indipendentemente da quando il datagramma arriva entro la finestra
+- Il thread prepara ogni period secondi le note che cadono nei prossimi
+  lookahead secondi; volume, BPM, genere e pattern valgono dal primo passo
+  non ancora inviato, senza passare da sclang
+- Il tempo è in battiti: un cambio di BPM riparte dall'ultimo battito inviato,
+  senza salti; un cambio di pattern parte sulla griglia del nuovo pattern
+- Con scsynth sovraccarico (set_shed) i charleston suonano una nota su due e poi
+  restano solo cassa, basso e pad, come i player di sclang con /carretto/shed
+"""
+
+import math
+import random
+import threading
+import time
+from pythonosc import osc_message_builder
+from pythonosc import osc_bundle_builder
+from modules.osc_fanout import OscFanout
+from modules.patterns import PATTERNS, layer_role
+from modules.scsynth_monitor import SCSYNTH_PORT, SHED_NONE, SHED_HATS, SHED_POLYPHONY
+from modules.logger import get_logger, Throttle
+from modules import metrics
+
+log = get_logger("sequencer")
+
+# Oltre questo ritardo (thread fermo, sistema sovraccarico) l'orologio riparte
+# da adesso invece di recuperare tutte le note perse
+MAX_LATE = 0.5
+
+# Griglia massima di partenza di un nuovo pattern, in battiti
+MAX_QUANT = 1.0
+
+# Parametri di una traccia che non sono argomenti della SynthDef
+_TRACK_KEYS = ('instrument', 'dur', 'amp')
+
+
+class _Track:
+    """Una voce di un pattern (un Pbind): liste cicliche indipendenti"""
+    __slots__ = ('instrument', 'role', 'durs', 'amp', 'params', 'index', 'next_beat')
+
+    def __init__(self, spec, start_beat):
+        self.instrument = spec['instrument']
+        self.role = layer_role(self.instrument)
+        self.durs = list(spec['dur'])
+        self.amp = spec['amp']
+        # Parametri fissi o ciclici (freq, attack, ...) come liste
+        self.params = [(name, value if isinstance(value, list) else [value])
+                       for name, value in spec.items() if name not in _TRACK_KEYS]
+        self.index = 0
+        self.next_beat = start_beat
+
+
+class Sequencer:
+    def __init__(self, host="127.0.0.1", port=SCSYNTH_PORT, lookahead=0.1, period=0.01,
+                 patterns=None, group=1):
+        """
+        Inizializza il sequencer
+
+        Args:
+            host: Indirizzo di scsynth
+            port: Porta UDP di scsynth
+            lookahead: Anticipo in secondi dei timetag rispetto all'invio
+            period: Secondi tra due preparazioni della finestra (deve essere < lookahead)
+            patterns: Pattern genere -> lista di 4 pattern (default modules/patterns.py)
+            group: Gruppo in cui vengono creati i synth (1 = gruppo di default di sclang)
+        """
+        if period >= lookahead:
+            raise ValueError("period deve essere minore di lookahead")
+        self.lookahead = lookahead
+        self.period = period
+        self.patterns = patterns or PATTERNS
+        self.group = group
+
+        self.client = OscFanout([(host, port)])
+        print(f"[SEQUENCER] Note verso scsynth su {host}:{port}, anticipo {lookahead * 1000:.0f} ms")
+
+        # Stato musicale (aggiornato da set_state)
+        self.volume = 0.8
+        self.bpm = 120.0
+        self.genre_name = "dub"
+        self.genre = "dub"
+        self.pattern_idx = 0
+        self.shed_level = SHED_NONE
+
+        # Orologio: time_at(beat) = time0 + (beat - beat0) * 60 / bpm  (perf_counter)
+        self.beat0 = 0.0
+        self.time0 = 0.0
+        self.sent_beat = 0.0        # Battito fino a cui le note sono già inviate
+
+        self.tracks = []
+        self.next_tracks = None     # Pattern in attesa della sua griglia di partenza
+        self.switch_beat = 0.0
+
+        # Timetag in tempo di sistema (scsynth usa l'orologio di sistema)
+        self.wall_offset = time.time() - time.perf_counter()
+
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.stop_event = threading.Event()
+
+        self.stats = {"notes": 0, "bundles": 0, "late": 0, "stalls": 0, "errors": 0, "changes": 0,
+                      "shed": 0}
+        self.error_throttle = Throttle(interval=1.0)
+
+        metrics.SEQ_NOTES.set_function(lambda: self.stats["notes"])
+        metrics.SEQ_LATE.set_function(lambda: self.stats["late"])
+
+    def reset(self, now):
+        """Riparte dal battito 0 del pattern corrente, un anticipo dopo now (perf_counter)"""
+        with self.lock:
+            self.beat0 = self.sent_beat = 0.0
+            self.time0 = now + self.lookahead
+            self.tracks = self._make_tracks(0.0)
+            self.next_tracks = None
+
+    def start(self):
+        """Avvia il thread: il primo battito cade dopo un anticipo"""
+        if self.running:
+            return
+        self.reset(time.perf_counter())
+        self.running = True
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="sequencer", daemon=True)
+        self.thread.start()
+        print(f"[SEQUENCER] Avviato: {self.genre} {self.pattern_idx}, {self.bpm:.0f} BPM")
+
+    def stop(self):
+        """Ferma il thread e chiude il socket (le note già inviate suonano comunque)"""
+        self.running = False
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=1.0)
+        self.client.close()
+
+    # --- Stato ---
+
+    def set_state(self, volume, bpm, genre, pattern_idx):
+        """
+        Nuovi parametri musicali: valgono dalla prima nota non ancora inviata
+
+        Args:
+            volume: Volume 0-1 (moltiplica l'amp di ogni traccia)
+            bpm: Tempo in battiti al minuto
+            genre: Nome del genere (come /carretto/pattern, "random" compreso)
+            pattern_idx: Indice del pattern 0-3
+        """
+        with self.lock:
+            self.volume = volume
+            if bpm != self.bpm:
+                self._set_tempo(bpm)
+
+            genre_changed = False
+            if genre != self.genre_name:
+                # Come sclang: "random" sceglie un genere solo quando il nome cambia
+                self.genre_name = genre
+                resolved = random.choice(list(self.patterns)) if genre == "random" else genre
+                if resolved not in self.patterns:
+                    resolved = "dub"
+                genre_changed = resolved != self.genre
+                self.genre = resolved
+            pattern_idx = min(max(int(pattern_idx), 0), 3)
+            if genre_changed or pattern_idx != self.pattern_idx:
+                self.pattern_idx = pattern_idx
+                self._schedule_switch()
+
+    def set_shed(self, level):
+        """Livello di riduzione del carico (ServerMonitor): vale dalla prima nota non inviata"""
+        with self.lock:
+            self.shed_level = level
+
+    def _set_tempo(self, bpm):
+        """Nuovo tempo dall'ultimo battito inviato: le note già in volo restano dove sono"""
+        self.time0 = self.time_at(self.sent_beat)
+        self.beat0 = self.sent_beat
+        self.bpm = float(bpm)
+
+    def _schedule_switch(self):
+        """Il nuovo pattern parte sul primo passo della sua griglia dopo le note già inviate"""
+        self.stats["changes"] += 1
+        specs = self.patterns[self.genre][self.pattern_idx]
+        quant = min(MAX_QUANT, min(min(spec['dur']) for spec in specs))
+        self.switch_beat = math.ceil(self.sent_beat / quant - 1e-9) * quant
+        self.next_tracks = self._make_tracks(self.switch_beat)
+
+    def _make_tracks(self, start_beat):
+        return [_Track(spec, start_beat) for spec in self.patterns[self.genre][self.pattern_idx]]
+
+    # --- Orologio ---
+
+    def time_at(self, beat):
+        return self.time0 + (beat - self.beat0) * 60.0 / self.bpm
+
+    def beat_at(self, t):
+        return self.beat0 + (t - self.time0) * self.bpm / 60.0
+
+    # --- Pianificazione ---
+
+    def collect(self, now):
+        """
+        Note da inviare fino a now + lookahead, raggruppate per istante
+
+        Returns:
+            Lista di (istante perf_counter, [(instrument, [nome, valore, ...]), ...])
+        """
+        with self.lock:
+            if self.time_at(self.sent_beat) < now - MAX_LATE:
+                # Thread rimasto fermo: riparte da adesso senza recuperare
+                self.stats["stalls"] += 1
+                self.time0 = now
+                self.beat0 = self.sent_beat
+            horizon = self.beat_at(now + self.lookahead)
+            if horizon <= self.sent_beat:
+                return []
+
+            events = []
+            if self.next_tracks is not None and self.switch_beat < horizon:
+                self._advance(self.tracks, self.switch_beat, events)
+                self.tracks = self.next_tracks
+                self.next_tracks = None
+            self._advance(self.tracks, horizon, events)
+            self.sent_beat = horizon
+
+            # Note dello stesso battito nello stesso bundle
+            events.sort(key=lambda event: event[0])
+            groups = []
+            last_beat = None
+            for beat, note in events:
+                if beat != last_beat:
+                    groups.append((self.time_at(beat), []))
+                    last_beat = beat
+                groups[-1][1].append(note)
+            return groups
+
+    def _advance(self, tracks, until, events):
+        """Aggiunge a events le note delle tracce con battito < until"""
+        volume = self.volume
+        shed = self.shed_level
+        for track in tracks:
+            # Voci taciute dalla riduzione del carico: la traccia avanza comunque
+            muted = shed >= SHED_POLYPHONY and track.role != 'core'
+            thinned = shed >= SHED_HATS and track.role == 'hat'
+            while track.next_beat < until:
+                i = track.index
+                dur = track.durs[i % len(track.durs)]
+                if muted or (thinned and i % 2):
+                    self.stats["shed"] += 1
+                else:
+                    args = ['amp', volume * track.amp, 'dur', dur]
+                    for name, values in track.params:
+                        args.append(name)
+                        args.append(values[i % len(values)])
+                    events.append((track.next_beat, (track.instrument, args)))
+                track.index = i + 1
+                track.next_beat += dur
+
+    def note_messages(self, notes):
+        """Un /s_new per nota (OscMessage), senza timetag"""
+        messages = []
+        for instrument, args in notes:
+            msg = osc_message_builder.OscMessageBuilder(address="/s_new")
+            msg.add_arg(instrument)
+            msg.add_arg(-1)             # scsynth sceglie l'ID del nodo
+            msg.add_arg(0)              # In testa al gruppo
+            msg.add_arg(self.group)
+            for j, value in enumerate(args):
+                msg.add_arg(value if j % 2 == 0 else float(value))
+            messages.append(msg.build())
+        return messages
+
+    def build_bundle(self, when, notes):
+        """Bundle con timetag when (perf_counter) e un /s_new per nota"""
+        bundle = osc_bundle_builder.OscBundleBuilder(when + self.wall_offset)
+        for message in self.note_messages(notes):
+            bundle.add_content(message)
+        return bundle.build()
+
+    def _run(self):
+        while self.running:
+            now = time.perf_counter()
+            for when, notes in self.collect(now):
+                if when < now:
+                    self.stats["late"] += 1
+                try:
+                    if not self.client.send(self.build_bundle(when, notes)):
+                        raise OSError("scsynth non raggiungibile")
+                    self.stats["bundles"] += 1
+                    self.stats["notes"] += len(notes)
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    if self.error_throttle():
+                        log.error("Errore nell'invio delle note: %s", e)
+            self.stop_event.wait(self.period)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats.update({"genre": self.genre, "pattern": self.pattern_idx, "bpm": self.bpm,
+                      "beat": round(self.sent_beat, 3), "shed_level": self.shed_level})
+        return stats
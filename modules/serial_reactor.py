@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - SERIAL REACTOR
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Un solo thread di I/O per tutte le porte seriali (Arduino, GPS, sensori futuri).
+- I descrittori sono registrati su selectors (epoll su Linux): nessun polling
+  di in_waiting e nessuna sleep
+- I byte letti vengono passati alla callback del dispositivo (il suo decoder)
+- Una disconnessione chiude solo quel dispositivo e programma la riapertura con
+  attesa esponenziale; gli altri dispositivi continuano a essere serviti
+"""
+
+import os
+import selectors
+import threading
+import time
+from modules.logger import get_logger, trace, EVT_ERROR
+from modules import metrics
+
+log = get_logger("reactor")
+
+READ_SIZE = 4096
+
+
+class FdPort:
+    def __init__(self, fd):
+        """Porta minima sopra un descrittore già aperto (stessa interfaccia usata da pyserial)"""
+        self.fd = fd
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def open_raw(port, baudrate=None):
+    """Apre un dispositivo con os.open, senza configurare termios (pty, FIFO, test)"""
+    return FdPort(os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK))
+
+
+def open_serial(port, baudrate):
+    """Apre una porta con pyserial (configura velocità e modalità raw)"""
+    import serial
+    return serial.Serial(port, baudrate, timeout=0)
+
+
+class Device:
+    def __init__(self, name, port, baudrate, on_data, resolve=None, on_state=None):
+        """
+        Dispositivo gestito dal reactor
+
+        Args:
+            name: Nome del dispositivo (es. 'arduino')
+            port: Percorso della porta
+            baudrate: Velocità della porta
+            on_data: Callback(dati, istante di arrivo perf_counter)
+            resolve: Callback opzionale che restituisce il percorso aggiornato prima di
+                     ogni riapertura (es. DeviceRegistry.lookup dopo un hotplug)
+            on_state: Callback opzionale(connesso) ad ogni connessione/disconnessione
+        """
+        self.name = name
+        self.port = port
+        self.baudrate = baudrate
+        self.on_data = on_data
+        self.resolve = resolve
+        self.on_state = on_state
+        self.handle = None
+        self.fd = None
+        self.connected = False
+        self.backoff = 0.0
+        self.next_attempt = 0.0
+        self.bytes_in = 0
+        self.connects = 0
+        self.disconnects = 0
+        self.failed_opens = 0
+
+    def get_stats(self):
+        return {
+            'connected': self.connected,
+            'bytes': self.bytes_in,
+            'connects': self.connects,
+            'disconnects': self.disconnects,
+            'failed_opens': self.failed_opens,
+            'backoff': self.backoff
+        }
+
+
+class SerialReactor:
+    def __init__(self, opener=open_serial, min_backoff=0.1, max_backoff=5.0):
+        """
+        Inizializza il reactor
+
+        Args:
+            opener: Funzione(porta, baudrate) -> oggetto con fileno() e close()
+            min_backoff: Prima attesa dopo una disconnessione (secondi)
+            max_backoff: Attesa massima tra due tentativi di riapertura
+        """
+        self.opener = opener
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.selector = selectors.DefaultSelector()
+        self.devices = {}
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+        # Pipe di risveglio: add()/remove()/stop() interrompono la select
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        os.set_blocking(self.wake_w, False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ, None)
+
+    def add(self, name, port, on_data, baudrate=9600, resolve=None, on_state=None):
+        """Aggiunge un dispositivo; la prima apertura avviene subito nel thread del reactor"""
+        device = Device(name, port, baudrate, on_data, resolve, on_state)
+        with self.lock:
+            self.devices[name] = device
+        self._wake()
+        return device
+
+    def remove(self, name):
+        """Rimuove un dispositivo chiudendone la porta"""
+        with self.lock:
+            device = self.devices.pop(name, None)
+        if device:
+            self._wake()
+        return device
+
+    def start(self):
+        """Avvia il thread del reactor"""
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name="serial-reactor")
+            self.thread.daemon = True
+            self.thread.start()
+            print("[REACTOR] Thread di I/O avviato")
+
+    def stop(self):
+        """Ferma il reactor e chiude tutte le porte"""
+        self.running = False
+        self._wake()
+        if self.thread:
+            self.thread.join(timeout=1.0)
+        for device in list(self.devices.values()):
+            self._close(device)
+        print("[REACTOR] Arrestato")
+
+    def get_stats(self):
+        """Statistiche per dispositivo"""
+        return {name: device.get_stats() for name, device in self.devices.items()}
+
+    def _wake(self):
+        try:
+            os.write(self.wake_w, b'\0')
+        except BlockingIOError:
+            pass  # Pipe piena: un risveglio è già in attesa
+
+    def _open(self, device, now):
+        """Tenta di aprire un dispositivo; in caso di errore programma il prossimo tentativo"""
+        if device.resolve is not None:
+            try:
+                device.port = device.resolve() or device.port
+            except Exception as e:
+                log.warning("%s: risoluzione porta fallita: %s", device.name, e)
+        handle = None
+        try:
+            handle = self.opener(device.port, device.baudrate)
+            fd = handle.fileno()
+            os.set_blocking(fd, False)
+            self.selector.register(fd, selectors.EVENT_READ, device)
+        except Exception as e:
+            if handle is not None:
+                handle.close()
+            device.failed_opens += 1
+            self._schedule(device, now)
+            if device.failed_opens == 1 or device.backoff >= self.max_backoff:
+                log.warning("%s: apertura di %s fallita (%s), nuovo tentativo tra %.1f s",
+                            device.name, device.port, e, device.backoff)
+            if device.failed_opens == 1 and not device.connects:
+                # Dispositivo assente fin dall'avvio
+                self._notify(device, False)
+            return False
+        device.handle = handle
+        device.fd = fd
+        device.connected = True
+        device.connects += 1
+        device.backoff = 0.0
+        if device.connects > 1:
+            metrics.RECONNECTS.inc(label_value=device.name)
+        log.info("%s: porta %s aperta", device.name, device.port)
+        self._notify(device, True)
+        return True
+
+    def _schedule(self, device, now):
+        """Attesa esponenziale: min_backoff, 2x, 4x, ... fino a max_backoff"""
+        device.backoff = min(self.max_backoff, device.backoff * 2 if device.backoff else self.min_backoff)
+        device.next_attempt = now + device.backoff
+
+    def _close(self, device):
+        if device.fd is not None:
+            try:
+                self.selector.unregister(device.fd)
+            except (KeyError, ValueError):
+                pass
+        if device.handle is not None:
+            try:
+                device.handle.close()
+            except Exception:
+                pass
+        device.handle = None
+        device.fd = None
+
+    def _disconnect(self, device, reason, now):
+        """Chiude un dispositivo caduto e ne programma la riapertura"""
+        trace(EVT_ERROR, 10)
+        log.warning("%s: disconnesso (%s)", device.name, reason)
+        self._close(device)
+        device.connected = False
+        device.disconnects += 1
+        self._schedule(device, now)
+        self._notify(device, False)
+
+    def _notify(self, device, connected):
+        if device.on_state is not None:
+            try:
+                device.on_state(connected)
+            except Exception as e:
+                log.error("%s: errore nella callback di stato: %s", device.name, e)
+
+    def _sync_devices(self, now):
+        """Apre i dispositivi nuovi o in attesa di riconnessione e chiude quelli rimossi"""
+        with self.lock:
+            devices = list(self.devices.values())
+            names = set(self.devices)
+        for key in list(self.selector.get_map().values()):
+            device = key.data
+            if device is not None and device.name not in names:
+                self._close(device)
+        next_timer = None
+        for device in devices:
+            if device.handle is not None:
+                continue
+            if device.next_attempt <= now:
+                if self._open(device, now):
+                    continue
+            if next_timer is None or device.next_attempt < next_timer:
+                next_timer = device.next_attempt
+        return next_timer
+
+    def _run(self):
+        """Ciclo del reactor: select con timeout pari al prossimo tentativo di riapertura"""
+        while self.running:
+            next_timer = self._sync_devices(time.monotonic())
+            timeout = None if next_timer is None else max(0.0, next_timer - time.monotonic())
+            for key, _ in self.selector.select(timeout):
+                device = key.data
+                if device is None:
+                    try:
+                        os.read(self.wake_r, 4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+                try:
+                    data = os.read(key.fd, READ_SIZE)
+                except BlockingIOError:
+                    continue
+                except OSError as e:
+                    # EIO quando l'adattatore USB (o il lato master della pty) scompare
+                    self._disconnect(device, e, time.monotonic())
+                    continue
+                if not data:
+                    self._disconnect(device, "fine del flusso", time.monotonic())
+                    continue
+                arrival = time.perf_counter()
+                device.bytes_in += len(data)
+                try:
+                    device.on_data(data, arrival)
+                except Exception as e:
+                    log.error("%s: errore nel decoder: %s", device.name, e)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - SESSION RECORDER
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Registrazione e riproduzione delle sessioni dei sensori.
+Il file è binario, solo in append:
+    intestazione: b'CARSESS1'
+    record:       [timestamp double, sorgente uint8, lunghezza uint16] + byte grezzi
+I byte sono esattamente quelli letti dalla seriale (pacchetti Arduino, frasi NMEA del GPS),
+così in riproduzione passano di nuovo dagli stessi decoder.
+"""
+
+import struct
+import threading
+import time
+
+MAGIC = b'CARSESS1'
+RECORD = struct.Struct('<dBH')
+
+SOURCE_ARDUINO = 1
+SOURCE_GPS = 2
+
+SOURCE_NAMES = {
+    SOURCE_ARDUINO: 'arduino',
+    SOURCE_GPS: 'gps'
+}
+
+
+class SessionRecorder:
+    def __init__(self, path):
+        """
+        Apre (o crea) il file di sessione in append
+
+        Args:
+            path: Percorso del file di sessione
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.records = 0
+        print(f"[RECORDER] Registrazione sessione su {path}")
+
+    def write(self, source, data, timestamp=None):
+        """
+        Aggiunge un blocco di byte grezzi
+
+        Args:
+            source: SOURCE_ARDUINO o SOURCE_GPS
+            data: Byte letti dalla seriale
+            timestamp: Istante di arrivo (time.time); default adesso
+        """
+        if not data or self.file is None:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            # Blocchi oltre 64KB vengono spezzati (lunghezza a 16 bit)
+            for pos in range(0, len(data), 0xFFFF):
+                chunk = data[pos:pos + 0xFFFF]
+                self.file.write(RECORD.pack(timestamp, source, len(chunk)))
+                self.file.write(chunk)
+                self.records += 1
+
+    def close(self):
+        """Chiude il file di sessione"""
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+        print(f"[RECORDER] Sessione chiusa: {self.records} blocchi registrati")
+
+
+def read_session(path):
+    """
+    Legge un file di sessione
+
+    Returns:
+        Lista di tuple (timestamp, sorgente, bytes) in ordine di registrazione
+    """
+    records = []
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} non è un file di sessione del carretto")
+
+    pos = len(MAGIC)
+    size = RECORD.size
+    end = len(data)
+    while pos + size <= end:
+        timestamp, source, length = RECORD.unpack_from(data, pos)
+        pos += size
+        if pos + length > end:
+            break  # Record troncato (es. interruzione durante la scrittura)
+        records.append((timestamp, source, data[pos:pos + length]))
+        pos += length
+    return records
+
+
+class SessionReplay:
+    def __init__(self, path, speed=1.0):
+        """
+        Riproduzione di una sessione registrata
+
+        Args:
+            path: File di sessione
+            speed: 1.0 = tempo reale, N = N volte più veloce, 0 = il più veloce possibile
+        """
+        self.path = path
+        self.speed = speed
+        self.records = read_session(path)
+        self.origin = self.records[0][0] if self.records else 0.0
+        self.start_time = None
+        self.lock = threading.Lock()
+        print(f"[REPLAY] {len(self.records)} blocchi da {path}, velocità "
+              f"{'massima' if not speed else f'{speed}x'}")
+
+    def clock_start(self):
+        """Avvia l'orologio di riproduzione (una sola volta, condiviso da tutte le sorgenti)"""
+        with self.lock:
+            if self.start_time is None:
+                self.start_time = time.monotonic()
+            return self.start_time
+
+    def due_time(self, timestamp):
+        """Istante (monotonic) in cui un record registrato va consegnato"""
+        if not self.speed:
+            return 0.0
+        return self.clock_start() + (timestamp - self.origin) / self.speed
+
+    def serial_for(self, source, timeout=1.0):
+        """Restituisce un oggetto compatibile con serial.Serial per una sorgente"""
+        chunks = [(timestamp, data) for timestamp, src, data in self.records if src == source]
+        return ReplaySerial(self, chunks, timeout)
+
+
+class ReplaySerial:
+    def __init__(self, replay, chunks, timeout=1.0):
+        """
+        Porta seriale simulata che restituisce i byte registrati con i tempi originali
+
+        Args:
+            replay: SessionReplay che fornisce l'orologio comune
+            chunks: Lista di (timestamp, bytes) della sorgente
+            timeout: Attesa massima di read() come in pyserial
+        """
+        self.replay = replay
+        self.chunks = chunks
+        self.index = 0
+        self.buffer = bytearray()
+        self.timeout = timeout
+        self.is_open = True
+
+    @property
+    def finished(self):
+        """True quando tutti i byte registrati sono stati letti"""
+        return self.index >= len(self.chunks) and not self.buffer
+
+    def _collect_due(self):
+        """Sposta nel buffer i blocchi il cui istante è già trascorso"""
+        now = time.monotonic()
+        while self.index < len(self.chunks):
+            timestamp, data = self.chunks[self.index]
+            if self.replay.due_time(timestamp) > now:
+                break
+            self.buffer += data
+            self.index += 1
+
+    @property
+    def in_waiting(self):
+        self._collect_due()
+        return len(self.buffer)
+
+    def read(self, size=1):
+        """Legge fino a size byte, attendendo il prossimo blocco al massimo timeout secondi"""
+        deadline = time.monotonic() + self.timeout
+        self._collect_due()
+        while not self.buffer and self.index < len(self.chunks):
+            wait = min(self.replay.due_time(self.chunks[self.index][0]), deadline) - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._collect_due()
+            if time.monotonic() >= deadline:
+                break
+        if not self.buffer and self.index >= len(self.chunks):
+            # Fine della registrazione: comportati come una porta muta
+            time.sleep(max(0.0, deadline - time.monotonic()))
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def close(self):
+        self.is_open = False
+
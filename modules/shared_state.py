@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - SHARED STATE
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Stato dei sensori in un blocco di memoria condivisa tra il processo di acquisizione
+(un solo scrittore) e il processo di controllo (lettori).
+- Un record a dimensione fissa: ultimo pacchetto Arduino, ultima istantanea GPS,
+  contatori dei lettori e heartbeat dello scrittore
+- Scrittura e lettura copiano il record tenendo un multiprocessing.Lock (un semaforo
+  POSIX): acquisire e rilasciare il semaforo sono barriere di memoria complete, quindi
+  anche su ARM (Raspberry Pi), dove le scritture in memoria possono diventare visibili
+  agli altri core in un ordine diverso, il lettore vede tutto il record scritto prima
+  del rilascio. Un contatore di sequenza senza barriere non basterebbe: il lettore
+  potrebbe vedere il contatore pari nuovo con una parte dei campi vecchi.
+  Il lock è tenuto solo per la copia (pochi µs); senza contesa acquisirlo è
+  un'operazione atomica, senza chiamate di sistema. Niente pickle
+- Il contatore resta dispari se lo scrittore muore a metà copia: il lettore tiene
+  l'ultimo record coerente. Un lock rimasto preso da un figlio ucciso viene sostituito
+  al riavvio (new_lock); nel frattempo la lettura scade dopo LOCK_TIMEOUT
+- Gli istanti sono perf_counter: su Linux è CLOCK_MONOTONIC, comune a tutti i processi
+"""
+
+import math
+import multiprocessing
+import struct
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+SEQUENCE = struct.Struct('<I')
+RECORD = struct.Struct('<QdH4H' 'Qdddd3B' '8Q' 'dI')
+RECORD_OFFSET = 8
+SIZE = RECORD_OFFSET + RECORD.size
+
+StateRecord = namedtuple('StateRecord', (
+    'pots_seq', 'pots_time', 'full_scale', 'raw1', 'raw2', 'raw3', 'raw4',
+    'gps_seq', 'gps_time', 'speed', 'lat', 'lon', 'fix_quality', 'satellites', 'valid',
+    'frames', 'resyncs', 'dropped', 'corrupt', 'sentences', 'gps_errors',
+    'arduino_reconnects', 'gps_reconnects',
+    'heartbeat', 'pid'))
+
+# Record iniziale: valori centrali dei potenziometri, nessun dato GPS (NaN = None)
+EMPTY = StateRecord(0, 0.0, 255, 128, 128, 128, 128,
+                    0, 0.0, math.nan, math.nan, math.nan, 0, 0, 0,
+                    0, 0, 0, 0, 0, 0, 0, 0,
+                    0.0, 0)
+
+# Attesa massima del lock in lettura (secondi): oltre, lo scrittore è morto tenendolo
+LOCK_TIMEOUT = 0.1
+
+
+def _attach(name):
+    """Apre un blocco esistente senza registrarlo di nuovo nel resource tracker"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13: i processi figli (spawn) condividono il resource tracker del
+        # proprietario, la registrazione è un duplicato e il blocco viene rimosso solo da unlink()
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedState:
+    def __init__(self, name=None, create=False, lock=None):
+        """
+        Crea o apre il blocco condiviso
+
+        Args:
+            name: Nome del blocco (None con create=True = nome generato)
+            create: True nel processo proprietario, False per aprire un blocco esistente
+            lock: Lock del proprietario (da passare al processo figlio insieme al nome);
+                  con create=True ne viene creato uno nuovo
+        """
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=SIZE)
+        else:
+            self.shm = _attach(name)
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        self.owner = create
+        if create:
+            self.new_lock()
+            SEQUENCE.pack_into(self.buf, 0, 0)
+            RECORD.pack_into(self.buf, RECORD_OFFSET, *EMPTY)
+        else:
+            self.lock = lock
+        self.stale = 0          # Letture che hanno restituito l'ultima copia (scrittore morto)
+        self.last = EMPTY
+
+    def new_lock(self):
+        """Nuovo lock (nel proprietario, prima di avviare uno scrittore): il precedente
+        può essere rimasto preso da uno scrittore terminato a metà copia"""
+        # Contesto spawn: il semaforo ha un nome e può essere passato a un processo avviato con spawn
+        self.lock = multiprocessing.get_context('spawn').Lock()
+        return self.lock
+
+    def write(self, record):
+        """Scrive un record completo (un solo scrittore)"""
+        buf = self.buf
+        with self.lock:
+            seq = SEQUENCE.unpack_from(buf, 0)[0]
+            if seq & 1:
+                seq += 1        # Scrittore precedente interrotto a metà: il record verrà sovrascritto
+            SEQUENCE.pack_into(buf, 0, (seq + 1) & 0xFFFFFFFF)
+            RECORD.pack_into(buf, RECORD_OFFSET, *record)
+            SEQUENCE.pack_into(buf, 0, (seq + 2) & 0xFFFFFFFF)
+
+    def read(self):
+        """
+        Copia coerente del record
+
+        Returns:
+            StateRecord (l'ultima copia coerente se lo scrittore è morto a metà di una scrittura)
+        """
+        buf = self.buf
+        lock = self.lock
+        if not lock.acquire(timeout=LOCK_TIMEOUT):
+            self.stale += 1
+            return self.last
+        try:
+            values = None if SEQUENCE.unpack_from(buf, 0)[0] & 1 else RECORD.unpack_from(buf, RECORD_OFFSET)
+        finally:
+            lock.release()
+        if values is None:
+            self.stale += 1
+            return self.last
+        self.last = StateRecord._make(values)
+        return self.last
+
+    def close(self):
+        """Chiude il blocco (e lo rimuove se questo processo lo ha creato)"""
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - SIGNAL FILTER
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Condizionamento dei segnali tra i lettori e il MusicEngine.
+Ogni canale di uscita ha una sorgente (pot1..pot4, speed) e una catena di filtri:
+    ema         media mobile esponenziale
+    one_euro    filtro "1€": poco ritardo sui movimenti veloci, molto liscio da fermo
+    deadband    mantiene l'uscita finché l'ingresso non si sposta di almeno width
+    gate        lascia passare il valore, ma lo segnala come cambiato solo oltre width
+                dall'ultimo segnalato (l'uscita raggiunge sempre la posizione vera)
+    slew        limita la velocità di variazione (unità al secondo)
+    hysteresis  sceglie un indice discreto (genere, pattern) con isteresi ai bordi
+La configurazione è un dizionario (o un file JSON con la stessa struttura) e
+tutti i canali vengono elaborati insieme, una volta per pacchetto.
+"""
+
+import json
+import math
+import time
+
+# Canale -> sorgente e catena di filtri; i valori dei potenziometri sono 0.0-1.0,
+# la velocità è in km/h. Sui potenziometri il rumore lo toglie lo smorzamento: il
+# gate finale evita solo risvegli inutili, con una soglia sotto la quantizzazione
+# del MusicEngine (1% di volume, 1 BPM = 1/120 di pot2), così anche una regolazione
+# lenta arriva fino alla posizione vera della manopola
+DEFAULT_CONFIG = {
+    'pot1': {'source': 'pot1', 'chain': [['ema', {'alpha': 0.5}], ['gate', {'width': 0.005}]]},
+    'pot2': {'source': 'pot2', 'chain': [['one_euro', {'min_cutoff': 0.5, 'beta': 1.0}],
+                                         ['gate', {'width': 0.004}]]},
+    'pot3': {'source': 'pot3', 'chain': [['ema', {'alpha': 0.5}], ['gate', {'width': 0.005}]]},
+    'pot4': {'source': 'pot4', 'chain': [['ema', {'alpha': 0.5}], ['gate', {'width': 0.005}]]},
+    # Indici discreti: una piccola oscillazione sul bordo di un intervallo non cambia più
+    # genere o pattern (ogni cambio riavvia il pattern in SuperCollider). Niente
+    # smorzamento prima dell'isteresi: un movimento deciso passerebbe per i generi intermedi
+    'genre_idx': {'source': 'pot3', 'chain': [['hysteresis', {'bins': 7, 'margin': 0.3}]]},
+    'pattern_idx': {'source': 'pot4', 'chain': [['hysteresis', {'bins': 4, 'margin': 0.3}]]},
+    'speed': {'source': 'speed', 'chain': [['ema', {'alpha': 0.5}], ['deadband', {'width': 0.5}]]}
+}
+
+
+class Ema:
+    def __init__(self, alpha=0.5):
+        """Media mobile esponenziale: alpha = peso del nuovo campione (1 = nessun filtro)"""
+        self.alpha = alpha
+        self.value = None
+
+    def __call__(self, x, t):
+        if self.value is None:
+            self.value = x
+        else:
+            self.value += self.alpha * (x - self.value)
+        return self.value
+
+
+class OneEuro:
+    def __init__(self, min_cutoff=1.0, beta=0.0, d_cutoff=1.0):
+        """
+        Filtro 1€ (Casiez et al. 2012)
+
+        Args:
+            min_cutoff: Frequenza di taglio (Hz) a potenziometro fermo
+            beta: Quanto la frequenza di taglio cresce con la velocità del movimento
+            d_cutoff: Frequenza di taglio per la stima della velocità
+        """
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.value = None
+        self.derivative = 0.0
+        self.last_time = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def __call__(self, x, t):
+        if self.value is None:
+            self.value = x
+            self.last_time = t
+            return x
+        dt = t - self.last_time
+        if dt <= 0:
+            dt = 1e-3   # Campioni con lo stesso istante (es. blocco con più pacchetti)
+        self.last_time = t
+        derivative = (x - self.value) / dt
+        self.derivative += self._alpha(self.d_cutoff, dt) * (derivative - self.derivative)
+        cutoff = self.min_cutoff + self.beta * abs(self.derivative)
+        self.value += self._alpha(cutoff, dt) * (x - self.value)
+        return self.value
+
+
+class Deadband:
+    def __init__(self, width=0.01):
+        """Uscita ferma finché l'ingresso non si allontana di più di width dall'ultima uscita"""
+        self.width = width
+        self.value = None
+
+    def __call__(self, x, t):
+        if self.value is None or abs(x - self.value) > self.width:
+            self.value = x
+        return self.value
+
+
+class Gate:
+    def __init__(self, width=0.005):
+        """Valore invariato; opened dice se si è allontanato di più di width dall'ultimo segnalato"""
+        self.width = width
+        self.reference = None
+        self.opened = False
+
+    def __call__(self, x, t):
+        self.opened = self.reference is None or abs(x - self.reference) > self.width
+        if self.opened:
+            self.reference = x
+        return x
+
+
+class Slew:
+    def __init__(self, rate=1.0):
+        """Variazione massima di rate unità al secondo"""
+        self.rate = rate
+        self.value = None
+        self.last_time = None
+
+    def __call__(self, x, t):
+        if self.value is None:
+            self.value = x
+        else:
+            step = self.rate * max(0.0, t - self.last_time)
+            self.value += max(-step, min(step, x - self.value))
+        self.last_time = t
+        return self.value
+
+
+class Hysteresis:
+    def __init__(self, bins, margin=0.3, scale=None):
+        """
+        Indice discreto con isteresi
+
+        Args:
+            bins: Numero di intervalli (es. 7 generi)
+            margin: Frazione di intervallo oltre il bordo da superare per cambiare indice
+            scale: Moltiplicatore valore -> indice (default bins - 0.01, come la mappatura
+                   storica del MusicEngine: int(v * 6.99) per 7 generi)
+        """
+        self.bins = bins
+        self.margin = margin
+        self.scale = scale if scale is not None else bins - 0.01
+        self.index = None
+        self.changes = 0
+
+    def __call__(self, x, t):
+        position = x * self.scale
+        if self.index is None:
+            self.index = min(int(position), self.bins - 1)
+        elif (position < self.index - self.margin or position >= self.index + 1 + self.margin):
+            index = min(max(int(position), 0), self.bins - 1)
+            if index != self.index:
+                self.index = index
+                self.changes += 1
+        return self.index
+
+
+FILTERS = {
+    'ema': Ema,
+    'one_euro': OneEuro,
+    'deadband': Deadband,
+    'gate': Gate,
+    'slew': Slew,
+    'hysteresis': Hysteresis
+}
+
+
+def load_config(path):
+    """Legge una configurazione JSON con la stessa struttura di DEFAULT_CONFIG"""
+    with open(path) as f:
+        return json.load(f)
+
+
+class SignalFilter:
+    def __init__(self, config=None):
+        """
+        Costruisce le catene di filtri
+
+        Args:
+            config: Dizionario canale -> {'source': chiave di ingresso, 'chain': [[nome, parametri], ...]}
+                    (default DEFAULT_CONFIG)
+        """
+        self.config = config or DEFAULT_CONFIG
+        self.channels = []      # (canale, sorgente, [filtri], gate finale o None)
+        for name, spec in self.config.items():
+            chain = []
+            for filter_name, params in spec.get('chain', []):
+                if filter_name not in FILTERS:
+                    raise ValueError(f"Filtro sconosciuto per {name}: {filter_name}")
+                chain.append(FILTERS[filter_name](**params))
+            gate = chain[-1] if chain and isinstance(chain[-1], Gate) else None
+            self.channels.append((name, spec.get('source', name), chain, gate))
+        self.outputs = {}
+
+    def process(self, inputs, timestamp=None):
+        """
+        Elabora un pacchetto: tutti i canali la cui sorgente è presente in inputs
+
+        Args:
+            inputs: Dizionario sorgente -> valore (es. PotSnapshot.as_dict() e/o {'speed': ...})
+            timestamp: Istante del campione (perf_counter); default adesso
+
+        Returns:
+            True se almeno un'uscita è cambiata (per i canali con gate: oltre la sua soglia;
+            sotto la soglia l'uscita si aggiorna comunque e parte con il prossimo invio)
+        """
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        outputs = self.outputs
+        changed = False
+        for name, source, chain, gate in self.channels:
+            value = inputs.get(source)
+            if value is None:
+                continue
+            for stage in chain:
+                value = stage(value, timestamp)
+            if outputs.get(name) != value:
+                outputs[name] = value
+                if gate is None or gate.opened:
+                    changed = True
+        return changed
+
+    def get_stats(self):
+        """Cambi di indice dei canali discreti"""
+        return {name: stage.changes for name, source, chain, gate in self.channels
+                for stage in chain if isinstance(stage, Hysteresis)}
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - SENSOR SNAPSHOT
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Istantanee immutabili di potenziometri e GPS. Il lettore ne crea una nuova per ogni
+pacchetto (o frase NMEA) e la pubblica con un solo assegnamento di riferimento: i consumatori
+la leggono senza lock e senza allocare memoria.
+"""
+
+# Tabelle di normalizzazione calcolate una sola volta:
+# 0-255 (pacchetti v1) e 0-1023 (pacchetti v2 a 10 bit) -> 0.0-1.0
+NORM = tuple(i / 255.0 for i in range(256))
+NORM10 = tuple(i / 1023.0 for i in range(1024))
+NORM_TABLES = {255: NORM, 1023: NORM10}
+
+POT_KEYS = ('pot1', 'pot2', 'pot3', 'pot4')
+
+
+class PotSnapshot:
+    __slots__ = ('seq', 'raw', 'values', 'timestamp', 'full_scale')
+
+    def __init__(self, seq, raw, timestamp=0.0, full_scale=255):
+        """
+        Crea l'istantanea di un pacchetto
+
+        Args:
+            seq: Numero di sequenza (crescente, 0 = valori iniziali)
+            raw: 4 valori grezzi 0-full_scale (bytes o sequenza di interi)
+            timestamp: Istante di arrivo del pacchetto (perf_counter)
+            full_scale: 255 (pacchetti v1, raw in bytes) o 1023 (v2, raw in tupla)
+        """
+        norm = NORM_TABLES[full_scale]
+        set_attr = object.__setattr__
+        set_attr(self, 'seq', seq)
+        set_attr(self, 'raw', bytes(raw) if full_scale == 255 else tuple(raw))
+        set_attr(self, 'values', (norm[raw[0]], norm[raw[1]], norm[raw[2]], norm[raw[3]]))
+        set_attr(self, 'timestamp', timestamp)
+        set_attr(self, 'full_scale', full_scale)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PotSnapshot è immutabile")
+
+    def __delattr__(self, name):
+        raise AttributeError("PotSnapshot è immutabile")
+
+    def __repr__(self):
+        return f"PotSnapshot(seq={self.seq}, raw={list(self.raw)})"
+
+    def as_dict(self):
+        """Valori normalizzati nel formato storico di get_values() (pot5 = pot4)"""
+        values = self.values
+        return {
+            'pot1': values[0],
+            'pot2': values[1],
+            'pot3': values[2],
+            'pot4': values[3],
+            'pot5': values[3]
+        }
+
+    def raw_dict(self):
+        """Valori grezzi (0-255 o 0-1023) come dizionario"""
+        raw = self.raw
+        return {'pot1': raw[0], 'pot2': raw[1], 'pot3': raw[2], 'pot4': raw[3]}
+
+
+class GPSSnapshot:
+    __slots__ = ('seq', 'timestamp', 'speed', 'lat', 'lon', 'fix_quality', 'satellites', 'valid')
+
+    def __init__(self, seq, timestamp=0.0, speed=None, lat=None, lon=None,
+                 fix_quality=0, satellites=0, valid=False):
+        """
+        Crea l'istantanea dello stato GPS
+
+        Args:
+            seq: Numero di sequenza (crescente, 0 = nessun dato)
+            timestamp: Istante dell'ultima frase decodificata (perf_counter)
+            speed: Velocità in km/h (None se sconosciuta)
+            lat, lon: Posizione in gradi decimali (None senza fix)
+            fix_quality: Qualità del fix da GGA (0 = nessun fix, 1 = GPS, 2 = DGPS, ...)
+            satellites: Satelliti usati nel fix
+            valid: Stato A/V dell'ultima frase RMC
+        """
+        set_attr = object.__setattr__
+        set_attr(self, 'seq', seq)
+        set_attr(self, 'timestamp', timestamp)
+        set_attr(self, 'speed', speed)
+        set_attr(self, 'lat', lat)
+        set_attr(self, 'lon', lon)
+        set_attr(self, 'fix_quality', fix_quality)
+        set_attr(self, 'satellites', satellites)
+        set_attr(self, 'valid', valid)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GPSSnapshot è immutabile")
+
+    def __delattr__(self, name):
+        raise AttributeError("GPSSnapshot è immutabile")
+
+    def __repr__(self):
+        return (f"GPSSnapshot(seq={self.seq}, speed={self.speed}, lat={self.lat}, lon={self.lon}, "
+                f"fix={self.fix_quality}, sats={self.satellites})")
+
+    def as_dict(self):
+        """Dati nel formato di GPSReader.get_data()"""
+        return {
+            'speed': self.speed,
+            'lat': self.lat,
+            'lon': self.lon,
+            'fix_quality': self.fix_quality,
+            'satellites': self.satellites,
+            'valid': self.valid,
+            'timestamp': self.timestamp
+        }
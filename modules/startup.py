@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CARRETTO MUSICALE - STARTUP
+Autore: Michele Pietravalle
+Data: 2025-06-15
+Versione: 1.0
+
+Avvio parallelo dei sottosistemi con tempi per fase.
+- Ogni sottosistema (Arduino, GPS, motore OSC) si apre nel proprio thread,
+  compresi gli import dei moduli che usa
+- Le attese hardware (reset del Nano, fix GPS) sono eventi di prontezza
+  osservati in sottofondo, non pause fisse: il resto parte subito
+- report() stampa i tempi di ogni fase dall'inizio dell'avvio
+"""
+
+import threading
+import time
+from modules.logger import get_logger
+
+log = get_logger("boot")
+
+
+class _Task:
+    __slots__ = ('name', 'thread', 'result', 'error', 'start', 'end')
+
+    def __init__(self, name):
+        self.name = name
+        self.thread = None
+        self.result = None
+        self.error = None
+        self.start = None
+        self.end = None
+
+
+class Startup:
+    def __init__(self):
+        """Orchestratore dell'avvio: l'origine dei tempi è la creazione dell'oggetto"""
+        self.origin = time.perf_counter()
+        self.tasks = {}
+        self.timings = {}   # fase -> secondi dall'origine al completamento
+        self.lock = threading.Lock()
+
+    def elapsed(self):
+        """Secondi trascorsi dall'inizio dell'avvio"""
+        return time.perf_counter() - self.origin
+
+    def _record(self, name, seconds):
+        with self.lock:
+            self.timings[name] = seconds
+
+    def launch(self, name, func, *args, **kwargs):
+        """Esegue func in un thread dedicato; il risultato si ottiene con result(name)"""
+        task = _Task(name)
+
+        def run():
+            task.start = self.elapsed()
+            try:
+                task.result = func(*args, **kwargs)
+            except Exception as e:
+                task.error = e
+            task.end = self.elapsed()
+            self._record(name, task.end)
+
+        task.thread = threading.Thread(target=run, name=f"boot-{name}", daemon=True)
+        self.tasks[name] = task
+        task.thread.start()
+        return task
+
+    def run(self, name, func, *args, **kwargs):
+        """Esegue func nel thread corrente registrandone il tempo"""
+        result = func(*args, **kwargs)
+        self._record(name, self.elapsed())
+        return result
+
+    def result(self, name, timeout=None):
+        """Attende una fase lanciata con launch() e ne restituisce il risultato (o rilancia l'errore)"""
+        task = self.tasks[name]
+        task.thread.join(timeout)
+        if task.thread.is_alive():
+            raise TimeoutError(f"Avvio di {name} oltre {timeout} s")
+        if task.error is not None:
+            raise task.error
+        return task.result
+
+    def watch(self, name, event, timeout):
+        """
+        Registra quando un evento di prontezza diventa vero, senza bloccare l'avvio
+
+        Args:
+            name: Nome della fase (es. 'arduino_pronto')
+            event: threading.Event impostato dal sottosistema
+            timeout: Attesa massima; oltre viene segnalato un avviso
+        """
+        def run():
+            if event.wait(timeout):
+                seconds = self.elapsed()
+                self._record(name, seconds)
+                log.info("%s in %.0f ms", name, seconds * 1000.0)
+            else:
+                log.warning("%s: nessun segnale dopo %.1f s", name, timeout)
+
+        threading.Thread(target=run, name=f"boot-{name}", daemon=True).start()
+
+    def mark(self, name):
+        """Registra il completamento di una fase del thread principale"""
+        self._record(name, self.elapsed())
+
+    def report(self):
+        """Stampa i tempi delle fasi completate finora"""
+        with self.lock:
+            timings = sorted(self.timings.items(), key=lambda item: item[1])
+        print("[BOOT] Tempi di avvio (ms dall'inizio):")
+        for name, seconds in timings:
+            task = self.tasks.get(name)
+            duration = f" (durata {(task.end - task.start) * 1000.0:.0f} ms)" if task and task.end else ""
+            print(f"[BOOT]   {name:20s} {seconds * 1000.0:7.0f}{duration}")
+        return dict(timings)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Test del rendering offline (modules/offline_render.py)
+
+Una sessione sintetica di 60 secondi (pacchetti Arduino a 20 Hz e RMC a 1 Hz) viene
+registrata su file e resa su orologio virtuale. Si verificano: formato del file NRT
+per scsynth -N, cambio di genere e di BPM nelle note, determinismo del file,
+SynthDef nello script sclang e velocità rispetto al tempo reale.
+
+Uso:
+    python offline_render_test.py
+"""
+
+import os
+import shutil
+import tempfile
+from modules import logger
+from modules.gps_reader import nmea_checksum
+from modules.offline_render import OfflineRender, read_score, synthdef_sources
+from modules.patterns import PATTERNS
+from modules.session_recorder import SessionRecorder, SOURCE_ARDUINO, SOURCE_GPS
+
+SECONDS = 60
+GENRE_CHANGE = 20.0     # dub -> techno
+BPM_CHANGE = 30.0       # 60 -> 180 BPM
+
+
+def nmea(body):
+    data = body.encode()
+    return b'$%s*%02X\r\n' % (data, nmea_checksum(data, 0, len(data)))
+
+
+def record_session(path, start=1750000000.0):
+    recorder = SessionRecorder(path)
+    for i in range(SECONDS * 20):
+        t = i / 20.0
+        pot2 = 0 if t < BPM_CHANGE else 254      # 255 è il marker del v1
+        pot3 = 0 if t < GENRE_CHANGE else 55
+        recorder.write(SOURCE_ARDUINO, bytes((0xFF, 200, pot2, pot3, 0)), start + t)
+        if i % 20 == 0:
+            second = i // 20
+            recorder.write(SOURCE_GPS, nmea(f"GPRMC,1200{second // 60:02d}{second % 60:02d}.00,A,4154.1680,N,"
+                                            f"01229.7840,E,10.00,87.5,150625,,,A"), start + t + 0.01)
+    recorder.close()
+
+
+def check(name, condition):
+    print(f"  {'OK ' if condition else 'ERR'} {name}")
+    return condition
+
+
+def render(session, out):
+    result = OfflineRender(session)
+    stats = result.run()
+    result.write_score(out + ".osc", out + "_synthdefs")
+    result.write_script(out + ".scd", out + ".osc", out + ".wav", out + "_synthdefs")
+    return result, stats
+
+
+def onsets(bundles, instrument, start, end):
+    return [when for when, messages in bundles if start <= when < end
+            for address, params in messages if address == "/s_new" and params[0] == instrument]
+
+
+def main():
+    print("=== TEST RENDERING OFFLINE ===")
+    logger.configure('ERROR')
+    ok = True
+    workdir = tempfile.mkdtemp()
+    session = os.path.join(workdir, "sessione.bin")
+    record_session(session)
+
+    print("\n--- Sessione su orologio virtuale ---")
+    first, stats = render(session, os.path.join(workdir, "a"))
+    ok &= check(f"{stats['records']} blocchi, {stats['session_seconds']:.1f} s resi in "
+                f"{stats['render_seconds']:.2f} s ({stats['speedup']:.0f}x)",
+                stats['records'] == SECONDS * 21 and stats['speedup'] > 10)
+    ok &= check(f"{stats['notes']} note in {stats['bundles']} bundle", stats['notes'] > 300)
+    states = [params for _, address, params in first.music.client.messages if address == "/carretto/state"]
+    genres = [params[2] for params in states]
+    ok &= check("stato per sclang: da dub a techno", "dub" in genres and genres[-1] == "techno"
+                and "techno" not in genres[:genres.index("dub")])
+
+    print("\n--- File NRT ---")
+    bundles = read_score(os.path.join(workdir, "a.osc"))
+    head, tail = bundles[0], bundles[-1]
+    ok &= check("tempo 0: /d_loadDir e /g_new 1", head[0] == 0.0 and [a for a, _ in head[1]] == ["/d_loadDir", "/g_new"]
+                and head[1][0][1][0] == os.path.join(workdir, "a_synthdefs") and head[1][1][1] == [1, 0, 0])
+    ok &= check(f"fine: /c_set a {tail[0]:.2f} s", tail[1] == [("/c_set", [0, 0])]
+                and abs(tail[0] - first.duration) < 1e-6 and tail[0] > SECONDS)
+    times = [when for when, _ in bundles]
+    ok &= check("timetag non decrescenti", times == sorted(times))
+    notes = [params for _, messages in bundles[1:-1] for address, params in messages]
+    ok &= check("solo /s_new nel gruppo 1 con amp", all(p[1:4] == [-1, 0, 1] and p[4] == "amp" for p in notes))
+
+    # Il primo istante suona lo stato iniziale (potenziometri a metà) come all'avvio reale
+    before = {p[0] for when, messages in bundles[1:-1] if 2.0 < when < GENRE_CHANGE for _, p in messages}
+    after = {p[0] for when, messages in bundles[1:-1] if when > GENRE_CHANGE + 1 for _, p in messages}
+    ok &= check(f"genere: {sorted(before)} -> {sorted(after)}",
+                before <= {'dubKick', 'dubHat', 'dubSnare', 'dubBass'} and 'techKick' in after
+                and not any(name.startswith('dub') for name in after))
+    # Passo della cassa techno (mezzo battito) contro il BPM inviato: con la manopola
+    # ferma lo smorzamento arriva fino agli estremi, 60 e 180
+    slow_bpm = [params[1] for when, address, params in first.music.client.messages
+                if address == "/carretto/state" and when < BPM_CHANGE][-1]
+    fast_bpm = states[-1][1]
+    slow = onsets(bundles, 'techKick', GENRE_CHANGE + 2, BPM_CHANGE - 1)
+    fast = onsets(bundles, 'techKick', BPM_CHANGE + 3, SECONDS - 1)
+    slow_step = (slow[-1] - slow[0]) / (len(slow) - 1)
+    fast_step = (fast[-1] - fast[0]) / (len(fast) - 1)
+    ok &= check(f"cassa techno: {slow_step * 1000:.0f} ms a {slow_bpm:.0f} BPM, {fast_step * 1000:.0f} ms a {fast_bpm:.0f} BPM",
+                slow_bpm == 60 and fast_bpm == 180 and abs(slow_step - 30.0 / slow_bpm) < 0.005
+                and abs(fast_step - 30.0 / fast_bpm) < 0.002)
+
+    print("\n--- Determinismo e script sclang ---")
+    # Keyframe sull'orologio virtuale (controllati ad ogni aggiornamento): stesso numero a
+    # ogni rendering, qualunque sia il tempo di calcolo, che è sotto i 2 s dell'intervallo
+    keyframes = []
+    for _ in range(2):
+        result = OfflineRender(session)
+        result.music.keyframe_interval = 2.0
+        stats = result.run()
+        keyframes.append(result.music.stats["keyframes"])
+    ok &= check(f"keyframe: {keyframes} in {stats['session_seconds']:.1f} s di sessione "
+                f"({stats['render_seconds']:.2f} s di calcolo)", keyframes[0] == keyframes[1] > 0)
+    render(session, os.path.join(workdir, "b"))
+    with open(os.path.join(workdir, "a.osc"), 'rb') as fa, open(os.path.join(workdir, "b.osc"), 'rb') as fb:
+        a, b = fa.read(), fb.read()
+    # Solo la cartella delle SynthDef (nel primo bundle) è diversa
+    ok &= check("stessa sessione, stesse note", a[a.index(b'/g_new'):].split(b'#bundle', 1)[1]
+                == b[b.index(b'/g_new'):].split(b'#bundle', 1)[1])
+    sources = synthdef_sources()
+    instruments = {track['instrument'] for genre in PATTERNS.values() for pattern in genre for track in pattern}
+    ok &= check(f"{len(sources)} SynthDef in carretto_music.scd, tutte quelle dei pattern",
+                instruments <= set(sources))
+    with open(os.path.join(workdir, "a.scd")) as f:
+        script = f.read()
+    ok &= check("script: SynthDef scritte e scsynth -N", script.count(".writeDefFile(dir);") == len(sources)
+                and '"-N"' in script and script.count("(") == script.count(")"))
+
+    shutil.rmtree(workdir)
+    print(f"\n{'TUTTI I TEST SUPERATI' if ok else 'ALCUNI TEST FALLITI'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
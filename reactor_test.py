@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Test del reactor seriale con coppie pty al posto di Arduino e GPS
+
+Ogni dispositivo è una pty: il test scrive sul lato master, il reactor legge
+il lato slave tramite un link simbolico (come /dev/serial/by-id). Per simulare
+lo scollegamento si chiude il master e si rimuove il link; per il
+ricollegamento si crea una nuova pty e si ripunta il link.
+
+Uso:
+    python reactor_test.py
+"""
+
+import os
+import pty
+import shutil
+import tempfile
+import time
+import tty
+from modules import logger
+from modules.arduino_reader import ArduinoReader
+from modules.gps_reader import GPSReader, nmea_checksum
+from modules.serial_reactor import SerialReactor, open_raw
+
+
+class FakeDevice:
+    def __init__(self, link):
+        """Dispositivo finto: una pty raggiungibile dal percorso link"""
+        self.link = link
+        self.master = None
+        self.plug()
+
+    def plug(self):
+        master, slave = pty.openpty()
+        tty.setraw(slave)           # Nessuna elaborazione di righe: byte binari intatti
+        path = os.ttyname(slave)
+        os.close(slave)
+        self.master = master
+        if os.path.lexists(self.link):
+            os.unlink(self.link)
+        os.symlink(path, self.link)
+
+    def unplug(self):
+        os.unlink(self.link)
+        os.close(self.master)
+        self.master = None
+
+    def write(self, data):
+        os.write(self.master, data)
+
+
+def nmea(body):
+    data = body.encode()
+    return b'$%s*%02X\r\n' % (data, nmea_checksum(data, 0, len(data)))
+
+
+def rmc(knots):
+    return nmea(f"GPRMC,120000.00,A,4107.0000,N,01452.0000,E,{knots:.2f},0.0,150625,,,A")
+
+
+def wait_for(condition, timeout=2.0):
+    """Attende che condition() sia vera; restituisce il tempo impiegato o None"""
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if condition():
+            return time.monotonic() - start
+        time.sleep(0.005)
+    return None
+
+
+def check(name, condition):
+    print(f"  {'OK ' if condition else 'ERR'} {name}")
+    return condition
+
+
+def main():
+    print("=== TEST SERIAL REACTOR (pty) ===")
+    logger.configure('ERROR')
+    ok = True
+    tmp = tempfile.mkdtemp(prefix='carretto-pty-')
+    arduino_dev = FakeDevice(os.path.join(tmp, 'ttyARDUINO'))
+    gps_dev = FakeDevice(os.path.join(tmp, 'ttyGPS'))
+
+    reactor = SerialReactor(opener=open_raw, min_backoff=0.05, max_backoff=0.4)
+    arduino = ArduinoReader(arduino_dev.link, reactor=reactor)
+    gps = GPSReader(gps_dev.link, reactor=reactor)
+    reactor.start()
+    arduino.start()
+    gps.start()
+
+    try:
+        # Dati normali su entrambe le porte
+        arduino_dev.write(bytes((0xFF, 10, 20, 30, 40)))
+        gps_dev.write(rmc(10.0))
+        ok &= check("Pacchetto Arduino ricevuto",
+                    wait_for(lambda: arduino.get_snapshot().raw == bytes((10, 20, 30, 40))) is not None)
+        ok &= check("Frase GPS ricevuta", wait_for(lambda: gps.speed and abs(gps.speed - 18.52) < 0.01) is not None)
+        ok &= check("Un solo thread di I/O (nessun thread per lettore)",
+                    arduino.thread is None and gps.thread is None)
+
+        # Pacchetto spezzato su più letture
+        arduino_dev.write(bytes((0xFF, 11)))
+        time.sleep(0.02)
+        arduino_dev.write(bytes((21, 31, 41)))
+        ok &= check("Pacchetto spezzato ricomposto",
+                    wait_for(lambda: arduino.get_snapshot().raw == bytes((11, 21, 31, 41))) is not None)
+
+        # Scollegamento dell'Arduino: il GPS deve continuare senza ritardi
+        arduino_dev.unplug()
+        ok &= check("Disconnessione rilevata",
+                    wait_for(lambda: not reactor.devices['arduino'].connected) is not None)
+        delays = []
+        for i in range(10):
+            sent = time.monotonic()
+            gps_dev.write(rmc(20.0 + i))
+            delay = wait_for(lambda: gps.speed and abs(gps.speed - (20.0 + i) * 1.852) < 0.01, timeout=1.0)
+            delays.append(delay if delay is not None else 1.0)
+            time.sleep(0.05)
+        print(f"      ritardo GPS durante lo scollegamento: max {max(delays) * 1000:.1f} ms")
+        ok &= check("GPS servito durante i tentativi di riconnessione", max(delays) < 0.1)
+        stats = reactor.devices['arduino'].get_stats()
+        ok &= check("Tentativi di riapertura con attesa crescente",
+                    stats['failed_opens'] >= 3 and stats['backoff'] == 0.4)
+
+        # Ricollegamento: nuova pty dietro lo stesso percorso
+        arduino_dev.plug()
+        reconnect = wait_for(lambda: reactor.devices['arduino'].connected, timeout=1.0)
+        ok &= check("Riconnessione entro l'attesa massima", reconnect is not None and reconnect <= 0.5)
+        arduino_dev.write(bytes((0xFF, 99, 98, 97, 96)))
+        ok &= check("Dati dopo la riconnessione",
+                    wait_for(lambda: arduino.get_snapshot().raw == bytes((99, 98, 97, 96))) is not None)
+        ok &= check("Contatori: 2 connessioni, 1 disconnessione",
+                    reactor.devices['arduino'].connects == 2 and reactor.devices['arduino'].disconnects == 1)
+
+        # Scollegamento a metà pacchetto: il frammento non deve sporcare il successivo
+        arduino_dev.write(bytes((0xFF, 1, 2)))
+        time.sleep(0.02)
+        arduino_dev.unplug()
+        wait_for(lambda: not reactor.devices['arduino'].connected)
+        arduino_dev.plug()
+        wait_for(lambda: reactor.devices['arduino'].connected, timeout=1.0)
+        arduino_dev.write(bytes((5, 6, 0xFF, 50, 51, 52, 53)))
+        ok &= check("Frammento scartato alla riconnessione",
+                    wait_for(lambda: arduino.get_snapshot().raw == bytes((50, 51, 52, 53))) is not None
+                    and arduino.get_stats()['frames'] == 4)
+    finally:
+        arduino.stop()
+        gps.stop()
+        reactor.stop()
+        for device in (arduino_dev, gps_dev):
+            if device.master is not None:
+                os.close(device.master)
+        shutil.rmtree(tmp)
+
+    print(f"\n{'TUTTI I TEST SUPERATI' if ok else 'ALCUNI TEST FALLITI'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
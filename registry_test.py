@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Test del registro dispositivi USB su un albero sysfs finto
+
+Uso:
+    python registry_test.py
+"""
+
+import os
+import shutil
+import tempfile
+from modules import logger
+from modules.device_registry import DeviceRegistry
+
+
+def add_device(root, tty, usb_path, vid, pid, serial=None, acm=False):
+    """Crea in root la struttura sysfs di un adattatore USB-seriale"""
+    usb_dir = os.path.join(root, 'devices', 'pci0000:00', 'usb1', usb_path)
+    interface = os.path.join(usb_dir, f"{usb_path}:1.0")
+    # ttyACM: device punta all'interfaccia; ttyUSB: alla porta usb-serial sotto l'interfaccia
+    target = interface if acm else os.path.join(interface, tty)
+    os.makedirs(target, exist_ok=True)
+    for attr, value in (('idVendor', vid), ('idProduct', pid), ('serial', serial)):
+        if value is not None:
+            with open(os.path.join(usb_dir, attr), 'w') as f:
+                f.write(value + '\n')
+    tty_dir = os.path.join(root, 'class', 'tty', tty)
+    os.makedirs(tty_dir, exist_ok=True)
+    os.symlink(os.path.relpath(target, tty_dir), os.path.join(tty_dir, 'device'))
+
+
+def remove_device(root, tty):
+    shutil.rmtree(os.path.join(root, 'class', 'tty', tty))
+
+
+def check(name, condition):
+    print(f"  {'OK ' if condition else 'ERR'} {name}")
+    return condition
+
+
+def main():
+    print("=== TEST DEVICE REGISTRY ===")
+    logger.configure('ERROR')
+    ok = True
+    root = tempfile.mkdtemp(prefix='carretto-sysfs-')
+    cache = os.path.join(root, 'cache', 'devices.json')
+    try:
+        # Porte non USB presenti in ogni sistema
+        os.makedirs(os.path.join(root, 'class', 'tty', 'ttyS0'))
+        os.makedirs(os.path.join(root, 'class', 'tty', 'tty1'))
+
+        # GPS enumerato per primo: con il vecchio glob sarebbe diventato l'"Arduino"
+        add_device(root, 'ttyUSB0', '1-1.1', '067B', '2303')
+        add_device(root, 'ttyUSB1', '1-1.2', '1a86', '7523', serial='NANO42')
+
+        registry = DeviceRegistry(sysfs_root=root, dev_root='/dev', cache_path=cache)
+        ports = registry.resolve()
+        ok &= check("Arduino riconosciuto per VID/PID", ports.get('arduino') == '/dev/ttyUSB1')
+        ok &= check("GPS riconosciuto per VID/PID", ports.get('gps') == '/dev/ttyUSB0')
+        ok &= check("Prima risoluzione = scansione completa", registry.probes == 1)
+        ok &= check("Cache scritta su disco", os.path.exists(cache))
+
+        # Avvio successivo: nessuna scansione
+        registry = DeviceRegistry(sysfs_root=root, dev_root='/dev', cache_path=cache)
+        ok &= check("Avvio con cache: stesse porte", registry.resolve() == ports)
+        ok &= check("Avvio con cache: nessuna scansione", registry.probes == 0)
+
+        # Scambio di nomi senza hotplug visibile nell'elenco (stessi ttyUSB0/ttyUSB1)
+        remove_device(root, 'ttyUSB0')
+        remove_device(root, 'ttyUSB1')
+        shutil.rmtree(os.path.join(root, 'devices'))
+        add_device(root, 'ttyUSB0', '1-1.2', '1a86', '7523', serial='NANO42')
+        add_device(root, 'ttyUSB1', '1-1.1', '067b', '2303')
+        ports = registry.resolve()
+        ok &= check("Scambio rilevato dalla verifica", registry.probes == 1)
+        ok &= check("Arduino seguito dopo lo scambio", ports.get('arduino') == '/dev/ttyUSB0')
+        ok &= check("GPS seguito dopo lo scambio", ports.get('gps') == '/dev/ttyUSB1')
+
+        # Hotplug: il GPS viene scollegato
+        remove_device(root, 'ttyUSB1')
+        ports = registry.resolve()
+        ok &= check("Hotplug: nuova scansione", registry.probes == 2)
+        ok &= check("Hotplug: GPS assente", 'gps' not in ports and ports.get('arduino') == '/dev/ttyUSB0')
+        ok &= check("Ruolo assente: porta di default", registry.lookup('gps') == '/dev/ttyUSB1')
+
+        # Due Nano identici: vince quello con il seriale salvato in cache
+        add_device(root, 'ttyACM0', '1-1.3', '2341', '0043', serial='UNO7', acm=True)
+        ports = registry.resolve()
+        ok &= check("Arduino salvato mantiene il ruolo", ports.get('arduino') == '/dev/ttyUSB0')
+
+        # Senza cache né sysfs (altri sistemi operativi): nessun errore
+        registry = DeviceRegistry(sysfs_root=os.path.join(root, 'mancante'), cache_path='')
+        ok &= check("Senza sysfs: nessuna porta", registry.resolve() == {})
+    finally:
+        shutil.rmtree(root)
+
+    ok &= test_unknown_and_overrides()
+
+    print(f"\n{'TUTTI I TEST SUPERATI' if ok else 'ALCUNI TEST FALLITI'}")
+    return 0 if ok else 1
+
+
+def test_unknown_and_overrides():
+    """Adattatori non in elenco, dispositivi identici senza seriale e porte indicate a mano"""
+    ok = True
+    root = tempfile.mkdtemp(prefix='carretto-sysfs-')
+    cache = os.path.join(root, 'cache', 'devices.json')
+    try:
+        # GPS dietro un adattatore USB-TTL sconosciuto, enumerato dopo un'altra porta
+        add_device(root, 'ttyUSB0', '1-1.1', '1a86', '7523')
+        add_device(root, 'ttyUSB2', '1-1.3', 'abcd', '1234')
+        registry = DeviceRegistry(sysfs_root=root, dev_root='/dev', cache_path=cache)
+        ports = registry.resolve()
+        ok &= check("VID sconosciuto: il GPS prende la porta rimasta",
+                    ports == {'arduino': '/dev/ttyUSB0', 'gps': '/dev/ttyUSB2'})
+
+        # Due CH340 identici senza seriale (Arduino e GPS): al primo avvio decide il nome...
+        remove_device(root, 'ttyUSB2')
+        add_device(root, 'ttyUSB1', '1-1.2', '1a86', '7523')
+        ports = DeviceRegistry(sysfs_root=root, dev_root='/dev', cache_path='').resolve()
+        ok &= check("CH340 identici: scelti per nome", ports == {'arduino': '/dev/ttyUSB0', 'gps': '/dev/ttyUSB1'})
+
+        # ...finché la porta indicata a mano non viene fissata nella cache
+        registry = DeviceRegistry(sysfs_root=root, dev_root='/dev', cache_path=cache,
+                                  overrides={'arduino': '/dev/ttyUSB1', 'gps': None})
+        ports = registry.resolve()
+        ok &= check("--arduino-port: porta indicata", ports.get('arduino') == '/dev/ttyUSB1'
+                    and ports.get('gps') == '/dev/ttyUSB0')
+
+        # Avvio successivo senza opzioni, con i nomi scambiati dal kernel: vince la presa USB
+        remove_device(root, 'ttyUSB0')
+        remove_device(root, 'ttyUSB1')
+        shutil.rmtree(os.path.join(root, 'devices'))
+        add_device(root, 'ttyUSB0', '1-1.2', '1a86', '7523')
+        add_device(root, 'ttyUSB1', '1-1.1', '1a86', '7523')
+        registry = DeviceRegistry(sysfs_root=root, dev_root='/dev', cache_path=cache)
+        ports = registry.resolve()
+        ok &= check("Porta fissata segue il dispositivo", ports.get('arduino') == '/dev/ttyUSB0'
+                    and ports.get('gps') == '/dev/ttyUSB1')
+
+        # Porta non USB (UART del Pi): restituita così com'è, senza consumare porte USB
+        registry = DeviceRegistry(sysfs_root=root, dev_root='/dev', cache_path=cache,
+                                  overrides={'gps': '/dev/ttyAMA0'})
+        ports = registry.resolve()
+        ok &= check("--gps-port non USB", ports == {'arduino': '/dev/ttyUSB0', 'gps': '/dev/ttyAMA0'}
+                    and registry.lookup('gps') == '/dev/ttyAMA0')
+    finally:
+        shutil.rmtree(root)
+    return ok
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Test del sequencer a lookahead (modules/sequencer.py)
+
+La pianificazione viene verificata chiamando collect() con istanti scelti,
+senza thread: griglia delle note, cambio di BPM senza salti, cambio di pattern
+sulla griglia, volume dalla nota successiva, ripartenza dopo un blocco.
+L'ultimo test collega il sequencer a MusicEngine con sink UDP locali.
+
+Uso:
+    python sequencer_test.py
+"""
+
+import socket
+import time
+from pythonosc.osc_packet import OscPacket
+from modules import logger
+from modules.music_engine import MusicEngine
+from modules.sequencer import Sequencer, MAX_LATE
+from modules.patterns import PATTERNS
+
+# Pattern minimo: cassa ogni battito, charleston ogni mezzo battito con freq ciclica
+SIMPLE = {
+    'dub': [[{'instrument': 'kick', 'dur': [1], 'amp': 1.0, 'freq': 60},
+             {'instrument': 'hat', 'dur': [0.5], 'amp': 0.5, 'freq': [1000, 2000]}]] * 4,
+    'techno': [[{'instrument': 'tk', 'dur': [0.25], 'amp': 1.0, 'freq': 60}]] * 4
+}
+
+
+def check(name, condition):
+    print(f"  {'OK ' if condition else 'ERR'} {name}")
+    return condition
+
+
+def make(patterns=SIMPLE):
+    sequencer = Sequencer(port=9, lookahead=0.1, period=0.01, patterns=patterns)
+    sequencer.reset(0.0)        # Battito 0 a t = 0.1
+    return sequencer
+
+
+def notes(groups):
+    """(istante, strumento, argomenti) per ogni nota"""
+    return [(when, instrument, args) for when, group in groups for instrument, args in group]
+
+
+def test_grid():
+    ok = True
+    print("\n--- Griglia e raggruppamento ---")
+    sequencer = make()
+    # Finestre successive fino a t = 1.1: battiti < 2 a 120 BPM
+    groups = sequencer.collect(0.3) + sequencer.collect(0.6) + sequencer.collect(1.0)
+    times = [round(when, 9) for when, _ in groups]
+    ok &= check(f"istanti dei passi ({times})", times == [0.1, 0.35, 0.6, 0.85])
+    ok &= check("cassa e charleston nello stesso bundle", [len(g) for _, g in groups] == [2, 1, 2, 1])
+    hats = [args for _, instrument, args in notes(groups) if instrument == 'hat']
+    ok &= check("freq ciclica", [a[a.index('freq') + 1] for a in hats] == [1000, 2000, 1000, 2000])
+    ok &= check("amp = volume * fattore", hats[0][1] == 0.8 * 0.5)
+    ok &= check("nessuna nota ripetuta", sequencer.collect(1.0) == [])
+    ok &= check("finestra successiva", [round(w, 9) for w, _ in sequencer.collect(1.2)] == [1.1])
+    return ok
+
+
+def test_tempo_change():
+    ok = True
+    print("\n--- Cambio di BPM dall'ultimo battito inviato ---")
+    sequencer = make()
+    sequencer.collect(0.5)                  # Inviato fino a t = 0.6 (battito 1)
+    sequencer.set_state(0.8, 60, "dub", 0)
+    groups = sequencer.collect(0.9) + sequencer.collect(1.3) + sequencer.collect(1.7) + sequencer.collect(2.05)
+    times = [round(when, 9) for when, _ in groups]
+    # Dal battito 1 (t = 0.6) a 60 BPM: un battito al secondo, mezzo battito 0.5 s
+    ok &= check(f"nuovo tempo senza salti ({times})", times == [0.6, 1.1, 1.6, 2.1])
+    return ok
+
+
+def test_pattern_switch():
+    ok = True
+    print("\n--- Cambio di pattern sulla griglia ---")
+    sequencer = make()
+    sequencer.collect(0.3)                  # Fino a t = 0.4: battito 0.6
+    sequencer.set_state(0.8, 120, "techno", 0)
+    ok &= check(f"partenza sul passo successivo ({sequencer.switch_beat})", sequencer.switch_beat == 0.75)
+    played = notes(sequencer.collect(0.6))  # Fino a t = 0.7: battito 1.2
+    instruments = [(round(when, 9), instrument) for when, instrument, _ in played]
+    ok &= check(f"vecchie tracce fino al cambio, poi le nuove ({instruments})",
+                instruments == [(0.475, 'tk'), (0.6, 'tk')])
+    ok &= check("stesso nome di genere: nessun nuovo cambio",
+                sequencer.set_state(0.8, 120, "techno", 0) is None and sequencer.next_tracks is None)
+
+    random_seq = make(PATTERNS)
+    random_seq.set_state(0.8, 120, "random", 0)
+    chosen = random_seq.genre
+    random_seq.set_state(0.5, 120, "random", 0)
+    ok &= check(f"random scelto una volta ({chosen})", chosen in PATTERNS and random_seq.genre == chosen)
+    return ok
+
+
+def test_volume_and_stall():
+    ok = True
+    print("\n--- Volume dalla nota successiva, ripartenza dopo un blocco ---")
+    sequencer = make()
+    first = notes(sequencer.collect(0.3))
+    sequencer.set_state(0.2, 120, "dub", 0)
+    second = notes(sequencer.collect(0.6))
+    ok &= check("note già inviate invariate", first[0][2][1] == 0.8)
+    ok &= check("nuovo volume sulle note successive", all(args[1] == 0.2 * 1.0 for _, i, args in second if i == 'kick'))
+
+    stalled_at = 0.6 + MAX_LATE + 1.0
+    resumed = sequencer.collect(stalled_at) + sequencer.collect(stalled_at + 0.3)
+    ok &= check(f"dopo un blocco nessuna raffica di note ({len(resumed)} passi)",
+                sequencer.stats['stalls'] == 1 and 0 < len(resumed) <= 3
+                and all(when >= stalled_at for when, _ in resumed))
+    return ok
+
+
+def test_bundle():
+    ok = True
+    print("\n--- Bundle /s_new con timetag ---")
+    # Timetag nel futuro: OscPacket porta quelli passati all'istante di ricezione
+    sequencer = make()
+    now = time.perf_counter()
+    sequencer.reset(now)
+    when, group = sequencer.collect(now + 0.05)[0]
+    packet = OscPacket(sequencer.build_bundle(when, group).dgram)
+    messages = packet.messages
+    ok &= check("un /s_new per nota", [m.message.address for m in messages] == ['/s_new', '/s_new'])
+    params = messages[0].message.params
+    ok &= check(f"argomenti ({params[:4]})", params[:4] == ['kick', -1, 0, 1] and params[4] == 'amp')
+    ok &= check("timetag in tempo di sistema", abs(messages[0].time - (when + sequencer.wall_offset)) < 1e-6)
+    sequencer.client.close()
+    return ok
+
+
+def test_engine():
+    ok = True
+    print("\n--- MusicEngine con sequencer ---")
+    synth = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    synth.bind(('127.0.0.1', 0))
+    synth.settimeout(0.5)
+    sclang = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sclang.bind(('127.0.0.1', 0))
+    sclang.settimeout(0.5)
+
+    sequencer = Sequencer(port=synth.getsockname()[1])
+    music = MusicEngine(port=sclang.getsockname()[1], sequencer=sequencer)
+    music.start()
+    try:
+        first = OscPacket(sclang.recv(4096)).messages
+        flags = [m.message.params for m in first if m.message.address == '/carretto/sequencer']
+        ok &= check("sclang avvisato del sequencer esterno", flags == [[1]])
+        music.update({'pot1': 0.5, 'pot2': 1.0, 'pot3': 0.2, 'pot4': 0.6}, {})
+        ok &= check("stato passato al sequencer",
+                    (sequencer.bpm, sequencer.genre, sequencer.pattern_idx) == (180.0, 'techno', 2)
+                    and sequencer.volume == music.current_values['volume'])
+        time.sleep(0.3)
+        data = synth.recv(4096)
+        ok &= check("note su scsynth", OscPacket(data).messages[0].message.address == '/s_new')
+    finally:
+        music.stop()
+    addresses = []
+    try:
+        while True:
+            addresses += [m.message.address for m in OscPacket(sclang.recv(4096)).messages]
+    except socket.timeout:
+        pass
+    ok &= check("all'arresto sclang riprende a suonare", '/carretto/sequencer' in addresses)
+    synth.close()
+    sclang.close()
+    return ok
+
+
+def main():
+    print("=== TEST SEQUENCER ===")
+    logger.configure('ERROR')
+    ok = test_grid()
+    ok &= test_tempo_change()
+    ok &= test_pattern_switch()
+    ok &= test_volume_and_stall()
+    ok &= test_bundle()
+    ok &= test_engine()
+    print(f"\n{'TUTTI I TEST SUPERATI' if ok else 'ALCUNI TEST FALLITI'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Test del controllo del carico di scsynth (modules/scsynth_monitor.py)
+
+Un scsynth finto risponde a /status come il server vero (/status.reply con
+UGen, synth, CPU media e di picco). Si verificano: lettura delle cifre, politica
+a soglie con tempi di permanenza e isteresi, riduzione delle note del sequencer,
+invio di /carretto/shed a sclang e ritorno al livello 0 quando il carico scende.
+
+Uso:
+    python shedding_test.py
+"""
+
+import socket
+import threading
+import time
+from pythonosc import osc_message_builder
+from pythonosc.osc_message import OscMessage
+from pythonosc.osc_packet import OscPacket
+from modules import logger
+from modules import metrics
+from modules.music_engine import MusicEngine
+from modules.scsynth_monitor import ServerMonitor, SHED_CONFIRM, SHED_HATS, SHED_POLYPHONY
+from modules.sequencer import Sequencer
+from modules.patterns import PATTERNS
+
+# Politica rapida per i test: stesse soglie di default, tempi brevi
+FAST = {'interval': 0.05, 'timeout': 0.3, 'hold': 0.2, 'release': 0.3}
+
+
+class FakeScsynth:
+    def __init__(self):
+        """scsynth finto su una porta locale libera"""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.05)
+        self.port = self.sock.getsockname()[1]
+        self.avg_cpu = 10.0
+        self.peak_cpu = 15.0
+        self.synths = 12
+        self.replying = True
+        self.requests = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if OscMessage(data).address != "/status":
+                continue
+            self.requests += 1
+            if not self.replying:
+                continue
+            msg = osc_message_builder.OscMessageBuilder(address="/status.reply")
+            for value in (1, self.synths * 9, self.synths, 3, 21):
+                msg.add_arg(value)
+            msg.add_arg(self.avg_cpu, 'f')
+            msg.add_arg(self.peak_cpu, 'f')
+            msg.add_arg(48000.0, 'd')
+            msg.add_arg(47999.5, 'd')
+            self.sock.sendto(msg.build().dgram, addr)
+
+    def close(self):
+        self.running = False
+        self.thread.join(timeout=1.0)
+        self.sock.close()
+
+
+def check(name, condition):
+    print(f"  {'OK ' if condition else 'ERR'} {name}")
+    return condition
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_status():
+    ok = True
+    print("\n--- /status e cifre di scsynth ---")
+    server = FakeScsynth()
+    monitor = ServerMonitor(port=server.port, policy=FAST)
+    monitor.start()
+    try:
+        ok &= check("risposta ricevuta", wait_for(lambda: monitor.alive, 1.0))
+        status = monitor.get_stats()
+        ok &= check(f"UGen, synth e CPU ({status['ugens']}, {status['synths']}, {status['avg_cpu']:.1f}%)",
+                    status['ugens'] == 108 and status['synths'] == 12 and abs(status['avg_cpu'] - 10.0) < 1e-6
+                    and abs(status['peak_cpu'] - 15.0) < 1e-6 and status['sample_rate'] == 47999.5)
+        text = metrics.REGISTRY.render()
+        ok &= check("metriche esposte", "carretto_scsynth_cpu_avg_percent 10" in text
+                    and "carretto_scsynth_synths 12" in text and "carretto_shed_level 0" in text)
+        server.replying = False
+        ok &= check("scsynth assente rilevato", wait_for(lambda: not monitor.alive, 1.0))
+        ok &= check("livello invariato senza misure", monitor.level == 0)
+    finally:
+        monitor.stop()
+        server.close()
+    return ok
+
+
+def test_policy():
+    ok = True
+    print("\n--- Soglie, permanenza e isteresi ---")
+    levels = []
+    monitor = ServerMonitor(port=9, on_level=levels.append)
+    t = 0.0
+
+    def feed(avg, seconds, peak=None, step=0.5):
+        nonlocal t
+        end = t + seconds
+        while t < end - 1e-9:
+            monitor.evaluate(avg, avg if peak is None else peak, t)
+            t += step
+
+    feed(60, 1.5)
+    ok &= check("picco breve sopra la soglia: nessuna riduzione", monitor.level == 0)
+    feed(30, 0.5)
+    feed(60, 3.0)
+    ok &= check("carico sostenuto: livello 1", monitor.level == SHED_CONFIRM)
+    feed(90, 10.0)
+    ok &= check(f"un livello alla volta fino al massimo ({levels})", levels == [1, 2, 3])
+    feed(72, 10.0)
+    ok &= check("dentro l'isteresi: livello invariato", monitor.level == SHED_POLYPHONY)
+    feed(20, 5.5)
+    ok &= check("margine sostenuto: un livello in meno", monitor.level == SHED_HATS)
+    feed(20, 30.0)
+    ok &= check(f"ritorno a 0 ({levels})", levels == [1, 2, 3, 2, 1, 0])
+
+    feed(30, 3.0, peak=99.0)
+    ok &= check("picchi oltre la soglia contano come carico", monitor.level >= SHED_CONFIRM)
+    monitor.sock.close()
+
+    try:
+        ServerMonitor(port=9, policy={'levels': [{'enter': 50, 'exit': 60}]})
+        ok &= check("soglie incoerenti rifiutate", False)
+    except ValueError:
+        ok &= check("soglie incoerenti rifiutate", True)
+    return ok
+
+
+def test_sequencer():
+    ok = True
+    print("\n--- Note del sequencer ai vari livelli ---")
+    counts = {}
+    for level in (0, SHED_HATS, SHED_POLYPHONY):
+        sequencer = Sequencer(port=9, patterns=PATTERNS)
+        sequencer.set_state(0.8, 172, "drumandbass", 1)
+        sequencer.reset(0.0)
+        sequencer.set_shed(level)
+        played = {}
+        for step in range(1, 41):
+            for _, group in sequencer.collect(step * 0.1):
+                for instrument, _ in group:
+                    played[instrument] = played.get(instrument, 0) + 1
+        counts[level] = played
+        sequencer.client.close()
+    full, hats, core = counts[0], counts[SHED_HATS], counts[SHED_POLYPHONY]
+    print(f"  note: {full} | {hats} | {core}")
+    ok &= check("livello 2: charleston dimezzati, resto invariato",
+                abs(hats['dnbHat'] - full['dnbHat'] / 2) <= 1
+                and hats['dnbKick'] == full['dnbKick'] and hats['dnbBass'] == full['dnbBass'])
+    ok &= check("livello 3: solo cassa e basso", set(core) == {'dnbKick', 'dnbBass'}
+                and core['dnbKick'] == full['dnbKick'])
+    return ok
+
+
+def test_engine():
+    ok = True
+    print("\n--- MusicEngine: /carretto/shed verso sclang ---")
+    server = FakeScsynth()
+    sclang = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sclang.bind(("127.0.0.1", 0))
+    sclang.settimeout(0.05)
+    received = []
+
+    def drain():
+        try:
+            while True:
+                packet = OscPacket(sclang.recv(4096))
+                received.extend((m.message.address, m.message.params) for m in packet.messages)
+        except socket.timeout:
+            pass
+
+    sequencer = Sequencer(port=9)
+    monitor = ServerMonitor(port=server.port, policy=FAST)
+    music = MusicEngine(port=sclang.getsockname()[1], sequencer=sequencer, monitor=monitor)
+    music.start()
+    try:
+        server.avg_cpu = 85.0
+        ok &= check("carico alto: livello 3", wait_for(lambda: monitor.level == SHED_POLYPHONY, 3.0))
+        drain()
+        levels = [params[0] for address, params in received if address == "/carretto/shed"]
+        ok &= check(f"livelli inviati a sclang ({levels})", levels == [1, 2, 3])
+        ok &= check("sequencer allineato", sequencer.shed_level == SHED_POLYPHONY)
+
+        received.clear()
+        music.send_full_state()
+        drain()
+        ok &= check("livello nello stato completo",
+                    ("/carretto/shed", [SHED_POLYPHONY]) in received)
+
+        server.avg_cpu = 20.0
+        ok &= check("carico rientrato: livello 0", wait_for(lambda: monitor.level == 0, 5.0))
+        ok &= check("cifre nelle metriche del motore", music.get_metrics()["scsynth"]["lowered"] == 3)
+    finally:
+        music.stop()
+        server.close()
+        sclang.close()
+    return ok
+
+
+def main():
+    print("=== TEST RIDUZIONE DEL CARICO DI SCSYNTH ===")
+    logger.configure('ERROR')
+    ok = test_status()
+    ok &= test_policy()
+    ok &= test_sequencer()
+    ok &= test_engine()
+    print(f"\n{'TUTTI I TEST SUPERATI' if ok else 'ALCUNI TEST FALLITI'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())